@@ -1,10 +1,12 @@
 """LangGraph智能体模块"""
 
 from .travel_planner_agent import TravelPlannerAgent
+from .registry import get_travel_planner_agent
 from .models import TravelRequest, TravelPlan, ItineraryItem
 
 __all__ = [
     "TravelPlannerAgent",
+    "get_travel_planner_agent",
     "TravelRequest", 
     "TravelPlan",
     "ItineraryItem"
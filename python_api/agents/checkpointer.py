@@ -0,0 +1,413 @@
+"""工作流检查点存储
+
+提供两种可替换的检查点后端：
+
+- BoundedMemorySaver: 内存存储，按线程做 LRU + TTL 淘汰，线程数有上限
+- SQLiteSaver: SQLite（WAL模式）持久化存储，可跨进程重启保留检查点
+
+计划最终化后，智能体会根据 CHECKPOINT_RETENTION 删除（delete）或压缩
+（compact，只保留最新检查点）该计划的线程，避免检查点无限增长。
+"""
+
+import os
+import time
+import asyncio
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, Optional, Sequence, Tuple
+
+from dotenv import load_dotenv
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+)
+from langgraph.checkpoint.memory import MemorySaver
+
+try:
+    from langgraph.checkpoint.base import WRITES_IDX_MAP
+except ImportError:  # 旧版本langgraph-checkpoint没有特殊写入索引
+    WRITES_IDX_MAP = {}
+
+# 加载环境变量
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+class BoundedMemorySaver(MemorySaver):
+    """有界内存检查点存储
+
+    Args:
+        max_threads: 最多保留的线程数，超出时淘汰最久未访问的线程
+        ttl: 线程最后一次访问后的存活时间（秒），0 表示不过期
+    """
+
+    def __init__(self, max_threads: int = 1000, ttl: float = 3600.0, **kwargs):
+        super().__init__(**kwargs)
+        self.max_threads = max_threads
+        self.ttl = ttl
+        self._threads: "OrderedDict[str, float]" = OrderedDict()  # 线程ID -> 最后访问时间
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def _touch(self, thread_id: str):
+        with self._lock:
+            self._threads[thread_id] = time.monotonic()
+            self._threads.move_to_end(thread_id)
+
+    def _evict(self):
+        """淘汰过期线程和超出容量的最久未访问线程"""
+        now = time.monotonic()
+        victims = []
+        with self._lock:
+            # 按访问时间有序，从最旧的一端检查即可
+            while self._threads:
+                thread_id, last_access = next(iter(self._threads.items()))
+                expired = self.ttl and now - last_access >= self.ttl
+                if not expired and len(self._threads) <= self.max_threads:
+                    break
+                self._threads.popitem(last=False)
+                victims.append(thread_id)
+        for thread_id in victims:
+            self._purge(thread_id)
+            self.evictions += 1
+
+    def _purge(self, thread_id: str):
+        """删除线程的所有检查点、写入和通道数据"""
+        self.storage.pop(thread_id, None)
+        for key in [k for k in self.writes if k[0] == thread_id]:
+            del self.writes[key]
+        blobs = getattr(self, 'blobs', None)
+        if blobs is not None:
+            for key in [k for k in blobs if k[0] == thread_id]:
+                del blobs[key]
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        thread_id = config["configurable"]["thread_id"]
+        if thread_id not in self._threads:
+            # 避免 defaultdict 访问时为不存在的线程创建空条目
+            return None
+        self._touch(thread_id)
+        return super().get_tuple(config)
+
+    def put(self, config: RunnableConfig, checkpoint: Checkpoint,
+            metadata: CheckpointMetadata, new_versions: ChannelVersions) -> RunnableConfig:
+        self._touch(config["configurable"]["thread_id"])
+        result = super().put(config, checkpoint, metadata, new_versions)
+        self._evict()
+        return result
+
+    def put_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]],
+                   task_id: str, task_path: str = "") -> None:
+        self._touch(config["configurable"]["thread_id"])
+        try:
+            super().put_writes(config, writes, task_id, task_path)
+        except TypeError:  # 旧版本put_writes不接受task_path
+            super().put_writes(config, writes, task_id)
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            self._threads.pop(thread_id, None)
+        self._purge(thread_id)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        self.delete_thread(thread_id)
+
+    def compact_thread(self, thread_id: str) -> None:
+        """只保留线程中每个命名空间的最新检查点"""
+        namespaces = self.storage.get(thread_id)
+        if not namespaces:
+            return
+        blobs = getattr(self, 'blobs', None)
+        for checkpoint_ns, checkpoints in namespaces.items():
+            if not checkpoints:
+                continue
+            latest_id = max(checkpoints)
+            for checkpoint_id in [cid for cid in checkpoints if cid != latest_id]:
+                del checkpoints[checkpoint_id]
+                self.writes.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+            if blobs is not None:
+                latest = self.serde.loads_typed(checkpoints[latest_id][0])
+                keep = {(thread_id, checkpoint_ns, channel, version)
+                        for channel, version in latest["channel_versions"].items()}
+                for key in [k for k in blobs if k[0] == thread_id and k[1] == checkpoint_ns and k not in keep]:
+                    del blobs[key]
+            # 兼容父检查点被删除后的引用
+            checkpoint, metadata, _ = checkpoints[latest_id]
+            checkpoints[latest_id] = (checkpoint, metadata, None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取存储状态"""
+        return {
+            'backend': 'memory',
+            'threads': len(self._threads),
+            'max_threads': self.max_threads,
+            'ttl': self.ttl,
+            'evictions': self.evictions
+        }
+
+class SQLiteSaver(BaseCheckpointSaver):
+    """SQLite检查点存储（WAL模式）
+
+    Args:
+        path: 数据库文件路径
+        ttl: 线程最后一次写入后的存活时间（秒），0 表示不过期；过期线程在写入时顺带清理
+    """
+
+    def __init__(self, path: str, ttl: float = 0.0, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._last_prune = 0.0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS checkpoints (
+                thread_id TEXT NOT NULL,
+                checkpoint_ns TEXT NOT NULL DEFAULT '',
+                checkpoint_id TEXT NOT NULL,
+                parent_checkpoint_id TEXT,
+                checkpoint_type TEXT,
+                checkpoint BLOB,
+                metadata_type TEXT,
+                metadata BLOB,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+            );
+            CREATE INDEX IF NOT EXISTS idx_checkpoints_updated_at ON checkpoints (updated_at);
+            CREATE TABLE IF NOT EXISTS writes (
+                thread_id TEXT NOT NULL,
+                checkpoint_ns TEXT NOT NULL DEFAULT '',
+                checkpoint_id TEXT NOT NULL,
+                task_id TEXT NOT NULL,
+                idx INTEGER NOT NULL,
+                channel TEXT NOT NULL,
+                value_type TEXT,
+                value BLOB,
+                task_path TEXT NOT NULL DEFAULT '',
+                PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+            );
+        """)
+        logger.info(f"SQLite检查点存储已初始化: {path}")
+
+    def _execute(self, sql: str, params: Sequence[Any] = ()) -> list:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _build_tuple(self, row: Tuple) -> CheckpointTuple:
+        thread_id, checkpoint_ns, checkpoint_id, parent_id, c_type, c_blob, m_type, m_blob = row
+        writes = self._execute(
+            "SELECT task_id, channel, value_type, value FROM writes "
+            "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ? ORDER BY task_id, idx",
+            (thread_id, checkpoint_ns, checkpoint_id)
+        )
+        return CheckpointTuple(
+            config={"configurable": {
+                "thread_id": thread_id,
+                "checkpoint_ns": checkpoint_ns,
+                "checkpoint_id": checkpoint_id
+            }},
+            checkpoint=self.serde.loads_typed((c_type, c_blob)),
+            metadata=self.serde.loads_typed((m_type, m_blob)),
+            parent_config=({"configurable": {
+                "thread_id": thread_id,
+                "checkpoint_ns": checkpoint_ns,
+                "checkpoint_id": parent_id
+            }} if parent_id else None),
+            pending_writes=[
+                (task_id, channel, self.serde.loads_typed((v_type, v_blob)))
+                for task_id, channel, v_type, v_blob in writes
+            ]
+        )
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        columns = ("thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, "
+                   "checkpoint_type, checkpoint, metadata_type, metadata")
+        checkpoint_id = get_checkpoint_id(config)
+        if checkpoint_id:
+            rows = self._execute(
+                f"SELECT {columns} FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                (thread_id, checkpoint_ns, checkpoint_id)
+            )
+        else:
+            rows = self._execute(
+                f"SELECT {columns} FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+                "ORDER BY checkpoint_id DESC LIMIT 1",
+                (thread_id, checkpoint_ns)
+            )
+        return self._build_tuple(rows[0]) if rows else None
+
+    def list(self, config: Optional[RunnableConfig], *, filter: Optional[Dict[str, Any]] = None,
+             before: Optional[RunnableConfig] = None, limit: Optional[int] = None) -> Iterator[CheckpointTuple]:
+        clauses, params = [], []
+        if config:
+            clauses.append("thread_id = ?")
+            params.append(config["configurable"]["thread_id"])
+            if config["configurable"].get("checkpoint_ns") is not None:
+                clauses.append("checkpoint_ns = ?")
+                params.append(config["configurable"]["checkpoint_ns"])
+            if get_checkpoint_id(config):
+                clauses.append("checkpoint_id = ?")
+                params.append(get_checkpoint_id(config))
+        if before and get_checkpoint_id(before):
+            clauses.append("checkpoint_id < ?")
+            params.append(get_checkpoint_id(before))
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._execute(
+            "SELECT thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, "
+            f"checkpoint_type, checkpoint, metadata_type, metadata FROM checkpoints {where} "
+            "ORDER BY checkpoint_id DESC",
+            params
+        )
+        for row in rows:
+            if limit is not None and limit <= 0:
+                break
+            checkpoint_tuple = self._build_tuple(row)
+            if filter and not all(checkpoint_tuple.metadata.get(k) == v for k, v in filter.items()):
+                continue
+            if limit is not None:
+                limit -= 1
+            yield checkpoint_tuple
+
+    def put(self, config: RunnableConfig, checkpoint: Checkpoint,
+            metadata: CheckpointMetadata, new_versions: ChannelVersions) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        c_type, c_blob = self.serde.dumps_typed(checkpoint)
+        m_type, m_blob = self.serde.dumps_typed(metadata)
+        self._execute(
+            "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (thread_id, checkpoint_ns, checkpoint["id"], config["configurable"].get("checkpoint_id"),
+             c_type, c_blob, m_type, m_blob, time.time())
+        )
+        self._maybe_prune()
+        return {"configurable": {
+            "thread_id": thread_id,
+            "checkpoint_ns": checkpoint_ns,
+            "checkpoint_id": checkpoint["id"]
+        }}
+
+    def put_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]],
+                   task_id: str, task_path: str = "") -> None:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for idx, (channel, value) in enumerate(writes):
+                    write_idx = WRITES_IDX_MAP.get(channel, idx)
+                    v_type, v_blob = self.serde.dumps_typed(value)
+                    # 普通写入首次为准，特殊写入（错误、中断等）允许覆盖，与MemorySaver一致
+                    verb = "INSERT OR REPLACE" if write_idx < 0 else "INSERT OR IGNORE"
+                    self._conn.execute(
+                        f"{verb} INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (thread_id, checkpoint_ns, checkpoint_id, task_id, write_idx,
+                         channel, v_type, v_blob, task_path)
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM checkpoints WHERE thread_id = ?", (thread_id,))
+            self._conn.execute("DELETE FROM writes WHERE thread_id = ?", (thread_id,))
+
+    def compact_thread(self, thread_id: str) -> None:
+        """只保留线程中每个命名空间的最新检查点"""
+        with self._lock:
+            self._conn.execute("""
+                DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_id NOT IN (
+                    SELECT MAX(checkpoint_id) FROM checkpoints WHERE thread_id = ? GROUP BY checkpoint_ns
+                )""", (thread_id, thread_id))
+            self._conn.execute("""
+                DELETE FROM writes WHERE thread_id = ? AND NOT EXISTS (
+                    SELECT 1 FROM checkpoints c WHERE c.thread_id = writes.thread_id
+                    AND c.checkpoint_ns = writes.checkpoint_ns AND c.checkpoint_id = writes.checkpoint_id
+                )""", (thread_id,))
+            self._conn.execute(
+                "UPDATE checkpoints SET parent_checkpoint_id = NULL WHERE thread_id = ?", (thread_id,)
+            )
+
+    def _maybe_prune(self):
+        """清理过期线程（最多每分钟一次）"""
+        if not self.ttl:
+            return
+        now = time.time()
+        if now - self._last_prune < 60:
+            return
+        self._last_prune = now
+        cutoff = now - self.ttl
+        with self._lock:
+            expired = [row[0] for row in self._conn.execute(
+                "SELECT thread_id FROM checkpoints GROUP BY thread_id HAVING MAX(updated_at) < ?", (cutoff,)
+            ).fetchall()]
+        for thread_id in expired:
+            self.delete_thread(thread_id)
+        if expired:
+            logger.info(f"清理了 {len(expired)} 个过期检查点线程")
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, func, *args)
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await self._run(self.get_tuple, config)
+
+    async def alist(self, config: Optional[RunnableConfig], *, filter: Optional[Dict[str, Any]] = None,
+                    before: Optional[RunnableConfig] = None, limit: Optional[int] = None):
+        items = await self._run(lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+        for item in items:
+            yield item
+
+    async def aput(self, config: RunnableConfig, checkpoint: Checkpoint,
+                   metadata: CheckpointMetadata, new_versions: ChannelVersions) -> RunnableConfig:
+        return await self._run(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]],
+                          task_id: str, task_path: str = "") -> None:
+        return await self._run(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        return await self._run(self.delete_thread, thread_id)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取存储状态"""
+        threads = self._execute("SELECT COUNT(DISTINCT thread_id) FROM checkpoints")[0][0]
+        return {
+            'backend': 'sqlite',
+            'path': self.path,
+            'threads': threads,
+            'ttl': self.ttl
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+def create_checkpointer() -> BaseCheckpointSaver:
+    """根据环境变量创建检查点存储"""
+    backend = os.getenv('CHECKPOINT_BACKEND', 'memory').lower()
+    ttl = float(os.getenv('CHECKPOINT_TTL', 3600))
+    if backend == 'sqlite':
+        return SQLiteSaver(os.getenv('CHECKPOINT_SQLITE_PATH', './data/checkpoints.db'), ttl=ttl)
+    if backend != 'memory':
+        logger.warning(f"未知的检查点后端: {backend}，使用内存存储")
+    return BoundedMemorySaver(max_threads=int(os.getenv('CHECKPOINT_MAX_THREADS', 1000)), ttl=ttl)
@@ -67,6 +67,7 @@ class TravelPlan(BaseModel):
     recommendations: List[str] = Field(default=[], description="推荐建议")
     weather_info: Optional[Dict[str, Any]] = Field(None, description="天气信息")
     cultural_tips: List[str] = Field(default=[], description="文化小贴士")
+    metadata: Dict[str, Any] = Field(default={}, description="生成过程元数据（各阶段耗时等）")
     created_at: datetime = Field(default_factory=datetime.now, description="创建时间")
     updated_at: datetime = Field(default_factory=datetime.now, description="更新时间")
 
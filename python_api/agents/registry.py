@@ -0,0 +1,51 @@
+"""智能体注册表
+
+进程内共享已编译的 LangGraph 工作流。TravelPlannerAgent 的节点方法只读写
+每次调用传入的 AgentState，编译后的图可以被多个请求并发 ainvoke，
+因此没有必要为每个请求重新构建和编译 StateGraph。
+"""
+
+import threading
+from typing import Any, Callable, Dict
+
+from .travel_planner_agent import TravelPlannerAgent
+
+# 智能体名称 -> 工厂函数
+_factories: Dict[str, Callable[[], Any]] = {
+    "travel_planner": TravelPlannerAgent
+}
+_instances: Dict[str, Any] = {}
+_lock = threading.Lock()
+
+def register_agent(name: str, factory: Callable[[], Any]):
+    """注册智能体工厂，已创建的同名实例会被替换"""
+    with _lock:
+        _factories[name] = factory
+        _instances.pop(name, None)
+
+def get_agent(name: str) -> Any:
+    """获取共享的智能体实例，首次访问时创建并编译工作流"""
+    agent = _instances.get(name)
+    if agent is None:
+        with _lock:
+            agent = _instances.get(name)
+            if agent is None:
+                if name not in _factories:
+                    raise KeyError(f"未注册的智能体: {name}")
+                agent = _factories[name]()
+                _instances[name] = agent
+    return agent
+
+def get_travel_planner_agent() -> TravelPlannerAgent:
+    """获取共享的旅行规划智能体"""
+    return get_agent("travel_planner")
+
+def warm_up_agents():
+    """启动时预先编译所有已注册的工作流"""
+    for name in list(_factories):
+        get_agent(name)
+
+def reset_agents():
+    """清空已创建的实例（用于测试）"""
+    with _lock:
+        _instances.clear()
@@ -1,12 +1,16 @@
 """LangGraph旅行规划智能体"""
 
+import os
 import json
+import time
+import uuid
 import asyncio
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional, Awaitable, Callable, Tuple
 from datetime import datetime, timedelta
 from langgraph.graph import StateGraph, END
-from langgraph.checkpoint.memory import MemorySaver
+from langgraph.checkpoint.base import BaseCheckpointSaver
 
+from .checkpointer import create_checkpointer
 from .models import AgentState, TravelRequest, TravelPlan, ItineraryItem, ActivityItem
 from .nodes import (
     InformationCollectorNode,
@@ -16,16 +20,63 @@ from .nodes import (
     PersonalizationNode,
     CollaborationNode
 )
-from services.llm_service import llm_service
+from services.llm_service import llm_service, ITINERARY_PERIODS
 from services.weather_service import weather_service
 from services.map_service import map_service
+from services.destination_knowledge import destination_knowledge
+from services.text_extraction import format_duration, format_opening_hours, parse_cost
+from services.deadline import cap_timeout, current_deadline, deadline_scope, get_route_budget, remaining_budget
+from services.model_tiering import current_tier_report, tier_report
+from services.singleflight import plan_memo
+from services.token_scheduler import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, priority_scope
+
+# 所有计划共享的每日行程并发上限，保护LLM和地图服务不被大量并发请求压垮
+GLOBAL_DAY_CONCURRENCY = int(os.getenv('ITINERARY_GLOBAL_CONCURRENCY', 8))
+# 单个计划内同时生成的天数上限
+PLAN_DAY_CONCURRENCY = int(os.getenv('ITINERARY_PLAN_CONCURRENCY', 3))
+
+# 目的地分析阶段各子任务的超时（秒）
+ANALYZE_LLM_TIMEOUT = float(os.getenv('ANALYZE_LLM_TIMEOUT', 90))
+ANALYZE_SERVICE_TIMEOUT = float(os.getenv('ANALYZE_SERVICE_TIMEOUT', 20))
+# 行程生成模式: per_day（每天一次请求）/ multi_day（按token预算每次请求生成多天）
+ITINERARY_MODE = os.getenv('ITINERARY_MODE', 'per_day').lower()
+# 每日行程是否使用流式生成：每个时段生成完毕后立即开始地点查询
+ITINERARY_STREAMING = os.getenv('ITINERARY_STREAMING', 'true').lower() == 'true'
+# 目的地知识库中保存的热门POI数量
+TOP_POI_COUNT = int(os.getenv('DESTINATION_TOP_POI_COUNT', 10))
+
+# 截止时间：目的地分析阶段最多使用剩余预算的比例，其余留给行程规划
+ANALYZE_DEADLINE_SHARE = float(os.getenv('DEADLINE_ANALYZE_SHARE', 0.4))
+# 剩余预算低于该值（秒）时，尚未开始的天直接使用规则生成的行程
+DAY_MIN_BUDGET = float(os.getenv('DEADLINE_DAY_MIN_BUDGET', 10))
+# 为预算优化、个性化和最终化预留的时间（秒）
+FINALIZE_RESERVE = float(os.getenv('DEADLINE_FINALIZE_RESERVE', 2))
+
+# 计划最终化后如何处理检查点线程: delete（删除）/ compact（只保留最新检查点）/ keep（保留）
+CHECKPOINT_RETENTION = os.getenv('CHECKPOINT_RETENTION', 'delete').lower()
+
+_global_day_semaphore: Optional[asyncio.Semaphore] = None
+
+def _get_global_day_semaphore() -> asyncio.Semaphore:
+    """获取全局每日行程信号量（首次使用时创建，避免在导入时绑定事件循环）"""
+    global _global_day_semaphore
+    if _global_day_semaphore is None:
+        _global_day_semaphore = asyncio.Semaphore(GLOBAL_DAY_CONCURRENCY)
+    return _global_day_semaphore
 
 class TravelPlannerAgent:
     """旅行规划智能体主类"""
     
-    def __init__(self):
-        """初始化智能体"""
-        self.memory = MemorySaver()
+    def __init__(self, day_concurrency: Optional[int] = None,
+                 checkpointer: Optional[BaseCheckpointSaver] = None):
+        """初始化智能体
+        
+        Args:
+            day_concurrency: 单个计划内并发生成的天数上限，默认读取 ITINERARY_PLAN_CONCURRENCY
+            checkpointer: 检查点存储，默认根据 CHECKPOINT_BACKEND 创建
+        """
+        self.day_concurrency = day_concurrency or PLAN_DAY_CONCURRENCY
+        self.memory = checkpointer or create_checkpointer()
         self.graph = self._build_graph()
         
         # 初始化各个节点
@@ -100,15 +151,72 @@ class TravelPlannerAgent:
             state.current_step = "analyzing_destination"
             
             destination = state.metadata.get("destination_processed")
-            preferences = {
+            # 目的地知识（分析、贴士、坐标、热门POI）只按目的地和 (旅行风格, 预算水平)
+            # 分桶生成，兴趣和人数不参与，以便跨用户共享；天气与出行日期相关，每次都要获取。
+            # 所有子任务互不依赖，并发执行，每个子任务有独立超时和备用结果
+            knowledge_preferences = {
                 "travel_style": state.metadata.get("travel_style"),
-                "interests": state.metadata.get("interests"),
-                "budget_level": state.metadata.get("budget_level"),
-                "group_size": state.metadata.get("group_size")
+                "budget_level": state.metadata.get("budget_level")
             }
+            timings: Dict[str, Dict[str, Any]] = {}
+            start_date = state.request.start_date.isoformat()
+            end_date = state.request.end_date.isoformat()
+            knowledge_key = destination_knowledge.make_key(
+                destination, knowledge_preferences["travel_style"], knowledge_preferences["budget_level"]
+            )
+            cached = destination_knowledge.get(knowledge_key)
+            
+            weather_tasks = asyncio.gather(
+                self._run_subtask(
+                    "current_weather",
+                    weather_service.get_current_weather(destination),
+                    ANALYZE_SERVICE_TIMEOUT, timings,
+                    lambda: weather_service._get_fallback_current_weather(destination)
+                ),
+                self._run_subtask(
+                    "forecast",
+                    weather_service.get_forecast(destination, days=7),
+                    ANALYZE_SERVICE_TIMEOUT, timings,
+                    lambda: weather_service._get_fallback_forecast(destination, 7)
+                ),
+                self._run_subtask(
+                    "travel_weather",
+                    weather_service.get_weather_for_travel(destination, start_date, end_date),
+                    ANALYZE_SERVICE_TIMEOUT, timings,
+                    lambda: {
+                        'city': destination,
+                        'error': '天气信息获取失败，请稍后重试',
+                        'recommendations': ['建议关注当地天气预报', '准备适合当季的衣物']
+                    }
+                )
+            )
             
-            # 使用豆包API生成目的地分析
-            analysis_content = await llm_service.generate_destination_analysis(destination, preferences)
+            if cached:
+                knowledge, stale = cached
+                timings["destination_knowledge"] = {"seconds": 0.0, "status": "stale" if stale else "cached"}
+                if stale:
+                    destination_knowledge.refresh_in_background(
+                        knowledge_key,
+                        lambda: self._load_destination_knowledge(destination, knowledge_preferences)
+                    )
+                print(f"✅ 使用目的地知识库{'（后台刷新中）' if stale else ''}: {destination}")
+                current_weather, forecast, travel_weather = await weather_tasks
+            else:
+                knowledge, (current_weather, forecast, travel_weather) = await asyncio.gather(
+                    self._fetch_destination_knowledge(destination, knowledge_preferences, timings),
+                    weather_tasks
+                )
+                if self._is_complete_knowledge(knowledge, timings):
+                    destination_knowledge.put(knowledge_key, knowledge)
+            
+            analysis_content = knowledge["analysis"]
+            tips = list(knowledge["tips"])  # 复制一份，避免后续节点修改共享条目
+            location_info = knowledge["location"]
+            
+            state.metadata.setdefault("stage_timings", {})["analyze_destination"] = timings
+            for name, timing in timings.items():
+                if timing["status"] in ("timeout", "deadline", "error"):
+                    self._record_degraded(state, "analyze_destination", name, timing["status"])
             
             # 解析分析内容并结构化存储
             destination_info = {
@@ -117,50 +225,25 @@ class TravelPlannerAgent:
                 "country": "中国",  # 可以从分析中提取
                 "timezone": "Asia/Shanghai",
                 "currency": "CNY",
-                "language": "中文"
+                "language": "中文",
+                "top_pois": list(knowledge["top_pois"])
             }
             
-            # 生成旅行贴士
-            tips = await llm_service.generate_travel_tips(destination, preferences)
-            
-            # 获取天气信息
-            try:
-                # 先获取目的地坐标
-                location_info = await map_service.geocode(destination)
-                if location_info:
-                    longitude = location_info['longitude']
-                    latitude = location_info['latitude']
-                    
-                    # 获取当前天气
-                    current_weather = await weather_service.get_current_weather(destination)
-                    
-                    # 获取天气预报
-                    forecast = await weather_service.get_forecast(destination, days=7)
-                    
-                    # 获取旅行天气分析
-                    travel_weather = await weather_service.get_weather_for_travel(
-                        destination,
-                        state.request.start_date.isoformat(), 
-                        state.request.end_date.isoformat()
-                    )
-                    
-                    weather_data = {
-                        "location": {
-                            "longitude": longitude,
-                            "latitude": latitude,
-                            "address": location_info.get('address', destination)
-                        },
-                        "current": current_weather,
-                        "forecast": forecast,
-                        "travel_analysis": travel_weather
-                    }
-                    
-                    print(f"✅ 天气信息获取成功: {destination}")
-                else:
-                    raise Exception("无法获取目的地坐标")
-                    
-            except Exception as e:
-                print(f"⚠️ 天气信息获取失败，使用备用数据: {str(e)}")
+            if location_info:
+                weather_data = {
+                    "location": {
+                        "longitude": location_info['longitude'],
+                        "latitude": location_info['latitude'],
+                        "address": location_info.get('address', destination)
+                    },
+                    "current": current_weather,
+                    "forecast": forecast,
+                    "travel_analysis": travel_weather
+                }
+                
+                print(f"✅ 天气信息获取成功: {destination}")
+            else:
+                print("⚠️ 天气信息获取失败，使用备用数据: 无法获取目的地坐标")
                 weather_data = {
                     "current_season": "春季",
                     "temperature_range": "15-25°C",
@@ -191,6 +274,87 @@ class TravelPlannerAgent:
         
         return state
     
+    async def _fetch_destination_knowledge(self, destination: str, preferences: Dict[str, Any],
+                                           timings: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+        """并发获取可跨用户共享的目的地知识：分析、贴士、坐标和热门POI"""
+        analysis_content, tips, location_info, pois = await asyncio.gather(
+            self._run_subtask(
+                "destination_analysis",
+                llm_service.generate_destination_analysis(destination, preferences),
+                ANALYZE_LLM_TIMEOUT, timings,
+                lambda: f"目的地 {destination} 是一个值得探索的地方，具有丰富的文化和自然景观。"
+            ),
+            self._run_subtask(
+                "travel_tips",
+                llm_service.generate_travel_tips(destination, preferences),
+                ANALYZE_LLM_TIMEOUT, timings,
+                lambda: [f"在{destination}旅行时，建议提前了解当地文化和习俗。"]
+            ),
+            self._run_subtask(
+                "geocode",
+                map_service.geocode(destination),
+                ANALYZE_SERVICE_TIMEOUT, timings,
+                lambda: None
+            ),
+            self._run_subtask(
+                "top_pois",
+                map_service.search_poi("景点", city=destination, page_size=TOP_POI_COUNT),
+                ANALYZE_SERVICE_TIMEOUT, timings,
+                lambda: []
+            )
+        )
+        
+        return {
+            "analysis": analysis_content,
+            "tips": tips,
+            "location": location_info,
+            "top_pois": [
+                {key: poi.get(key) for key in ("name", "address", "location", "type")}
+                for poi in (pois or [])[:TOP_POI_COUNT]
+            ]
+        }
+    
+    def _is_complete_knowledge(self, knowledge: Dict[str, Any], timings: Dict[str, Dict[str, Any]]) -> bool:
+        """只有全部子任务成功的目的地知识才写入知识库，避免共享备用数据"""
+        return knowledge["location"] is not None and all(
+            timings.get(name, {}).get("status") == "ok"
+            for name in ("destination_analysis", "travel_tips", "geocode", "top_pois")
+        )
+    
+    async def _load_destination_knowledge(self, destination: str,
+                                          preferences: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """后台刷新目的地知识，获取不完整时返回None保留旧条目"""
+        timings: Dict[str, Dict[str, Any]] = {}
+        with deadline_scope(None):  # 后台刷新不受发起计划的截止时间限制
+            knowledge = await self._fetch_destination_knowledge(destination, preferences, timings)
+        return knowledge if self._is_complete_knowledge(knowledge, timings) else None
+    
+    async def _run_subtask(self, name: str, coro: Awaitable[Any], timeout: float,
+                           timings: Dict[str, Dict[str, Any]], fallback: Callable[[], Any]) -> Any:
+        """执行单个子任务，超时或失败时返回备用结果并记录耗时
+
+        超时不超过计划剩余预算的 ANALYZE_DEADLINE_SHARE，因预算截断而超时记为 deadline。
+        """
+        start = time.perf_counter()
+        budget = cap_timeout(timeout, ANALYZE_DEADLINE_SHARE)
+        try:
+            result = await asyncio.wait_for(coro, budget)
+            status = "ok"
+        except asyncio.TimeoutError:
+            print(f"⚠️ 子任务超时({budget:.3g}s)，使用备用数据: {name}")
+            result = fallback()
+            status = "timeout" if budget >= timeout else "deadline"
+        except Exception as e:
+            print(f"⚠️ 子任务失败，使用备用数据: {name}: {str(e)}")
+            result = fallback()
+            status = "error"
+        
+        timings[name] = {
+            "seconds": round(time.perf_counter() - start, 3),
+            "status": status
+        }
+        return result
+    
     async def _plan_itinerary(self, state: AgentState) -> AgentState:
         """行程规划节点"""
         try:
@@ -209,46 +373,36 @@ class TravelPlannerAgent:
                 "group_size": state.metadata.get("group_size")
             }
             
-            itinerary = []
+            # 按天（或按批）并发生成行程，单个计划和全局的并发数均受限，gather保证结果按天排序
+            day_concurrency = max(1, int(state.metadata.get("day_concurrency") or self.day_concurrency))
+            plan_semaphore = asyncio.Semaphore(day_concurrency)
             
-            for day in range(1, travel_days + 1):
-                # 获取当日天气信息
-                day_date = state.request.start_date + timedelta(days=day-1)
-                weather_note = self._get_weather_note_for_day(state.weather_data, day_date)
-                
-                # 根据天气调整偏好设置
-                weather_adjusted_preferences = preferences.copy()
-                weather_adjusted_preferences['weather_info'] = weather_note
-                
-                # 使用豆包API生成每日行程
-                daily_plan = await llm_service.generate_daily_itinerary(
-                    destination, day, travel_days, weather_adjusted_preferences, budget_level
-                )
-                
-                # 将AI生成的行程转换为ActivityItem格式
-                activities = await self._convert_ai_plan_to_activities(daily_plan, destination)
-                
-                # 根据天气调整活动建议
-                activities = self._adjust_activities_for_weather(activities, weather_note)
-                
-                # 计算当日费用
-                total_cost = sum(activity.cost or 0 for activity in activities)
-                
-                # 生成包含天气信息的备注
-                day_notes = f"第{day}天行程安排，注意合理安排时间"
-                if weather_note:
-                    day_notes += f"\n天气提醒: {weather_note}"
-                
-                itinerary_item = ItineraryItem(
-                    day=day,
-                    date=day_date.strftime("%Y-%m-%d"),
-                    theme=f"第{day}天 - {self._get_day_theme(day, travel_style)}",
-                    activities=activities,
-                    total_cost=total_cost,
-                    notes=day_notes
-                )
-                
-                itinerary.append(itinerary_item)
+            if ITINERARY_MODE == "multi_day":
+                # 多日模式：按token预算把天数分批，每批一次请求，减少重复发送的提示词模板
+                tasks = [
+                    self._plan_day_chunk(
+                        state, days, travel_days, destination, travel_style,
+                        preferences, budget_level, plan_semaphore
+                    )
+                    for days in llm_service.plan_itinerary_chunks(travel_days)
+                ]
+            else:
+                tasks = [
+                    self._plan_single_day(
+                        state, day, travel_days, destination, travel_style,
+                        preferences, budget_level, plan_semaphore
+                    )
+                    for day in range(1, travel_days + 1)
+                ]
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+            
+            for result in results:
+                if isinstance(result, BaseException):
+                    raise result
+            
+            itinerary = []
+            for result in results:
+                itinerary.extend(result if isinstance(result, list) else [result])
             
             state.itinerary_draft = itinerary
             
@@ -282,6 +436,191 @@ class TravelPlannerAgent:
         
         return state
     
+    async def _plan_single_day(self, state: AgentState, day: int, travel_days: int, destination: str,
+                               travel_style: str, preferences: Dict[str, Any], budget_level: str,
+                               plan_semaphore: asyncio.Semaphore) -> ItineraryItem:
+        """生成单日行程"""
+        # 获取当日天气信息
+        day_date = state.request.start_date + timedelta(days=day-1)
+        weather_note = self._get_weather_note_for_day(state.weather_data, day_date)
+        
+        # 根据天气调整偏好设置
+        weather_adjusted_preferences = preferences.copy()
+        weather_adjusted_preferences['weather_info'] = weather_note
+        
+        start = time.perf_counter()
+        if not llm_service.is_available():
+            # 所有大模型供应商熔断中：不占用并发名额排队，直接使用备用行程
+            print(f"⚠️ 大模型服务熔断中，第{day}天使用备用行程")
+            daily_plan = await llm_service.generate_daily_itinerary(
+                destination, day, travel_days, weather_adjusted_preferences, budget_level
+            )
+            activities = await self._convert_ai_plan_to_activities(daily_plan, destination)
+            state.metadata.setdefault("stage_timings", {}).setdefault("plan_itinerary", {})[f"day_{day}"] = {
+                "seconds": round(time.perf_counter() - start, 3),
+                "status": "circuit_open"
+            }
+            self._record_degraded(state, "plan_itinerary", f"day_{day}", "circuit_open")
+            return self._build_itinerary_item(day, day_date, activities, weather_note, travel_style)
+        
+        interests = preferences.get("interests", [])
+        async with plan_semaphore, _get_global_day_semaphore():
+            # 排队结束后再检查剩余预算：不足以生成一天时直接使用规则生成的行程
+            budget = self._day_budget()
+            if budget is not None and budget < DAY_MIN_BUDGET:
+                print(f"⚠️ 剩余时间预算不足，第{day}天使用规则生成的行程")
+                return self._degrade_day(state, day, day_date, weather_note, travel_style, interests, destination, start)
+            try:
+                activities, first_activity = await asyncio.wait_for(
+                    self._generate_day_activities(
+                        destination, day, travel_days, weather_adjusted_preferences, budget_level, start
+                    ),
+                    budget
+                )
+            except asyncio.TimeoutError:
+                print(f"⚠️ 第{day}天行程生成超出剩余时间预算，使用规则生成的行程")
+                return self._degrade_day(state, day, day_date, weather_note, travel_style, interests, destination, start)
+        
+        state.metadata.setdefault("stage_timings", {}).setdefault("plan_itinerary", {})[f"day_{day}"] = {
+            "first_activity": round(first_activity, 3) if first_activity is not None else None,
+            "seconds": round(time.perf_counter() - start, 3),
+            "streaming": ITINERARY_STREAMING
+        }
+        
+        return self._build_itinerary_item(day, day_date, activities, weather_note, travel_style)
+    
+    async def _generate_day_activities(self, destination: str, day: int, travel_days: int,
+                                       preferences: Dict[str, Any], budget_level: str,
+                                       start: float) -> Tuple[List[ActivityItem], Optional[float]]:
+        """使用大模型生成单日活动，返回 (活动列表, 首个活动就绪耗时)"""
+        if ITINERARY_STREAMING:
+            return await self._stream_day_activities(
+                destination, day, travel_days, preferences, budget_level, start
+            )
+        
+        # 使用大模型生成每日行程
+        daily_plan = await llm_service.generate_daily_itinerary(
+            destination, day, travel_days, preferences, budget_level
+        )
+        
+        # 将AI生成的行程转换为ActivityItem格式
+        activities = await self._convert_ai_plan_to_activities(daily_plan, destination)
+        return activities, (time.perf_counter() - start if activities else None)
+    
+    def _day_budget(self) -> Optional[float]:
+        """行程生成可用的剩余预算（扣除后续节点的预留时间），未设置截止时间时返回None"""
+        remaining = remaining_budget()
+        return None if remaining is None else max(0.0, remaining - FINALIZE_RESERVE)
+    
+    def _degrade_day(self, state: AgentState, day: int, day_date, weather_note: str, travel_style: str,
+                     interests: List[str], destination: str, start: float) -> ItineraryItem:
+        """截止时间临近时使用规则生成的单日行程，并记录降级"""
+        activities = self._generate_daily_activities(day, travel_style, interests, destination)
+        state.metadata.setdefault("stage_timings", {}).setdefault("plan_itinerary", {})[f"day_{day}"] = {
+            "seconds": round(time.perf_counter() - start, 3),
+            "status": "deadline"
+        }
+        self._record_degraded(state, "plan_itinerary", f"day_{day}", "deadline")
+        return self._build_itinerary_item(day, day_date, activities, weather_note, travel_style)
+    
+    def _record_degraded(self, state: AgentState, stage: str, part: str, reason: str):
+        """记录使用备用结果的部分，随计划元数据返回"""
+        state.metadata.setdefault("degraded", []).append({"stage": stage, "part": part, "reason": reason})
+    
+    def _build_itinerary_item(self, day: int, day_date, activities: List[ActivityItem],
+                              weather_note: str, travel_style: str) -> ItineraryItem:
+        """根据天气调整活动并汇总为单日行程"""
+        # 根据天气调整活动建议
+        activities = self._adjust_activities_for_weather(activities, weather_note)
+        
+        # 计算当日费用
+        total_cost = sum(activity.cost or 0 for activity in activities)
+        
+        # 生成包含天气信息的备注
+        day_notes = f"第{day}天行程安排，注意合理安排时间"
+        if weather_note:
+            day_notes += f"\n天气提醒: {weather_note}"
+        
+        return ItineraryItem(
+            day=day,
+            date=day_date.strftime("%Y-%m-%d"),
+            theme=f"第{day}天 - {self._get_day_theme(day, travel_style)}",
+            activities=activities,
+            total_cost=total_cost,
+            notes=day_notes
+        )
+    
+    async def _plan_day_chunk(self, state: AgentState, days: List[int], travel_days: int, destination: str,
+                              travel_style: str, preferences: Dict[str, Any], budget_level: str,
+                              plan_semaphore: asyncio.Semaphore) -> List[ItineraryItem]:
+        """一次请求生成连续多天的行程，缺失的天逐天补生成"""
+        day_dates = {day: state.request.start_date + timedelta(days=day-1) for day in days}
+        weather_notes = {day: self._get_weather_note_for_day(state.weather_data, day_dates[day]) for day in days}
+        
+        start = time.perf_counter()
+        daily_plans = {}  # 熔断中或预算不足时为空，各天由 _plan_single_day 降级
+        if llm_service.is_available():
+            async with plan_semaphore, _get_global_day_semaphore():
+                budget = self._day_budget()
+                if budget is None or budget >= DAY_MIN_BUDGET:
+                    try:
+                        daily_plans = await asyncio.wait_for(
+                            llm_service.generate_multi_day_itinerary(
+                                destination, days, travel_days, preferences, budget_level, weather_notes
+                            ),
+                            budget
+                        )
+                    except asyncio.TimeoutError:
+                        print(f"⚠️ 第{days[0]}-{days[-1]}天行程生成超出剩余时间预算")
+        
+        missing = [day for day in days if day not in daily_plans]
+        state.metadata.setdefault("stage_timings", {}).setdefault("plan_itinerary", {})[
+            f"days_{days[0]}_{days[-1]}"
+        ] = {"seconds": round(time.perf_counter() - start, 3), "days": len(days), "missing": missing}
+        if missing:
+            print(f"⚠️ 多日行程缺少第{missing}天，逐天补生成")
+        
+        async def build(day: int) -> ItineraryItem:
+            if day not in daily_plans:
+                return await self._plan_single_day(
+                    state, day, travel_days, destination, travel_style,
+                    preferences, budget_level, plan_semaphore
+                )
+            activities = await self._convert_ai_plan_to_activities(daily_plans[day], destination)
+            return self._build_itinerary_item(day, day_dates[day], activities, weather_notes[day], travel_style)
+        
+        return list(await asyncio.gather(*[build(day) for day in days]))
+    
+    async def _stream_day_activities(self, destination: str, day: int, travel_days: int,
+                                     preferences: Dict[str, Any], budget_level: str,
+                                     start: float) -> Tuple[List[ActivityItem], Optional[float]]:
+        """流式生成单日行程，每个时段生成完毕即开始地点查询，与后续生成重叠
+        
+        Returns:
+            (按时段排序的活动列表, 首个活动就绪耗时)
+        """
+        first_ready: List[float] = []
+        
+        async def convert(period: str, section: Dict[str, Any]) -> ActivityItem:
+            activity = await self._convert_section_to_activity(period, section, destination)
+            if not first_ready:
+                first_ready.append(time.perf_counter() - start)
+            return activity
+        
+        tasks: Dict[str, asyncio.Task] = {}
+        try:
+            async for period, section in llm_service.stream_daily_itinerary(
+                destination, day, travel_days, preferences, budget_level
+            ):
+                tasks[period] = asyncio.create_task(convert(period, section))
+            activities = await asyncio.gather(*[tasks[p] for p in ITINERARY_PERIODS if p in tasks])
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            raise
+        
+        return list(activities), (first_ready[0] if first_ready else None)
+    
     def _generate_daily_activities(self, day: int, travel_style: str, interests: List[str], destination: str) -> List[ActivityItem]:
         """生成每日活动安排"""
         activities = []
@@ -535,132 +874,100 @@ class TravelPlannerAgent:
         
         return activities
     
-    def _parse_cost_from_string(self, cost_str: Any) -> float:
-        """从字符串中解析费用数字"""
-        import re
-        
-        if cost_str is None:
-            return 0.0
-        
-        if isinstance(cost_str, (int, float)):
-            return float(cost_str)
-        
-        if not isinstance(cost_str, str):
-            return 0.0
-        
-        # 移除所有非数字和小数点的字符，提取数字
-        numbers = re.findall(r'\d+(?:\.\d+)?', cost_str)
-        
-        if numbers:
-            try:
-                # 取第一个找到的数字
-                return float(numbers[0])
-            except (ValueError, IndexError):
-                return 0.0
-        
-        return 0.0
-    
     async def _convert_ai_plan_to_activities(self, daily_plan: Dict[str, Any], destination: str) -> List[ActivityItem]:
-        """将AI生成的行程转换为ActivityItem格式，并添加地理位置信息"""
-        activities = []
+        """将AI生成的行程转换为ActivityItem格式，并添加地理位置信息
         
-        # 早餐
-        if daily_plan.get('breakfast'):
-            breakfast = daily_plan['breakfast']
-            location_name = breakfast.get('restaurant', breakfast.get('location', '酒店餐厅'))
+        各时段的地点查询互不依赖，并发执行；结果按时段顺序返回。
+        """
+        periods = [period for period in ITINERARY_PERIODS if daily_plan.get(period)]
+        return list(await asyncio.gather(*[
+            self._convert_section_to_activity(period, daily_plan[period], destination)
+            for period in periods
+        ]))
+    
+    async def _convert_section_to_activity(self, period: str, section: Dict[str, Any],
+                                           destination: str) -> ActivityItem:
+        """将单个餐饮/活动时段转换为ActivityItem，并添加地理位置信息"""
+        if period == 'breakfast':  # 早餐
+            location_name = section.get('restaurant', section.get('location', '酒店餐厅'))
             
             location_info = await self._get_location_info(location_name, destination)
             
-            activities.append(ActivityItem(
+            return ActivityItem(
                 time="08:00",
-                activity=f"早餐 - {breakfast.get('restaurant', '酒店餐厅')}",
+                activity=f"早餐 - {section.get('restaurant', '酒店餐厅')}",
                 location=location_info.get('formatted_address', location_name),
-                cost=self._parse_cost_from_string(breakfast.get('cost', 50)),
-                duration=breakfast.get('duration', '1小时'),
-                description=f"{breakfast.get('description', '享用早餐')}\n推荐菜品: {breakfast.get('recommended_dishes', '当地特色')}\n{location_info.get('poi_info', '')}"
-            ))
-        
-        # 上午活动
-        if daily_plan.get('morning'):
-            morning = daily_plan['morning']
-            location_name = morning.get('location', '待定')
+                cost=parse_cost(section.get('cost'), default=50),
+                duration=format_duration(section.get('duration'), '1小时'),
+                description=f"{section.get('description', '享用早餐')}\n推荐菜品: {section.get('recommended_dishes', '当地特色')}\n{location_info.get('poi_info', '')}"
+            )
+        elif period == 'morning':  # 上午活动
+            location_name = section.get('location', '待定')
             
             location_info = await self._get_location_info(location_name, destination)
             
-            activities.append(ActivityItem(
+            return ActivityItem(
                 time="09:30",
-                activity=morning.get('activity', '上午活动'),
+                activity=section.get('activity', '上午活动'),
                 location=location_info.get('formatted_address', location_name),
-                cost=self._parse_cost_from_string(morning.get('cost', 100)),
-                duration=morning.get('duration', '2-3小时'),
-                description=f"{morning.get('description', '上午活动安排')}\n开放时间: {morning.get('opening_hours', '全天')}\n门票: {morning.get('ticket_price', '待查询')}\n{location_info.get('poi_info', '')}"
-            ))
-        
-        # 午餐
-        if daily_plan.get('lunch'):
-            lunch = daily_plan['lunch']
-            location_name = lunch.get('restaurant', lunch.get('location', '当地餐厅'))
+                cost=parse_cost(section.get('cost'), default=100),
+                duration=format_duration(section.get('duration'), '2-3小时'),
+                description=f"{section.get('description', '上午活动安排')}\n开放时间: {format_opening_hours(section.get('openTime') or section.get('opening_hours'), '全天')}\n门票: {section.get('ticket_price', '待查询')}\n{location_info.get('poi_info', '')}"
+            )
+        elif period == 'lunch':  # 午餐
+            location_name = section.get('restaurant', section.get('location', '当地餐厅'))
             
             location_info = await self._get_location_info(location_name, destination)
             
-            activities.append(ActivityItem(
+            return ActivityItem(
                 time="12:00",
-                activity=f"午餐 - {lunch.get('restaurant', '当地餐厅')}",
+                activity=f"午餐 - {section.get('restaurant', '当地餐厅')}",
                 location=location_info.get('formatted_address', location_name),
-                cost=self._parse_cost_from_string(lunch.get('cost', 80)),
-                duration=lunch.get('duration', '1小时'),
-                description=f"{lunch.get('description', '享用午餐')}\n推荐菜品: {lunch.get('recommended_dishes', '当地特色')}\n人均消费: {lunch.get('average_cost', '80元')}\n{location_info.get('poi_info', '')}"
-            ))
-        
-        # 下午活动
-        if daily_plan.get('afternoon'):
-            afternoon = daily_plan['afternoon']
-            location_name = afternoon.get('location', '待定')
+                cost=parse_cost(section.get('cost'), default=80),
+                duration=format_duration(section.get('duration'), '1小时'),
+                description=f"{section.get('description', '享用午餐')}\n推荐菜品: {section.get('recommended_dishes', '当地特色')}\n人均消费: {section.get('average_cost', '80元')}\n{location_info.get('poi_info', '')}"
+            )
+        elif period == 'afternoon':  # 下午活动
+            location_name = section.get('location', '待定')
             
             location_info = await self._get_location_info(location_name, destination)
             
-            activities.append(ActivityItem(
+            return ActivityItem(
                 time="14:00",
-                activity=afternoon.get('activity', '下午活动'),
+                activity=section.get('activity', '下午活动'),
                 location=location_info.get('formatted_address', location_name),
-                cost=self._parse_cost_from_string(afternoon.get('cost', 150)),
-                duration=afternoon.get('duration', '3-4小时'),
-                description=f"{afternoon.get('description', '下午活动安排')}\n开放时间: {afternoon.get('opening_hours', '全天')}\n门票: {afternoon.get('ticket_price', '待查询')}\n特色: {afternoon.get('features', '精彩体验')}\n{location_info.get('poi_info', '')}"
-            ))
-        
-        # 晚餐
-        if daily_plan.get('dinner'):
-            dinner = daily_plan['dinner']
-            location_name = dinner.get('restaurant', dinner.get('location', '当地餐厅'))
+                cost=parse_cost(section.get('cost'), default=150),
+                duration=format_duration(section.get('duration'), '3-4小时'),
+                description=f"{section.get('description', '下午活动安排')}\n开放时间: {format_opening_hours(section.get('openTime') or section.get('opening_hours'), '全天')}\n门票: {section.get('ticket_price', '待查询')}\n特色: {section.get('features', '精彩体验')}\n{location_info.get('poi_info', '')}"
+            )
+        elif period == 'dinner':  # 晚餐
+            location_name = section.get('restaurant', section.get('location', '当地餐厅'))
             
             location_info = await self._get_location_info(location_name, destination)
             
-            activities.append(ActivityItem(
+            return ActivityItem(
                 time="18:00",
-                activity=f"晚餐 - {dinner.get('restaurant', '当地餐厅')}",
+                activity=f"晚餐 - {section.get('restaurant', '当地餐厅')}",
                 location=location_info.get('formatted_address', location_name),
-                cost=self._parse_cost_from_string(dinner.get('cost', 120)),
-                duration=dinner.get('duration', '1.5小时'),
-                description=f"{dinner.get('description', '享用晚餐')}\n推荐菜品: {dinner.get('recommended_dishes', '当地特色')}\n人均消费: {dinner.get('average_cost', '120元')}\n{location_info.get('poi_info', '')}"
-            ))
-        
-        # 晚上活动
-        if daily_plan.get('evening'):
-            evening = daily_plan['evening']
-            location_name = evening.get('location', '酒店附近')
+                cost=parse_cost(section.get('cost'), default=120),
+                duration=format_duration(section.get('duration'), '1.5小时'),
+                description=f"{section.get('description', '享用晚餐')}\n推荐菜品: {section.get('recommended_dishes', '当地特色')}\n人均消费: {section.get('average_cost', '120元')}\n{location_info.get('poi_info', '')}"
+            )
+        elif period == 'evening':  # 晚上活动
+            location_name = section.get('location', '酒店附近')
             
             location_info = await self._get_location_info(location_name, destination)
             
-            activities.append(ActivityItem(
+            return ActivityItem(
                 time="20:00",
-                activity=evening.get('activity', '晚上活动'),
+                activity=section.get('activity', '晚上活动'),
                 location=location_info.get('formatted_address', location_name),
-                cost=self._parse_cost_from_string(evening.get('cost', 80)),
-                duration=evening.get('duration', '2小时'),
-                description=f"{evening.get('description', '晚上活动安排')}\n开放时间: {evening.get('opening_hours', '夜间')}\n费用: {evening.get('cost', 80)}元\n{location_info.get('poi_info', '')}"
-            ))
+                cost=parse_cost(section.get('cost'), default=80),
+                duration=format_duration(section.get('duration'), '2小时'),
+                description=f"{section.get('description', '晚上活动安排')}\n开放时间: {format_opening_hours(section.get('openTime') or section.get('opening_hours'), '夜间')}\n费用: {section.get('cost', 80)}元\n{location_info.get('poi_info', '')}"
+            )
         
-        return activities
+        raise ValueError(f"未知的行程时段: {period}")
     
     def _get_day_theme(self, day: int, travel_style: str) -> str:
         """获取当日主题"""
@@ -847,6 +1154,7 @@ class TravelPlannerAgent:
             # 确保所有必需字段都有有效值
             destination = state.metadata.get("destination_processed") or state.request.destination
             user_id = state.request.user_id or "anonymous"
+            deadline = current_deadline()
             
             # 生成最终的旅行计划
             plan = TravelPlan(
@@ -860,7 +1168,13 @@ class TravelPlannerAgent:
                 itinerary=state.itinerary_draft or [],
                 recommendations=state.recommendations or [],
                 weather_info=state.weather_data,
-                cultural_tips=state.cultural_info.get("tips", []) if state.cultural_info else []
+                cultural_tips=state.cultural_info.get("tips", []) if state.cultural_info else [],
+                metadata={
+                    "stage_timings": state.metadata.get("stage_timings", {}),
+                    "deadline": deadline.to_dict() if deadline else None,
+                    "degraded": state.metadata.get("degraded", []),
+                    "model_tiers": current_tier_report() or {}
+                }
             )
             
             # 将计划存储到状态中
@@ -874,9 +1188,19 @@ class TravelPlannerAgent:
         
         return state
     
-    async def generate_travel_plan(self, request: TravelRequest) -> Dict[str, Any]:
-        """生成旅行计划的主入口方法"""
+    async def generate_travel_plan(self, request: TravelRequest, route: str = "full",
+                                   budget: Optional[float] = None) -> Dict[str, Any]:
+        """生成旅行计划的主入口方法
+        
+        Args:
+            request: 旅行请求
+            route: 调用路由（quick / full），决定默认的总时间预算
+            budget: 总时间预算（秒），默认读取 PLAN_DEADLINE_<ROUTE>，0 表示不限时
+        """
         start_time = datetime.now()
+        if budget is None:
+            budget = get_route_budget(route)
+        thread_id = f"travel_plan_{request.user_id}_{uuid.uuid4().hex}"
         
         try:
             # 创建初始状态
@@ -885,13 +1209,18 @@ class TravelPlannerAgent:
                 current_step="start"
             )
             
-            # 执行工作流
-            config = {"configurable": {"thread_id": f"travel_plan_{request.user_id}"}}
+            # 执行工作流：编译后的图在请求间共享，每次调用使用独立的线程ID，
+            # 避免同一用户（或所有匿名用户）的并发计划写入同一条检查点线程
+            config = {"configurable": {"thread_id": thread_id}}
             
             print(f"🚀 开始生成旅行计划: {request.destination}")
             
-            # 运行图
-            final_state = await self.graph.ainvoke(initial_state, config)
+            # 运行图：截止时间、模型档位报告、查询记忆化和请求优先级通过上下文传递给各节点及其发起的上游请求
+            # 同步等待结果的快速规划优先于后台生成的完整计划
+            priority = PRIORITY_INTERACTIVE if route == "quick" else PRIORITY_BACKGROUND
+            with deadline_scope(budget if budget > 0 else None, route), tier_report(), plan_memo(), \
+                    priority_scope(priority):
+                final_state = await self.graph.ainvoke(initial_state, config)
             
             # 计算处理时间
             processing_time = (datetime.now() - start_time).total_seconds()
@@ -940,4 +1269,16 @@ class TravelPlannerAgent:
                 "message": error_msg,
                 "processing_time": processing_time,
                 "error": str(e)
-            }
\ No newline at end of file
+            }
+        finally:
+            await self._release_checkpoints(thread_id)
+    
+    async def _release_checkpoints(self, thread_id: str):
+        """计划结束后释放检查点线程，避免检查点随计划数量无限增长"""
+        try:
+            if CHECKPOINT_RETENTION == "delete":
+                await self.memory.adelete_thread(thread_id)
+            elif CHECKPOINT_RETENTION == "compact" and hasattr(self.memory, "compact_thread"):
+                self.memory.compact_thread(thread_id)
+        except Exception as e:
+            print(f"⚠️ 释放检查点失败: {e}")
\ No newline at end of file
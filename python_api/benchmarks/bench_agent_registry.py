@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""基准测试：每个请求新建 TravelPlannerAgent vs 共享注册表中的单例
+
+测量请求准入阶段（获取智能体实例）的延迟和每个请求的内存分配。
+
+用法: python benchmarks/bench_agent_registry.py [--requests 200]
+"""
+
+import argparse
+import gc
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+sys.path.append(str(Path(__file__).parent.parent))
+os.environ.setdefault('QWEN_API_KEY', 'bench-key')
+
+from agents.travel_planner_agent import TravelPlannerAgent
+from agents.registry import get_travel_planner_agent, reset_agents
+
+def measure(label: str, factory, requests: int):
+    # 预热，排除首次导入和编译开销
+    factory()
+    gc.collect()
+
+    latencies = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        factory()
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    gc.collect()
+    tracemalloc.start()
+    snapshot_before = tracemalloc.take_snapshot()
+    agents = [factory() for _ in range(requests)]
+    snapshot_after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    stats = snapshot_after.compare_to(snapshot_before, 'filename')
+    allocated = sum(stat.size_diff for stat in stats if stat.size_diff > 0)
+    blocks = sum(stat.count_diff for stat in stats if stat.count_diff > 0)
+    del agents
+
+    latencies.sort()
+    p50 = statistics.median(latencies)
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    print(f"{label:<12}{p50:>10.3f}{p99:>10.3f}{allocated / requests / 1024:>14.1f}{blocks / requests:>12.0f}")
+
+def main(requests: int):
+    print(f"=== 智能体准入基准测试 ({requests} 次请求) ===")
+    print(f"{'模式':<12}{'p50(ms)':>10}{'p99(ms)':>10}{'分配/请求(KB)':>14}{'对象/请求':>12}")
+    measure("per-request", TravelPlannerAgent, requests)
+    reset_agents()
+    measure("singleton", get_travel_planner_agent, requests)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="智能体准入基准测试")
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+    main(args.requests)
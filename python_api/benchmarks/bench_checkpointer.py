@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""基准测试：检查点存储随计划数量的内存增长
+
+对比无界 MemorySaver（不清理）、有界内存存储（仅容量上限）和计划完成后
+删除检查点三种方式，LLM调用使用本地假实现。统计检查点存储中序列化数据的
+字节数（不开启 tracemalloc，避免 1 万个计划时拖慢到不可用）。
+
+用法: python benchmarks/bench_checkpointer.py [--plans 10000] [--concurrency 20]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+sys.path.append(str(Path(__file__).parent.parent))
+os.environ.setdefault('QWEN_API_KEY', 'bench-key')
+os.environ.setdefault('ITINERARY_STREAMING', 'false')  # 下面替换的是非流式的 generate_daily_itinerary
+
+from langgraph.checkpoint.memory import MemorySaver
+
+import agents.travel_planner_agent as planner_module
+from agents.checkpointer import BoundedMemorySaver
+from agents.travel_planner_agent import TravelPlannerAgent
+from agents.models import TravelRequest
+from services.llm_service import llm_service
+
+async def fake_analysis(destination, preferences):
+    return f"{destination}是一个值得探索的目的地。" * 20
+
+async def fake_tips(destination, preferences):
+    return [f"{destination}贴士{i}" for i in range(5)]
+
+async def fake_daily(destination, day, total_days, preferences, budget_level):
+    return {
+        'day': day,
+        'morning': {'activity': f'游览{destination}', 'location': destination, 'cost': 50},
+        'afternoon': {'activity': '博物馆', 'location': destination, 'cost': 30},
+        'evening': {'activity': '夜市', 'location': destination, 'cost': 80}
+    }
+
+def store_size(saver) -> int:
+    """检查点存储中序列化数据的总字节数"""
+    total = 0
+    for namespaces in saver.storage.values():
+        for checkpoints in namespaces.values():
+            for checkpoint, metadata, _ in checkpoints.values():
+                total += len(checkpoint[1]) + len(metadata[1])
+    for writes in saver.writes.values():
+        for write in writes.values():
+            total += len(write[2][1])
+    for value in getattr(saver, 'blobs', {}).values():
+        total += len(value[1])
+    return total
+
+async def run(label: str, saver, retention: str, plans: int, concurrency: int, checkpoints: int):
+    planner_module.CHECKPOINT_RETENTION = retention
+    agent = TravelPlannerAgent(checkpointer=saver)
+    request = TravelRequest(
+        destination="杭州",
+        start_date=date.today(),
+        end_date=date.today() + timedelta(days=2),
+        budget_level="舒适型",
+        travel_style="文化探索"
+    )
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            return await agent.generate_travel_plan(request)
+
+    start = time.perf_counter()
+    samples = []
+    done = 0
+    step = max(plans // checkpoints, 1)
+    with contextlib.redirect_stdout(io.StringIO()):
+        while done < plans:
+            batch = min(step, plans - done)
+            results = await asyncio.gather(*[one() for _ in range(batch)])
+            assert all(result["success"] for result in results)
+            done += batch
+            samples.append(store_size(saver) / 1024 / 1024)
+    elapsed = time.perf_counter() - start
+
+    curve = " ".join(f"{value:.1f}" for value in samples)
+    print(f"{label:<20}{elapsed:>8.1f}s{len(saver.storage):>8}{samples[-1]:>10.2f}MB  [{curve}]")
+
+async def main(plans: int, concurrency: int, max_threads: int):
+    llm_service.generate_destination_analysis = fake_analysis
+    llm_service.generate_travel_tips = fake_tips
+    llm_service.generate_daily_itinerary = fake_daily
+
+    print(f"=== 检查点内存基准测试 ({plans} 个计划，并发 {concurrency}) ===")
+    print(f"{'模式':<20}{'耗时':>9}{'线程数':>8}{'检查点数据':>10}  [各阶段数据量(MB)]")
+    await run("unbounded/keep", MemorySaver(), "keep", plans, concurrency, 5)
+    await run(f"bounded({max_threads})/keep", BoundedMemorySaver(max_threads=max_threads, ttl=0),
+              "keep", plans, concurrency, 5)
+    await run("bounded/delete", BoundedMemorySaver(max_threads=max_threads, ttl=0),
+              "delete", plans, concurrency, 5)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="检查点内存基准测试")
+    parser.add_argument("--plans", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--max-threads", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(main(args.plans, args.concurrency, args.max_threads))
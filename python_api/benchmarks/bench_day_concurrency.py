@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""基准测试：每日行程并发生成 vs 逐天串行生成
+
+LLM 由本地桩服务模拟，延迟服从对数正态分布（中位数约为真实通义千问
+生成单日行程耗时的 1/8，避免基准运行过久）；地图和天气使用离线备用数据。
+
+用法: python benchmarks/bench_day_concurrency.py [--median 1.0] [--concurrency 3]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+sys.path.append(str(Path(__file__).parent.parent))
+
+from benchmarks.stub_upstream import StubUpstream
+
+async def run_benchmark(median: float, concurrency: int):
+    rng = random.Random(42)
+
+    def latency(path: str) -> float:
+        if path.endswith('/chat/completions'):
+            return median * rng.lognormvariate(0, 0.35)
+        return 0.0
+
+    stub = StubUpstream(latency=latency)
+    await stub.start()
+
+    os.environ.update({'QWEN_API_KEY': 'bench-key', 'QWEN_BASE_URL': f"{stub.base_url}/v1",
+                       'LLM_CACHE_ENABLED': 'false'})
+    os.environ.pop('AMAP_API_KEY', None)
+    os.environ.pop('OPENWEATHER_API_KEY', None)
+
+    from agents.travel_planner_agent import TravelPlannerAgent
+    from agents.models import TravelRequest
+
+    print(f"=== 每日行程并发生成基准测试 (LLM延迟中位数 {median:.2f}s, 单计划并发 {concurrency}) ===")
+    print(f"{'天数':<6}{'串行(s)':>10}{'并发(s)':>10}{'加速比':>8}{'顺序正确':>10}")
+
+    for days in (3, 7, 14):
+        request = TravelRequest(
+            destination="杭州",
+            start_date=date.today(),
+            end_date=date.today() + timedelta(days=days - 1),
+            budget_level="舒适型",
+            travel_style="文化探索"
+        )
+
+        timings = {}
+        ordered = True
+        for mode, day_concurrency in (("serial", 1), ("concurrent", concurrency)):
+            agent = TravelPlannerAgent(day_concurrency=day_concurrency)
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = await agent.generate_travel_plan(request)
+            timings[mode] = time.perf_counter() - start
+            itinerary = result["plan"].itinerary
+            ordered = ordered and [item.day for item in itinerary] == list(range(1, days + 1))
+
+        speedup = timings["serial"] / timings["concurrent"]
+        print(f"{days:<6}{timings['serial']:>10.2f}{timings['concurrent']:>10.2f}{speedup:>7.1f}x{str(ordered):>10}")
+
+    await stub.stop()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="每日行程并发生成基准测试")
+    parser.add_argument("--median", type=float, default=1.0, help="模拟LLM延迟中位数（秒）")
+    parser.add_argument("--concurrency", type=int, default=3, help="单个计划内的并发天数")
+    args = parser.parse_args()
+    asyncio.run(run_benchmark(args.median, args.concurrency))
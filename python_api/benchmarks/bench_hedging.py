@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""基准测试：对冲请求对长尾延迟的影响
+
+本地桩服务注入重尾延迟：大部分大模型/地图请求很快，少数请求慢一到两个数量级
+（帕累托分布）。分别在不对冲（预算为 0，只统计延迟）和开启对冲两种模式下顺序
+发出相同数量的大模型和地图调用，比较 p50/p95/p99 延迟和额外的上游请求比例。
+
+用法: python benchmarks/bench_hedging.py [--calls 200] [--budget 0.1] [--slow-ratio 0.05]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+sys.path.append(str(Path(__file__).parent.parent))
+
+from benchmarks.stub_upstream import StubUpstream
+
+# 正常请求的延迟（秒）和慢请求的基准延迟
+FAST_LATENCY = {'llm': 0.05, 'amap': 0.01}
+SLOW_SCALE = {'llm': 1.0, 'amap': 0.3}
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+async def run_benchmark(calls: int, budget: float, slow_ratio: float):
+    rng = random.Random(42)
+
+    def heavy_tail(kind: str) -> float:
+        if rng.random() < slow_ratio:
+            return min(SLOW_SCALE[kind] * rng.paretovariate(1.5), SLOW_SCALE[kind] * 10)
+        return FAST_LATENCY[kind] * rng.uniform(0.8, 1.5)
+
+    def latency(path: str) -> float:
+        if path.endswith('/chat/completions'):
+            return heavy_tail('llm')
+        if path.startswith('/v3/'):
+            return heavy_tail('amap')
+        return 0.0
+
+    stub = StubUpstream(latency=latency)
+    await stub.start()
+
+    # 服务在导入时读取环境变量，因此需要先指向桩服务
+    os.environ.update({
+        'QWEN_API_KEY': 'bench-key',
+        'QWEN_BASE_URL': f"{stub.base_url}/v1",
+        'AMAP_API_KEY': 'bench-key',
+        'AMAP_BASE_URL': f"{stub.base_url}/v3",
+        'AMAP_STORE_ENABLED': 'false',
+        'LLM_CACHE_ENABLED': 'false',  # 每次调用都要真正发出请求
+        'HEDGE_ENABLED': 'true',
+        'HEDGE_LLM_MIN_DELAY': '0.05',
+        'HEDGE_AMAP_MIN_DELAY': '0.01',
+    })
+
+    from services.llm_service import llm_service
+    from services.map_service import map_service
+
+    map_service.rate_limiter.set_rate(0)  # 只比较上游延迟，不计频率控制等待
+    messages = [{"role": "user", "content": "推荐一个景点"}]
+
+    async def llm_call(i: int):
+        await llm_service._make_request(messages, site="travel_tips")
+
+    async def map_call(i: int):
+        map_service.cache.clear()
+        await map_service.search_poi(f"景点{i}", "杭州")
+
+    results = {}
+    for mode, mode_budget in (("no-hedge", 0.0), ("hedged", budget)):
+        for kind, service, call in (("llm", llm_service, llm_call), ("amap", map_service, map_call)):
+            policy = service.hedging
+            policy.budget = mode_budget
+            policy.stats = {key: 0 for key in policy.stats}
+            policy._tokens = 0.0
+            stub.reset_counters()
+
+            latencies = []
+            for i in range(calls):
+                start = time.perf_counter()
+                await call(i)
+                latencies.append(time.perf_counter() - start)
+            results[(mode, kind)] = (latencies, stub.requests, policy.get_stats())
+
+    await stub.stop()
+
+    print(f"=== 对冲请求基准测试 ({calls} 次调用, 慢请求比例 {slow_ratio:.0%}, 对冲预算 {budget:.0%}) ===")
+    print(f"{'模式':<10}{'上游':<6}{'p50(ms)':>9}{'p95(ms)':>9}{'p99(ms)':>9}{'max(ms)':>9}"
+          f"{'请求数':>8}{'对冲':>6}{'胜出':>6}{'额外负载':>10}")
+    for (mode, kind), (latencies, requests, stats) in results.items():
+        print(f"{mode:<10}{kind:<6}"
+              f"{percentile(latencies, 0.5) * 1000:>9.1f}{percentile(latencies, 0.95) * 1000:>9.1f}"
+              f"{percentile(latencies, 0.99) * 1000:>9.1f}{max(latencies) * 1000:>9.1f}"
+              f"{requests:>8}{stats['hedged']:>6}{stats['hedge_wins']:>6}{stats['extra_load']:>10.1%}")
+    for kind in ("llm", "amap"):
+        before = percentile(results[("no-hedge", kind)][0], 0.99)
+        after = percentile(results[("hedged", kind)][0], 0.99)
+        print(f"\n{kind} p99 降低: {(before - after) / before * 100:.1f}%")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="对冲请求基准测试")
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--budget", type=float, default=0.1)
+    parser.add_argument("--slow-ratio", type=float, default=0.05)
+    args = parser.parse_args()
+    asyncio.run(run_benchmark(args.calls, args.budget, args.slow_ratio))
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""基准测试：共享HTTP连接池 vs 每次请求新建客户端
+
+在本地桩服务上运行完整的旅行规划流程，对比单个计划的耗时和建立的连接数。
+桩服务对每个新连接增加 connect_delay 的延迟，用来模拟 TCP+TLS 握手开销。
+
+用法: python benchmarks/bench_http_pool.py [--days 5] [--connect-delay 0.03]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import time
+from contextlib import asynccontextmanager
+from datetime import date, timedelta
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+sys.path.append(str(Path(__file__).parent.parent))
+
+from benchmarks.stub_upstream import StubUpstream
+
+UPSTREAM_LATENCY = {'/v1/chat/completions': 0.05}
+
+async def run_benchmark(days: int, connect_delay: float):
+    stub = StubUpstream(latency=lambda path: UPSTREAM_LATENCY.get(path, 0.01), connect_delay=connect_delay)
+    await stub.start()
+
+    # 服务在导入时读取环境变量，因此需要先指向桩服务
+    os.environ.update({
+        'QWEN_API_KEY': 'bench-key',
+        'QWEN_BASE_URL': f"{stub.base_url}/v1",
+        'AMAP_API_KEY': 'bench-key',
+        'AMAP_BASE_URL': f"{stub.base_url}/v3",
+        'AMAP_STORE_ENABLED': 'false',
+        'OPENWEATHER_API_KEY': 'bench-key',
+        'OPENWEATHER_BASE_URL': f"{stub.base_url}/data/2.5",
+        'LLM_CACHE_ENABLED': 'false',  # 每次调用都要真正发出请求
+    })
+
+    import httpx
+    from services.http_client import HTTPClientPool
+    from services.llm_service import llm_service
+    from services.map_service import map_service
+    from services.weather_service import weather_service
+    from agents.travel_planner_agent import TravelPlannerAgent
+    from agents.models import TravelRequest
+
+    weather_service.geocoding_url = f"{stub.base_url}/geo/1.0"
+
+    class PerCallClientPool(HTTPClientPool):
+        """复现旧行为：每次请求新建并关闭一个客户端"""
+
+        @asynccontextmanager
+        async def session(self, name: str):
+            async with httpx.AsyncClient(timeout=self._timeouts.get(name, 10.0)) as client:
+                yield client
+
+    request = TravelRequest(
+        destination="杭州",
+        start_date=date.today(),
+        end_date=date.today() + timedelta(days=days - 1),
+        budget_level="舒适型",
+        travel_style="文化探索",
+        interests=["历史", "美食"]
+    )
+
+    results = {}
+    for mode, pool in (("per-call", PerCallClientPool()), ("pooled", HTTPClientPool())):
+        for service in (llm_service, map_service, weather_service):
+            service.http_pool = pool
+        map_service.cache.clear()
+        stub.reset_counters()
+
+        agent = TravelPlannerAgent()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = await agent.generate_travel_plan(request)
+        elapsed = time.perf_counter() - start
+        await pool.aclose()
+
+        results[mode] = (elapsed, stub.connections, stub.requests, result.get("success"))
+
+    await stub.stop()
+
+    print(f"=== 共享HTTP连接池基准测试 ({days}天行程, 模拟握手延迟 {connect_delay * 1000:.0f}ms) ===")
+    print(f"{'模式':<10}{'耗时(s)':>10}{'连接数':>8}{'请求数':>8}{'成功':>6}")
+    for mode, (elapsed, connections, requests, success) in results.items():
+        print(f"{mode:<10}{elapsed:>10.2f}{connections:>8}{requests:>8}{str(success):>6}")
+    before, after = results["per-call"][0], results["pooled"][0]
+    print(f"\n耗时降低: {(before - after) / before * 100:.1f}%")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="共享HTTP连接池基准测试")
+    parser.add_argument("--days", type=int, default=5)
+    parser.add_argument("--connect-delay", type=float, default=0.03)
+    args = parser.parse_args()
+    asyncio.run(run_benchmark(args.days, args.connect_delay))
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""基准测试：多日行程模式（每次请求生成多天）vs 逐天请求
+
+LLM 由本地桩服务模拟：首个分块前等待 --ttft 秒，之后按输出长度每个分块
+等待 --token-interval 秒，因此一次生成多天的请求输出更长、耗时更久。
+token 数用 estimate_tokens 对请求消息和返回内容估算。
+
+用法: python benchmarks/bench_multi_day.py [--ttft 0.5] [--token-interval 0.003]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+sys.path.append(str(Path(__file__).parent.parent))
+
+from benchmarks.stub_upstream import StubUpstream, _route
+
+async def run_benchmark(ttft: float, token_interval: float, concurrency: int):
+    usage = {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0}
+
+    def latency(path: str) -> float:
+        return ttft if path.endswith('/chat/completions') else 0.0
+
+    def handler(method, path, query, body):
+        result = _route(method, path, query, body)
+        if path.endswith('/chat/completions'):
+            from services.llm_service import estimate_tokens
+            payload = json.loads(body)
+            if 'breakfast' in payload['messages'][0]['content']:
+                usage["calls"] += 1
+                usage["prompt_tokens"] += sum(estimate_tokens(m['content']) for m in payload['messages'])
+                usage["completion_tokens"] += estimate_tokens(result[1]['choices'][0]['message']['content'])
+        return result
+
+    stub = StubUpstream(latency=latency, handler=handler, token_interval=token_interval)
+    await stub.start()
+
+    os.environ.update({
+        'QWEN_API_KEY': 'bench-key',
+        'QWEN_BASE_URL': f"{stub.base_url}/v1",
+        'LLM_CACHE_ENABLED': 'false',
+        'ITINERARY_STREAMING': 'false',
+    })
+    os.environ.pop('AMAP_API_KEY', None)
+    os.environ.pop('OPENWEATHER_API_KEY', None)
+
+    import agents.travel_planner_agent as planner_module
+    from agents.travel_planner_agent import TravelPlannerAgent
+    from agents.models import TravelRequest
+    from services.llm_service import llm_service
+
+    agent = TravelPlannerAgent(day_concurrency=concurrency)
+    print(f"=== 多日行程模式基准测试 (TTFT {ttft:.2f}s, 分块间隔 {token_interval * 1000:.1f}ms, "
+          f"单计划并发 {concurrency}, 每天约 {llm_service.tokens_per_day} 输出token) ===")
+    print(f"{'天数':<6}{'模式':<12}{'批次':<18}{'调用数':>6}{'输入token':>10}{'输出token':>10}{'耗时(s)':>9}")
+
+    for days in (3, 7, 14):
+        request = TravelRequest(
+            destination="杭州",
+            start_date=date.today(),
+            end_date=date.today() + timedelta(days=days - 1),
+            budget_level="舒适型",
+            travel_style="文化探索"
+        )
+        for mode in ("per_day", "multi_day"):
+            planner_module.ITINERARY_MODE = mode
+            usage.update({key: 0 for key in usage})
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = await agent.generate_travel_plan(request)
+            elapsed = time.perf_counter() - start
+            assert [item.day for item in result["plan"].itinerary] == list(range(1, days + 1))
+            chunks = "-" if mode == "per_day" else "/".join(
+                str(len(chunk)) for chunk in llm_service.plan_itinerary_chunks(days))
+            print(f"{days:<6}{mode:<12}{chunks:<18}{usage['calls']:>6}{usage['prompt_tokens']:>10}"
+                  f"{usage['completion_tokens']:>10}{elapsed:>9.2f}")
+
+    await stub.stop()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="多日行程模式基准测试")
+    parser.add_argument("--ttft", type=float, default=0.5, help="首个分块前的延迟（秒）")
+    parser.add_argument("--token-interval", type=float, default=0.003, help="分块间隔（秒）")
+    parser.add_argument("--concurrency", type=int, default=3, help="单个计划内的并发请求数")
+    args = parser.parse_args()
+    asyncio.run(run_benchmark(args.ttft, args.token_interval, args.concurrency))
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""基准测试：提示词格式的输入token开销和可复用的固定前缀
+
+在固定的请求语料（若干目的地 × 偏好组合 × 每天的天气提醒）上，分别用 verbose
+（带占位符的完整模板、缩进JSON）和 compact（紧凑结构说明、紧凑JSON）格式构建
+各调用点的提示词，按调用点统计平均输入token数和固定前缀（系统提示词）的占比，
+并检查系统提示词在所有天数和用户之间是否逐字节相同（供应商上下文缓存命中的前提）。
+
+用法: python benchmarks/bench_prompt_tokens.py
+"""
+
+import os
+import sys
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+sys.path.append(str(Path(__file__).parent.parent))
+
+os.environ.setdefault('QWEN_API_KEY', 'bench-key')
+
+from benchmarks.stub_upstream import DAILY_ITINERARY
+from services.token_accounting import TokenAccounting
+from services.token_scheduler import estimate_tokens
+
+DESTINATIONS = ["杭州", "成都", "西安", "厦门"]
+PREFERENCES = [
+    {"travel_style": "文化探索", "interests": ["历史", "博物馆"], "budget_level": "舒适型", "group_size": 2},
+    {"travel_style": "美食之旅", "interests": ["小吃", "夜市"], "budget_level": "经济型", "group_size": 4},
+    {"travel_style": "休闲度假", "interests": ["自然风光"], "budget_level": "豪华型", "group_size": 1},
+]
+WEATHER = ["晴，22°C，适合户外活动", "小雨，18°C，建议安排室内景点", "多云，20°C"]
+TOTAL_DAYS = 3
+
+def build_corpus(llm_service):
+    """按当前提示词格式构建语料中所有请求的 (调用点, 消息列表)"""
+    requests = []
+    for destination in DESTINATIONS:
+        for preferences in PREFERENCES:
+            budget_level = preferences["budget_level"]
+            requests.append(("destination_analysis",
+                             llm_service._build_destination_analysis_messages(destination, preferences)))
+            requests.append(("travel_tips", llm_service._build_travel_tips_messages(destination, preferences)))
+            for day in range(1, TOTAL_DAYS + 1):
+                day_preferences = {**preferences, "weather_info": WEATHER[day - 1]}
+                messages = llm_service._build_daily_itinerary_messages(
+                    destination, day, TOTAL_DAYS, day_preferences, budget_level)
+                requests.append(("daily_itinerary", messages))
+            requests.append(("multi_day_itinerary", llm_service._build_multi_day_itinerary_messages(
+                destination, list(range(1, TOTAL_DAYS + 1)), TOTAL_DAYS, preferences, budget_level,
+                {day: WEATHER[day - 1] for day in range(1, TOTAL_DAYS + 1)})))
+            requests.append(("itinerary_patch", llm_service._build_patch_messages(
+                messages, {"day": TOTAL_DAYS, **DAILY_ITINERARY}, ["dinner", "evening"])))
+    return requests
+
+def common_prefix_tokens(texts):
+    return estimate_tokens(os.path.commonprefix(texts))
+
+def run_benchmark():
+    from services.llm_service import llm_service
+
+    reports, identical, plan_prefix = {}, {}, {}
+    for prompt_format in ("verbose", "compact"):
+        llm_service.prompt_format = prompt_format
+        accounting = TokenAccounting()
+        systems = {}
+        for site, messages in build_corpus(llm_service):
+            accounting.record(site, messages)
+            systems.setdefault(site, set()).add(messages[0]["content"])
+        reports[prompt_format] = accounting.get_report()
+        identical[prompt_format] = {site: len(prompts) == 1 for site, prompts in systems.items()}
+
+        # 同一计划内各天的每日行程请求共享的前缀（系统提示词 + 用户提示词的开头）
+        preferences = PREFERENCES[0]
+        days = [llm_service._build_daily_itinerary_messages(
+            DESTINATIONS[0], day, TOTAL_DAYS, {**preferences, "weather_info": WEATHER[day - 1]},
+            preferences["budget_level"]) for day in range(1, TOTAL_DAYS + 1)]
+        plan_prefix[prompt_format] = common_prefix_tokens(
+            ["\n".join(message["content"] for message in messages) for messages in days])
+
+    print(f"=== 提示词token基准测试（{len(DESTINATIONS)} 个目的地 × {len(PREFERENCES)} 组偏好 × {TOTAL_DAYS} 天）===")
+    print(f"{'调用点':<22}{'verbose':>9}{'compact':>9}{'节省':>8}{'固定前缀':>9}{'前缀占比':>9}{'前缀一致':>9}")
+    total = {"verbose": 0, "compact": 0}
+    for site, compact in reports["compact"].items():
+        verbose = reports["verbose"][site]
+        before, after = verbose["avg_prompt_tokens"], compact["avg_prompt_tokens"]
+        total["verbose"] += before * verbose["calls"]
+        total["compact"] += after * compact["calls"]
+        print(f"{site:<22}{before:>9.0f}{after:>9.0f}{(before - after) / before:>8.1%}"
+              f"{compact['avg_prefix_tokens']:>9.0f}{compact['prefix_share']:>9.1%}"
+              f"{'是' if identical['compact'][site] else '否':>9}")
+    print(f"\n语料总输入token: verbose {total['verbose']:.0f}, compact {total['compact']:.0f}, "
+          f"节省 {(total['verbose'] - total['compact']) / total['verbose']:.1%}")
+    print(f"同一计划各天每日行程请求的共同前缀: verbose {plan_prefix['verbose']} token, "
+          f"compact {plan_prefix['compact']} token")
+
+if __name__ == "__main__":
+    run_benchmark()
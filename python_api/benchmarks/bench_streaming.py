@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""基准测试：流式生成 + 流水线地点查询 vs 完整生成后再查询
+
+LLM 由本地桩服务模拟：首个分块前等待 --ttft 秒，之后每个分块间隔
+--token-interval 秒（非流式请求等待全部分块的时间后一次性返回）。
+高德POI搜索同样由桩服务模拟，延迟为 --poi-latency 秒。
+
+统计每天的首个活动就绪耗时（time-to-first-activity）和单日总耗时。
+
+用法: python benchmarks/bench_streaming.py [--days 3] [--ttft 0.3] [--token-interval 0.01]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import statistics
+import sys
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+sys.path.append(str(Path(__file__).parent.parent))
+
+from benchmarks.stub_upstream import StubUpstream
+
+async def run_benchmark(days: int, ttft: float, token_interval: float, poi_latency: float, rounds: int):
+    def latency(path: str) -> float:
+        if path.endswith('/chat/completions'):
+            return ttft
+        if path.endswith('/place/text'):
+            return poi_latency
+        return 0.0
+
+    stub = StubUpstream(latency=latency, token_interval=token_interval)
+    await stub.start()
+
+    # 服务在导入时读取环境变量，因此需要先指向桩服务
+    os.environ.update({
+        'QWEN_API_KEY': 'bench-key',
+        'QWEN_BASE_URL': f"{stub.base_url}/v1",
+        'AMAP_API_KEY': 'bench-key',
+        'AMAP_BASE_URL': f"{stub.base_url}/v3",
+        'AMAP_STORE_ENABLED': 'false',
+        'LLM_CACHE_ENABLED': 'false',
+        'DESTINATION_KNOWLEDGE_ENABLED': 'false',
+    })
+    os.environ.pop('OPENWEATHER_API_KEY', None)
+
+    import agents.travel_planner_agent as planner_module
+    from agents.travel_planner_agent import TravelPlannerAgent
+    from agents.models import TravelRequest
+    from services.map_service import map_service
+
+    # 只测量流水线重叠效果，去掉地图服务自身的请求间隔和缓存
+    map_service.rate_limiter.set_rate(0)
+    map_service.cache.ttls = {group: 0.0 for group in map_service.cache.ttls}
+
+    request = TravelRequest(
+        destination="杭州",
+        start_date=date.today(),
+        end_date=date.today() + timedelta(days=days - 1),
+        budget_level="舒适型",
+        travel_style="文化探索"
+    )
+    agent = TravelPlannerAgent(day_concurrency=days)
+
+    print(f"=== 流式生成基准测试 ({days} 天, TTFT {ttft:.2f}s, 分块间隔 {token_interval * 1000:.0f}ms, "
+          f"POI延迟 {poi_latency:.2f}s, {rounds} 轮) ===")
+    print(f"{'模式':<12}{'首个活动p50(s)':>16}{'单日p50(s)':>14}{'计划耗时(s)':>14}{'活动数':>8}")
+
+    results = {}
+    for mode, streaming in (("buffered", False), ("streaming", True)):
+        planner_module.ITINERARY_STREAMING = streaming
+        first, total, wall = [], [], []
+        activities = 0
+        for _ in range(rounds):
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = await agent.generate_travel_plan(request)
+            wall.append(time.perf_counter() - start)
+            plan = result["plan"]
+            activities = sum(len(item.activities) for item in plan.itinerary)
+            for timing in plan.metadata["stage_timings"]["plan_itinerary"].values():
+                first.append(timing["first_activity"])
+                total.append(timing["seconds"])
+        results[mode] = (statistics.median(first), statistics.median(total), statistics.median(wall))
+        print(f"{mode:<12}{results[mode][0]:>16.2f}{results[mode][1]:>14.2f}{results[mode][2]:>14.2f}{activities:>8}")
+
+    buffered, streaming = results["buffered"], results["streaming"]
+    print(f"首个活动提前 {buffered[0] - streaming[0]:.2f}s，单日耗时减少 {buffered[1] - streaming[1]:.2f}s")
+    await stub.stop()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="流式生成基准测试")
+    parser.add_argument("--days", type=int, default=3)
+    parser.add_argument("--ttft", type=float, default=0.3, help="首个分块前的延迟（秒）")
+    parser.add_argument("--token-interval", type=float, default=0.01, help="分块间隔（秒）")
+    parser.add_argument("--poi-latency", type=float, default=0.15, help="POI搜索延迟（秒）")
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+    asyncio.run(run_benchmark(args.days, args.ttft, args.token_interval, args.poi_latency, args.rounds))
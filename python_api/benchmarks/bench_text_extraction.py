@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""基准测试：LLM文本提取（预编译单遍扫描 vs 改造前的逐模式正则）
+
+使用 benchmarks/corpus/llm_itinerary_outputs.json 中记录的模型输出，
+分别统计单次解析耗时和提取出的非空字段数。改造前的实现原样保留在本文件中作为对照，
+运行前清空 re 模块的编译缓存，模拟服务运行中缓存被其他正则挤出的情况。
+
+用法: python benchmarks/bench_text_extraction.py [--rounds 2000]
+"""
+
+import argparse
+import json
+import re
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict
+
+# 添加项目根目录到Python路径
+sys.path.append(str(Path(__file__).parent.parent))
+
+from services.text_extraction import clean_markdown, extract_itinerary
+
+CORPUS_PATH = Path(__file__).parent / "corpus" / "llm_itinerary_outputs.json"
+PERIODS = ('breakfast', 'morning', 'lunch', 'afternoon', 'dinner', 'evening')
+
+def legacy_fallback_parse(content: str, day: int) -> Dict[str, Any]:
+    """改造前的备用解析（逐个模式、每次调用重新查找正则）"""
+
+    itinerary = {'day': day, 'transportation': '公共交通/步行', 'estimated_cost': '200-500元'}
+    for period in ('breakfast', 'morning', 'lunch', 'afternoon', 'dinner', 'evening'):
+        itinerary[period] = {'name': '', 'activity': '', 'location': '', 'address': '', 'cost': 0}
+
+    # 按时间段分割内容
+    sections = {
+        'morning': [],
+        'afternoon': [],
+        'evening': []
+    }
+
+    lines = content.split('\n')
+    current_section = None
+
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+
+        # 识别时间段
+        if re.search(r'(上午|早上|morning)', line, re.IGNORECASE):
+            current_section = 'morning'
+            # 同时将这一行的内容也加入到对应时间段
+            sections[current_section].append(line)
+            continue
+        elif re.search(r'(中午|午餐|lunch)', line, re.IGNORECASE):
+            current_section = 'afternoon'  # 中午的内容归到下午
+            sections[current_section].append(line)
+            continue
+        elif re.search(r'(下午|afternoon)', line, re.IGNORECASE):
+            current_section = 'afternoon'
+            sections[current_section].append(line)
+            continue
+        elif re.search(r'(晚上|傍晚|晚餐|evening)', line, re.IGNORECASE):
+            current_section = 'evening'
+            sections[current_section].append(line)
+            continue
+
+        if current_section and line:
+            sections[current_section].append(line)
+
+    # 解析每个时间段的内容
+    for section_name, section_lines in sections.items():
+        if not section_lines:
+            continue
+
+        # 对于每个时间段，只处理第一行（最相关的内容）
+        line = section_lines[0] if section_lines else ''
+        if not line:
+            continue
+
+        # 提取活动和位置信息
+        activity_text = ''
+        location_text = ''
+
+        # 尝试提取具体的景点名称、餐厅名称等
+        # 匹配常见的景点、餐厅、地址模式
+        location_patterns = [
+            r'([\u4e00-\u9fa5]+(?:博物馆|公园|寺|庙|塔|楼|山|湖|河|街|路|广场|中心|景区|风景区))',
+            r'([\u4e00-\u9fa5]+(?:餐厅|酒店|饭店|茶楼|咖啡厅|小吃店|美食城))',
+            r'([\u4e00-\u9fa5]+(?:大学|学院|图书馆|剧院|影院|商场|市场))',
+            r'地址[：:](.*?)(?:[，,。]|$)',
+            r'位置[：:](.*?)(?:[，,。]|$)',
+            r'在(.*?)(?:[，,。]|$)'
+        ]
+
+        # 提取位置信息
+        for pattern in location_patterns:
+            matches = re.findall(pattern, line)
+            if matches:
+                location_candidate = matches[0].strip()
+                if location_candidate and len(location_candidate) > 1:
+                    location_text = location_candidate
+                    break
+
+        # 提取活动描述（移除时间段标识后的内容）
+        # 清理时间段标识
+        clean_line = re.sub(r'^(上午|下午|中午|晚上|早上|傍晚)[：:]?\s*', '', line)
+        # 清理时间、价格等信息，保留主要活动描述
+        clean_line = re.sub(r'\d+[：:]\d+', '', clean_line)  # 移除时间
+        clean_line = re.sub(r'\d+元', '', clean_line)  # 移除价格
+        clean_line = re.sub(r'[（(].*?[）)]', '', clean_line)  # 移除括号内容
+        clean_line = clean_line.strip('，,。. ')
+        if clean_line:
+            activity_text = clean_line
+
+        # 设置解析结果
+        if activity_text:
+            itinerary[section_name]['activity'] = activity_text
+        if location_text:
+            itinerary[section_name]['location'] = location_text
+
+        # 如果没有找到具体位置，根据活动类型设置默认位置
+        if not itinerary[section_name]['location'] and itinerary[section_name]['activity']:
+            activity = itinerary[section_name]['activity']
+            if '餐' in activity or '吃' in activity or '美食' in activity:
+                itinerary[section_name]['location'] = "当地特色餐厅"
+            elif '博物馆' in activity:
+                itinerary[section_name]['location'] = "博物馆"
+            elif '公园' in activity or '漫步' in activity:
+                itinerary[section_name]['location'] = "城市公园"
+            elif '购物' in activity or '商场' in activity:
+                itinerary[section_name]['location'] = "购物中心"
+            else:
+                itinerary[section_name]['location'] = "市区景点"
+
+    return itinerary
+
+
+def legacy_clean_markdown(text: str) -> str:
+    """改造前的Markdown清理（每次调用依次执行 6 个 re.sub）"""
+    text = re.sub(r'\*\*(.*?)\*\*', r'\1', text)
+    text = re.sub(r'\*(.*?)\*', r'\1', text)
+    text = re.sub(r'^[\s]*[-\*]\s+', '', text, flags=re.MULTILINE)
+    text = re.sub(r'^[\s]*#+\s+', '', text, flags=re.MULTILINE)
+    text = re.sub(r'^[\s]*\d+\.\s+', '', text, flags=re.MULTILINE)
+    return re.sub(r'\s+', ' ', text).strip()
+
+def count_fields(itinerary: Dict[str, Any]) -> int:
+    """统计提取出的非空字段数"""
+    return sum(1 for period in PERIODS for value in (itinerary.get(period) or {}).values() if value)
+
+def measure(parse: Callable[[str], Any], texts, rounds: int, purge: bool) -> float:
+    """返回每段文本的平均解析耗时（微秒）"""
+    start = time.perf_counter()
+    for _ in range(rounds):
+        if purge:
+            re.purge()
+        for text in texts:
+            parse(text)
+    return (time.perf_counter() - start) / (rounds * len(texts)) * 1e6
+
+def main(rounds: int):
+    corpus = json.loads(CORPUS_PATH.read_text(encoding='utf-8'))
+    texts = [case['content'] for case in corpus]
+    tips = [line for text in texts for line in text.splitlines() if line.strip()]
+
+    print(f"=== 文本提取基准测试 ({len(texts)} 段记录输出, {rounds} 轮) ===")
+    legacy_fields = sum(count_fields(legacy_fallback_parse(text, 1)) for text in texts)
+    new_fields = sum(count_fields(extract_itinerary(text, 1)) for text in texts)
+    print(f"{'实现':<12}{'冷缓存(us/段)':>14}{'热缓存(us/段)':>14}{'提取字段数':>10}")
+    for label, parse, fields in (
+        ("legacy", lambda text: legacy_fallback_parse(text, 1), legacy_fields),
+        ("extraction", lambda text: extract_itinerary(text, 1), new_fields),
+    ):
+        cold = measure(parse, texts, rounds, purge=True)
+        warm = measure(parse, texts, rounds, purge=False)
+        print(f"{label:<12}{cold:>14.1f}{warm:>14.1f}{fields:>10}")
+
+    print(f"\n{'Markdown清理':<12}{'冷缓存(us/行)':>14}{'热缓存(us/行)':>14}")
+    for label, clean in (("legacy", legacy_clean_markdown), ("extraction", clean_markdown)):
+        cold = measure(clean, tips, rounds // 10 or 1, purge=True)
+        warm = measure(clean, tips, rounds // 10 or 1, purge=False)
+        print(f"{label:<12}{cold:>14.2f}{warm:>14.2f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="文本提取基准测试")
+    parser.add_argument("--rounds", type=int, default=2000, help="重复解析整个语料的轮数")
+    args = parser.parse_args()
+    main(args.rounds)
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""本地上游桩服务（用于离线基准测试）
+
+用 asyncio 实现的极简 HTTP/1.1 服务，支持 keep-alive，统计建立的连接数，
+并模拟通义千问（OpenAI兼容）、Anthropic、高德地图和 OpenWeatherMap 的接口响应。
+"""
+
+import asyncio
+import json
+import re
+import time
+from typing import Callable, Dict, Any, Optional, Tuple
+from urllib.parse import urlsplit, parse_qs
+
+DAILY_ITINERARY = {
+    "breakfast": {"name": "知味观", "activity": "在知味观用餐", "location": "知味观", "address": "仁和路83号",
+                  "duration": "1小时", "cost": 50, "description": "百年老店", "specialties": "小笼包",
+                  "features": "杭帮点心", "tips": "早去排队少", "openTime": "07:00-21:00", "ticketPrice": "免费"},
+    "morning": {"name": "西湖", "activity": "游览西湖", "location": "西湖", "address": "龙井路1号",
+                "duration": "3小时", "cost": 0, "description": "世界文化遗产", "features": "苏堤春晓",
+                "tips": "建议骑行", "openTime": "全天", "ticketPrice": "免费"},
+    "lunch": {"name": "楼外楼", "activity": "在楼外楼用餐", "location": "楼外楼", "address": "孤山路30号",
+              "duration": "1.5小时", "cost": 120, "description": "西湖边名店", "specialties": "西湖醋鱼",
+              "features": "湖景", "tips": "提前订位", "openTime": "10:30-20:30", "ticketPrice": "免费"},
+    "afternoon": {"name": "灵隐寺", "activity": "游览灵隐寺", "location": "灵隐寺", "address": "法云弄1号",
+                  "duration": "3.5小时", "cost": 75, "description": "千年古刹", "features": "飞来峰石刻",
+                  "tips": "穿舒适鞋", "openTime": "07:00-18:00", "ticketPrice": "飞来峰45元+香花券30元"},
+    "dinner": {"name": "外婆家", "activity": "在外婆家用餐", "location": "外婆家", "address": "湖滨路3号",
+               "duration": "1.5小时", "cost": 80, "description": "平价杭帮菜", "specialties": "茶香鸡",
+               "features": "性价比高", "tips": "需排号", "openTime": "10:30-21:00", "ticketPrice": "免费"},
+    "evening": {"name": "河坊街", "activity": "逛河坊街", "location": "河坊街", "address": "上城区河坊街",
+                "duration": "2小时", "cost": 60, "description": "历史街区", "features": "夜景小吃",
+                "tips": "注意人流", "openTime": "全天", "ticketPrice": "免费"},
+    "transportation": "地铁/公交",
+    "estimated_cost": "400元"
+}
+
+TRAVEL_TIPS = "1. 提前预约热门景点\n2. 随身携带雨具\n3. 尊重当地习俗\n4. 错峰出行\n5. 尝试地铁出行"
+
+# 流式响应每个分块的字符数（约等于若干个token）
+STREAM_CHUNK_CHARS = 8
+
+class SSEStream:
+    """流式（SSE）响应体：桩服务逐块发送，块间间隔 token_interval 秒"""
+
+    def __init__(self, content: str, model: str = 'stub'):
+        self.chunks = [content[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(content), STREAM_CHUNK_CHARS)]
+        self.model = model
+
+    def events(self):
+        for chunk in self.chunks:
+            yield {'id': 'stub-completion', 'object': 'chat.completion.chunk', 'model': self.model,
+                   'choices': [{'index': 0, 'delta': {'content': chunk}, 'finish_reason': None}]}
+
+class AnthropicSSEStream(SSEStream):
+    """Anthropic Messages 接口的流式事件"""
+
+    def events(self):
+        for chunk in self.chunks:
+            yield {'type': 'content_block_delta', 'index': 0, 'delta': {'type': 'text_delta', 'text': chunk}}
+        yield {'type': 'message_stop'}
+
+def _completion_content(payload: Dict[str, Any]) -> str:
+    """根据系统提示词选择返回内容"""
+    messages = payload.get('messages', [])
+    system = messages[0].get('content', '') if messages else ''
+    user = messages[-1].get('content', '') if messages else ''
+    multi_day = re.search(r'第(\d+)天至第(\d+)天', user)
+    if '"days"' in system and multi_day:
+        first, last = int(multi_day.group(1)), int(multi_day.group(2))
+        content = json.dumps({'days': [{'day': day, **DAILY_ITINERARY} for day in range(first, last + 1)]},
+                             ensure_ascii=False)
+    elif 'breakfast' in system:
+        content = json.dumps(DAILY_ITINERARY, ensure_ascii=False)
+    elif '贴士' in system or '贴士' in user:
+        content = TRAVEL_TIPS
+    else:
+        content = "目的地概况：历史文化名城，山水秀丽，适合全年旅行。"
+    return content
+
+def _chat_completion(payload: Dict[str, Any]) -> Any:
+    """模拟 chat/completions，stream=true 时返回 SSEStream"""
+    content = _completion_content(payload)
+    if payload.get('stream'):
+        return SSEStream(content, payload.get('model', 'stub'))
+    return {
+        'id': 'stub-completion',
+        'object': 'chat.completion',
+        'model': payload.get('model', 'stub'),
+        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+        'usage': {'prompt_tokens': 600, 'completion_tokens': 900, 'total_tokens': 1500}
+    }
+
+def _anthropic_message(payload: Dict[str, Any]) -> Any:
+    """模拟 Anthropic messages 接口（系统提示词为独立的 system 字段）"""
+    content = _completion_content({
+        'messages': [{'role': 'system', 'content': payload.get('system', '')}, *payload.get('messages', [])]
+    })
+    if payload.get('stream'):
+        return AnthropicSSEStream(content, payload.get('model', 'stub'))
+    return {
+        'id': 'stub-message',
+        'type': 'message',
+        'model': payload.get('model', 'stub'),
+        'content': [{'type': 'text', 'text': content}],
+        'stop_reason': 'end_turn',
+        'usage': {'input_tokens': 600, 'output_tokens': 900}
+    }
+
+def _route(method: str, path: str, query: Dict[str, str], body: bytes) -> Tuple[int, Any]:
+    """模拟上游接口"""
+    if path.endswith('/chat/completions'):
+        return 200, _chat_completion(json.loads(body or b'{}'))
+    if path.endswith('/messages'):
+        return 200, _anthropic_message(json.loads(body or b'{}'))
+    if path.endswith('/geocode/geo'):
+        return 200, {'status': '1', 'info': 'OK', 'geocodes': [{
+            'formatted_address': query.get('address', ''), 'location': '120.155070,30.274084',
+            'level': '市', 'province': '浙江省', 'city': '杭州市', 'district': ''}]}
+    if path.endswith('/geocode/regeo'):
+        return 200, {'status': '1', 'info': 'OK', 'regeocode': {
+            'formatted_address': '浙江省杭州市上城区', 'addressComponent': {'province': '浙江省', 'city': '杭州市'}}}
+    if path.endswith('/place/text'):
+        keyword = query.get('keywords', '')
+        return 200, {'status': '1', 'info': 'OK', 'pois': [
+            {'name': f'{keyword}{i}', 'address': f'示例路{i}号', 'location': f'120.{150 + i},30.{270 + i}',
+             'type': '风景名胜', 'typecode': '110000'} for i in range(10)]}
+    if path.endswith('/geo/1.0/direct'):
+        return 200, [{'name': query.get('q', ''), 'lat': 30.27, 'lon': 120.15, 'local_names': {}}]
+    if path.endswith('/weather'):
+        return 200, {'main': {'temp': 22.4, 'feels_like': 23.1, 'humidity': 60, 'pressure': 1012},
+                     'weather': [{'description': '多云', 'icon': '02d'}], 'wind': {'speed': 3.2}, 'visibility': 10000}
+    if path.endswith('/forecast'):
+        now = int(time.time())
+        return 200, {'list': [{'dt': now + i * 10800, 'main': {'temp': 20 + i % 5, 'humidity': 55},
+                               'weather': [{'description': '晴'}], 'wind': {'speed': 2.0}} for i in range(40)]}
+    return 404, {'error': 'not found'}
+
+class StubUpstream:
+    """本地桩服务
+
+    Args:
+        latency: 根据请求路径返回模拟处理延迟（秒）的函数
+        connect_delay: 每个新连接首个请求前的额外延迟，模拟TLS握手开销
+        token_interval: 模拟LLM逐块生成的间隔（秒）；流式响应在块之间等待，
+            非流式响应在返回前等待全部块的生成时间
+        handler: 自定义路由函数，签名同 _route，可额外返回响应头字典
+    """
+
+    def __init__(self, latency: Optional[Callable[[str], float]] = None, connect_delay: float = 0.0,
+                 handler: Optional[Callable[[str, str, Dict[str, str], bytes], Tuple[int, Any]]] = None,
+                 token_interval: float = 0.0):
+        self.latency = latency or (lambda path: 0.0)
+        self.connect_delay = connect_delay
+        self.token_interval = token_interval
+        self.handler = handler or _route
+        self.connections = 0
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._writers = set()
+        self.port: Optional[int] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, '127.0.0.1', 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            for writer in list(self._writers):
+                writer.close()
+            await self._server.wait_closed()
+
+    def reset_counters(self):
+        self.connections = 0
+        self.requests = 0
+        self.max_in_flight = 0
+
+    async def _write_stream(self, writer: asyncio.StreamWriter, stream: SSEStream):
+        """以分块传输编码发送SSE事件"""
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+                     b"Transfer-Encoding: chunked\r\nConnection: keep-alive\r\n\r\n")
+        events = [f"data: {json.dumps(event, ensure_ascii=False)}\n\n" for event in stream.events()]
+        events.append("data: [DONE]\n\n")
+        for i, event in enumerate(events):
+            if i and self.token_interval:
+                await asyncio.sleep(self.token_interval)
+            data = event.encode('utf-8')
+            writer.write(f"{len(data):x}\r\n".encode('latin-1') + data + b"\r\n")
+            await writer.drain()
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        self._writers.add(writer)
+        first_request = True
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    key, _, value = line.decode('latin-1').partition(':')
+                    headers[key.strip().lower()] = value.strip()
+                body = b''
+                if int(headers.get('content-length', 0)) > 0:
+                    body = await reader.readexactly(int(headers['content-length']))
+
+                self.requests += 1
+                self.in_flight += 1
+                self.max_in_flight = max(self.max_in_flight, self.in_flight)
+                try:
+                    if first_request and self.connect_delay:
+                        await asyncio.sleep(self.connect_delay)
+                    first_request = False
+                    parts = urlsplit(target)
+                    query = {k: v[0] for k, v in parse_qs(parts.query).items()}
+                    delay = self.latency(parts.path)
+                    if delay:
+                        await asyncio.sleep(delay)
+                    result = self.handler(method, parts.path, query, body)
+                    status, payload = result[0], result[1]
+                    response_headers = result[2] if len(result) > 2 else {}
+                    if isinstance(payload, SSEStream):
+                        await self._write_stream(writer, payload)
+                        continue
+                    if self.token_interval and status < 400 and parts.path.endswith('/chat/completions'):
+                        content = payload['choices'][0]['message']['content']
+                        await asyncio.sleep(self.token_interval * len(SSEStream(content).chunks))
+                finally:
+                    self.in_flight -= 1
+
+                data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                extra_headers = ''.join(f"{k}: {v}\r\n" for k, v in response_headers.items())
+                writer.write(
+                    f"HTTP/1.1 {status} {'OK' if status < 400 else 'ERROR'}\r\n"
+                    f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n"
+                    f"{extra_headers}Connection: keep-alive\r\n\r\n".encode('latin-1') + data
+                )
+                await writer.drain()
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionResetError, asyncio.IncompleteReadError, ValueError, asyncio.CancelledError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
@@ -7,6 +7,7 @@ FastAPI 主应用文件
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
+from contextlib import asynccontextmanager
 import uvicorn
 import os
 from dotenv import load_dotenv
@@ -15,17 +16,30 @@ from dotenv import load_dotenv
 from routes.auth import router as auth_router
 from routes import plans
 from routes import nemo_plans
+from services.http_client import http_client_pool
+from agents.registry import warm_up_agents
 
 # 加载环境变量
 load_dotenv()
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期：启动时创建共享HTTP连接池并编译工作流，关闭时释放连接"""
+    await http_client_pool.start()
+    warm_up_agents()
+    try:
+        yield
+    finally:
+        await http_client_pool.aclose()
+
 # 创建 FastAPI 应用实例
 app = FastAPI(
     title="Let's Go API",
     description="AI 旅行规划应用后端 API",
     version="1.0.0",
     docs_url="/api/docs",
-    redoc_url="/api/redoc"
+    redoc_url="/api/redoc",
+    lifespan=lifespan
 )
 
 # 配置 CORS
@@ -93,8 +93,8 @@ class NeMoTravelAgent:
                 travel_style=preferences if preferences else "休闲度假"
             )
             
-            from agents.travel_planner_agent import TravelPlannerAgent
-            agent = TravelPlannerAgent()
+            from agents.registry import get_travel_planner_agent
+            agent = get_travel_planner_agent()
             result = await agent.generate_travel_plan(travel_request)
             return result
         except Exception as e:
@@ -159,7 +159,7 @@ async def quick_plan_trip(destination: str, start_date: str, end_date: str,
     """
     try:
         from agents.models import TravelRequest
-        from agents.travel_planner_agent import TravelPlannerAgent
+        from agents.registry import get_travel_planner_agent
         from datetime import datetime
         import logging
         
@@ -197,8 +197,8 @@ async def quick_plan_trip(destination: str, start_date: str, end_date: str,
             interests=["文化探索"]
         )
         
-        agent = TravelPlannerAgent()
-        result = await agent.generate_travel_plan(request)
+        agent = get_travel_planner_agent()
+        result = await agent.generate_travel_plan(request, route="quick")
         
         # 检查结果是否成功
         if not result.get("success"):
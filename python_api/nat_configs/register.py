@@ -9,7 +9,7 @@ from datetime import datetime
 # Add parent directory to path to import existing modules
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from agents.travel_planner_agent import TravelPlannerAgent
+from agents.registry import get_travel_planner_agent
 from services.weather_service import WeatherService
 
 
@@ -17,7 +17,7 @@ class TravelPlannerTool:
     """Travel Planner Tool for NeMo Agent Toolkit"""
     
     def __init__(self):
-        self.agent = TravelPlannerAgent()
+        self.agent = get_travel_planner_agent()
         self.weather_service = WeatherService()
     
     async def travel_planner(self, destination: str, start_date: str, end_date: str, 
@@ -7,7 +7,7 @@ import asyncio
 from datetime import datetime
 import uuid
 
-from agents import TravelPlannerAgent
+from agents import TravelPlannerAgent, get_travel_planner_agent
 from agents.models import (
     TravelRequest, 
     TravelPlan, 
@@ -15,6 +15,12 @@ from agents.models import (
     TravelStyle,
     BudgetLevel
 )
+from services.llm_service import llm_service
+from services.destination_knowledge import destination_knowledge
+from services.resilience import upstream_guards
+from services.hedging import hedge_policies
+from services.singleflight import flight_groups
+from services.map_service import map_service
 
 router = APIRouter(prefix="/api/plans", tags=["旅行规划"])
 
@@ -49,8 +55,8 @@ async def create_travel_plan(request: TravelRequest):
         if request.group_size <= 0:
             raise HTTPException(status_code=400, detail="参与人数必须大于0")
         
-        # 创建智能体实例
-        agent = TravelPlannerAgent()
+        # 获取共享的智能体实例（工作流只在启动时编译一次）
+        agent = get_travel_planner_agent()
         
         # 记录任务状态
         active_plans[plan_id] = {
@@ -108,8 +114,8 @@ async def generate_plan(plan_id: str):
         request_data = plan_info["request"]
         request = TravelRequest(**request_data)
         
-        # 创建智能体实例
-        agent = TravelPlannerAgent()
+        # 获取共享的智能体实例（工作流只在启动时编译一次）
+        agent = get_travel_planner_agent()
         
         # 重置计划状态为处理中
         active_plans[plan_id]["status"] = "processing"
@@ -191,8 +197,8 @@ async def optimize_plan(plan_id: str, optimization_request: Dict[str, Any]):
         # 获取原始计划
         original_plan = plan_results[plan_id]
         
-        # 创建智能体实例
-        agent = TravelPlannerAgent()
+        # 获取共享的智能体实例（工作流只在启动时编译一次）
+        agent = get_travel_planner_agent()
         
         # 执行优化（这里可以根据optimization_request的内容进行不同的优化）
         optimization_type = optimization_request.get("type", "budget")
@@ -205,7 +211,7 @@ async def optimize_plan(plan_id: str, optimization_request: Dict[str, Any]):
                 original_request = TravelRequest(**active_plans[plan_id]["request"])
                 original_request.budget_level = new_budget
                 
-                optimized_plan = await agent.generate_travel_plan(original_request)
+                optimized_plan = await agent.generate_travel_plan(original_request, route="quick")
                 plan_results[plan_id] = optimized_plan
                 
                 return {
@@ -220,7 +226,7 @@ async def optimize_plan(plan_id: str, optimization_request: Dict[str, Any]):
                 original_request = TravelRequest(**active_plans[plan_id]["request"])
                 original_request.travel_style = new_styles[0] if new_styles else original_request.travel_style
                 
-                optimized_plan = await agent.generate_travel_plan(original_request)
+                optimized_plan = await agent.generate_travel_plan(original_request, route="quick")
                 plan_results[plan_id] = optimized_plan
                 
                 return {
@@ -498,7 +504,7 @@ async def generate_plan_async(plan_id: str, request: TravelRequest, agent: Trave
         active_plans[plan_id]["message"] = "开始分析旅行需求..."
         
         # 生成旅行计划
-        result = await agent.generate_travel_plan(request)
+        result = await agent.generate_travel_plan(request, route="full")
         
         # 检查生成结果
         if result.get("success") and result.get("plan"):
@@ -530,5 +536,17 @@ async def health_check():
         "service": "travel_planner",
         "timestamp": datetime.now().isoformat(),
         "active_plans": len(active_plans),
-        "completed_plans": len(plan_results)
+        "completed_plans": len(plan_results),
+        "llm_cache": llm_service.cache.get_stats(),
+        "llm_router": llm_service.router.get_stats(),
+        "model_tiers": llm_service.tiering.get_stats(),
+        "itinerary_parsing": llm_service.get_parse_stats(),
+        "prompt_tokens": llm_service.accounting.get_report(),
+        "destination_knowledge": destination_knowledge.get_stats(),
+        "upstreams": upstream_guards.get_stats(),
+        "hedging": hedge_policies.get_stats(),
+        "singleflight": flight_groups.get_stats(),
+        "map_cache": map_service.cache.get_stats(),
+        "map_store": map_service.store.get_stats(),
+        "map_rate_limit": map_service.rate_limiter.get_stats()
     }
\ No newline at end of file
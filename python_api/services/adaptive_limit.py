@@ -0,0 +1,90 @@
+"""上游在途请求上限的 AIMD 自适应调整
+
+固定的舱壁上限要么在上游繁忙时过高（持续触发限流、超时），要么在上游空闲时过低。
+AIMDController 按加法增大、乘法减小（AIMD）调整单个上游允许的在途请求数：
+
+- 成功且延迟正常：上限每轮增加 1（每次成功增加 1/上限，约一个上限数量的请求后增加 1）；
+- 限流（429/503、业务限流码）或超时：上限乘以 decrease_factor（默认减半）；
+- 延迟超过基线的 latency_tolerance 倍：视为排队拥塞，同样乘法减小（tolerance 为 0 时不按延迟调整，
+  用于输出长度差异大、延迟不能反映拥塞的大模型调用）。
+
+同一轮只减小一次：在上一次减小之前发出的请求再报告拥塞时忽略，避免一批并发请求同时失败时
+把上限连续减到最小。上限在 [min_limit, max_limit] 之间，拥塞消失后自动恢复到 max_limit。
+"""
+
+import time
+import logging
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# 开始按延迟判断拥塞前需要的样本数
+_BASELINE_MIN_SAMPLES = 5
+# 延迟基线向较慢样本漂移的速度，上游整体变慢后基线随之上调
+_BASELINE_DRIFT = 0.01
+
+class AIMDController:
+    """单个上游的 AIMD 在途上限"""
+
+    def __init__(self, name: str, max_limit: int, min_limit: int = 1, decrease_factor: float = 0.5,
+                 latency_tolerance: float = 0.0):
+        self.name = name
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+        self._limit = float(self.max_limit)
+        self._last_decrease = 0.0
+        self._baseline: Optional[float] = None
+        self._samples = 0
+        self.stats = {'increases': 0, 'decreases': 0, 'throttle_decreases': 0, 'latency_decreases': 0}
+
+    @property
+    def limit(self) -> int:
+        """当前允许的在途请求数"""
+        return max(self.min_limit, int(self._limit))
+
+    def _observe_latency(self, latency: float) -> bool:
+        """更新延迟基线，返回本次延迟是否超出容忍范围"""
+        self._samples += 1
+        if self._baseline is None or latency < self._baseline:
+            self._baseline = latency
+            return False
+        self._baseline += _BASELINE_DRIFT * (latency - self._baseline)
+        return (self.latency_tolerance > 0 and self._samples > _BASELINE_MIN_SAMPLES
+                and latency > self.latency_tolerance * self._baseline)
+
+    def on_success(self, started: float, latency: float):
+        """请求成功：延迟正常时加法增大，延迟过高时乘法减小"""
+        if self._observe_latency(latency):
+            self._decrease(started, 'latency')
+            return
+        if self._limit < self.max_limit:
+            previous = self.limit
+            self._limit = min(float(self.max_limit), self._limit + 1.0 / self._limit)
+            if self.limit > previous:
+                self.stats['increases'] += 1
+
+    def on_overload(self, started: float):
+        """请求被限流或超时：乘法减小"""
+        self._decrease(started, 'throttle')
+
+    def _decrease(self, started: float, reason: str):
+        if started < self._last_decrease:
+            return  # 上一次减小之前发出的请求，已经按这一轮拥塞调整过
+        previous = self.limit
+        self._limit = max(float(self.min_limit), self._limit * self.decrease_factor)
+        self._last_decrease = time.monotonic()
+        self.stats['decreases'] += 1
+        self.stats[f'{reason}_decreases'] += 1
+        if self.limit < previous:
+            logger.info(f"{self.name} 在途上限 {previous} -> {self.limit}（{'限流' if reason == 'throttle' else '延迟升高'}）")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'limit': self.limit,
+            'min_limit': self.min_limit,
+            'max_limit': self.max_limit,
+            'baseline_latency': round(self._baseline, 4) if self._baseline is not None else None,
+            **self.stats
+        }
@@ -0,0 +1,131 @@
+"""计划生成的截止时间（deadline）
+
+每次生成计划时按路由（quick / full）设定总时间预算，通过 contextvars 传递给
+工作流中的各个节点以及它们发起的 LLM、地图、天气请求：每次请求的超时取剩余预算与
+默认超时中的较小值，剩余预算不足时不再发起请求或等待重试。
+"""
+
+import os
+import time
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, Optional
+import httpx
+from dotenv import load_dotenv
+
+from services.resilience import UpstreamUnavailableError
+
+# 加载环境变量
+load_dotenv()
+
+# 各路由默认的计划生成总预算（秒），可通过 PLAN_DEADLINE_<ROUTE> 覆盖
+ROUTE_DEADLINE_DEFAULTS: Dict[str, float] = {
+    'full': 300.0,   # 后台生成完整计划
+    'quick': 60.0,   # 同步等待结果的快速规划、计划优化
+}
+# 剩余预算低于该值（秒）时不再发起新的上游请求
+MIN_CALL_BUDGET = float(os.getenv('DEADLINE_MIN_CALL_BUDGET', 1.0))
+
+class DeadlineExceededError(UpstreamUnavailableError):
+    """剩余时间预算不足，调用方应直接使用备用数据"""
+
+class Deadline:
+    """单次计划生成的截止时间"""
+
+    def __init__(self, budget: float, route: str = 'full'):
+        self.route = route
+        self.budget = budget
+        self.started_at = time.monotonic()
+        self.expires_at = self.started_at + budget
+
+    def extend(self, expires_at: float):
+        """把截止时间推迟到 expires_at（monotonic），早于当前截止时间时不变"""
+        if expires_at > self.expires_at:
+            self.expires_at = expires_at
+            self.budget = expires_at - self.started_at
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'route': self.route,
+            'budget': self.budget,
+            'elapsed': round(self.elapsed(), 3),
+            'remaining': round(self.remaining(), 3)
+        }
+
+_current_deadline: ContextVar[Optional[Deadline]] = ContextVar('plan_deadline', default=None)
+
+def get_route_budget(route: str) -> float:
+    """读取路由的总预算，未知路由按完整计划处理"""
+    default = ROUTE_DEADLINE_DEFAULTS.get(route, ROUTE_DEADLINE_DEFAULTS['full'])
+    return float(os.getenv(f'PLAN_DEADLINE_{route.upper()}', default))
+
+@contextmanager
+def deadline_scope(budget: Optional[float], route: str = 'full') -> Iterator[Optional[Deadline]]:
+    """在当前上下文（及其创建的任务）中设置截止时间；budget 为 None 时不限时
+
+    后台任务（如目的地知识刷新）会复制发起计划的上下文，需要用 None 解除限制。
+    """
+    deadline = Deadline(budget, route) if budget is not None else None
+    with use_deadline(deadline):
+        yield deadline
+
+@contextmanager
+def use_deadline(deadline: Optional[Deadline]) -> Iterator[Optional[Deadline]]:
+    """在当前上下文中使用已有的截止时间对象（如多个调用方共享、可推迟的截止时间）"""
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(token)
+
+def current_deadline() -> Optional[Deadline]:
+    return _current_deadline.get()
+
+def remaining_budget() -> Optional[float]:
+    """当前上下文的剩余预算（秒），未设置截止时间时返回 None"""
+    deadline = _current_deadline.get()
+    return deadline.remaining() if deadline else None
+
+def cap_timeout(timeout: float, share: float = 1.0) -> float:
+    """把超时限制在剩余预算的 share 比例以内"""
+    remaining = remaining_budget()
+    return timeout if remaining is None else min(timeout, remaining * share)
+
+def call_timeout(upstream: str, default: float) -> float:
+    """单次上游请求的超时：默认超时与剩余预算取小，预算不足时抛出 DeadlineExceededError"""
+    remaining = remaining_budget()
+    if remaining is None:
+        return default
+    if remaining < MIN_CALL_BUDGET:
+        raise DeadlineExceededError(upstream, f"剩余预算 {remaining:.1f}s 不足，跳过请求")
+    return min(default, remaining)
+
+@asynccontextmanager
+async def bounded_call(upstream: str, default: float) -> AsyncIterator[float]:
+    """包裹一次上游请求并给出超时；因预算缩短的超时触发时转为 DeadlineExceededError
+
+    放在 UpstreamGuard.protect() 之内，预算耗尽不会被记为上游失败而触发熔断。
+    """
+    timeout = call_timeout(upstream, default)
+    try:
+        yield timeout
+    except httpx.TimeoutException as e:
+        if timeout < default:
+            raise DeadlineExceededError(upstream, f"剩余预算 {timeout:.1f}s 内未完成") from e
+        raise
+
+def stop_before_deadline(min_wait: float) -> Callable[[Any], bool]:
+    """tenacity 停止条件：剩余预算不足以等待下一次重试时停止"""
+    def stop(retry_state: Any) -> bool:
+        remaining = remaining_budget()
+        return remaining is not None and remaining < min_wait + MIN_CALL_BUDGET
+    return stop
@@ -0,0 +1,134 @@
+import os
+import re
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple
+from dotenv import load_dotenv
+
+from services.token_scheduler import PRIORITY_BACKGROUND, priority_scope
+
+# 加载环境变量
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+class DestinationKnowledgeStore:
+    """目的地知识库：跨用户共享的目的地分析、贴士、坐标和热门POI
+
+    按 标准化目的地 + (旅行风格, 预算水平) 分桶存储。条目超过新鲜期后仍可
+    直接返回（stale-while-revalidate），同时在后台刷新；超过最大陈旧期的条目
+    视为不存在。
+    """
+
+    def __init__(self):
+        self.enabled = os.getenv('DESTINATION_KNOWLEDGE_ENABLED', 'true').lower() == 'true'
+        self.fresh_ttl = float(os.getenv('DESTINATION_KNOWLEDGE_TTL', 86400))
+        self.max_stale = float(os.getenv('DESTINATION_KNOWLEDGE_MAX_STALE', 7 * 86400))
+        self.max_entries = int(os.getenv('DESTINATION_KNOWLEDGE_MAX_ENTRIES', 1000))
+
+        # 键 -> (更新时间, 知识条目)
+        self._entries: "OrderedDict[Tuple[str, str, str], Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._refreshing: Dict[Tuple[str, str, str], asyncio.Task] = {}
+        self._background_tasks: Set[asyncio.Task] = set()
+
+        self.stats = {
+            'hits': 0,
+            'stale_hits': 0,
+            'misses': 0,
+            'refreshes': 0,
+            'refresh_failures': 0
+        }
+
+    @staticmethod
+    def normalize_destination(destination: str) -> str:
+        """标准化目的地名称：去空白、统一大小写、去掉行政区划后缀"""
+        name = re.sub(r'\s+', '', destination or '').lower()
+        if len(name) > 2:
+            name = re.sub(r'(特别行政区|自治区|自治州|省|市|地区)$', '', name)
+        return name
+
+    def make_key(self, destination: str, travel_style: Optional[str],
+                 budget_level: Optional[str]) -> Tuple[str, str, str]:
+        """生成知识库键"""
+        return (self.normalize_destination(destination), travel_style or '', budget_level or '')
+
+    def get(self, key: Tuple[str, str, str]) -> Optional[Tuple[Dict[str, Any], bool]]:
+        """查询知识条目，返回 (条目, 是否陈旧)"""
+        if not self.enabled:
+            return None
+        item = self._entries.get(key)
+        if item is None:
+            self.stats['misses'] += 1
+            return None
+
+        updated_at, entry = item
+        age = time.time() - updated_at
+        if age >= self.fresh_ttl + self.max_stale:
+            del self._entries[key]
+            self.stats['misses'] += 1
+            return None
+
+        self._entries.move_to_end(key)
+        stale = age >= self.fresh_ttl
+        self.stats['stale_hits' if stale else 'hits'] += 1
+        return entry, stale
+
+    def put(self, key: Tuple[str, str, str], entry: Dict[str, Any]):
+        """写入知识条目"""
+        if not self.enabled:
+            return
+        self._entries[key] = (time.time(), entry)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def refresh_in_background(self, key: Tuple[str, str, str],
+                              loader: Callable[[], Awaitable[Optional[Dict[str, Any]]]]):
+        """后台刷新条目，同一个键同时只有一个刷新任务"""
+        if key in self._refreshing:
+            return
+
+        async def _refresh():
+            try:
+                with priority_scope(PRIORITY_BACKGROUND):  # 后台刷新让位于交互式请求
+                    entry = await loader()
+                if entry:
+                    self.put(key, entry)
+                    self.stats['refreshes'] += 1
+                    logger.info(f"目的地知识已刷新: {key}")
+                else:
+                    self.stats['refresh_failures'] += 1
+            except Exception as e:
+                self.stats['refresh_failures'] += 1
+                logger.warning(f"目的地知识刷新失败: {key}, 错误: {str(e)}")
+            finally:
+                self._refreshing.pop(key, None)
+
+        task = asyncio.create_task(_refresh())
+        self._refreshing[key] = task
+        # 保留任务引用，避免后台任务被垃圾回收
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    async def wait_for_refreshes(self):
+        """等待所有后台刷新完成（用于测试和关闭）"""
+        if self._background_tasks:
+            await asyncio.gather(*list(self._background_tasks), return_exceptions=True)
+
+    def clear(self):
+        """清空知识库"""
+        self._entries.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取知识库统计"""
+        return {
+            **self.stats,
+            'entries': len(self._entries),
+            'refreshing': len(self._refreshing),
+            'enabled': self.enabled
+        }
+
+# 创建全局实例
+destination_knowledge = DestinationKnowledgeStore()
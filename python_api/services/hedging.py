@@ -0,0 +1,171 @@
+"""对冲请求（hedged requests），降低上游长尾延迟
+
+一次调用超过该调用近期延迟的某个分位数（默认 p95）仍未返回时，再发出一份相同的请求，
+先成功返回的结果生效，另一份立即取消。对冲请求消耗预算：每次调用积累 HEDGE_BUDGET
+个令牌、每次对冲消耗 1 个，因此对冲带来的额外上游请求不会超过调用数的 HEDGE_BUDGET 比例。
+
+只对冲非流式请求；流式请求已经开始返回内容后无法替换。
+"""
+
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+from dotenv import load_dotenv
+
+from services.llm_router import LatencyTracker
+
+# 加载环境变量
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+# 各上游的默认 (对冲分位数, 最小对冲延迟秒数)
+HEDGE_DEFAULTS: Dict[str, Tuple[float, float]] = {
+    'llm': (0.95, 2.0),
+    'amap': (0.95, 0.1),
+}
+
+class HedgePolicy:
+    """单个上游的对冲策略：按调用键（调用点/接口）统计延迟，超过分位数后发出对冲请求"""
+
+    def __init__(self, name: str, enabled: bool = False, percentile: float = 0.95, budget: float = 0.1,
+                 min_samples: int = 20, min_delay: float = 0.1, burst: float = 10.0,
+                 window: int = 200, horizon: float = 600.0):
+        self.name = name
+        self.enabled = enabled
+        self.percentile = percentile
+        self.budget = budget  # 对冲请求占调用数的比例上限
+        self.min_samples = min_samples  # 样本数达到后才开始对冲
+        self.min_delay = min_delay  # 对冲等待时间的下限（秒）
+        self.burst = burst  # 预算令牌的积累上限
+        self.window = window
+        self.horizon = horizon
+        self._tokens = 0.0
+        self._trackers: Dict[str, LatencyTracker] = {}
+        self.stats = {'calls': 0, 'hedged': 0, 'hedge_wins': 0, 'budget_denied': 0, 'cancelled': 0}
+
+    def _tracker(self, key: Optional[str]) -> LatencyTracker:
+        key = key or '*'
+        if key not in self._trackers:
+            self._trackers[key] = LatencyTracker(self.window, self.horizon)
+        return self._trackers[key]
+
+    def hedge_delay(self, key: Optional[str] = None) -> Optional[float]:
+        """发出对冲请求前的等待时间，样本不足时返回 None（不对冲）"""
+        tracker = self._tracker(key)
+        if tracker.count < self.min_samples:
+            return None
+        return max(self.min_delay, tracker.percentile(self.percentile) or 0.0)
+
+    def _spend(self) -> bool:
+        if self._tokens < 1 - 1e-9:  # 容忍浮点累加误差
+            return False
+        self._tokens -= 1
+        return True
+
+    async def _timed(self, call: Callable[[], Awaitable[T]], key: Optional[str]) -> T:
+        start = time.monotonic()
+        try:
+            result = await call()
+        except asyncio.CancelledError:
+            # 被取消的请求至少耗时这么久，计入样本避免低估长尾
+            self._tracker(key).record(time.monotonic() - start, True)
+            raise
+        self._tracker(key).record(time.monotonic() - start, True)
+        return result
+
+    async def run(self, call: Callable[[], Awaitable[T]], key: Optional[str] = None,
+                  hedge_call: Optional[Callable[[], Awaitable[T]]] = None) -> T:
+        """执行调用，必要时发出对冲请求
+
+        Args:
+            call: 发起一次请求的函数，每次调用返回新的协程
+            key: 延迟统计的分组（如调用点、接口）
+            hedge_call: 对冲请求使用的函数，默认与 call 相同
+        """
+        if not self.enabled:
+            return await call()
+
+        self.stats['calls'] += 1
+        self._tokens = min(self.burst, self._tokens + self.budget)
+        delay = self.hedge_delay(key)
+        primary = asyncio.ensure_future(self._timed(call, key))
+        hedge = None
+        try:
+            if delay is None:
+                return await primary
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done:
+                return primary.result()
+            if not self._spend():
+                self.stats['budget_denied'] += 1
+                return await primary
+
+            self.stats['hedged'] += 1
+            logger.info(f"{self.name} 请求 {key or ''} 超过 {delay:.2f}s 未返回，发出对冲请求")
+            hedge = asyncio.ensure_future(self._timed(hedge_call or call, key))
+            pending = {primary, hedge}
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.stats['hedge_wins'] += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in (primary, hedge):
+                if task is not None and not task.done():
+                    task.cancel()
+                    self.stats['cancelled'] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        calls = self.stats['calls']
+        return {
+            'enabled': self.enabled,
+            **self.stats,
+            'extra_load': round(self.stats['hedged'] / calls, 4) if calls else 0.0,
+            'delays': {key: round(delay, 3) for key in self._trackers
+                       if (delay := self.hedge_delay(key)) is not None}
+        }
+
+class HedgePolicies:
+    """各上游（llm / amap）的对冲策略注册表
+
+    HEDGE_<NAME>_<参数> 覆盖 HEDGE_<参数> 的全局配置。
+    """
+
+    def __init__(self):
+        self._policies: Dict[str, HedgePolicy] = {}
+
+    @staticmethod
+    def _env(name: str, key: str, default: Any) -> str:
+        return os.getenv(f'HEDGE_{name.upper()}_{key}', os.getenv(f'HEDGE_{key}', str(default)))
+
+    def get(self, name: str) -> HedgePolicy:
+        policy = self._policies.get(name)
+        if policy is None:
+            percentile, min_delay = HEDGE_DEFAULTS.get(name, (0.95, 0.1))
+            policy = HedgePolicy(
+                name,
+                enabled=self._env(name, 'ENABLED', 'false').lower() == 'true',
+                percentile=float(self._env(name, 'PERCENTILE', percentile)),
+                budget=float(self._env(name, 'BUDGET', 0.1)),
+                min_samples=int(self._env(name, 'MIN_SAMPLES', 20)),
+                min_delay=float(self._env(name, 'MIN_DELAY', min_delay)),
+                burst=float(self._env(name, 'BURST', 10))
+            )
+            self._policies[name] = policy
+        return policy
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {name: policy.get_stats() for name, policy in self._policies.items()}
+
+# 创建全局实例
+hedge_policies = HedgePolicies()
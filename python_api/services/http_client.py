@@ -0,0 +1,96 @@
+import os
+import logging
+import importlib.util
+from contextlib import asynccontextmanager
+from typing import Dict, Any, AsyncIterator
+import httpx
+from dotenv import load_dotenv
+
+# 加载环境变量
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+class HTTPClientPool:
+    """出站HTTP客户端池
+
+    每个上游（llm / amap / weather）共享一个长连接的 httpx.AsyncClient，
+    由 FastAPI lifespan 负责启动和关闭；在 lifespan 之外（脚本、测试）
+    首次使用时惰性创建。
+    """
+
+    def __init__(self):
+        self.max_connections = int(os.getenv('HTTP_MAX_CONNECTIONS_PER_HOST', 20))  # 每个上游的最大连接数
+        self.max_keepalive_connections = int(os.getenv('HTTP_MAX_KEEPALIVE_PER_HOST', 10))  # 每个上游保持的空闲连接数
+        self.keepalive_expiry = float(os.getenv('HTTP_KEEPALIVE_EXPIRY', 30.0))  # 空闲连接保持时间（秒）
+        self.http2 = os.getenv('HTTP_ENABLE_HTTP2', 'false').lower() == 'true'
+        self._timeouts: Dict[str, float] = {}  # 上游名称 -> 默认超时
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+
+        if self.http2 and importlib.util.find_spec('h2') is None:
+            logger.warning("已启用HTTP/2但未安装h2包（pip install httpx[http2]），回退为HTTP/1.1")
+            self.http2 = False
+
+    def register(self, name: str, timeout: float):
+        """登记一个上游及其默认超时"""
+        self._timeouts[name] = timeout
+
+    def get_timeout(self, name: str) -> float:
+        """上游的默认超时"""
+        return self._timeouts.get(name, 10.0)
+
+    def _create_client(self, name: str) -> httpx.AsyncClient:
+        """创建上游客户端"""
+        limits = httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry
+        )
+        logger.info(f"创建HTTP客户端: {name} (max_connections={self.max_connections}, http2={self.http2})")
+        return httpx.AsyncClient(
+            timeout=self.get_timeout(name),
+            limits=limits,
+            http2=self.http2
+        )
+
+    def get_client(self, name: str) -> httpx.AsyncClient:
+        """获取上游共享客户端，不存在或已关闭时重新创建"""
+        client = self._clients.get(name)
+        if client is None or client.is_closed:
+            client = self._create_client(name)
+            self._clients[name] = client
+        return client
+
+    @asynccontextmanager
+    async def session(self, name: str) -> AsyncIterator[httpx.AsyncClient]:
+        """以上下文管理器形式借出共享客户端（退出时不关闭连接）"""
+        yield self.get_client(name)
+
+    async def start(self):
+        """预先创建所有已登记上游的客户端"""
+        for name in self._timeouts:
+            self.get_client(name)
+
+    async def aclose(self):
+        """关闭所有客户端并释放连接"""
+        clients = list(self._clients.items())
+        self._clients.clear()
+        for name, client in clients:
+            try:
+                await client.aclose()
+                logger.info(f"HTTP客户端已关闭: {name}")
+            except Exception as e:
+                logger.warning(f"关闭HTTP客户端失败: {name}, 错误: {str(e)}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取客户端池状态"""
+        return {
+            'upstreams': sorted(self._timeouts),
+            'open_clients': sorted(name for name, client in self._clients.items() if not client.is_closed),
+            'max_connections_per_host': self.max_connections,
+            'max_keepalive_per_host': self.max_keepalive_connections,
+            'http2': self.http2
+        }
+
+# 创建全局实例
+http_client_pool = HTTPClientPool()
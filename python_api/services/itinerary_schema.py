@@ -0,0 +1,86 @@
+"""LLM行程输出的结构定义
+
+与 DAILY_ITINERARY_TEMPLATE 对应，用于校验和补全模型返回的JSON。
+"""
+
+from typing import Any, Dict, List, Union
+from pydantic import BaseModel, ConfigDict, Field, field_validator, model_validator
+
+from services.text_extraction import parse_cost
+
+# 各时段缺失字段的默认值（与模板中的示例一致）
+PERIOD_DEFAULTS: Dict[str, Dict[str, Any]] = {
+    'breakfast': {'duration': '1小时', 'ticketPrice': '免费'},
+    'morning': {'duration': '3小时', 'ticketPrice': ''},
+    'lunch': {'duration': '1.5小时', 'ticketPrice': '免费'},
+    'afternoon': {'duration': '3.5小时', 'ticketPrice': ''},
+    'dinner': {'duration': '1.5小时', 'ticketPrice': '免费'},
+    'evening': {'duration': '2小时', 'ticketPrice': ''},
+}
+
+class ItinerarySection(BaseModel):
+    """单个餐饮/活动时段"""
+    model_config = ConfigDict(extra='allow')
+
+    name: str = ''
+    activity: str = ''
+    location: str = ''
+    address: str = ''
+    duration: str = ''
+    cost: float = 0.0
+    description: str = ''
+    specialties: str = ''
+    features: str = ''
+    tips: str = ''
+    openTime: str = ''
+    ticketPrice: str = ''
+
+    @field_validator('cost', mode='before')
+    @classmethod
+    def _parse_cost(cls, value: Any) -> float:
+        """费用统一为数字，字符串取第一个数字（如 "人均80元" -> 80）"""
+        return parse_cost(value)
+
+    @field_validator('name', 'activity', 'location', 'address', 'duration', 'description',
+                     'specialties', 'features', 'tips', 'openTime', 'ticketPrice', mode='before')
+    @classmethod
+    def _to_text(cls, value: Any) -> str:
+        """模型偶尔返回数字或列表，统一转为文本"""
+        if value is None:
+            return ''
+        if isinstance(value, list):
+            return '、'.join(str(item) for item in value)
+        return str(value)
+
+class DailyItinerary(BaseModel):
+    """单日行程"""
+    model_config = ConfigDict(extra='allow')
+
+    day: int = 1
+    breakfast: ItinerarySection
+    morning: ItinerarySection
+    lunch: ItinerarySection
+    afternoon: ItinerarySection
+    dinner: ItinerarySection
+    evening: ItinerarySection
+    transportation: str = '公共交通/步行'
+    estimated_cost: Union[str, float] = '200-500元'
+
+    @model_validator(mode='before')
+    @classmethod
+    def _fill_period_defaults(cls, data: Any) -> Any:
+        """缺失的时段或字段使用各时段的默认值"""
+        if not isinstance(data, dict):
+            return data
+        data = dict(data)
+        for period, defaults in PERIOD_DEFAULTS.items():
+            section = data.get(period)
+            section = dict(section) if isinstance(section, dict) else {}
+            for key, value in defaults.items():
+                section.setdefault(key, value)
+            data[period] = section
+        return data
+
+class MultiDayItinerary(BaseModel):
+    """多日行程"""
+    days: List[DailyItinerary] = Field(default_factory=list)
@@ -0,0 +1,79 @@
+"""本地JSON修复
+
+模型输出被截断或格式不严格时，在重新生成之前先尝试低成本的本地修复：
+去掉markdown代码块和前后说明文字、删除多余的尾随逗号、补全被截断的字符串、
+丢弃不完整的末尾键值，并按嵌套顺序补齐未闭合的括号。
+"""
+
+import re
+from typing import List, Tuple
+
+_FENCE_PATTERN = re.compile(r'```(?:json)?', re.IGNORECASE)
+_TRAILING_COMMA_PATTERN = re.compile(r',\s*([}\]])')
+_DANGLING_TAIL_PATTERN = re.compile(r'(,\s*"[^"]*"\s*:?\s*|,\s*|:\s*)$')
+
+def _scan(text: str) -> Tuple[List[str], bool, bool, int]:
+    """扫描JSON文本的括号嵌套，返回 (未闭合括号对应的闭合符, 是否截断在字符串中, 是否有悬空转义符, 顶层结构结束位置)"""
+    stack = []
+    in_string = False
+    escape = False
+    end = len(text)
+    for i, ch in enumerate(text):
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == '\\':
+                escape = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in '{[':
+            stack.append('}' if ch == '{' else ']')
+        elif ch in '}]':
+            if stack:
+                stack.pop()
+            if not stack:
+                # 顶层结构已闭合，忽略后面的说明文字
+                end = i + 1
+                break
+    return stack, in_string, escape, end
+
+def is_truncated(text: str) -> bool:
+    """JSON文本是否在顶层结构闭合之前中断（括号未闭合或停在字符串中间）"""
+    text = _FENCE_PATTERN.sub('', text or '')
+    starts = [i for i in (text.find('{'), text.find('[')) if i >= 0]
+    if not starts:
+        return False
+    stack, in_string, _, _ = _scan(text[min(starts):])
+    return bool(stack) or in_string
+
+def repair_json(text: str) -> str:
+    """尽力修复不完整的JSON文本，返回修复后的文本（不保证一定可以解析）"""
+    text = _FENCE_PATTERN.sub('', text or '')
+    starts = [i for i in (text.find('{'), text.find('[')) if i >= 0]
+    if not starts:
+        return text.strip()
+    text = text[min(starts):]
+    stack, in_string, escape, end = _scan(text)
+
+    text = text[:end]
+    if in_string:
+        # 截断在字符串中间：去掉悬空的转义符后补上引号
+        if escape:
+            text = text[:-1]
+        text += '"'
+
+    text = text.rstrip()
+    if stack:
+        # 截断在键名或冒号之后时丢弃不完整的键值对
+        text = _DANGLING_TAIL_PATTERN.sub('', text)
+        if stack[-1] == '}' and text.endswith('"'):
+            # 对象中只有键名没有值的情况，例如 {"a": 1, "b"
+            last_key = re.search(r'([{,])\s*"(?:[^"\\]|\\.)*"$', text)
+            if last_key:
+                text = text[:last_key.start() + (1 if last_key.group(1) == '{' else 0)]
+        text += ''.join(reversed(stack))
+
+    return _TRAILING_COMMA_PATTERN.sub(r'\1', text)
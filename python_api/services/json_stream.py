@@ -0,0 +1,68 @@
+import json
+from typing import Any, List, Optional, Tuple
+
+class IncrementalJSONParser:
+    """增量JSON解析器
+
+    逐段输入流式生成的文本，顶层对象中值为对象的字段一旦闭合就立即解析返回，
+    不必等待整个JSON生成完毕。顶层对象之前的内容（如 ```json 标记）会被忽略。
+    """
+
+    def __init__(self):
+        self.text = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._last_string: Optional[str] = None
+        self._key: Optional[str] = None
+        self._section_key: Optional[str] = None
+        self._section_start: Optional[int] = None
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """输入一段文本，返回本段中闭合的 (字段名, 字段值) 列表"""
+        self.text += chunk
+        text = self.text
+        sections = []
+
+        for i in range(self._pos, len(text)):
+            ch = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._last_string = text[self._string_start:i + 1]
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                self._string_start = i
+            elif ch == ':' and self._depth == 1 and self._last_string is not None:
+                try:
+                    self._key = json.loads(self._last_string)
+                except ValueError:
+                    self._key = None
+            elif ch == ',' and self._depth == 1:
+                self._key = None
+                self._last_string = None
+            elif ch in '{[':
+                self._depth += 1
+                if self._depth == 2 and ch == '{' and self._key is not None:
+                    self._section_key = self._key
+                    self._section_start = i
+            elif ch in '}]':
+                if self._depth == 2 and self._section_start is not None:
+                    try:
+                        sections.append((self._section_key, json.loads(text[self._section_start:i + 1])))
+                    except ValueError:
+                        pass
+                    self._section_start = None
+                self._depth = max(self._depth - 1, 0)
+
+        self._pos = len(text)
+        return sections
@@ -0,0 +1,203 @@
+import os
+import json
+import time
+import random
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple, Any
+from dotenv import load_dotenv
+
+# 加载环境变量
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+class LLMResponseCache:
+    """LLM响应缓存：按内容寻址，内存LRU + SQLite两级存储
+
+    缓存键由模型、消息和采样参数计算得出，相同请求命中同一条目。
+    temperature > 0 的调用可以为同一个键保存多个变体，缓存未满时继续
+    请求API补充变体，满后随机返回其中一个，保证结果仍有变化。
+    """
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.enabled = os.getenv('LLM_CACHE_ENABLED', 'true').lower() == 'true'
+        self.ttl = float(os.getenv('LLM_CACHE_TTL', 86400))
+        self.max_memory_entries = int(os.getenv('LLM_CACHE_MAX_MEMORY_ENTRIES', 512))
+        self.max_disk_entries = int(os.getenv('LLM_CACHE_MAX_DISK_ENTRIES', 10000))
+        self.db_path = db_path or os.getenv('LLM_CACHE_DB_PATH', './data/llm_cache.db')
+        # 关闭缓存的调用点，例如 LLM_CACHE_DISABLED_SITES=daily_itinerary,travel_tips
+        self.disabled_sites = {
+            site.strip() for site in os.getenv('LLM_CACHE_DISABLED_SITES', '').split(',') if site.strip()
+        }
+
+        # 内存层：键 -> (写入时间, [变体响应])
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+
+        self.stats = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'evictions': 0,
+            'errors': 0
+        }
+        self.site_stats: Dict[str, Dict[str, int]] = {}
+
+    def is_enabled(self, site: Optional[str]) -> bool:
+        """调用点是否启用缓存"""
+        return self.enabled and site is not None and site not in self.disabled_sites
+
+    @staticmethod
+    def make_key(model: str, messages: List[Dict[str, str]], params: Dict[str, Any]) -> str:
+        """计算缓存键"""
+        raw = json.dumps(
+            {'model': model, 'messages': messages, 'params': params},
+            ensure_ascii=False, sort_keys=True, separators=(',', ':')
+        )
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _get_connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS llm_cache (
+                    key TEXT NOT NULL,
+                    variant INTEGER NOT NULL,
+                    response TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    PRIMARY KEY (key, variant)
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_accessed ON llm_cache (accessed_at)")
+            logger.info(f"LLM响应缓存数据库已初始化: {self.db_path}")
+        return self._conn
+
+    def _disk_get(self, key: str) -> Tuple[Optional[float], List[Dict[str, Any]]]:
+        """返回 (最早变体的写入时间, 变体列表)，提升到内存时沿用写入时间，不重新计算TTL"""
+        with self._db_lock:
+            conn = self._get_connection()
+            rows = conn.execute(
+                "SELECT response, created_at FROM llm_cache WHERE key = ? AND created_at > ? ORDER BY variant",
+                (key, time.time() - self.ttl)
+            ).fetchall()
+            if rows:
+                conn.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        created_at = min(row[1] for row in rows) if rows else None
+        return created_at, [json.loads(row[0]) for row in rows]
+
+    def _disk_put(self, key: str, response: Dict[str, Any], variants: int):
+        """追加一个变体，编号取数据库中的下一个（内存条目可能已被淘汰），已有 variants 个时不写入"""
+        now = time.time()
+        with self._db_lock:
+            conn = self._get_connection()
+            # 先清理过期条目，过期的变体不占用编号
+            conn.execute("DELETE FROM llm_cache WHERE created_at <= ?", (now - self.ttl,))
+            variant = conn.execute(
+                "SELECT COALESCE(MAX(variant) + 1, 0) FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()[0]
+            if variant >= variants:
+                return
+            conn.execute(
+                "INSERT INTO llm_cache VALUES (?, ?, ?, ?, ?)",
+                (key, variant, json.dumps(response, ensure_ascii=False), now, now)
+            )
+            # 超出容量时按最近访问时间淘汰
+            conn.execute("""
+                DELETE FROM llm_cache WHERE rowid IN (
+                    SELECT rowid FROM llm_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                )""", (self.max_disk_entries,))
+
+    def _memory_get(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        created_at, variants = entry
+        if time.time() - created_at >= self.ttl:
+            del self._memory[key]
+            return None
+        self._memory.move_to_end(key)
+        return variants
+
+    def _memory_put(self, key: str, variants: List[Dict[str, Any]], created_at: Optional[float] = None):
+        self._memory[key] = (created_at or time.time(), variants)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    def _record(self, site: str, outcome: str):
+        self.stats[outcome] += 1
+        counters = self.site_stats.setdefault(site, {'hits': 0, 'misses': 0})
+        counters['misses' if outcome == 'misses' else 'hits'] += 1
+
+    async def get(self, key: str, site: str, variants: int = 1) -> Optional[Dict[str, Any]]:
+        """查询缓存，已缓存的变体数不足 variants 时视为未命中"""
+        cached = self._memory_get(key)
+        outcome = 'memory_hits'
+        if cached is None or len(cached) < variants:
+            try:
+                created_at, disk_cached = await asyncio.to_thread(self._disk_get, key)
+            except Exception as e:
+                logger.warning(f"读取LLM缓存数据库失败: {str(e)}")
+                self.stats['errors'] += 1
+                created_at, disk_cached = None, []
+            if len(disk_cached) > len(cached or []):
+                cached = disk_cached
+                self._memory_put(key, cached, created_at)
+            outcome = 'disk_hits'
+
+        if not cached or len(cached) < variants:
+            self._record(site, 'misses')
+            return None
+
+        self._record(site, outcome)
+        return random.choice(cached[:variants])
+
+    async def put(self, key: str, response: Dict[str, Any], variants: int = 1):
+        """写入缓存，已保存 variants 个变体时不再追加"""
+        cached = list(self._memory_get(key) or [])
+        if len(cached) >= variants:
+            return
+        cached.append(response)
+        entry = self._memory.get(key)
+        self._memory_put(key, cached, entry[0] if entry else None)  # 补充变体不延长已有变体的TTL
+        self.stats['stores'] += 1
+        try:
+            await asyncio.to_thread(self._disk_put, key, response, variants)
+        except Exception as e:
+            logger.warning(f"写入LLM缓存数据库失败: {str(e)}")
+            self.stats['errors'] += 1
+
+    def clear(self):
+        """清空两级缓存"""
+        self._memory.clear()
+        with self._db_lock:
+            self._get_connection().execute("DELETE FROM llm_cache")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计"""
+        hits = self.stats['memory_hits'] + self.stats['disk_hits']
+        lookups = hits + self.stats['misses']
+        return {
+            **self.stats,
+            'hit_rate': round(hits / lookups, 3) if lookups else 0.0,
+            'memory_entries': len(self._memory),
+            'sites': self.site_stats,
+            'enabled': self.enabled
+        }
+
+# 创建全局实例
+llm_cache = LLMResponseCache()
@@ -0,0 +1,315 @@
+"""大模型多供应商路由
+
+按 LLM_PROVIDERS 配置的顺序登记供应商（通义千问、OpenAI、Anthropic 或其他
+OpenAI 兼容接口），为每个供应商/模型和调用点记录滚动的 p50/p95 延迟与错误率。
+每次调用按健康度排序：熔断中的供应商不参与，错误率过高或明显偏慢的供应商排在后面，
+其余按配置顺序；当前供应商失败时由调用方依次切换到下一个。
+"""
+
+import os
+import time
+import json
+import logging
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+
+from services.http_client import HTTPClientPool
+from services.resilience import UpstreamGuard, upstream_guards
+from services.token_scheduler import TokenScheduler
+
+# 加载环境变量
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 内置供应商的默认接口地址、模型、更快的备选模型和接口风格
+PROVIDER_DEFAULTS: Dict[str, Dict[str, str]] = {
+    'qwen': {'base_url': 'https://dashscope.aliyuncs.com/compatible-mode/v1', 'model': 'qwen-plus',
+             'fast_model': 'qwen-turbo', 'api': 'openai'},
+    'openai': {'base_url': 'https://api.openai.com/v1', 'model': 'gpt-4o-mini', 'api': 'openai'},
+    'anthropic': {'base_url': 'https://api.anthropic.com/v1', 'model': 'claude-3-5-haiku-latest', 'api': 'anthropic'},
+}
+
+# Anthropic 停止原因到 OpenAI finish_reason 的映射
+_ANTHROPIC_FINISH_REASONS = {'end_turn': 'stop', 'stop_sequence': 'stop', 'max_tokens': 'length'}
+
+class LatencyTracker:
+    """滚动窗口内的延迟分位数和错误率"""
+
+    def __init__(self, window: int = 100, horizon: float = 300.0):
+        self.horizon = horizon  # 超过该时间（秒）的样本不再参与统计
+        self._samples: Deque[Tuple[float, float, bool]] = deque(maxlen=window)  # (时间, 耗时, 是否成功)
+
+    def record(self, seconds: float, ok: bool):
+        self._samples.append((time.monotonic(), seconds, ok))
+
+    def _recent(self) -> List[Tuple[float, float, bool]]:
+        cutoff = time.monotonic() - self.horizon
+        while self._samples and self._samples[0][0] < cutoff:
+            self._samples.popleft()
+        return list(self._samples)
+
+    @property
+    def count(self) -> int:
+        return len(self._recent())
+
+    def percentile(self, q: float) -> Optional[float]:
+        """成功请求耗时的分位数，没有样本时返回 None"""
+        latencies = sorted(seconds for _, seconds, ok in self._recent() if ok)
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+    @property
+    def error_rate(self) -> float:
+        samples = self._recent()
+        return sum(1 for _, _, ok in samples if not ok) / len(samples) if samples else 0.0
+
+    def get_stats(self) -> Dict[str, Any]:
+        p50, p95 = self.percentile(0.5), self.percentile(0.95)
+        return {
+            'count': self.count,
+            'p50': round(p50, 3) if p50 is not None else None,
+            'p95': round(p95, 3) if p95 is not None else None,
+            'error_rate': round(self.error_rate, 4)
+        }
+
+class LLMProvider:
+    """OpenAI 兼容接口（chat/completions）的大模型供应商"""
+
+    api_style = 'openai'
+
+    def __init__(self, name: str, api_key: str, base_url: str, model: str, priority: int,
+                 http_pool: HTTPClientPool, timeout: float = 120.0, fast_model: Optional[str] = None,
+                 tpm: int = 0, rpm: int = 0):
+        self.name = name
+        self.api_key = api_key
+        self.base_url = base_url.rstrip('/')
+        self.model = model
+        self.fast_model = fast_model  # 延迟超出SLO时可降级使用的更快模型
+        self.priority = priority  # 配置顺序，越小越优先
+        self.upstream = f"llm_{name}"  # 连接池、熔断器和舱壁的名称
+        http_pool.register(self.upstream, timeout=timeout)
+        self.guard: UpstreamGuard = upstream_guards.get(self.upstream)
+        # 按供应商的 TPM/RPM 限额控制发出节奏
+        self.scheduler = TokenScheduler(self.upstream, tpm, rpm,
+                                        max_wait=float(os.getenv('LLM_SCHEDULER_MAX_WAIT', 60)))
+
+    @property
+    def key(self) -> str:
+        return f"{self.name}/{self.model}"
+
+    @property
+    def url(self) -> str:
+        return f"{self.base_url}/chat/completions"
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {
+            'Content-Type': 'application/json',
+            'Authorization': f'Bearer {self.api_key}'
+        }
+
+    def build_payload(self, messages: List[Dict[str, str]], stream: bool = False,
+                      model: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        payload = {'model': model or self.model, 'messages': messages, **kwargs}
+        if stream:
+            payload['stream'] = True
+        return payload
+
+    def parse_response(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """转换为 OpenAI chat.completion 格式"""
+        return data
+
+    def parse_stream_event(self, data: str) -> Tuple[Optional[str], bool]:
+        """解析一条SSE数据，返回 (新增文本, 是否结束)"""
+        if data == '[DONE]':
+            return None, True
+        choices = json.loads(data).get('choices') or []
+        return (choices[0].get('delta', {}).get('content') if choices else None), False
+
+class AnthropicProvider(LLMProvider):
+    """Anthropic Messages 接口，请求和响应与 OpenAI 格式互相转换"""
+
+    api_style = 'anthropic'
+
+    @property
+    def url(self) -> str:
+        return f"{self.base_url}/messages"
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {
+            'Content-Type': 'application/json',
+            'x-api-key': self.api_key,
+            'anthropic-version': '2023-06-01'
+        }
+
+    def build_payload(self, messages: List[Dict[str, str]], stream: bool = False,
+                      model: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        system = '\n\n'.join(m['content'] for m in messages if m.get('role') == 'system')
+        payload = {
+            'model': model or self.model,
+            'messages': [m for m in messages if m.get('role') != 'system'],
+            'max_tokens': kwargs.get('max_tokens') or 4096,
+        }
+        if system:
+            payload['system'] = system
+        for key in ('temperature', 'top_p', 'stop'):
+            if key in kwargs:
+                payload['stop_sequences' if key == 'stop' else key] = kwargs[key]
+        # response_format 不受支持，JSON输出由提示词约束
+        if stream:
+            payload['stream'] = True
+        return payload
+
+    def parse_response(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        content = ''.join(block.get('text', '') for block in data.get('content', []) if block.get('type') == 'text')
+        usage = data.get('usage', {})
+        # input_tokens 不含命中和写入提示词缓存的部分
+        cached_tokens = usage.get('cache_read_input_tokens') or 0
+        prompt_tokens = usage.get('input_tokens', 0) + cached_tokens + (usage.get('cache_creation_input_tokens') or 0)
+        completion_tokens = usage.get('output_tokens', 0)
+        return {
+            'id': data.get('id'),
+            'object': 'chat.completion',
+            'model': data.get('model', self.model),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': content},
+                'finish_reason': _ANTHROPIC_FINISH_REASONS.get(data.get('stop_reason'), data.get('stop_reason'))
+            }],
+            'usage': {
+                'prompt_tokens': prompt_tokens,
+                'completion_tokens': completion_tokens,
+                'total_tokens': prompt_tokens + completion_tokens,
+                'prompt_tokens_details': {'cached_tokens': cached_tokens}
+            }
+        }
+
+    def parse_stream_event(self, data: str) -> Tuple[Optional[str], bool]:
+        if data == '[DONE]':
+            return None, True
+        event = json.loads(data)
+        if event.get('type') == 'content_block_delta':
+            return event.get('delta', {}).get('text'), False
+        return None, event.get('type') == 'message_stop'
+
+PROVIDER_CLASSES = {'openai': LLMProvider, 'anthropic': AnthropicProvider}
+
+class LLMRouter:
+    """按调用点选择最健康的大模型供应商"""
+
+    def __init__(self, providers: List[LLMProvider]):
+        self.providers = providers
+        self.window = int(os.getenv('LLM_ROUTER_WINDOW', 100))
+        self.horizon = float(os.getenv('LLM_ROUTER_HORIZON', 300))
+        self.min_samples = int(os.getenv('LLM_ROUTER_MIN_SAMPLES', 5))
+        self.max_error_rate = float(os.getenv('LLM_ROUTER_MAX_ERROR_RATE', 0.5))
+        # p95 超过最快供应商的该倍数时视为偏慢
+        self.latency_tolerance = float(os.getenv('LLM_ROUTER_LATENCY_TOLERANCE', 1.5))
+        self._trackers: Dict[Tuple[str, str], LatencyTracker] = {}
+        self.stats = {'requests': 0, 'failovers': 0}
+
+    @classmethod
+    def from_env(cls, http_pool: HTTPClientPool) -> 'LLMRouter':
+        """根据 LLM_PROVIDERS 创建路由，未配置API密钥的供应商跳过"""
+        names = [name.strip().lower() for name in os.getenv('LLM_PROVIDERS', 'qwen').split(',') if name.strip()]
+        providers = []
+        for name in names:
+            prefix = name.upper()
+            defaults = PROVIDER_DEFAULTS.get(name, {})
+            api_key = os.getenv(f'{prefix}_API_KEY')
+            if not api_key:
+                logger.warning(f"{prefix}_API_KEY 未配置，跳过大模型供应商: {name}")
+                continue
+            base_url = os.getenv(f'{prefix}_BASE_URL', defaults.get('base_url'))
+            model = os.getenv(f'{prefix}_MODEL', defaults.get('model'))
+            if not base_url or not model:
+                logger.warning(f"{prefix}_BASE_URL 或 {prefix}_MODEL 未配置，跳过大模型供应商: {name}")
+                continue
+            api_style = os.getenv(f'{prefix}_API_STYLE', defaults.get('api', 'openai')).lower()
+            provider_class = PROVIDER_CLASSES.get(api_style, LLMProvider)
+            providers.append(provider_class(
+                name, api_key, base_url, model, len(providers), http_pool,
+                timeout=float(os.getenv(f'{prefix}_TIMEOUT', 120.0)),
+                fast_model=os.getenv(f'{prefix}_FAST_MODEL', defaults.get('fast_model')) or None,
+                tpm=int(os.getenv(f'{prefix}_TPM', 0)),
+                rpm=int(os.getenv(f'{prefix}_RPM', 0))
+            ))
+        if not providers:
+            logger.error(f"{names[0].upper() if names else 'QWEN'}_API_KEY not found in environment variables")
+            raise ValueError(f"{names[0].upper() if names else 'QWEN'}_API_KEY is required")
+        logger.info(f"大模型供应商: {', '.join(p.key for p in providers)}")
+        return cls(providers)
+
+    @property
+    def primary(self) -> LLMProvider:
+        return self.providers[0]
+
+    def is_available(self) -> bool:
+        """是否还有未熔断的供应商"""
+        return any(provider.guard.is_available() for provider in self.providers)
+
+    def _tracker(self, provider: LLMProvider, site: str) -> LatencyTracker:
+        tracker = self._trackers.get((provider.key, site))
+        if tracker is None:
+            tracker = LatencyTracker(self.window, self.horizon)
+            self._trackers[(provider.key, site)] = tracker
+        return tracker
+
+    def _site_tracker(self, provider: LLMProvider, site: Optional[str]) -> LatencyTracker:
+        """调用点样本足够时按调用点统计，否则使用供应商整体统计"""
+        tracker = self._tracker(provider, site or '*')
+        if site and tracker.count < self.min_samples:
+            return self._tracker(provider, '*')
+        return tracker
+
+    def rank(self, site: Optional[str] = None) -> List[LLMProvider]:
+        """返回可用供应商，按 (错误率过高, 偏慢, 配置顺序) 排序"""
+        candidates = [provider for provider in self.providers if provider.guard.is_available()]
+        trackers = {provider.key: self._site_tracker(provider, site) for provider in candidates}
+        p95s = {
+            key: tracker.percentile(0.95) for key, tracker in trackers.items()
+            if tracker.count >= self.min_samples
+        }
+        known = [p95 for p95 in p95s.values() if p95 is not None]
+        fastest = min(known) if known else None
+
+        def sort_key(provider: LLMProvider) -> Tuple[bool, bool, int]:
+            tracker = trackers[provider.key]
+            unhealthy = tracker.count >= self.min_samples and tracker.error_rate >= self.max_error_rate
+            p95 = p95s.get(provider.key)
+            slow = fastest is not None and p95 is not None and p95 > fastest * self.latency_tolerance
+            return unhealthy, slow, provider.priority
+
+        return sorted(candidates, key=sort_key)
+
+    def record(self, provider: LLMProvider, site: Optional[str], seconds: float, ok: bool):
+        """记录一次调用结果（同时计入调用点和供应商整体统计）"""
+        self._tracker(provider, '*').record(seconds, ok)
+        if site:
+            self._tracker(provider, site).record(seconds, ok)
+
+    def record_failover(self, provider: LLMProvider, site: Optional[str], error: Exception):
+        self.stats['failovers'] += 1
+        logger.warning(f"大模型供应商 {provider.key} 调用失败，切换到下一个供应商（{site or '未知调用点'}）: {error}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        providers = []
+        for provider in self.providers:
+            sites = {
+                site: tracker.get_stats() for (key, site), tracker in self._trackers.items()
+                if key == provider.key and site != '*'
+            }
+            providers.append({
+                'name': provider.name,
+                'model': provider.model,
+                'api': provider.api_style,
+                'available': provider.guard.is_available(),
+                **self._tracker(provider, '*').get_stats(),
+                'sites': sites,
+                'scheduler': provider.scheduler.get_stats()
+            })
+        return {**self.stats, 'providers': providers}
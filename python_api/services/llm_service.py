@@ -1,142 +1,52 @@
 import os
+import re
 import json
+import math
 import time
 import logging
-from typing import Dict, List, Optional, Any
+from functools import partial
+from typing import AsyncIterator, Callable, Dict, List, Optional, Any, Tuple
 import httpx
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
+from tenacity import retry, stop_after_attempt, wait_exponential
 from dotenv import load_dotenv
 
+from services.http_client import HTTPClientPool, http_client_pool
+from services.llm_cache import LLMResponseCache, llm_cache
+from services.resilience import CircuitOpenError, UpstreamUnavailableError
+from services.deadline import DeadlineExceededError, bounded_call, stop_before_deadline
+from services.hedging import hedge_policies
+from services.singleflight import flight_groups
+from services.token_scheduler import TokenReservation, estimate_tokens
+from services.token_accounting import TokenAccounting
+from services.llm_router import LLMProvider, LLMRouter
+from services.model_tiering import ModelTier, ModelTiering
+from services.json_stream import IncrementalJSONParser
+from services.json_repair import is_truncated, repair_json
+from services.itinerary_schema import DailyItinerary, ItinerarySection, PERIOD_DEFAULTS
+from services.text_extraction import clean_markdown, extract_itinerary
+from pydantic import ValidationError
+
 # 加载环境变量
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
-class QwenLLMService:
-    """阿里云通义千问大模型服务类"""
-    
-    def __init__(self):
-        self.api_key = os.getenv('QWEN_API_KEY')
-        self.base_url = os.getenv('QWEN_BASE_URL', 'https://dashscope.aliyuncs.com/compatible-mode/v1')
-        self.model = os.getenv('QWEN_MODEL', 'qwen-plus')
-        
-        if not self.api_key:
-            logger.error("QWEN_API_KEY not found in environment variables")
-            raise ValueError("QWEN_API_KEY is required")
-        
-        logger.info(f"QwenLLMService initialized with model: {self.model}")
-        
-        self.headers = {
-            'Content-Type': 'application/json',
-            'Authorization': f'Bearer {self.api_key}'
-        }
-    
-    @retry(
-        stop=stop_after_attempt(3),
-        wait=wait_exponential(multiplier=1, min=4, max=10),
-        retry=retry_if_exception_type((httpx.RequestError, httpx.HTTPStatusError))
-    )
-    async def _make_request(self, messages: List[Dict[str, str]], **kwargs) -> Dict[str, Any]:
-        """发送请求到豆包API"""
-        start_time = time.time()
-        request_id = f"req_{int(time.time() * 1000)}"
-        
-        payload = {
-            'model': self.model,
-            'messages': messages,
-            **kwargs
-        }
-        
-        # 记录请求开始日志
-        logger.info(f"[{request_id}] 开始调用阿里云通义千问API")
-        logger.debug(f"[{request_id}] 请求参数: model={self.model}, messages_count={len(messages)}, kwargs={kwargs}")
-        
-        # 记录消息内容（仅在debug模式下）
-        for i, msg in enumerate(messages):
-            logger.debug(f"[{request_id}] Message {i}: role={msg.get('role')}, content_length={len(msg.get('content', ''))}")
-        
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            try:
-                response = await client.post(
-                    f"{self.base_url}/chat/completions",
-                    headers=self.headers,
-                    json=payload
-                )
-                response.raise_for_status()
-                response_data = response.json()
-                
-                # 计算响应时间
-                response_time = time.time() - start_time
-                
-                # 提取token使用信息
-                usage = response_data.get('usage', {})
-                prompt_tokens = usage.get('prompt_tokens', 0)
-                completion_tokens = usage.get('completion_tokens', 0)
-                total_tokens = usage.get('total_tokens', 0)
-                
-                # 记录成功响应日志
-                logger.info(f"[{request_id}] API调用成功 - 响应时间: {response_time:.2f}s")
-                logger.info(f"[{request_id}] Token使用情况 - 输入: {prompt_tokens}, 输出: {completion_tokens}, 总计: {total_tokens}")
-                
-                # 记录响应内容长度
-                if 'choices' in response_data and response_data['choices']:
-                    content_length = len(response_data['choices'][0].get('message', {}).get('content', ''))
-                    logger.debug(f"[{request_id}] 响应内容长度: {content_length} 字符")
-                
-                return response_data
-                
-            except httpx.HTTPStatusError as e:
-                response_time = time.time() - start_time
-                logger.error(f"[{request_id}] 阿里云通义千问API请求失败 - 状态码: {e.response.status_code}, 响应时间: {response_time:.2f}s")
-                logger.error(f"[{request_id}] 错误详情: {e.response.text}")
-                raise
-            except httpx.RequestError as e:
-                response_time = time.time() - start_time
-                logger.error(f"[{request_id}] 阿里云通义千问API网络请求错误 - 响应时间: {response_time:.2f}s, 错误: {str(e)}")
-                raise
-            except Exception as e:
-                response_time = time.time() - start_time
-                logger.error(f"[{request_id}] 阿里云通义千问API未知错误 - 响应时间: {response_time:.2f}s, 错误: {str(e)}")
-                raise
-    
-    async def generate_destination_analysis(self, destination: str, preferences: Dict[str, Any]) -> str:
-        """生成目的地分析"""
-        system_prompt = """你是一个专业的旅行顾问。请根据用户提供的目的地和偏好，生成详细的目的地分析报告。
-        报告应包括：
-        1. 目的地概况
-        2. 最佳旅行时间
-        3. 主要景点和活动
-        4. 当地文化和特色
-        5. 交通和住宿建议
-        6. 预算参考
-        
-        请用中文回答，内容要详实且实用。"""
-        
-        user_prompt = f"""目的地：{destination}
-        用户偏好：{json.dumps(preferences, ensure_ascii=False, indent=2)}
-        
-        请为这个目的地生成详细的分析报告。"""
-        
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ]
-        
-        try:
-            response = await self._make_request(messages, temperature=0.7, max_tokens=2000)
-            return response['choices'][0]['message']['content']
-        except Exception as e:
-            logger.error(f"生成目的地分析失败: {str(e)}")
-            return f"目的地 {destination} 是一个值得探索的地方，具有丰富的文化和自然景观。"
-    
-    async def generate_daily_itinerary(self, destination: str, day: int, total_days: int, 
-                                     preferences: Dict[str, Any], budget_level: str) -> Dict[str, Any]:
-        """生成每日行程"""
-        system_prompt = """你是一个专业的旅行规划师。请根据提供的信息生成详细的每日行程安排。
-        
-        请直接返回以下JSON格式的数据，不要添加任何其他文字说明：
-        
-        {
+# 每日行程中的餐饮/活动时段，按时间顺序
+ITINERARY_PERIODS = ['breakfast', 'morning', 'lunch', 'afternoon', 'dinner', 'evening']
+
+_CODE_FENCE_PATTERN = re.compile(r'```json\s*|```\s*$')
+# 续写与已有文本的重叠至少这么长，或结束在JSON的分隔符/引号上，才视为模型重复输出
+_CONTINUATION_MIN_OVERLAP = 16
+_TOKEN_BOUNDARIES = frozenset('"{}[],:')
+
+def _retry_while_available(retry_state) -> bool:
+    """tenacity 重试条件：网络或HTTP错误，且仍有未熔断的供应商"""
+    error = retry_state.outcome.exception()
+    return isinstance(error, (httpx.RequestError, httpx.HTTPStatusError)) and \
+        retry_state.args[0].router.is_available()
+
+# 单日行程JSON模板，单日和多日提示词共用
+DAILY_ITINERARY_TEMPLATE = """{
           "day": 1,
           "breakfast": {
             "name": "[具体餐厅名称]",
@@ -221,7 +131,314 @@ class QwenLLMService:
           },
           "transportation": "[主要交通方式]",
           "estimated_cost": "[全天预估费用]"
-        }
+        }"""
+
+# 模板中各时段的结构，补全缺失时段时只发送对应部分
+_TEMPLATE_SECTIONS = json.loads(DAILY_ITINERARY_TEMPLATE)
+
+# 紧凑格式的单日行程结构说明：时段字段只描述一次，代替带占位符的完整模板
+ITINERARY_SECTION_SCHEMA = ('{"name":"名称","activity":"活动","location":"地点","address":"详细地址","duration":"时长",'
+                            '"cost":数字,"description":"简介和推荐理由","specialties":"推荐菜品（餐饮时段）",'
+                            '"features":"特色亮点","tips":"贴心提示","openTime":"开放/营业时间","ticketPrice":"门票价格"}')
+COMPACT_ITINERARY_SCHEMA = ('{"day":天数,"breakfast":S,"morning":S,"lunch":S,"afternoon":S,"dinner":S,"evening":S,'
+                            '"transportation":"主要交通方式","estimated_cost":"全天预估费用"}\n'
+                            f'其中S为：{ITINERARY_SECTION_SCHEMA}')
+
+# 时段以外字段（day、transportation、estimated_cost 和括号）的预估输出token数
+ITINERARY_BASE_TOKENS = 100
+
+# 输出被截断后请求续写的提示
+CONTINUATION_PROMPT = "上一条回复因长度限制被截断。请从截断处继续输出剩余的JSON文本，不要重复已输出的内容，不要添加任何说明。"
+
+class QwenLLMService:
+    """大模型服务类（默认使用阿里云通义千问，可通过 LLM_PROVIDERS 配置多个供应商）"""
+    
+    def __init__(self, http_pool: Optional[HTTPClientPool] = None,
+                 cache: Optional[LLMResponseCache] = None):
+        # 共享连接池，避免每次请求重新建立TCP+TLS连接
+        self.http_pool = http_pool or http_client_pool
+        
+        # 多供应商路由：每个供应商有独立的连接池、熔断器和舱壁，失败时切换到下一个
+        self.router = LLMRouter.from_env(self.http_pool)
+        self.model = self.router.primary.model  # 缓存键使用首选模型，各供应商共享缓存
+        
+        # 按调用点配置模型档位、max_tokens、超时和延迟目标，p95 超出目标时切换到更快的档位
+        self.tiering = ModelTiering(self.router)
+        
+        # 对冲请求：超过近期 p95 延迟仍未返回时再发一份，先返回的生效（HEDGE_LLM_ENABLED）
+        self.hedging = hedge_policies.get('llm')
+        
+        # 相同提示词的并发请求共享一次调用（只用于允许缓存的调用点）
+        self.flights = flight_groups.get('llm')
+        
+        logger.info(f"QwenLLMService initialized with model: {self.model}")
+        
+        # 多日行程模式的token预算：单次请求的输出上限和每天的预估输出token数
+        self.max_output_tokens = int(os.getenv('ITINERARY_MAX_OUTPUT_TOKENS', 6000))
+        self.tokens_per_day = int(os.getenv('ITINERARY_TOKENS_PER_DAY', 0)) or \
+            math.ceil(estimate_tokens(DAILY_ITINERARY_TEMPLATE) * 1.3)
+        self.max_days_per_call = int(os.getenv('ITINERARY_MAX_DAYS_PER_CALL', 7))
+        
+        # 每日行程的输出上限按请求的时段数计算；被截断时续写剩余文本，仍缺失的时段单独补全
+        self.tokens_per_section = int(os.getenv('ITINERARY_TOKENS_PER_SECTION', 320))
+        self.max_continuations = int(os.getenv('ITINERARY_MAX_CONTINUATIONS', 1))
+        self.patch_sections = os.getenv('ITINERARY_PATCH_SECTIONS', 'true').lower() == 'true'
+        
+        # 响应缓存，temperature > 0 的调用默认保存多个变体
+        self.cache = cache or llm_cache
+        self.cache_variants = int(os.getenv('LLM_CACHE_VARIANTS', 3))
+        
+        # 提示词格式：compact 使用紧凑的结构说明和JSON，verbose 使用带占位符的完整模板
+        # 系统提示词只包含固定内容，跨天、跨用户逐字节相同，便于命中供应商的上下文缓存
+        self.prompt_format = os.getenv('LLM_PROMPT_FORMAT', 'compact').lower()
+        self.accounting = TokenAccounting()
+        
+        # 结构化输出：行程调用启用JSON模式（response_format），解析失败时先本地修复再重新生成
+        self.json_mode = os.getenv('LLM_JSON_MODE', 'true').lower() == 'true'
+        self.parse_stats = {'total': 0, 'strict': 0, 'repaired': 0, 'continued': 0, 'patched': 0,
+                            'regenerated': 0, 'fallback': 0}
+    
+    @retry(
+        stop=stop_after_attempt(3) | stop_before_deadline(4),
+        wait=wait_exponential(multiplier=1, min=4, max=10),
+        retry=_retry_while_available
+    )
+    async def _make_request(self, messages: List[Dict[str, str]], site: Optional[str] = None,
+                            tier: Optional[ModelTier] = None, **kwargs) -> Dict[str, Any]:
+        """发送请求到大模型API，当前供应商失败时依次切换到下一个
+        
+        Args:
+            messages: 消息列表
+            site: 调用点名称，用于按调用点统计延迟和选择供应商
+            tier: 模型档位，为 None 时按调用点选择
+        """
+        if tier is None:
+            tier, kwargs = self._select_tier(site, kwargs)
+        request_id = f"req_{int(time.time() * 1000)}"
+        providers = self.router.rank(site)
+        if not providers:
+            raise CircuitOpenError('llm', "所有大模型供应商熔断中")
+        self.router.stats['requests'] += 1
+        
+        for index, provider in enumerate(providers):
+            try:
+                # 在对冲之外按 TPM/RPM 限额排队，对冲计时和延迟统计不包含排队时间；
+                # 对冲请求另外占用自己的限额
+                async with provider.scheduler.reserve(messages, kwargs.get('max_tokens'), site) as reservation:
+                    return await self.hedging.run(
+                        partial(self._request_provider, provider, messages, site, tier, request_id,
+                                reservation, **kwargs),
+                        key=f"{provider.name}:{site or '*'}",
+                        hedge_call=partial(self._reserved_request, provider, messages, site, tier, request_id,
+                                           **kwargs)
+                    )
+            except DeadlineExceededError:
+                raise  # 剩余预算不足，不再切换
+            except (httpx.RequestError, httpx.HTTPStatusError, UpstreamUnavailableError) as e:
+                if index == len(providers) - 1:
+                    raise
+                self.router.record_failover(provider, site, e)
+    
+    async def _reserved_request(self, provider: LLMProvider, messages: List[Dict[str, str]],
+                                site: Optional[str], tier: ModelTier, request_id: str,
+                                **kwargs) -> Dict[str, Any]:
+        """按 TPM/RPM 限额排队后向单个供应商发送请求"""
+        async with provider.scheduler.reserve(messages, kwargs.get('max_tokens'), site) as reservation:
+            return await self._request_provider(provider, messages, site, tier, request_id, reservation, **kwargs)
+    
+    async def _request_provider(self, provider: LLMProvider, messages: List[Dict[str, str]],
+                                site: Optional[str], tier: ModelTier, request_id: str,
+                                reservation: TokenReservation, **kwargs) -> Dict[str, Any]:
+        """向单个供应商发送请求（已占用限额），返回 OpenAI chat.completion 格式的响应"""
+        model = tier.model_for(provider)
+        payload = provider.build_payload(messages, model=model, **kwargs)
+        
+        # 记录请求开始日志
+        logger.info(f"[{request_id}] 开始调用大模型API: {provider.key}")
+        logger.debug(f"[{request_id}] 请求参数: model={model}, messages_count={len(messages)}, kwargs={kwargs}")
+        
+        # 记录消息内容（仅在debug模式下）
+        for i, msg in enumerate(messages):
+            logger.debug(f"[{request_id}] Message {i}: role={msg.get('role')}, content_length={len(msg.get('content', ''))}")
+        
+        # 已按 TPM/RPM 限额排队，再占用舱壁名额
+        async with provider.guard.protect(), \
+                bounded_call(provider.upstream, self._call_timeout(provider, tier)) as timeout, \
+                self.http_pool.session(provider.upstream) as client:
+            start_time = time.time()  # 响应时间不包含限额排队和舱壁等待
+            try:
+                response = await client.post(
+                    provider.url,
+                    headers=provider.headers,
+                    json=payload,
+                    timeout=timeout
+                )
+                response.raise_for_status()
+                response_data = provider.parse_response(response.json())
+                
+                # 计算响应时间
+                response_time = time.time() - start_time
+                self.router.record(provider, site, response_time, True)
+                self.tiering.record(tier, response_time)
+                
+                # 提取token使用信息，按实际用量修正限额占用
+                usage = response_data.get('usage', {})
+                reservation.settle(usage)
+                self.accounting.record(site, messages, usage)
+                prompt_tokens = usage.get('prompt_tokens', 0)
+                completion_tokens = usage.get('completion_tokens', 0)
+                total_tokens = usage.get('total_tokens', 0)
+                
+                # 记录成功响应日志
+                logger.info(f"[{request_id}] API调用成功 - {provider.name}/{model}, 响应时间: {response_time:.2f}s")
+                logger.info(f"[{request_id}] Token使用情况 - 输入: {prompt_tokens}, 输出: {completion_tokens}, 总计: {total_tokens}")
+                
+                # 记录响应内容长度
+                if 'choices' in response_data and response_data['choices']:
+                    content_length = len(response_data['choices'][0].get('message', {}).get('content', ''))
+                    logger.debug(f"[{request_id}] 响应内容长度: {content_length} 字符")
+                
+                return response_data
+                
+            except httpx.HTTPStatusError as e:
+                response_time = time.time() - start_time
+                self.router.record(provider, site, response_time, False)
+                logger.error(f"[{request_id}] {provider.key} 请求失败 - 状态码: {e.response.status_code}, 响应时间: {response_time:.2f}s")
+                logger.error(f"[{request_id}] 错误详情: {e.response.text}")
+                raise
+            except httpx.RequestError as e:
+                response_time = time.time() - start_time
+                self.router.record(provider, site, response_time, False)
+                if isinstance(e, httpx.TimeoutException):
+                    self.tiering.record(tier, response_time)
+                logger.error(f"[{request_id}] {provider.key} 网络请求错误 - 响应时间: {response_time:.2f}s, 错误: {str(e)}")
+                raise
+            except Exception as e:
+                response_time = time.time() - start_time
+                logger.error(f"[{request_id}] {provider.key} 未知错误 - 响应时间: {response_time:.2f}s, 错误: {str(e)}")
+                raise
+    
+    def is_available(self) -> bool:
+        """是否还有未熔断的大模型供应商"""
+        return self.router.is_available()
+    
+    def _select_tier(self, site: Optional[str], params: Dict[str, Any]) -> Tuple[ModelTier, Dict[str, Any]]:
+        """选择调用点的模型档位，调用方未指定 max_tokens 时使用档位的输出上限"""
+        tier = self.tiering.select(site)
+        if tier.max_tokens and 'max_tokens' not in params:
+            params = {**params, 'max_tokens': tier.max_tokens}
+        return tier, params
+    
+    def _call_timeout(self, provider: LLMProvider, tier: ModelTier) -> float:
+        """单次请求的超时：调用点配置的超时，未配置时使用供应商连接池的超时"""
+        return tier.timeout or self.http_pool.get_timeout(provider.upstream)
+    
+    async def _cached_request(self, messages: List[Dict[str, str]], cache_site: Optional[str] = None,
+                              cache_variants: Optional[int] = None,
+                              cache_validator: Optional[Callable[[Dict[str, Any]], bool]] = None,
+                              **kwargs) -> Dict[str, Any]:
+        """带响应缓存的请求
+        
+        Args:
+            messages: 消息列表
+            cache_site: 调用点名称，为 None 或在 LLM_CACHE_DISABLED_SITES 中时不使用缓存
+            cache_variants: 同一请求缓存的变体数，默认 temperature > 0 时为 LLM_CACHE_VARIANTS，否则为 1
+            cache_validator: 返回 False 的响应（如无法解析的JSON）不写入缓存
+        """
+        tier, kwargs = self._select_tier(cache_site, kwargs)
+        if not self.cache.is_enabled(cache_site):
+            return await self._make_request(messages, site=cache_site, tier=tier, **kwargs)
+        
+        if cache_variants is None:
+            cache_variants = self.cache_variants if kwargs.get('temperature', 0) > 0 else 1
+        key = self.cache.make_key(tier.model, messages, kwargs)
+        
+        cached = await self.cache.get(key, cache_site, cache_variants)
+        if cached is not None:
+            logger.info(f"LLM缓存命中: {cache_site} ({key[:12]})")
+            return cached
+        
+        async def fetch() -> Dict[str, Any]:
+            response = await self._make_request(messages, site=cache_site, tier=tier, **kwargs)
+            if response.get('choices') and (cache_validator is None or cache_validator(response)):
+                await self.cache.put(key, response, cache_variants)
+            return response
+        
+        return await self.flights.do(key, fetch)
+    
+    def _json_params(self) -> Dict[str, Any]:
+        """JSON模式的请求参数，LLM_JSON_MODE=false 时为空（兼容不支持 response_format 的模型）"""
+        return {'response_format': {'type': 'json_object'}} if self.json_mode else {}
+    
+    @property
+    def compact_prompts(self) -> bool:
+        return self.prompt_format != 'verbose'
+    
+    def _encode_json(self, data: Any) -> str:
+        """提示词中的JSON：紧凑格式不缩进、不加空格，保持字段顺序（每天变化的字段在最后）"""
+        if self.compact_prompts:
+            return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+        return json.dumps(data, ensure_ascii=False, indent=2)
+    
+    def _itinerary_schema(self) -> str:
+        return COMPACT_ITINERARY_SCHEMA if self.compact_prompts else DAILY_ITINERARY_TEMPLATE
+    
+    def _prompt_messages(self, system_prompt: str, user_prompt: str) -> List[Dict[str, str]]:
+        """组装消息；紧凑格式去掉每行的缩进和空行"""
+        if self.compact_prompts:
+            system_prompt, user_prompt = (
+                '\n'.join(line.strip() for line in text.splitlines() if line.strip())
+                for text in (system_prompt, user_prompt)
+            )
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
+    
+    def _build_destination_analysis_messages(self, destination: str,
+                                             preferences: Dict[str, Any]) -> List[Dict[str, str]]:
+        """构建目的地分析提示词"""
+        system_prompt = """你是一个专业的旅行顾问。请根据用户提供的目的地和偏好，生成详细的目的地分析报告。
+        报告应包括：
+        1. 目的地概况
+        2. 最佳旅行时间
+        3. 主要景点和活动
+        4. 当地文化和特色
+        5. 交通和住宿建议
+        6. 预算参考
+        
+        请用中文回答，内容要详实且实用。"""
+        
+        user_prompt = f"""目的地：{destination}
+        用户偏好：{self._encode_json(preferences)}
+        
+        请为这个目的地生成详细的分析报告。"""
+        
+        return self._prompt_messages(system_prompt, user_prompt)
+    
+    async def generate_destination_analysis(self, destination: str, preferences: Dict[str, Any]) -> str:
+        """生成目的地分析"""
+        messages = self._build_destination_analysis_messages(destination, preferences)
+        
+        try:
+            response = await self._cached_request(messages, cache_site='destination_analysis',
+                                                  temperature=0.7)
+            return response['choices'][0]['message']['content']
+        except Exception as e:
+            logger.error(f"生成目的地分析失败: {str(e)}")
+            return f"目的地 {destination} 是一个值得探索的地方，具有丰富的文化和自然景观。"
+    
+    def _build_daily_itinerary_messages(self, destination: str, day: int, total_days: int,
+                                        preferences: Dict[str, Any], budget_level: str) -> List[Dict[str, str]]:
+        """构建每日行程提示词
+        
+        系统提示词不含任何天数或用户信息；用户提示词中同一计划各天相同的内容在前，当天的信息在最后。
+        """
+        system_prompt = f"""你是一个专业的旅行规划师。请根据提供的信息生成详细的每日行程安排。
+        
+        请直接返回以下JSON格式的数据，不要添加任何其他文字说明：
+        
+        {self._itinerary_schema()}
         
         重要要求：
         1. 所有cost字段必须是数字，不要包含货币符号
@@ -230,396 +447,497 @@ class QwenLLMService:
         4. 只返回JSON数据，不要添加任何解释文字
         """
         
-        user_prompt = f"""请为以下旅行安排生成第{day}天的详细行程：
-        
-        目的地：{destination}
+        user_prompt = f"""目的地：{destination}
         总行程天数：{total_days}天
-        当前是第{day}天
-        用户偏好：{json.dumps(preferences, ensure_ascii=False, indent=2)}
         预算水平：{budget_level}
+        用户偏好：{self._encode_json(preferences)}
         
-        请生成具体的行程安排，包括真实的景点名称、地址和活动建议。"""
+        请为以上旅行安排生成第{day}天的详细行程，包括真实的景点名称、地址和活动建议。"""
         
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ]
+        return self._prompt_messages(system_prompt, user_prompt)
+    
+    async def generate_daily_itinerary(self, destination: str, day: int, total_days: int, 
+                                     preferences: Dict[str, Any], budget_level: str) -> Dict[str, Any]:
+        """生成每日行程"""
+        messages = self._build_daily_itinerary_messages(destination, day, total_days, preferences, budget_level)
+        params = {'temperature': 0.8, 'max_tokens': self._sections_max_tokens(ITINERARY_PERIODS),
+                  **self._json_params()}
         
-        try:
-            response = await self._make_request(messages, temperature=0.8, max_tokens=1500)
+        def complete(response: Dict[str, Any]) -> bool:
+            # 被截断或缺少时段的响应不写入缓存
             content = response['choices'][0]['message']['content']
+            return not self._is_truncated(response) and not self._missing_periods(content) and \
+                self._parse_itinerary_json(content, day)[0] is not None
+        
+        try:
+            response = await self._cached_request(messages, cache_site='daily_itinerary',
+                                                  cache_validator=complete, **params)
+            content, continued = await self._continue_truncated(messages, response, day, params)
+            itinerary, outcome = self._parse_itinerary_json(content, day)
             
-            # 解析生成的内容并结构化
-            return self._parse_daily_itinerary(content, day)
+            if itinerary is None:
+                # 本地修复失败时重新生成一次（不走缓存）
+                logger.warning(f"第{day}天行程JSON无法解析，重新生成")
+                response = await self._make_request(messages, site='daily_itinerary', **params)
+                content, continued = await self._continue_truncated(messages, response, day, params)
+                itinerary, outcome = self._parse_itinerary_json(content, day)
+                if itinerary is not None:
+                    outcome = 'regenerated'
+            
+            if itinerary is None:
+                # 最后的兜底：从非JSON文本中提取
+                self._record_parse('fallback')
+                return self._fallback_parse_itinerary(content, day)
+            
+            if continued and outcome != 'regenerated':
+                outcome = 'continued'
+            # 续写后仍缺失的时段单独补全，不重新生成整天
+            patched = await self._patch_sections(messages, itinerary, self._missing_periods(content), day, params)
+            if patched:
+                itinerary.update(patched)
+                outcome = 'patched'
+            self._record_parse(outcome)
+            return itinerary
         except Exception as e:
             logger.error(f"生成第{day}天行程失败: {str(e)}")
             return self._get_fallback_itinerary(destination, day)
     
-    def _parse_cost_from_string(self, cost_str: str) -> float:
-        """从字符串中解析费用数字"""
-        import re
-        
-        if not cost_str or not isinstance(cost_str, str):
-            return 0.0
+    def _sections_max_tokens(self, periods: List[str]) -> int:
+        """按请求的时段数计算输出上限，不超过 ITINERARY_MAX_OUTPUT_TOKENS"""
+        return min(self.max_output_tokens, len(periods) * self.tokens_per_section + ITINERARY_BASE_TOKENS)
+    
+    def _is_truncated(self, response: Dict[str, Any]) -> bool:
+        """输出是否被截断：finish_reason 为 length，或JSON括号未闭合"""
+        choice = response['choices'][0]
+        return choice.get('finish_reason') == 'length' or is_truncated(choice['message']['content'])
+    
+    def _missing_periods(self, content: str) -> List[str]:
+        """输出中没有完整生成的时段（缺失、截断在中间或不是对象）"""
+        closed = {key for key, value in IncrementalJSONParser().feed(content or '') if isinstance(value, dict)}
+        return [period for period in ITINERARY_PERIODS if period not in closed]
+    
+    def _join_continuation(self, head: str, tail: str) -> str:
+        """拼接续写的文本，去掉模型重复输出的重叠部分；模型从头重新生成时使用新的输出
         
-        # 移除所有非数字和小数点的字符，提取数字
-        numbers = re.findall(r'\d+(?:\.\d+)?', cost_str)
+        重叠不足 _CONTINUATION_MIN_OVERLAP 个字符且不结束在分隔符或引号上时直接拼接。
+        """
+        tail = _CODE_FENCE_PATTERN.sub('', tail)
+        if tail.lstrip().startswith('{') and '"breakfast"' in tail and '"breakfast"' in head:
+            return tail
+        for size in range(min(len(head), len(tail), 200), 0, -1):
+            overlap = tail[:size]
+            # 很短的重叠可能只是巧合（数字 10 + 0、叠字“谢”+“谢光临”），去掉会丢字符
+            if head.endswith(overlap) and (size >= _CONTINUATION_MIN_OVERLAP
+                                           or overlap.rstrip()[-1:] in _TOKEN_BOUNDARIES):
+                return head + tail[size:]
+        return head + tail
+    
+    async def _continue_truncated(self, messages: List[Dict[str, str]], response: Dict[str, Any], day: int,
+                                  params: Dict[str, Any]) -> Tuple[str, bool]:
+        """输出被截断且有时段未完整生成时，请求模型只续写剩余的文本
         
-        if numbers:
+        Returns:
+            (拼接后的文本, 是否续写过)
+        """
+        content = response['choices'][0]['message']['content']
+        continued = False
+        for _ in range(self.max_continuations):
+            pending = self._missing_periods(content)
+            if not self._is_truncated(response) or not pending:
+                break  # 所有时段都已完整时，末尾字段的截断由本地修复处理
+            logger.info(f"第{day}天行程输出被截断，续写剩余的 {len(pending)} 个时段")
+            # 续写的内容不是完整的JSON对象，不使用JSON模式
+            continuation_params = {key: value for key, value in params.items() if key != 'response_format'}
+            continuation_params['max_tokens'] = self._sections_max_tokens(pending)
             try:
-                # 取第一个找到的数字
-                return float(numbers[0])
-            except (ValueError, IndexError):
-                return 0.0
-        
-        return 0.0
+                response = await self._make_request(
+                    messages + [{"role": "assistant", "content": content},
+                                {"role": "user", "content": CONTINUATION_PROMPT}],
+                    site='daily_itinerary', **continuation_params
+                )
+            except Exception as e:
+                logger.warning(f"第{day}天行程续写失败: {str(e)}")
+                break
+            tail = response['choices'][0]['message']['content']
+            if not tail or not tail.strip():
+                break
+            content = self._join_continuation(content, tail)
+            response = {'choices': [{'message': {'content': content},
+                                     'finish_reason': response['choices'][0].get('finish_reason')}]}
+            continued = True
+        return content, continued
     
-    def _clean_markdown_format(self, text: str) -> str:
-        """清理Markdown格式标记"""
-        import re
+    def _build_patch_messages(self, messages: List[Dict[str, str]], itinerary: Dict[str, Any],
+                              periods: List[str]) -> List[Dict[str, str]]:
+        """构建补全缺失时段的提示词：只发送缺失时段的模板，并列出已安排的时段避免重复"""
+        if self.compact_prompts:
+            template = '{' + ','.join(f'"{period}":S' for period in periods) + f'}}\n其中S为：{ITINERARY_SECTION_SCHEMA}'
+        else:
+            template = json.dumps({period: _TEMPLATE_SECTIONS[period] for period in periods},
+                                  ensure_ascii=False, indent=2)
+        system_prompt = f"""你是一个专业的旅行规划师。已生成的行程缺少部分时段，请只为这些时段补充安排。
         
-        # 清理粗体标记 **text**
-        text = re.sub(r'\*\*(.*?)\*\*', r'\1', text)
+        请直接返回以下JSON格式的数据，不要添加任何其他文字说明：
         
-        # 清理斜体标记 *text*
-        text = re.sub(r'\*(.*?)\*', r'\1', text)
+        {template}
         
-        # 清理列表标记 - text 或 * text
-        text = re.sub(r'^[\s]*[-\*]\s+', '', text, flags=re.MULTILINE)
+        重要要求：
+        1. 所有cost字段必须是数字，不要包含货币符号
+        2. 与当天已安排的时段衔接，不要重复已安排的地点
+        3. 只返回JSON数据，不要添加任何解释文字
+        """
         
-        # 清理标题标记 # text
-        text = re.sub(r'^[\s]*#+\s+', '', text, flags=re.MULTILINE)
+        arranged = '\n'.join(
+            f"        {period}: {itinerary[period].get('name') or itinerary[period].get('activity')}"
+            for period in ITINERARY_PERIODS
+            if period not in periods and (itinerary.get(period) or {}).get('name')
+        )
+        user_prompt = f"""{messages[-1]['content']}
         
-        # 清理数字列表标记 1. text
-        text = re.sub(r'^[\s]*\d+\.\s+', '', text, flags=re.MULTILINE)
+        当天已安排的时段：
+{arranged or '        （无）'}
         
-        # 清理多余的空格和换行
-        text = re.sub(r'\s+', ' ', text).strip()
+        请只补充以下时段：{'、'.join(periods)}"""
         
-        return text
+        return self._prompt_messages(system_prompt, user_prompt)
     
-    def _parse_daily_itinerary(self, content: str, day: int) -> Dict[str, Any]:
-        """解析生成的行程内容"""
-        import json
-        import re
-        
-        # 尝试直接解析JSON
+    async def _patch_sections(self, messages: List[Dict[str, str]], itinerary: Dict[str, Any],
+                              periods: List[str], day: int, params: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+        """只请求缺失的时段，返回通过结构校验的 {时段: 内容}；请求失败时返回空字典"""
+        if not periods or not self.patch_sections:
+            return {}
+        logger.info(f"第{day}天行程缺少时段 {periods}，单独补全")
         try:
-            # 清理可能的markdown格式
-            content = re.sub(r'```json\s*', '', content)
-            content = re.sub(r'```\s*$', '', content)
-            content = content.strip()
-            
-            # 解析JSON
-            itinerary = json.loads(content)
-            
-            # 确保包含所有必要字段
-            default_structure = {
-                'day': day,
-                'breakfast': {
-                    'name': '', 'activity': '', 'location': '', 'address': '', 'duration': '1小时', 
-                    'cost': 0, 'description': '', 'specialties': '', 'features': '', 
-                    'tips': '', 'openTime': '', 'ticketPrice': '免费'
-                },
-                'morning': {
-                    'name': '', 'activity': '', 'location': '', 'address': '', 'duration': '3小时', 
-                    'cost': 0, 'description': '', 'features': '', 'tips': '', 
-                    'openTime': '', 'ticketPrice': ''
-                },
-                'lunch': {
-                    'name': '', 'activity': '', 'location': '', 'address': '', 'duration': '1.5小时', 
-                    'cost': 0, 'description': '', 'specialties': '', 'features': '', 
-                    'tips': '', 'openTime': '', 'ticketPrice': '免费'
-                },
-                'afternoon': {
-                    'name': '', 'activity': '', 'location': '', 'address': '', 'duration': '3.5小时', 
-                    'cost': 0, 'description': '', 'features': '', 'tips': '', 
-                    'openTime': '', 'ticketPrice': ''
-                },
-                'dinner': {
-                    'name': '', 'activity': '', 'location': '', 'address': '', 'duration': '1.5小时', 
-                    'cost': 0, 'description': '', 'specialties': '', 'features': '', 
-                    'tips': '', 'openTime': '', 'ticketPrice': '免费'
-                },
-                'evening': {
-                    'name': '', 'activity': '', 'location': '', 'address': '', 'duration': '2小时', 
-                    'cost': 0, 'description': '', 'features': '', 'tips': '', 
-                    'openTime': '', 'ticketPrice': ''
-                },
-                'transportation': '公共交通/步行',
-                'estimated_cost': '200-500元'
-            }
-            
-            # 合并默认结构和解析结果，并处理费用字段
-            for period in ['breakfast', 'morning', 'lunch', 'afternoon', 'dinner', 'evening']:
-                if period in itinerary:
-                    for key in default_structure[period]:
-                        if key not in itinerary[period]:
-                            itinerary[period][key] = default_structure[period][key]
-                    
-                    # 处理cost字段，确保是数字类型
-                    if 'cost' in itinerary[period]:
-                        cost_value = itinerary[period]['cost']
-                        if isinstance(cost_value, str):
-                            itinerary[period]['cost'] = self._parse_cost_from_string(cost_value)
-                        elif not isinstance(cost_value, (int, float)):
-                            itinerary[period]['cost'] = 0.0
-                else:
-                    itinerary[period] = default_structure[period]
-            
-            # 设置基本信息
-            itinerary['day'] = day
-            if 'transportation' not in itinerary:
-                itinerary['transportation'] = default_structure['transportation']
-            if 'estimated_cost' not in itinerary:
-                itinerary['estimated_cost'] = default_structure['estimated_cost']
-                
-            return itinerary
-            
-        except (json.JSONDecodeError, KeyError) as e:
-            print(f"JSON解析失败，使用备用解析方法: {e}")
-            # 如果JSON解析失败，使用备用解析方法
-            return self._fallback_parse_itinerary(content, day)
+            response = await self._make_request(
+                self._build_patch_messages(messages, itinerary, periods), site='daily_itinerary',
+                **{**params, 'max_tokens': self._sections_max_tokens(periods)}
+            )
+        except Exception as e:
+            logger.warning(f"第{day}天行程时段补全失败: {str(e)}")
+            return {}
+        data, _ = self._load_json(response['choices'][0]['message']['content'])
+        if not isinstance(data, dict):
+            return {}
+        patched = {}
+        for period in periods:
+            section = data.get(period)
+            if isinstance(section, dict) and (section := self._validate_section(period, section)) is not None:
+                patched[period] = section
+        return patched
     
-    def _fallback_parse_itinerary(self, content: str, day: int) -> Dict[str, Any]:
-        """备用解析方法"""
-        import re
+    def plan_itinerary_chunks(self, total_days: int) -> List[List[int]]:
+        """按token预算把行程天数分成若干批，每批一次请求；各批天数尽量均匀"""
+        days_per_call = max(1, min(self.max_days_per_call, self.max_output_tokens // self.tokens_per_day))
+        chunk_count = math.ceil(total_days / days_per_call)
+        base, extra = divmod(total_days, chunk_count)
+        chunks, day = [], 1
+        for i in range(chunk_count):
+            size = base + (1 if i < extra else 0)
+            chunks.append(list(range(day, day + size)))
+            day += size
+        return chunks
+    
+    def _build_multi_day_itinerary_messages(self, destination: str, days: List[int], total_days: int,
+                                            preferences: Dict[str, Any], budget_level: str,
+                                            day_notes: Dict[int, str]) -> List[Dict[str, str]]:
+        """构建多日行程提示词，单日模板只发送一次"""
+        system_prompt = f"""你是一个专业的旅行规划师。请根据提供的信息一次生成连续多天的详细行程安排。
         
-        itinerary = {
-            'day': day,
-            'breakfast': {
-                'name': '', 'activity': '', 'location': '', 'address': '', 'duration': '1小时', 
-                'cost': 0, 'description': '', 'specialties': '', 'features': '', 
-                'tips': '', 'openTime': '', 'ticketPrice': '免费'
-            },
-            'morning': {
-                'name': '', 'activity': '', 'location': '', 'address': '', 'duration': '3小时', 
-                'cost': 0, 'description': '', 'features': '', 'tips': '', 
-                'openTime': '', 'ticketPrice': ''
-            },
-            'lunch': {
-                'name': '', 'activity': '', 'location': '', 'address': '', 'duration': '1.5小时', 
-                'cost': 0, 'description': '', 'specialties': '', 'features': '', 
-                'tips': '', 'openTime': '', 'ticketPrice': '免费'
-            },
-            'afternoon': {
-                'name': '', 'activity': '', 'location': '', 'address': '', 'duration': '3.5小时', 
-                'cost': 0, 'description': '', 'features': '', 'tips': '', 
-                'openTime': '', 'ticketPrice': ''
-            },
-            'dinner': {
-                'name': '', 'activity': '', 'location': '', 'address': '', 'duration': '1.5小时', 
-                'cost': 0, 'description': '', 'specialties': '', 'features': '', 
-                'tips': '', 'openTime': '', 'ticketPrice': '免费'
-            },
-            'evening': {
-                'name': '', 'activity': '', 'location': '', 'address': '', 'duration': '2小时', 
-                'cost': 0, 'description': '', 'features': '', 'tips': '', 
-                'openTime': '', 'ticketPrice': ''
-            },
-            'transportation': '公共交通/步行',
-            'estimated_cost': '200-500元'
-        }
+        请直接返回以下JSON格式的数据，不要添加任何其他文字说明：
         
-        # 按时间段分割内容
-        sections = {
-            'morning': [],
-            'afternoon': [],
-            'evening': []
-        }
+        {{"days": [每天一个对象]}}
         
-        lines = content.split('\n')
-        current_section = None
+        每天的对象格式如下：
         
-        for line in lines:
-            line = line.strip()
-            if not line:
-                continue
-                
-            # 识别时间段
-            if re.search(r'(上午|早上|morning)', line, re.IGNORECASE):
-                current_section = 'morning'
-                # 同时将这一行的内容也加入到对应时间段
-                sections[current_section].append(line)
-                continue
-            elif re.search(r'(中午|午餐|lunch)', line, re.IGNORECASE):
-                current_section = 'afternoon'  # 中午的内容归到下午
-                sections[current_section].append(line)
-                continue
-            elif re.search(r'(下午|afternoon)', line, re.IGNORECASE):
-                current_section = 'afternoon'
-                sections[current_section].append(line)
-                continue
-            elif re.search(r'(晚上|傍晚|晚餐|evening)', line, re.IGNORECASE):
-                current_section = 'evening'
-                sections[current_section].append(line)
-                continue
-            
-            if current_section and line:
-                sections[current_section].append(line)
+        {self._itinerary_schema()}
         
-        # 解析每个时间段的内容
-        for section_name, section_lines in sections.items():
-            if not section_lines:
-                continue
-                
-            # 对于每个时间段，只处理第一行（最相关的内容）
-            line = section_lines[0] if section_lines else ''
-            if not line:
+        重要要求：
+        1. 所有cost字段必须是数字，不要包含货币符号
+        2. 必须包含name、openTime、ticketPrice、specialties、features、tips等详细字段
+        3. 确保所有推荐都是真实存在的，提供准确的地址和价格信息
+        4. days数组按天数顺序包含要求的每一天，day字段为对应的天数，不同天的景点和餐厅不要重复
+        5. 只返回JSON数据，不要添加任何解释文字
+        """
+        
+        notes = "\n".join(f"        第{day}天：{day_notes[day]}" for day in days if day_notes.get(day))
+        user_prompt = f"""目的地：{destination}
+        总行程天数：{total_days}天
+        预算水平：{budget_level}
+        用户偏好：{self._encode_json(preferences)}
+        各天天气提醒：
+{notes or '        无'}
+        
+        请为以上旅行安排生成第{days[0]}天至第{days[-1]}天的详细行程，包括真实的景点名称、地址和活动建议。"""
+        
+        return self._prompt_messages(system_prompt, user_prompt)
+    
+    async def generate_multi_day_itinerary(self, destination: str, days: List[int], total_days: int,
+                                           preferences: Dict[str, Any], budget_level: str,
+                                           day_notes: Optional[Dict[int, str]] = None) -> Dict[int, Dict[str, Any]]:
+        """一次请求生成连续多天的行程
+        
+        Returns:
+            天数 -> 单日行程；请求失败或某天缺失时不包含该天，由调用方逐天补生成
+        """
+        messages = self._build_multi_day_itinerary_messages(
+            destination, days, total_days, preferences, budget_level, day_notes or {}
+        )
+        max_tokens = min(self.max_output_tokens, self.tokens_per_day * len(days) + 200)
+        
+        try:
+            response = await self._cached_request(messages, cache_site='multi_day_itinerary',
+                                                  temperature=0.8, max_tokens=max_tokens,
+                                                  **self._json_params())
+            content = response['choices'][0]['message']['content']
+            return self._parse_multi_day_itinerary(content, days)
+        except Exception as e:
+            logger.error(f"生成第{days[0]}-{days[-1]}天行程失败: {str(e)}")
+            return {}
+    
+    def _parse_multi_day_itinerary(self, content: str, days: List[int]) -> Dict[int, Dict[str, Any]]:
+        """解析多日行程，兼容 {"days": [...]} 和直接返回数组两种格式"""
+        data, outcome = self._load_json(content)
+        if data is None:
+            logger.warning("多日行程JSON解析失败")
+            self._record_parse('fallback')
+            return {}
+        self._record_parse(outcome)
+        
+        items = data.get('days', []) if isinstance(data, dict) else data
+        if not isinstance(items, list):
+            return {}
+        
+        result = {}
+        for index, item in enumerate(items):
+            if not isinstance(item, dict):
                 continue
-                
-            # 提取活动和位置信息
-            activity_text = ''
-            location_text = ''
-            
-            # 尝试提取具体的景点名称、餐厅名称等
-            # 匹配常见的景点、餐厅、地址模式
-            location_patterns = [
-                r'([\u4e00-\u9fa5]+(?:博物馆|公园|寺|庙|塔|楼|山|湖|河|街|路|广场|中心|景区|风景区))',
-                r'([\u4e00-\u9fa5]+(?:餐厅|酒店|饭店|茶楼|咖啡厅|小吃店|美食城))',
-                r'([\u4e00-\u9fa5]+(?:大学|学院|图书馆|剧院|影院|商场|市场))',
-                r'地址[：:](.*?)(?:[，,。]|$)',
-                r'位置[：:](.*?)(?:[，,。]|$)',
-                r'在(.*?)(?:[，,。]|$)'
-            ]
-            
-            # 提取位置信息
-            for pattern in location_patterns:
-                matches = re.findall(pattern, line)
-                if matches:
-                    location_candidate = matches[0].strip()
-                    if location_candidate and len(location_candidate) > 1:
-                        location_text = location_candidate
-                        break
-            
-            # 提取活动描述（移除时间段标识后的内容）
-            # 清理时间段标识
-            clean_line = re.sub(r'^(上午|下午|中午|晚上|早上|傍晚)[：:]?\s*', '', line)
-            # 清理时间、价格等信息，保留主要活动描述
-            clean_line = re.sub(r'\d+[：:]\d+', '', clean_line)  # 移除时间
-            clean_line = re.sub(r'\d+元', '', clean_line)  # 移除价格
-            clean_line = re.sub(r'[（(].*?[）)]', '', clean_line)  # 移除括号内容
-            clean_line = clean_line.strip('，,。. ')
-            if clean_line:
-                activity_text = clean_line
-            
-            # 设置解析结果
-            if activity_text:
-                itinerary[section_name]['activity'] = activity_text
-            if location_text:
-                itinerary[section_name]['location'] = location_text
-            
-            # 如果没有找到具体位置，根据活动类型设置默认位置
-            if not itinerary[section_name]['location'] and itinerary[section_name]['activity']:
-                activity = itinerary[section_name]['activity']
-                if '餐' in activity or '吃' in activity or '美食' in activity:
-                    itinerary[section_name]['location'] = f"当地特色餐厅"
-                elif '博物馆' in activity:
-                    itinerary[section_name]['location'] = f"博物馆"
-                elif '公园' in activity or '漫步' in activity:
-                    itinerary[section_name]['location'] = f"城市公园"
-                elif '购物' in activity or '商场' in activity:
-                    itinerary[section_name]['location'] = f"购物中心"
-                else:
-                    itinerary[section_name]['location'] = f"市区景点"
-        
-        return itinerary
-    
-    def _extract_meal_info(self, text: str, meal_info: Dict[str, str]):
-        """提取餐厅信息"""
-        import re
-        
-        # 提取餐厅名称
-        restaurant_patterns = [
-            r'餐厅名称[：:]\s*([^\n]+)',
-            r'([^，。！？\n]+(?:餐厅|酒楼|饭店|小吃|美食|茶楼|咖啡|酒吧|食堂))'
-        ]
+            # 优先使用模型返回的day字段，缺失时按数组顺序对应
+            day = item.get('day') if item.get('day') in days else (days[index] if index < len(days) else None)
+            if day is not None and day not in result:
+                try:
+                    result[day] = self._normalize_daily_itinerary(item, day)
+                except ValidationError as e:
+                    logger.warning(f"第{day}天行程不符合结构: {e.error_count()} 个错误")
+        return result
+    
+    async def _stream_request(self, messages: List[Dict[str, str]], site: Optional[str] = None,
+                              tier: Optional[ModelTier] = None, **kwargs) -> AsyncIterator[str]:
+        """以流式（SSE）方式调用API，逐段返回生成的文本
         
-        for pattern in restaurant_patterns:
-            match = re.search(pattern, text)
-            if match:
-                meal_info['location'] = match.group(1).strip()
-                meal_info['activity'] = f"在{match.group(1).strip()}用餐"
-                break
+        只在收到第一段文本之前切换供应商，已经返回的内容不会重复。
+        """
+        if tier is None:
+            tier, kwargs = self._select_tier(site, kwargs)
+        request_id = f"req_{int(time.time() * 1000)}"
+        providers = self.router.rank(site)
+        if not providers:
+            raise CircuitOpenError('llm', "所有大模型供应商熔断中")
+        self.router.stats['requests'] += 1
         
-        # 提取地址
-        address_match = re.search(r'地址[：:]\s*([^\n]+)', text)
-        if address_match:
-            meal_info['description'] = address_match.group(1).strip()
-        
-        # 提取推荐菜品
-        dishes_match = re.search(r'推荐菜品[：:]\s*([^\n]+)', text)
-        if dishes_match:
-            meal_info['dishes'] = dishes_match.group(1).strip()
-        
-        # 提取人均消费
-        cost_match = re.search(r'人均消费[：:]\s*([^\n]+)', text)
-        if cost_match:
-            meal_info['cost'] = cost_match.group(1).strip()
-        
-        # 提取特色介绍
-        features_match = re.search(r'特色介绍[：:]\s*([^\n]+)', text)
-        if features_match:
-            meal_info['features'] = features_match.group(1).strip()
-    
-    def _extract_activity_info(self, text: str, activity_info: Dict[str, str]):
-        """提取活动信息"""
-        import re
-        
-        # 提取景点名称
-        location_patterns = [
-            r'景点名称[：:]\s*([^\n]+)',
-            r'活动名称[：:]\s*([^\n]+)',
-            r'([^，。！？\n]+(?:景区|公园|寺|庙|塔|楼|馆|院|山|湖|桥|街|路|广场|中心))'
-        ]
+        for index, provider in enumerate(providers):
+            emitted = False
+            try:
+                async for content in self._stream_provider(provider, messages, site, tier, request_id, **kwargs):
+                    emitted = True
+                    yield content
+                return
+            except DeadlineExceededError:
+                raise
+            except (httpx.RequestError, httpx.HTTPStatusError, UpstreamUnavailableError) as e:
+                if emitted or index == len(providers) - 1:
+                    raise
+                self.router.record_failover(provider, site, e)
+    
+    async def _stream_provider(self, provider: LLMProvider, messages: List[Dict[str, str]],
+                               site: Optional[str], tier: ModelTier, request_id: str,
+                               **kwargs) -> AsyncIterator[str]:
+        """向单个供应商发起流式请求"""
+        payload = provider.build_payload(messages, stream=True, model=tier.model_for(provider), **kwargs)
+        
+        logger.info(f"[{request_id}] 开始流式调用大模型API: {provider.key}")
+        first_chunk_time = None
+        
+        output = []
+        async with provider.scheduler.reserve(messages, kwargs.get('max_tokens'), site) as reservation, \
+                provider.guard.protect(), \
+                bounded_call(provider.upstream, self._call_timeout(provider, tier)) as timeout, \
+                self.http_pool.session(provider.upstream) as client:
+            start_time = time.time()  # 响应时间不包含限额排队和舱壁等待
+            try:
+                async with client.stream(
+                    'POST',
+                    provider.url,
+                    headers=provider.headers,
+                    json=payload,
+                    timeout=timeout
+                ) as response:
+                    response.raise_for_status()
+                    async for line in response.aiter_lines():
+                        if not line.startswith('data:'):
+                            continue
+                        content, done = provider.parse_stream_event(line[5:].strip())
+                        if done:
+                            break
+                        if content:
+                            if first_chunk_time is None:
+                                first_chunk_time = time.time() - start_time
+                            output.append(content)
+                            yield content
+                reservation.settle(completion_text=''.join(output))  # 流式响应没有 usage，按输出文本估算
+                self.accounting.record(site, messages, completion_text=''.join(output))
+            except (httpx.RequestError, httpx.HTTPStatusError) as e:
+                self.router.record(provider, site, time.time() - start_time, False)
+                if isinstance(e, httpx.TimeoutException):
+                    self.tiering.record(tier, time.time() - start_time)
+                raise
         
-        for pattern in location_patterns:
-            match = re.search(pattern, text)
-            if match:
-                activity_info['location'] = match.group(1).strip()
-                activity_info['activity'] = f"游览{match.group(1).strip()}"
-                break
+        self.router.record(provider, site, time.time() - start_time, True)
+        self.tiering.record(tier, time.time() - start_time)
+        logger.info(f"[{request_id}] 流式调用完成 - {provider.key}, 首字节: {first_chunk_time or 0:.2f}s, "
+                    f"总耗时: {time.time() - start_time:.2f}s")
+    
+    async def stream_daily_itinerary(self, destination: str, day: int, total_days: int,
+                                     preferences: Dict[str, Any],
+                                     budget_level: str) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """流式生成每日行程，每个餐饮/活动时段的JSON对象闭合后立即返回 (时段, 内容)
         
-        # 提取地址
-        address_match = re.search(r'地址[：:]\s*([^\n]+)', text)
-        if address_match:
-            activity_info['description'] = address_match.group(1).strip()
-        
-        # 提取开放时间
-        hours_match = re.search(r'开放时间[：:]\s*([^\n]+)', text)
-        if hours_match:
-            activity_info['opening_hours'] = hours_match.group(1).strip()
-        
-        # 提取门票价格
-        price_match = re.search(r'门票价格[：:]\s*([^\n]+)', text)
-        if price_match:
-            activity_info['cost'] = price_match.group(1).strip()
-        
-        # 提取游览重点或活动内容
-        highlights_patterns = [
-            r'游览重点[：:]\s*([^\n]+)',
-            r'活动内容[：:]\s*([^\n]+)'
-        ]
+        流式请求失败或输出无法增量解析时，回退到完整解析/非流式生成，
+        保证每个时段最多返回一次。
+        """
+        messages = self._build_daily_itinerary_messages(destination, day, total_days, preferences, budget_level)
+        tier, params = self._select_tier('daily_itinerary', {
+            'temperature': 0.8, 'max_tokens': self._sections_max_tokens(ITINERARY_PERIODS), **self._json_params()
+        })
+        
+        cache_key = None
+        variants = self.cache_variants
+        if self.cache.is_enabled('daily_itinerary'):
+            cache_key = self.cache.make_key(tier.model, messages, params)
+            cached = await self.cache.get(cache_key, 'daily_itinerary', variants)
+            if cached is not None:
+                itinerary = self._parse_daily_itinerary(cached['choices'][0]['message']['content'], day)
+                for period in ITINERARY_PERIODS:
+                    if itinerary.get(period):
+                        yield period, itinerary[period]
+                return
+        
+        parser = IncrementalJSONParser()
+        emitted = set()
+        completed = False
+        try:
+            async for chunk in self._stream_request(messages, site='daily_itinerary', tier=tier, **params):
+                for period, section in parser.feed(chunk):
+                    if period in ITINERARY_PERIODS and period not in emitted and isinstance(section, dict):
+                        section = self._validate_section(period, section)
+                        if section is None:
+                            continue
+                        emitted.add(period)
+                        yield period, section
+            completed = True
+        except Exception as e:
+            logger.error(f"流式生成第{day}天行程失败: {str(e)}")
+            if not emitted:
+                itinerary = await self.generate_daily_itinerary(destination, day, total_days,
+                                                                preferences, budget_level)
+                for period in ITINERARY_PERIODS:
+                    if itinerary.get(period):
+                        yield period, itinerary[period]
+                return
+        
+        content = parser.text
+        if completed and content and cache_key and len(emitted) == len(ITINERARY_PERIODS):
+            await self.cache.put(cache_key, {'choices': [{'message': {'content': content}}]}, variants)
+        
+        # 补齐增量解析未能返回的时段：已返回的时段保留，缺失的时段单独补全，补全失败时走本地修复或备用解析
+        if len(emitted) == len(ITINERARY_PERIODS):
+            self._record_parse('strict')
+            return
+        missing = [period for period in ITINERARY_PERIODS if period not in emitted]
+        itinerary, outcome = self._parse_itinerary_json(content, day) if content else (None, None)
+        if itinerary is not None:
+            patched = await self._patch_sections(messages, itinerary, missing, day, params)
+            itinerary.update(patched)
+            self._record_parse('patched' if patched else outcome)
+        else:
+            itinerary = (self._parse_daily_itinerary(content, day) if content
+                         else self._get_fallback_itinerary(destination, day))
+        for period in missing:
+            if itinerary.get(period):
+                yield period, itinerary[period]
+    
+    def _load_json(self, content: str) -> Tuple[Optional[Any], Optional[str]]:
+        """严格解析JSON，失败时本地修复后再解析
         
-        for pattern in highlights_patterns:
-            match = re.search(pattern, text)
-            if match:
-                if 'highlights' in activity_info:
-                    activity_info['highlights'] = match.group(1).strip()
-                else:
-                    activity_info['content'] = match.group(1).strip()
-                break
+        Returns:
+            (数据, 'strict' | 'repaired')；修复后仍无法解析时为 (None, None)
+        """
+        content = _CODE_FENCE_PATTERN.sub('', content or '').strip()
+        try:
+            return json.loads(content), 'strict'
+        except json.JSONDecodeError:
+            pass
+        try:
+            return json.loads(repair_json(content)), 'repaired'
+        except json.JSONDecodeError:
+            return None, None
+    
+    def _parse_itinerary_json(self, content: str, day: int) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """解析并按结构校验单日行程，返回 (行程, 解析方式)，无法得到合法结构时行程为 None"""
+        data, outcome = self._load_json(content)
+        if not isinstance(data, dict) or not any(period in data for period in ITINERARY_PERIODS):
+            return None, None
+        try:
+            return self._normalize_daily_itinerary(data, day), outcome
+        except ValidationError as e:
+            logger.warning(f"第{day}天行程不符合结构: {e.error_count()} 个错误")
+            return None, None
+    
+    def _record_parse(self, outcome: str):
+        """记录一次行程解析结果"""
+        self.parse_stats['total'] += 1
+        self.parse_stats[outcome] += 1
+    
+    def get_parse_stats(self) -> Dict[str, Any]:
+        """行程解析统计，failure_rate 为本地（严格解析+修复）无法解析的比例"""
+        stats = dict(self.parse_stats)
+        total = stats['total']
+        stats['repair_rate'] = round(stats['repaired'] / total, 4) if total else 0.0
+        stats['failure_rate'] = round((stats['regenerated'] + stats['fallback']) / total, 4) if total else 0.0
+        stats['json_mode'] = self.json_mode
+        return stats
+    
+    def _validate_section(self, period: str, section: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """按结构校验单个时段并补全该时段的默认字段"""
+        try:
+            return ItinerarySection.model_validate({**PERIOD_DEFAULTS[period], **section}).model_dump()
+        except ValidationError:
+            return None
+    
+    def _parse_daily_itinerary(self, content: str, day: int) -> Dict[str, Any]:
+        """解析生成的行程内容：严格解析 -> 本地修复 -> 备用文本解析"""
+        itinerary, outcome = self._parse_itinerary_json(content, day)
+        if itinerary is not None:
+            self._record_parse(outcome)
+            return itinerary
         
-        # 提取交通方式
-        transport_match = re.search(r'交通方式[：:]\s*([^\n]+)', text)
-        if transport_match:
-            activity_info['transportation'] = transport_match.group(1).strip()
+        logger.warning(f"第{day}天行程JSON解析失败，使用备用解析方法")
+        self._record_parse('fallback')
+        return self._fallback_parse_itinerary(content, day)
+    
+    def _normalize_daily_itinerary(self, itinerary: Dict[str, Any], day: int) -> Dict[str, Any]:
+        """按 DailyItinerary 结构校验单日行程，补全缺失字段并将费用统一为数字
         
-        # 提取注意事项
-        notes_match = re.search(r'注意事项[：:]\s*([^\n]+)', text)
-        if notes_match:
-            activity_info['notes'] = notes_match.group(1).strip()
-
+        缺失或不是对象的时段按该时段的默认值补全。
+        
+        Raises:
+            ValidationError: 结构无法修正（例如 estimated_cost 是对象、transportation 是列表）
+        """
+        return DailyItinerary.model_validate({**itinerary, 'day': day}).model_dump()
+    
+    def _fallback_parse_itinerary(self, content: str, day: int) -> Dict[str, Any]:
+        """备用解析方法：从非JSON文本中按时段提取字段"""
+        return self._normalize_daily_itinerary(extract_itinerary(content, day), day)
+    
     def _get_fallback_itinerary(self, destination: str, day: int) -> Dict[str, Any]:
         """获取备用行程"""
         return {
@@ -643,8 +961,8 @@ class QwenLLMService:
             'estimated_cost': '200-500元'
         }
     
-    async def generate_travel_tips(self, destination: str, preferences: Dict[str, Any]) -> List[str]:
-        """生成旅行贴士"""
+    def _build_travel_tips_messages(self, destination: str, preferences: Dict[str, Any]) -> List[Dict[str, str]]:
+        """构建旅行贴士提示词"""
         system_prompt = """你是一个经验丰富的旅行顾问。请根据目的地和用户偏好，生成实用的旅行贴士。
         
         贴士应该包括：
@@ -657,17 +975,19 @@ class QwenLLMService:
         每个贴士要简洁明了，用中文回答。"""
         
         user_prompt = f"""目的地：{destination}
-        用户偏好：{json.dumps(preferences, ensure_ascii=False, indent=2)}
+        用户偏好：{self._encode_json(preferences)}
         
         请生成5-8个实用的旅行贴士。"""
         
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ]
+        return self._prompt_messages(system_prompt, user_prompt)
+    
+    async def generate_travel_tips(self, destination: str, preferences: Dict[str, Any]) -> List[str]:
+        """生成旅行贴士"""
+        messages = self._build_travel_tips_messages(destination, preferences)
         
         try:
-            response = await self._make_request(messages, temperature=0.6, max_tokens=800)
+            response = await self._cached_request(messages, cache_site='travel_tips',
+                                                  temperature=0.6)
             content = response['choices'][0]['message']['content']
             
             # 解析贴士
@@ -679,7 +999,7 @@ class QwenLLMService:
                     tip = line.lstrip('•-*0123456789. ').strip()
                     if tip:
                         # 清理Markdown格式
-                        tip = self._clean_markdown_format(tip)
+                        tip = clean_markdown(tip)
                         tips.append(tip)
             
             return tips[:8] if tips else [f"在{destination}旅行时，建议提前了解当地文化和习俗。"]
@@ -0,0 +1,163 @@
+"""高德地图响应缓存
+
+有容量上限的LRU缓存，按接口分组设置有效期：地理编码几乎不变（天级），
+POI 搜索结果按小时更新，路线和距离受路况影响（分钟级）。
+
+条目按最近访问顺序保存在 OrderedDict 中。读取时只检查该条目是否过期（O(1)）；
+写入时从最久未访问的一端依次移除已过期的条目，再按容量淘汰，每个条目最多被移除一次
+（摊还 O(1)），不需要扫描整个缓存。
+
+写入前只保留解析时用到的字段（例如去掉路线的 polyline 和路况分段），
+减少缓存占用的内存。
+"""
+
+import os
+import time
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+from dotenv import load_dotenv
+
+# 加载环境变量
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 接口 -> 缓存分组
+ENDPOINT_GROUPS = {
+    'geocode/geo': 'geocode',
+    'geocode/regeo': 'geocode',
+    'place/text': 'poi',
+    'direction/driving': 'route',
+    'distance': 'route',
+}
+
+# 各分组默认的有效期（秒），可通过 AMAP_CACHE_TTL_<GROUP> 覆盖
+GROUP_TTLS = {
+    'geocode': 7 * 86400.0,
+    'poi': 6 * 3600.0,
+    'route': 600.0,
+    'default': 300.0,
+}
+
+# 各接口缓存时保留的字段
+_GEOCODE_FIELDS = ('formatted_address', 'location', 'level', 'province', 'city', 'district')
+_POI_FIELDS = ('name', 'address', 'location', 'type', 'typecode', 'tel', 'distance', 'business_area',
+               'citycode', 'adcode')
+_PATH_FIELDS = ('distance', 'duration', 'tolls', 'toll_distance', 'traffic_lights')
+_STEP_FIELDS = ('instruction', 'road', 'distance', 'duration', 'action', 'assistant_action')
+_ADDRESS_FIELDS = ('province', 'city', 'district', 'township')
+
+def _pick(data: Dict[str, Any], fields: Tuple[str, ...]) -> Dict[str, Any]:
+    return {field: data[field] for field in fields if field in data}
+
+def trim_response(endpoint: str, data: Dict[str, Any]) -> Dict[str, Any]:
+    """只保留解析时用到的字段；未知接口原样返回"""
+    trimmed = _pick(data, ('status', 'info'))
+    if endpoint == 'geocode/geo':
+        # 只使用第一个结果
+        trimmed['geocodes'] = [_pick(geocode, _GEOCODE_FIELDS) for geocode in (data.get('geocodes') or [])[:1]]
+    elif endpoint == 'geocode/regeo':
+        regeocode = data.get('regeocode') or {}
+        component = regeocode.get('addressComponent') or {}
+        trimmed['regeocode'] = {
+            'formatted_address': regeocode.get('formatted_address', ''),
+            'addressComponent': {
+                **_pick(component, _ADDRESS_FIELDS),
+                'neighborhood': {'name': (component.get('neighborhood') or {}).get('name', '')},
+                'building': {'name': (component.get('building') or {}).get('name', '')},
+            }
+        }
+    elif endpoint == 'place/text':
+        trimmed['pois'] = [_pick(poi, _POI_FIELDS) for poi in data.get('pois') or []]
+    elif endpoint == 'direction/driving':
+        # 只使用第一条路径，去掉 polyline、路况分段等
+        paths = ((data.get('route') or {}).get('paths') or [])[:1]
+        trimmed['route'] = {'paths': [
+            {**_pick(path, _PATH_FIELDS), 'steps': [_pick(step, _STEP_FIELDS) for step in path.get('steps') or []]}
+            for path in paths
+        ]}
+    elif endpoint == 'distance':
+        trimmed['results'] = [_pick(result, ('distance', 'duration')) for result in data.get('results') or []]
+    else:
+        return data
+    return trimmed
+
+class MapResponseCache:
+    """有容量上限、按接口分组设置有效期的LRU缓存"""
+
+    def __init__(self, max_entries: Optional[int] = None, ttls: Optional[Dict[str, float]] = None):
+        self.max_entries = max_entries or int(os.getenv('AMAP_CACHE_MAX_ENTRIES', 2048))
+        self.ttls = {
+            group: float(os.getenv(f'AMAP_CACHE_TTL_{group.upper()}', default))
+            for group, default in GROUP_TTLS.items()
+        }
+        self.ttls.update(ttls or {})
+        # 键 -> (过期时间, 分组, 数据)，按最近访问顺序排列
+        self._entries: "OrderedDict[str, Tuple[float, str, Dict[str, Any]]]" = OrderedDict()
+        self.stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0, 'stores': 0}
+        self.group_stats: Dict[str, Dict[str, int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def group_of(self, endpoint: str) -> str:
+        return ENDPOINT_GROUPS.get(endpoint, 'default')
+
+    def _count(self, group: str, outcome: str):
+        self.stats[outcome] += 1
+        counters = self.group_stats.setdefault(group, {'hits': 0, 'misses': 0})
+        if outcome in counters:
+            counters[outcome] += 1
+
+    def get(self, endpoint: str, key: str) -> Optional[Dict[str, Any]]:
+        """读取未过期的条目，命中时移到最近访问的一端"""
+        group = self.group_of(endpoint)
+        entry = self._entries.get(key)
+        if entry is None:
+            self._count(group, 'misses')
+            return None
+        expires_at, _, data = entry
+        if time.monotonic() >= expires_at:
+            del self._entries[key]
+            self.stats['expired'] += 1
+            self._count(group, 'misses')
+            return None
+        self._entries.move_to_end(key)
+        self._count(group, 'hits')
+        return data
+
+    def put(self, endpoint: str, key: str, data: Dict[str, Any]):
+        """写入裁剪后的响应，移除最久未访问一端的过期条目，超出容量时淘汰最久未访问的条目"""
+        group = self.group_of(endpoint)
+        ttl = self.ttls.get(group, self.ttls['default'])
+        if ttl <= 0:
+            return
+        now = time.monotonic()
+        self._entries[key] = (now + ttl, group, trim_response(endpoint, data))
+        self._entries.move_to_end(key)
+        self.stats['stores'] += 1
+
+        while self._entries:
+            oldest_key, (expires_at, _, _) = next(iter(self._entries.items()))
+            if expires_at > now:
+                break
+            del self._entries[oldest_key]
+            self.stats['expired'] += 1
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.stats['hits'] + self.stats['misses']
+        return {
+            'size': len(self._entries),
+            'max_entries': self.max_entries,
+            'ttls': self.ttls,
+            'hit_rate': round(self.stats['hits'] / lookups, 4) if lookups else 0.0,
+            **self.stats,
+            'groups': self.group_stats
+        }
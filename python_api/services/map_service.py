@@ -4,13 +4,22 @@ import time
 import logging
 from typing import Dict, List, Optional, Any, Tuple
 import httpx
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
+from tenacity import retry, stop_after_attempt, wait_exponential
 from dotenv import load_dotenv
 import math
 import asyncio
-from functools import lru_cache
+from functools import lru_cache, partial
 import hashlib
 
+from services.http_client import HTTPClientPool, http_client_pool
+from services.resilience import UpstreamUnavailableError, retry_while_available, upstream_guards
+from services.deadline import bounded_call, stop_before_deadline
+from services.hedging import hedge_policies
+from services.singleflight import flight_groups
+from services.map_cache import ENDPOINT_GROUPS, MapResponseCache
+from services.map_store import MapResultStore
+from services.rate_limiter import RateLimiter
+
 # 加载环境变量
 load_dotenv()
 
@@ -19,13 +28,17 @@ logger = logging.getLogger(__name__)
 class MapService:
     """地图服务类"""
     
-    def __init__(self):
+    def __init__(self, http_pool: Optional[HTTPClientPool] = None):
         self.amap_key = os.getenv('AMAP_API_KEY')  # 高德地图API密钥
-        self.amap_base_url = "https://restapi.amap.com/v3"
-        self._last_request_time = 0  # 上次请求时间
-        self._min_request_interval = 0.2  # 最小请求间隔（秒）
-        self._request_cache = {}  # 请求缓存
-        self._cache_ttl = 300  # 缓存有效期（秒）
+        self.amap_base_url = os.getenv('AMAP_BASE_URL', "https://restapi.amap.com/v3")
+        self.rate_limiter = RateLimiter.from_env('amap', ENDPOINT_GROUPS)  # 令牌桶限流，按接口分组配额
+        self.cache = MapResponseCache()  # 有容量上限的LRU缓存，按接口分组设置有效期
+        self.store = MapResultStore()  # 地理编码和POI结果的持久化存储（第二级缓存）
+        self.http_pool = http_pool or http_client_pool  # 共享连接池
+        self.http_pool.register('amap', timeout=10.0)
+        self.guard = upstream_guards.get('amap')  # 熔断器 + 舱壁
+        self.hedging = hedge_policies.get('amap')  # 对冲请求（HEDGE_AMAP_ENABLED）
+        self.flights = flight_groups.get('amap')  # 合并并发的相同查询，计划内记忆化
         
         if not self.amap_key:
             logger.warning("高德地图API密钥未配置，地图功能将使用模拟数据")
@@ -37,41 +50,10 @@ class MapService:
         cache_data = f"{endpoint}:{json.dumps(cache_params, sort_keys=True)}"
         return hashlib.md5(cache_data.encode()).hexdigest()
     
-    def _is_cache_valid(self, cache_time: float) -> bool:
-        """检查缓存是否有效"""
-        return time.time() - cache_time < self._cache_ttl
-    
-    async def _wait_for_rate_limit(self):
-        """等待满足频率限制"""
-        current_time = time.time()
-        time_since_last = current_time - self._last_request_time
-        
-        if time_since_last < self._min_request_interval:
-            wait_time = self._min_request_interval - time_since_last
-            logger.debug(f"频率控制：等待 {wait_time:.2f} 秒")
-            await asyncio.sleep(wait_time)
-        
-        self._last_request_time = time.time()
-    
-    def _cleanup_expired_cache(self):
-        """清理过期缓存"""
-        current_time = time.time()
-        expired_keys = []
-        
-        for key, (data, cache_time) in self._request_cache.items():
-            if current_time - cache_time >= self._cache_ttl:
-                expired_keys.append(key)
-        
-        for key in expired_keys:
-            del self._request_cache[key]
-        
-        if expired_keys:
-            logger.debug(f"清理了 {len(expired_keys)} 个过期缓存")
-    
     @retry(
-        stop=stop_after_attempt(3),
+        stop=stop_after_attempt(3) | stop_before_deadline(2),
         wait=wait_exponential(multiplier=1, min=2, max=8),
-        retry=retry_if_exception_type((httpx.RequestError, httpx.HTTPStatusError))
+        retry=retry_while_available('amap', (httpx.RequestError, httpx.HTTPStatusError))
     )
     async def _make_request(self, endpoint: str, params: Dict[str, Any]) -> Dict[str, Any]:
         """发送HTTP请求到高德地图API"""
@@ -82,17 +64,20 @@ class MapService:
         cache_key = self._get_cache_key(endpoint, params)
         
         # 检查缓存
-        if cache_key in self._request_cache:
-            cached_data, cache_time = self._request_cache[cache_key]
-            if self._is_cache_valid(cache_time):
-                logger.info(f"[{request_id}] 使用缓存数据: {endpoint}")
-                return cached_data
-            else:
-                # 清理过期缓存
-                del self._request_cache[cache_key]
+        cached_data = self.cache.get(endpoint, cache_key)
+        if cached_data is not None:
+            logger.info(f"[{request_id}] 使用缓存数据: {endpoint}")
+            return cached_data
+        
+        # 内存未命中时查询持久化存储，命中后写回内存缓存
+        stored_data = await self.store.get(endpoint, params)
+        if stored_data is not None:
+            logger.info(f"[{request_id}] 使用持久化数据: {endpoint}")
+            self.cache.put(endpoint, cache_key, stored_data)
+            return stored_data
         
         # 频率控制
-        await self._wait_for_rate_limit()
+        await self.rate_limiter.acquire(endpoint)
         
         # 添加API密钥到参数
         params['key'] = self.amap_key
@@ -103,9 +88,28 @@ class MapService:
         logger.info(f"[{request_id}] 开始调用地图API: {endpoint}")
         logger.debug(f"[{request_id}] 请求参数: {params}")
         
-        async with httpx.AsyncClient(timeout=10.0) as client:
+        async def hedge_request() -> Dict[str, Any]:
+            # 对冲请求同样遵守频率控制
+            await self.rate_limiter.acquire(endpoint)
+            return await self._send_request(endpoint, url, params, cache_key, request_id, start_time)
+        
+        response_data = await self.hedging.run(
+            partial(self._send_request, endpoint, url, params, cache_key, request_id, start_time),
+            key=endpoint,
+            hedge_call=hedge_request
+        )
+        if response_data.get('status') == '1':
+            await self.store.put(endpoint, params, response_data)
+        return response_data
+    
+    async def _send_request(self, endpoint: str, url: str, params: Dict[str, Any], cache_key: str,
+                            request_id: str, start_time: float) -> Dict[str, Any]:
+        """发出一次地图API请求，成功时写入缓存"""
+        async with self.guard.protect() as outcome, \
+                bounded_call('amap', self.http_pool.get_timeout('amap')) as timeout, \
+                self.http_pool.session('amap') as client:
             try:
-                response = await client.get(url, params=params)
+                response = await client.get(url, params=params, timeout=timeout)
                 response.raise_for_status()
                 response_data = response.json()
                 
@@ -124,12 +128,13 @@ class MapService:
                         logger.warning(f"[{request_id}] 参数无效，请检查传入的参数格式和内容")
                     elif error_info == 'CUQPS_HAS_EXCEEDED_THE_LIMIT':
                         logger.warning(f"[{request_id}] API调用频率超限，建议稍后重试")
-                        # 频率超限时增加等待时间
-                        self._min_request_interval = min(self._min_request_interval * 2, 2.0)
-                        logger.info(f"[{request_id}] 调整请求间隔为: {self._min_request_interval:.2f}s")
+                        outcome.throttled()
+                        # 频率超限时降低该接口的速率
+                        self.rate_limiter.throttled(endpoint)
                 else:
-                    # 成功时缓存结果
-                    self._request_cache[cache_key] = (response_data, time.time())
+                    self.rate_limiter.succeeded(endpoint)
+                    # 成功时缓存结果（只保留解析用到的字段）
+                    self.cache.put(endpoint, cache_key, response_data)
                     logger.debug(f"[{request_id}] 结果已缓存")
                 
                 return response_data
@@ -184,6 +189,10 @@ class MapService:
     
     async def geocode(self, address: str, city: str = None) -> Optional[Dict[str, Any]]:
         """地理编码：将地址转换为经纬度"""
+        return await self.flights.do(('geocode', address, city), partial(self._geocode, address, city),
+                                     memoize=True)
+    
+    async def _geocode(self, address: str, city: str = None) -> Optional[Dict[str, Any]]:
         if not self.amap_key:
             return self._get_fallback_geocode(address, city)
         
@@ -282,11 +291,17 @@ class MapService:
     async def search_poi(self, keyword: str, city: str = None, poi_type: str = None, 
                         page_size: int = 20) -> List[Dict[str, Any]]:
         """搜索兴趣点(POI)"""
+        return await self.flights.do(('search_poi', keyword, city, poi_type, page_size),
+                                     partial(self._search_poi, keyword, city, poi_type, page_size),
+                                     memoize=True)
+    
+    async def _search_poi(self, keyword: str, city: str = None, poi_type: str = None,
+                          page_size: int = 20) -> List[Dict[str, Any]]:
         if not self.amap_key:
             return self._get_fallback_poi_search(keyword, city)
-        
-        # 清理过期缓存
-        self._cleanup_expired_cache()
+        if not self.guard.is_available():
+            logger.warning(f"地图服务熔断中，使用备用POI数据: {keyword}")
+            return self._get_fallback_poi_search(keyword, city)
         
         # 验证和标准化关键词
         validated_keyword = self._validate_and_normalize_keyword(keyword, city)
@@ -315,7 +330,7 @@ class MapService:
                 if response_data.get('info') == 'CUQPS_HAS_EXCEEDED_THE_LIMIT':
                     retry_count += 1
                     if retry_count < max_retries:
-                        wait_time = self._min_request_interval * (2 ** retry_count)
+                        wait_time = self.rate_limiter.interval('place/text') * (2 ** retry_count)
                         logger.warning(f"POI搜索频率超限，第{retry_count}次重试，等待{wait_time:.2f}秒")
                         await asyncio.sleep(wait_time)
                         continue
@@ -325,6 +340,10 @@ class MapService:
                 
                 break  # 成功或其他错误时跳出循环
                 
+            except UpstreamUnavailableError as e:
+                # 熔断、舱壁已满或剩余预算不足时不再重试，直接使用备用数据
+                logger.warning(f"POI搜索快速失败: {str(e)}")
+                return self._get_fallback_poi_search(validated_keyword, city)
             except Exception as e:
                 retry_count += 1
                 if retry_count < max_retries:
@@ -0,0 +1,241 @@
+"""地理编码和 POI 搜索结果的持久化存储
+
+进程重启或新的无服务器实例启动后，内存中的地图缓存为空，热门目的地和景点会被重新
+解析。MapResultStore 把地理编码、逆地理编码和 POI 搜索的（裁剪后的）响应保存在
+SQLite 中，作为内存缓存之后的第二级：内存未命中时先查询本地存储，仍未命中才请求高德。
+
+条目按（接口分组, 规范化的查询, 城市）寻址，有效期较长（地理编码 90 天、POI 30 天）。
+可以通过 AMAP_STORE_PREWARM_FILE 指定 JSON Lines 文件预热，文件格式与 dump_file 导出的一致：
+每行 {"kind": "geocode", "query": "杭州", "city": "", "response": {...}}，
+POI 的 query 为“关键词|类型|条数”（如 "西湖||20"）。
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+import sqlite3
+import threading
+from typing import Any, Dict, Optional, Tuple
+from dotenv import load_dotenv
+
+from services.map_cache import trim_response
+
+# 加载环境变量
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 持久化的接口 -> 存储分组
+STORE_KINDS = {
+    'geocode/geo': 'geocode',
+    'geocode/regeo': 'regeo',
+    'place/text': 'poi',
+}
+KIND_ENDPOINTS = {kind: endpoint for endpoint, kind in STORE_KINDS.items()}
+# 各分组响应中的结果字段
+_RESULT_FIELDS = {'geocode': 'geocodes', 'regeo': 'regeocode', 'poi': 'pois'}
+
+# 各分组默认的有效期（秒），可通过 AMAP_STORE_TTL_GEOCODE / AMAP_STORE_TTL_POI 覆盖（逆地理编码同地理编码）
+STORE_TTLS = {
+    'geocode': 90 * 86400.0,
+    'poi': 30 * 86400.0,
+}
+
+# 每写入多少条清理一次过期和超出容量的条目
+_PRUNE_INTERVAL = 100
+
+def _normalize_text(text: Optional[str]) -> str:
+    return ' '.join(str(text or '').split()).casefold()
+
+def _normalize_city(city: Optional[str]) -> str:
+    """城市名去掉空白和“市”后缀（“杭州市”与“杭州”视为同一城市）"""
+    city = _normalize_text(city)
+    return city[:-1] if len(city) > 2 and city.endswith('市') else city
+
+def normalize_query(endpoint: str, params: Dict[str, Any]) -> Optional[Tuple[str, str, str]]:
+    """请求参数 -> (分组, 规范化的查询, 城市)；不持久化的接口返回 None"""
+    kind = STORE_KINDS.get(endpoint)
+    if kind == 'geocode':
+        query = _normalize_text(params.get('address'))
+    elif kind == 'regeo':
+        try:
+            longitude, latitude = str(params.get('location', '')).split(',')
+            query = f"{float(longitude):.6f},{float(latitude):.6f}"
+        except ValueError:
+            return None
+    elif kind == 'poi':
+        query = '|'.join([_normalize_text(params.get('keywords')), _normalize_text(params.get('types')),
+                          str(params.get('offset', ''))])
+    else:
+        return None
+    return kind, query, _normalize_city(params.get('city'))
+
+class MapResultStore:
+    """SQLite 持久化的地图查询结果"""
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.enabled = os.getenv('AMAP_STORE_ENABLED', 'true').lower() == 'true'
+        self.db_path = db_path or os.getenv('AMAP_STORE_DB_PATH', './data/map_store.db')
+        self.max_entries = int(os.getenv('AMAP_STORE_MAX_ENTRIES', 50000))
+        geocode_ttl = float(os.getenv('AMAP_STORE_TTL_GEOCODE', STORE_TTLS['geocode']))
+        self.ttls = {
+            'geocode': geocode_ttl,
+            'regeo': geocode_ttl,
+            'poi': float(os.getenv('AMAP_STORE_TTL_POI', STORE_TTLS['poi'])),
+        }
+        self.prewarm_file = os.getenv('AMAP_STORE_PREWARM_FILE')
+        self._conn: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.RLock()  # 首次连接时在锁内预热
+        self._writes = 0
+        self.stats = {'hits': 0, 'misses': 0, 'stores': 0, 'prewarmed': 0, 'errors': 0}
+
+    def _get_connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            # 主键 (kind, query, city) 即查询索引
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS map_store (
+                    kind TEXT NOT NULL,
+                    query TEXT NOT NULL,
+                    city TEXT NOT NULL,
+                    response TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    PRIMARY KEY (kind, query, city)
+                ) WITHOUT ROWID
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_map_store_created ON map_store (created_at)")
+            logger.info(f"地图结果存储已初始化: {self.db_path}")
+            if self.prewarm_file:
+                self._load_file(self.prewarm_file)
+        return self._conn
+
+    def _get(self, kind: str, query: str, city: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._db_lock:
+            conn = self._get_connection()
+            row = conn.execute(
+                "SELECT response FROM map_store WHERE kind = ? AND query = ? AND city = ? AND created_at > ?",
+                (kind, query, city, now - self.ttls[kind])
+            ).fetchone()
+            if row:
+                conn.execute("UPDATE map_store SET accessed_at = ? WHERE kind = ? AND query = ? AND city = ?",
+                             (now, kind, query, city))
+        return json.loads(row[0]) if row else None
+
+    def _put(self, kind: str, query: str, city: str, response: Dict[str, Any], created_at: Optional[float] = None,
+             replace: bool = True):
+        now = time.time()
+        with self._db_lock:
+            conn = self._get_connection()
+            cursor = conn.execute(
+                f"INSERT OR {'REPLACE' if replace else 'IGNORE'} INTO map_store VALUES (?, ?, ?, ?, ?, ?)",
+                (kind, query, city, json.dumps(response, ensure_ascii=False), created_at or now, now)
+            )
+            self._writes += 1
+            if self._writes % _PRUNE_INTERVAL == 0:
+                self._prune(conn, now)
+        return cursor.rowcount
+
+    def _prune(self, conn: sqlite3.Connection, now: float):
+        """清理过期条目，超出容量时按最近访问时间淘汰"""
+        for kind, ttl in self.ttls.items():
+            conn.execute("DELETE FROM map_store WHERE kind = ? AND created_at <= ?", (kind, now - ttl))
+        conn.execute("""
+            DELETE FROM map_store WHERE (kind, query, city) IN (
+                SELECT kind, query, city FROM map_store ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+            )""", (self.max_entries,))
+
+    async def get(self, endpoint: str, params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """查询持久化的响应；不持久化的接口或未命中时返回 None"""
+        address = normalize_query(endpoint, params) if self.enabled else None
+        if address is None:
+            return None
+        try:
+            response = await asyncio.to_thread(self._get, *address)
+        except Exception as e:
+            logger.warning(f"读取地图结果存储失败: {str(e)}")
+            self.stats['errors'] += 1
+            return None
+        self.stats['hits' if response is not None else 'misses'] += 1
+        return response
+
+    async def put(self, endpoint: str, params: Dict[str, Any], response: Dict[str, Any]):
+        """保存成功的响应（只保留解析用到的字段）；没有结果的响应不保存，避免长期缓存查询失败"""
+        address = normalize_query(endpoint, params) if self.enabled else None
+        response = trim_response(endpoint, response)
+        if address is None or not response.get(_RESULT_FIELDS[address[0]]):
+            return
+        try:
+            await asyncio.to_thread(self._put, *address, response)
+            self.stats['stores'] += 1
+        except Exception as e:
+            logger.warning(f"写入地图结果存储失败: {str(e)}")
+            self.stats['errors'] += 1
+
+    def _load_file(self, path: str) -> int:
+        """从 JSON Lines 文件预热，已有的条目不覆盖；返回新增条数"""
+        loaded = 0
+        try:
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    entry = json.loads(line)
+                    kind = entry['kind']
+                    if kind not in self.ttls:
+                        continue
+                    params = {'city': entry.get('city')}
+                    query, city = entry['query'], _normalize_city(entry.get('city'))
+                    if kind != 'poi':
+                        # 地理编码按与请求相同的规则规范化，便于手工编写预热文件
+                        params.update({'address': query} if kind == 'geocode' else {'location': query})
+                        _, query, city = normalize_query(KIND_ENDPOINTS[kind], params)
+                    loaded += self._put(kind, query, city, trim_response(KIND_ENDPOINTS[kind], entry['response']),
+                                        created_at=entry.get('created_at'), replace=False)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"地图结果预热文件读取失败: {path}: {str(e)}")
+            self.stats['errors'] += 1
+        self.stats['prewarmed'] += loaded
+        logger.info(f"地图结果存储从 {path} 预热 {loaded} 条")
+        return loaded
+
+    def load_file(self, path: str) -> int:
+        """从 JSON Lines 文件预热（同步，用于启动脚本）"""
+        self._get_connection()
+        return self._load_file(path)
+
+    def dump_file(self, path: str) -> int:
+        """导出未过期的条目为 JSON Lines 文件，可作为其他实例的预热文件"""
+        now = time.time()
+        count = 0
+        with self._db_lock:
+            rows = self._get_connection().execute(
+                "SELECT kind, query, city, response, created_at FROM map_store").fetchall()
+        with open(path, 'w', encoding='utf-8') as f:
+            for kind, query, city, response, created_at in rows:
+                if created_at <= now - self.ttls.get(kind, 0):
+                    continue
+                f.write(json.dumps({'kind': kind, 'query': query, 'city': city, 'response': json.loads(response),
+                                    'created_at': created_at}, ensure_ascii=False) + '\n')
+                count += 1
+        return count
+
+    def clear(self):
+        with self._db_lock:
+            self._get_connection().execute("DELETE FROM map_store")
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.stats['hits'] + self.stats['misses']
+        return {
+            'enabled': self.enabled,
+            'hit_rate': round(self.stats['hits'] / lookups, 4) if lookups else 0.0,
+            **self.stats
+        }
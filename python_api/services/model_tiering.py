@@ -0,0 +1,164 @@
+"""按调用点分级的大模型配置
+
+不同调用点对模型的要求差别很大：旅行贴士（几百个token）和目的地分析用不着与每日行程
+相同的模型。每个调用点配置一组由强到快的模型档位、输出上限（max_tokens）、请求超时和
+延迟目标（SLO，秒）。每次调用选择第一个近期 p95 延迟不超过 SLO 的档位，都超出时使用
+最快的档位；降级后较强档位的样本超过统计时长后过期，之后会重新尝试较强档位。
+
+档位中的模型指首选供应商的模型；切换到其他供应商时，第一档使用该供应商的默认模型，
+其余档位使用其更快的模型（<NAME>_FAST_MODEL）。
+"""
+
+import os
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from dotenv import load_dotenv
+
+from services.llm_router import LatencyTracker, LLMProvider, LLMRouter
+
+# 加载环境变量
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 各调用点默认的 (max_tokens, 超时秒数, SLO秒数)
+# 可通过 LLM_MAX_TOKENS_<SITE>、LLM_TIMEOUT_<SITE>、LLM_SLO_<SITE> 覆盖
+SITE_PROFILES: Dict[str, Tuple[int, float, float]] = {
+    'destination_analysis': (2000, 60.0, 20.0),
+    'travel_tips': (800, 30.0, 10.0),
+    'daily_itinerary': (1500, 120.0, 45.0),  # max_tokens 由调用方按时段数计算
+    'multi_day_itinerary': (6000, 180.0, 120.0),  # max_tokens 由调用方按天数计算
+}
+
+@dataclass
+class ModelTier:
+    """某个调用点的一个模型档位"""
+    site: Optional[str]
+    index: int  # 0 为最强档位，越大越快
+    model: str  # 首选供应商使用的模型
+    provider: str  # 首选供应商名称
+    max_tokens: Optional[int] = None
+    timeout: Optional[float] = None
+    slo: Optional[float] = None
+
+    @property
+    def label(self) -> str:
+        return f"{self.provider}/{self.model}"
+
+    def model_for(self, provider: LLMProvider) -> str:
+        """该档位在指定供应商上使用的模型"""
+        if provider.name == self.provider:
+            return self.model
+        if self.index == 0:
+            return provider.model
+        return provider.fast_model or provider.model
+
+# 当前计划中各调用点选中的档位：{调用点: {档位: 次数}}
+_current_tier_report: ContextVar[Optional[Dict[str, Dict[str, int]]]] = ContextVar('model_tier_report', default=None)
+
+@contextmanager
+def tier_report() -> Iterator[Dict[str, Dict[str, int]]]:
+    """在当前上下文（及其创建的任务）中记录各调用点选中的模型档位"""
+    report: Dict[str, Dict[str, int]] = {}
+    token = _current_tier_report.set(report)
+    try:
+        yield report
+    finally:
+        _current_tier_report.reset(token)
+
+def current_tier_report() -> Optional[Dict[str, Dict[str, int]]]:
+    return _current_tier_report.get()
+
+class ModelTiering:
+    """按调用点的延迟目标在模型档位之间切换"""
+
+    def __init__(self, router: LLMRouter):
+        self.router = router
+        self.min_samples = int(os.getenv('LLM_TIER_MIN_SAMPLES', 5))
+        self.horizon = float(os.getenv('LLM_TIER_HORIZON', 300))
+        self.window = int(os.getenv('LLM_ROUTER_WINDOW', 100))
+        self.tiers: Dict[str, List[ModelTier]] = {}
+        self._trackers: Dict[Tuple[str, int], LatencyTracker] = {}
+        self._active: Dict[str, int] = {}
+        self.stats = {'selections': 0, 'downgrades': 0}
+
+    def _build_tiers(self, site: str) -> List[ModelTier]:
+        primary = self.router.primary
+        key = site.upper()
+        max_tokens, timeout, slo = SITE_PROFILES.get(site, (None, None, None))
+        max_tokens = int(os.getenv(f'LLM_MAX_TOKENS_{key}', 0)) or max_tokens
+        timeout = float(os.getenv(f'LLM_TIMEOUT_{key}', 0)) or timeout
+        slo = float(os.getenv(f'LLM_SLO_{key}', 0)) or slo
+
+        configured = os.getenv(f'LLM_TIERS_{key}')
+        if configured:
+            models = [model.strip() for model in configured.split(',') if model.strip()]
+        else:
+            models = [primary.model]
+            if primary.fast_model and primary.fast_model != primary.model:
+                models.append(primary.fast_model)
+        return [ModelTier(site, index, model, primary.name, max_tokens, timeout, slo)
+                for index, model in enumerate(models)]
+
+    def get_tiers(self, site: str) -> List[ModelTier]:
+        if site not in self.tiers:
+            self.tiers[site] = self._build_tiers(site)
+        return self.tiers[site]
+
+    def _tracker(self, tier: ModelTier) -> LatencyTracker:
+        key = (tier.site, tier.index)
+        if key not in self._trackers:
+            self._trackers[key] = LatencyTracker(self.window, self.horizon)
+        return self._trackers[key]
+
+    def _within_slo(self, tier: ModelTier) -> bool:
+        tracker = self._tracker(tier)
+        if tier.slo is None or tracker.count < self.min_samples:
+            return True
+        return tracker.percentile(0.95) <= tier.slo
+
+    def select(self, site: Optional[str]) -> ModelTier:
+        """选择调用点的模型档位，并计入当前计划的档位报告"""
+        if site is None:
+            return ModelTier(None, 0, self.router.primary.model, self.router.primary.name)
+
+        tiers = self.get_tiers(site)
+        tier = next((t for t in tiers if self._within_slo(t)), tiers[-1])
+        self.stats['selections'] += 1
+
+        previous = self._active.get(site, 0)
+        if tier.index != previous:
+            if tier.index > previous:
+                self.stats['downgrades'] += 1
+                p95 = self._tracker(tiers[previous]).percentile(0.95)
+                logger.warning(f"调用点 {site} 的 p95 延迟 {p95 or 0:.1f}s 超过目标 {tiers[previous].slo}s，"
+                               f"切换到 {tier.label}")
+            else:
+                logger.info(f"调用点 {site} 恢复到 {tier.label}")
+            self._active[site] = tier.index
+
+        report = _current_tier_report.get()
+        if report is not None:
+            counts = report.setdefault(site, {})
+            counts[tier.label] = counts.get(tier.label, 0) + 1
+        return tier
+
+    def record(self, tier: ModelTier, seconds: float):
+        """记录一次请求耗时；超时按超时时间计入，使 p95 反映实际等待"""
+        if tier.site is not None:
+            self._tracker(tier).record(seconds, True)
+
+    def get_stats(self) -> Dict[str, Any]:
+        sites = {}
+        for site, tiers in self.tiers.items():
+            sites[site] = {
+                'active': tiers[self._active.get(site, 0)].label,
+                'slo': tiers[0].slo,
+                'max_tokens': tiers[0].max_tokens,
+                'timeout': tiers[0].timeout,
+                'tiers': {tier.label: self._tracker(tier).get_stats() for tier in tiers}
+            }
+        return {**self.stats, 'sites': sites}
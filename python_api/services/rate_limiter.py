@@ -0,0 +1,261 @@
+"""上游接口的异步令牌桶限流
+
+高德按密钥限制每秒请求数（QPS），不同服务（地理编码、POI 搜索、路线规划）另有各自的配额，
+超出后返回 CUQPS_HAS_EXCEEDED_THE_LIMIT。原先的“上次请求时间 + 最小间隔”在并发协程中
+会读到同一个时间戳，一起越过限制。
+
+令牌桶按 GCRA（理论到达时间）实现：每个请求在同步代码中一次性预约发出时刻并推进桶的
+理论到达时间，预约和推进之间没有 await，因此并发安全；先到的请求先预约，同一分组内
+按到达顺序（FIFO）发出。桶允许的突发为 burst 个请求，之后按 rate 匀速发出。
+
+请求同时受所属分组的配额桶（如果配置）和全局桶约束：先在配额桶中排队，轮到后再在
+全局桶中预约，受配额限制的分组不会阻塞其他分组。
+上游返回超限时速率减半，之后每次成功请求按加法恢复，直到配置的速率（AIMD）。
+按分组统计排队等待时间、排队深度和需求 QPS，用于评估需要的高德配额。
+"""
+
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+from dotenv import load_dotenv
+
+from services.resilience import UpstreamUnavailableError
+from services.deadline import DeadlineExceededError, remaining_budget
+
+# 加载环境变量
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 需求统计窗口（秒）
+DEMAND_WINDOW = 60.0
+# 两次降速的最小间隔（秒）
+SLOW_DOWN_INTERVAL = 1.0
+
+class RateLimitExceededError(UpstreamUnavailableError):
+    """按限流需要等待的时间超过上限，调用方应直接使用备用数据"""
+
+class TokenBucket:
+    """单个令牌桶，rate 为 0 表示不限制"""
+
+    def __init__(self, name: str, rate: float, burst: int = 1, min_rate: float = 0.5):
+        self.name = name
+        self.rate = rate
+        self.max_rate = rate  # 配置的速率，降速后按加法恢复到该值
+        self.burst = max(1, burst)
+        self.min_rate = min_rate
+        self._tat = 0.0  # 理论到达时间（monotonic）
+        self._last_slow_down = float('-inf')
+
+    @property
+    def interval(self) -> float:
+        return 1.0 / self.rate if self.rate > 0 else 0.0
+
+    def earliest(self, now: float) -> float:
+        """不超过限额时最早可以发出的时刻"""
+        if self.rate <= 0:
+            return now
+        return max(now, self._tat - (self.burst - 1) * self.interval)
+
+    def commit(self, at: float) -> float:
+        """在 at 时刻占用一个令牌，返回新的理论到达时间"""
+        if self.rate > 0:
+            self._tat = max(self._tat, at) + self.interval
+        return self._tat
+
+    def release(self, tat: float):
+        """取消尚未发出的预约；之后已有其他预约时不退回，保守地保持间隔"""
+        if self.rate > 0 and self._tat == tat:
+            self._tat -= self.interval
+
+    def slow_down(self) -> float:
+        """上游报告超限时把速率减半（不低于 min_rate），返回新的速率
+
+        超限按秒统计，同一秒内并发请求报告的多次超限只减半一次。
+        """
+        now = time.monotonic()
+        if self.rate > 0 and now - self._last_slow_down >= SLOW_DOWN_INTERVAL:
+            self.rate = max(self.rate / 2, self.min_rate)
+            self._last_slow_down = now
+        return self.rate
+
+    def speed_up(self, step: float) -> float:
+        """请求成功后按加法增大速率，不超过配置的速率，返回新的速率"""
+        if 0 < self.rate < self.max_rate:
+            self.rate = min(self.rate + step, self.max_rate)
+        return self.rate
+
+class RateLimiter:
+    """全局令牌桶 + 按接口分组的配额桶"""
+
+    def __init__(self, name: str, rate: float, burst: int = 1, quotas: Optional[Dict[str, TokenBucket]] = None,
+                 groups: Optional[Dict[str, str]] = None, max_wait: float = 10.0, rate_increase: float = 0.1):
+        self.name = name
+        self.bucket = TokenBucket(name, rate, burst)
+        self.rate_increase = rate_increase  # 降速后每次成功请求恢复的速率（QPS）
+        self.quotas = quotas or {}
+        self.groups = groups or {}  # 接口 -> 分组
+        self.max_wait = max_wait
+        self._waits: Dict[str, Deque[float]] = {}
+        self._arrivals: Deque[float] = deque()  # 最近 DEMAND_WINDOW 秒内的到达时间
+        self._queue_depth: Dict[str, int] = {}
+        self.stats = {'requests': 0, 'delayed': 0, 'rejected': 0, 'throttled': 0, 'peak_queue_depth': 0,
+                      'peak_demand_qps': 0}
+        self.group_stats: Dict[str, Dict[str, int]] = {}
+
+    @classmethod
+    def from_env(cls, name: str, groups: Dict[str, str]) -> 'RateLimiter':
+        """按 <NAME>_QPS / <NAME>_BURST / <NAME>_RATE_MAX_WAIT 和 <NAME>_QPS_<GROUP> / <NAME>_BURST_<GROUP> 创建"""
+        prefix = name.upper()
+        quotas = {}
+        for group in sorted(set(groups.values())):
+            rate = float(os.getenv(f'{prefix}_QPS_{group.upper()}', 0))
+            if rate > 0:
+                quotas[group] = TokenBucket(f'{name}/{group}', rate, int(os.getenv(f'{prefix}_BURST_{group.upper()}', 1)))
+        return cls(
+            name,
+            rate=float(os.getenv(f'{prefix}_QPS', 5)),
+            burst=int(os.getenv(f'{prefix}_BURST', 1)),
+            quotas=quotas,
+            groups=groups,
+            max_wait=float(os.getenv(f'{prefix}_RATE_MAX_WAIT', 10)),
+            rate_increase=float(os.getenv(f'{prefix}_RATE_INCREASE', 0.1))
+        )
+
+    def group_of(self, endpoint: str) -> str:
+        return self.groups.get(endpoint, 'default')
+
+    def _buckets(self, group: str) -> List[TokenBucket]:
+        return [self.bucket] + ([self.quotas[group]] if group in self.quotas else [])
+
+    def interval(self, endpoint: str) -> float:
+        """该接口当前的最小请求间隔（秒）"""
+        return max(bucket.interval for bucket in self._buckets(self.group_of(endpoint)))
+
+    def set_rate(self, rate: float, burst: Optional[int] = None, group: Optional[str] = None):
+        """调整全局（或某个分组配额）的速率，rate 为 0 表示不限制"""
+        if group is None:
+            bucket = self.bucket
+        else:
+            bucket = self.quotas.setdefault(group, TokenBucket(f'{self.name}/{group}', rate))
+        bucket.rate = bucket.max_rate = rate
+        if burst is not None:
+            bucket.burst = max(1, burst)
+
+    def _record_arrival(self, now: float, group: str):
+        self.stats['requests'] += 1
+        counters = self.group_stats.setdefault(group, {'requests': 0, 'delayed': 0, 'rejected': 0, 'throttled': 0})
+        counters['requests'] += 1
+        self._arrivals.append(now)
+        while self._arrivals and self._arrivals[0] < now - DEMAND_WINDOW:
+            self._arrivals.popleft()
+        # 最近 1 秒内的到达数即瞬时需求 QPS
+        recent = 0
+        for arrived in reversed(self._arrivals):
+            if arrived < now - 1.0:
+                break
+            recent += 1
+        self.stats['peak_demand_qps'] = max(self.stats['peak_demand_qps'], recent)
+
+    async def acquire(self, endpoint: str):
+        """等到限额允许后返回；需要等待的时间超过 max_wait 或剩余预算时抛出异常"""
+        group = self.group_of(endpoint)
+        arrived = time.monotonic()
+        self._record_arrival(arrived, group)
+        # 先按分组配额、再按全局速率预约：受配额限制的请求不会提前占用全局的发出时刻，
+        # 阻塞其他分组
+        buckets = self._buckets(group)[::-1]
+        wait = max(bucket.earliest(arrived) for bucket in buckets) - arrived
+
+        remaining = remaining_budget()
+        if wait > self.max_wait or (remaining is not None and wait > remaining):
+            self.stats['rejected'] += 1
+            self.group_stats[group]['rejected'] += 1
+            message = f"{group} 需等待 {wait:.1f}s 才能发出"
+            if remaining is not None and wait > remaining:
+                raise DeadlineExceededError(self.name, message)
+            raise RateLimitExceededError(self.name, message, retry_after=wait)
+
+        queued = False
+        try:
+            for bucket in buckets:
+                now = time.monotonic()
+                start = bucket.earliest(now)
+                # 预约和推进理论到达时间之间没有 await，并发请求按到达顺序依次预约
+                tat = bucket.commit(start)
+                if start <= now:
+                    continue
+                if not queued:
+                    queued = True
+                    self.stats['delayed'] += 1
+                    self.group_stats[group]['delayed'] += 1
+                    self._queue_depth[group] = self._queue_depth.get(group, 0) + 1
+                    self.stats['peak_queue_depth'] = max(self.stats['peak_queue_depth'],
+                                                         sum(self._queue_depth.values()))
+                logger.debug(f"{bucket.name} 频率控制：{endpoint} 等待 {start - now:.2f} 秒")
+                try:
+                    await asyncio.sleep(start - now)
+                except asyncio.CancelledError:
+                    bucket.release(tat)
+                    raise
+        finally:
+            if queued:
+                self._queue_depth[group] -= 1
+            self._waits.setdefault(group, deque(maxlen=200)).append(time.monotonic() - arrived)
+
+    def throttled(self, endpoint: str):
+        """上游返回超限时降低该接口的速率：有分组配额时调整配额，否则调整全局速率"""
+        group = self.group_of(endpoint)
+        self.stats['throttled'] += 1
+        self.group_stats.setdefault(group, {'requests': 0, 'delayed': 0, 'rejected': 0, 'throttled': 0})
+        self.group_stats[group]['throttled'] += 1
+        bucket = self.quotas.get(group, self.bucket)
+        rate = bucket.slow_down()
+        logger.info(f"{bucket.name} 频率超限，调整速率为 {rate:.2f} QPS")
+
+    def succeeded(self, endpoint: str):
+        """请求成功：降速后的桶按加法恢复（AIMD），持续成功约 (配置速率/2)/rate_increase 次后回到配置速率"""
+        bucket = self.quotas.get(self.group_of(endpoint), self.bucket)
+        if bucket.rate < bucket.max_rate:
+            rate = bucket.speed_up(self.rate_increase)
+            if rate >= bucket.max_rate:
+                logger.info(f"{bucket.name} 速率已恢复到 {rate:.2f} QPS")
+
+    @staticmethod
+    def _wait_summary(waits: List[float]) -> Dict[str, float]:
+        waits = sorted(waits)
+        if not waits:
+            return {'wait_avg': 0.0, 'wait_p95': 0.0, 'wait_max': 0.0}
+        return {
+            'wait_avg': round(sum(waits) / len(waits), 3),
+            'wait_p95': round(waits[min(len(waits) - 1, int(0.95 * len(waits)))], 3),
+            'wait_max': round(waits[-1], 3)
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        demand = sum(1 for arrived in self._arrivals if arrived >= now - DEMAND_WINDOW)
+        groups = {}
+        for group, counters in self.group_stats.items():
+            quota = self.quotas.get(group)
+            groups[group] = {
+                'rate': quota.rate if quota else None,
+                'max_rate': quota.max_rate if quota else None,
+                'queue_depth': self._queue_depth.get(group, 0),
+                **self._wait_summary(list(self._waits.get(group, []))),
+                **counters
+            }
+        return {
+            'rate': self.bucket.rate,
+            'max_rate': self.bucket.max_rate,
+            'burst': self.bucket.burst,
+            'max_wait': self.max_wait,
+            'queue_depth': sum(self._queue_depth.values()),
+            'demand_qps': round(demand / DEMAND_WINDOW, 3),
+            **self._wait_summary([wait for waits in self._waits.values() for wait in waits]),
+            **self.stats,
+            'groups': groups
+        }
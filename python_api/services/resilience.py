@@ -0,0 +1,412 @@
+import os
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from collections import deque
+from typing import Any, AsyncIterator, Deque, Dict, Optional, Tuple, Type
+import httpx
+from tenacity import retry_if_exception
+from dotenv import load_dotenv
+
+from services.adaptive_limit import AIMDController
+from services.shared_quota import SharedQuota, shared_quotas
+
+# 加载环境变量
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 各上游舱壁的默认并发上限和排队等待时间（秒）
+BULKHEAD_DEFAULTS: Dict[str, Tuple[int, float]] = {
+    'llm': (16, 30.0),
+    'amap': (10, 5.0),
+    'weather': (10, 5.0),
+}
+
+# 各上游 AIMD 按延迟判断拥塞的容忍倍数，0 表示只按限流和超时调整
+# （大模型调用的延迟主要取决于输出长度，不能反映拥塞）
+AIMD_LATENCY_TOLERANCE: Dict[str, float] = {
+    'llm': 0.0,
+    'amap': 3.0,
+    'weather': 3.0,
+}
+
+class UpstreamUnavailableError(Exception):
+    """上游暂时不可用，调用方应直接使用备用数据"""
+
+    def __init__(self, upstream: str, message: str, retry_after: float = 0.0):
+        super().__init__(f"{upstream}: {message}")
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+class CircuitOpenError(UpstreamUnavailableError):
+    """熔断器处于打开状态"""
+
+class BulkheadFullError(UpstreamUnavailableError):
+    """舱壁已满，等待超时"""
+
+class QuotaExceededError(UpstreamUnavailableError):
+    """多进程共享配额的下一个发送时刻超过等待上限"""
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析 Retry-After 响应头（秒数或HTTP日期），返回需要等待的秒数"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+class CircuitBreaker:
+    """熔断器：closed（正常）-> open（快速失败）-> half_open（放行少量探测请求）
+
+    连续失败达到阈值后打开；收到带 Retry-After 的 429/503 时立即打开并按该时长冷却。
+    冷却结束后进入半开状态，探测请求成功则关闭，失败则重新打开。
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name: str, failure_threshold: int = 5, recovery_timeout: float = 30.0,
+                 half_open_max_calls: int = 1, enabled: bool = True):
+        self.name = name
+        self.enabled = enabled  # 关闭时只统计不熔断
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_until = 0.0
+        self._half_open_calls = 0
+        self.stats = {'opened': 0, 'rejected': 0, 'failures': 0, 'successes': 0}
+
+    @property
+    def state(self) -> str:
+        if self._state == self.OPEN and time.monotonic() >= self._opened_until:
+            self._state = self.HALF_OPEN
+            self._half_open_calls = 0
+            logger.info(f"熔断器半开: {self.name}")
+        return self._state
+
+    def retry_after(self) -> float:
+        """距离允许下一次请求的秒数"""
+        return max(0.0, self._opened_until - time.monotonic()) if self._state == self.OPEN else 0.0
+
+    def allows_requests(self) -> bool:
+        """当前是否会放行请求（不占用半开探测名额）"""
+        if not self.enabled:
+            return True
+        state = self.state
+        return state == self.CLOSED or (state == self.HALF_OPEN and self._half_open_calls < self.half_open_max_calls)
+
+    def before_call(self):
+        """请求前检查，打开状态或半开探测名额已满时抛出 CircuitOpenError"""
+        state = self.state
+        if state == self.CLOSED or not self.enabled:
+            return
+        if state == self.HALF_OPEN and self._half_open_calls < self.half_open_max_calls:
+            self._half_open_calls += 1
+            return
+        self.stats['rejected'] += 1
+        raise CircuitOpenError(self.name, f"熔断中（{state}）", self.retry_after())
+
+    def release_probe(self):
+        """半开探测请求未实际发出（如舱壁已满）时归还探测名额"""
+        if self._state == self.HALF_OPEN and self._half_open_calls > 0:
+            self._half_open_calls -= 1
+
+    def record_success(self):
+        self.stats['successes'] += 1
+        if self._state != self.CLOSED:
+            logger.info(f"熔断器关闭: {self.name}")
+        self._state = self.CLOSED
+        self._failures = 0
+
+    def record_failure(self, retry_after: Optional[float] = None):
+        """记录一次失败；retry_after 为上游要求的等待时间，给出时立即打开"""
+        self.stats['failures'] += 1
+        if not self.enabled:
+            return
+        self._failures += 1
+        if retry_after is not None or self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+            self._open(retry_after)
+
+    def _open(self, retry_after: Optional[float]):
+        cooldown = retry_after if retry_after is not None else self.recovery_timeout
+        self._opened_until = max(self._opened_until, time.monotonic() + cooldown)
+        if self._state != self.OPEN:
+            self.stats['opened'] += 1
+            logger.warning(f"熔断器打开: {self.name}，{cooldown:.1f}秒内快速失败")
+        self._state = self.OPEN
+        self._failures = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'state': self.state,
+            'retry_after': round(self.retry_after(), 2),
+            **self.stats
+        }
+
+class Bulkhead:
+    """舱壁：限制单个上游的在途请求数，等待超过 max_wait 秒时快速失败
+
+    配置了 AIMD 控制器时，在途上限随上游状态在 [min_limit, max_concurrent] 之间调整；
+    排队的请求按先到先得放行。
+    """
+
+    def __init__(self, name: str, max_concurrent: int, max_wait: float,
+                 controller: Optional[AIMDController] = None):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_wait = max_wait
+        self.controller = controller
+        self._waiters: Deque[asyncio.Future] = deque()
+        self.in_flight = 0
+        self.stats = {'rejected': 0, 'peak_in_flight': 0}
+
+    @property
+    def limit(self) -> int:
+        """当前的在途上限"""
+        return self.controller.limit if self.controller else self.max_concurrent
+
+    def _wake(self):
+        """按当前上限放行排队的请求（名额直接转交，计入在途数）"""
+        while self._waiters and self.in_flight < self.limit:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def _release(self):
+        self.in_flight -= 1
+        self._wake()
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[None]:
+        if self.in_flight < self.limit and not self._waiters:
+            self.in_flight += 1
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await asyncio.wait_for(waiter, timeout=self.max_wait)
+            except asyncio.TimeoutError:
+                self.stats['rejected'] += 1
+                raise BulkheadFullError(self.name, f"在途请求已达上限 {self.limit}")
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    self._release()  # 名额已转交但调用方已取消
+                raise
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+        self.stats['peak_in_flight'] = max(self.stats['peak_in_flight'], self.in_flight)
+        try:
+            yield
+        finally:
+            self._release()
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = {
+            'in_flight': self.in_flight,
+            'queued': len(self._waiters),
+            'limit': self.limit,
+            'max_concurrent': self.max_concurrent,
+            **self.stats
+        }
+        if self.controller:
+            stats['adaptive'] = self.controller.get_stats()
+        return stats
+
+class CallOutcome:
+    """一次受保护调用的结果标记"""
+
+    def __init__(self):
+        self.failed = False
+        self.retry_after: Optional[float] = None
+
+    def throttled(self, retry_after: Optional[float] = None):
+        self.failed = True
+        self.retry_after = retry_after
+
+class UpstreamGuard:
+    """单个上游的熔断器 + 舱壁（在途上限按 AIMD 自适应）+ 多进程共享配额（如果启用）"""
+
+    def __init__(self, name: str, breaker: CircuitBreaker, bulkhead: Bulkhead, quota: Optional[SharedQuota] = None):
+        self.name = name
+        self.breaker = breaker
+        self.bulkhead = bulkhead
+        self.quota = quota
+
+    def is_available(self) -> bool:
+        """熔断器是否放行请求，调用方可据此跳过排队直接降级"""
+        return self.breaker.allows_requests()
+
+    def is_failure(self, error: BaseException) -> Tuple[bool, Optional[float]]:
+        """判断异常是否计入熔断失败，返回 (是否失败, Retry-After秒数)
+
+        网络错误、超时、429 和 5xx 计入；其他 4xx 是请求本身的问题，不影响熔断。
+        """
+        if isinstance(error, httpx.HTTPStatusError):
+            status = error.response.status_code
+            retry_after = None
+            if status in (429, 503):
+                retry_after = parse_retry_after(error.response.headers.get('Retry-After'))
+            return status == 429 or status >= 500, retry_after
+        return isinstance(error, (httpx.RequestError, asyncio.TimeoutError)), None
+
+    def is_overload(self, error: BaseException) -> bool:
+        """限流（429/503）和超时说明上游已过载，AIMD 据此减小在途上限"""
+        if isinstance(error, httpx.HTTPStatusError):
+            return error.response.status_code in (429, 503)
+        return isinstance(error, (httpx.TimeoutException, asyncio.TimeoutError))
+
+    def _adapt(self, started: float, overloaded: bool):
+        controller = self.bulkhead.controller
+        if controller is None:
+            return
+        if overloaded:
+            controller.on_overload(started)
+        else:
+            controller.on_success(started, time.monotonic() - started)
+            self.bulkhead._wake()  # 上限增大后放行排队的请求
+
+    @asynccontextmanager
+    async def protect(self) -> AsyncIterator['CallOutcome']:
+        """包裹一次上游调用：熔断打开或舱壁已满时抛出 UpstreamUnavailableError
+
+        上游以业务状态码返回限流（HTTP 200）时，调用方通过 outcome.throttled() 记为失败。
+        """
+        self.breaker.before_call()
+        if self.quota is not None:
+            # 在舱壁之前等待共享配额，排队时间不占用在途名额，也不计入 AIMD 的延迟
+            try:
+                waited = await self.quota.acquire()
+            except BaseException:
+                self.breaker.release_probe()
+                raise
+            if waited is None:
+                self.breaker.release_probe()
+                raise QuotaExceededError(self.name, f"共享配额 {self.quota.rate} QPS 已用满")
+        outcome = CallOutcome()
+        try:
+            async with self.bulkhead.acquire():
+                started = time.monotonic()
+                try:
+                    yield outcome
+                except (asyncio.CancelledError, UpstreamUnavailableError):
+                    # 取消或调用方因预算不足放弃请求，不说明上游状态
+                    self.breaker.release_probe()
+                    raise
+                except Exception as e:
+                    failed, retry_after = self.is_failure(e)
+                    if failed:
+                        self.breaker.record_failure(retry_after)
+                        if self.is_overload(e):
+                            self._adapt(started, overloaded=True)
+                    else:
+                        # 4xx 等请求错误说明上游可达
+                        self.breaker.record_success()
+                    raise
+                if outcome.failed:
+                    self.breaker.record_failure(outcome.retry_after)
+                else:
+                    self.breaker.record_success()
+                self._adapt(started, overloaded=outcome.failed)
+        except BulkheadFullError:
+            self.breaker.release_probe()
+            raise
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = {'breaker': self.breaker.get_stats(), 'bulkhead': self.bulkhead.get_stats()}
+        if self.quota is not None:
+            stats['shared_quota'] = self.quota.get_stats()
+        return stats
+
+class UpstreamGuards:
+    """各上游（llm_<供应商> / amap / weather）的熔断器、舱壁和共享配额注册表"""
+
+    def __init__(self):
+        self.enabled = os.getenv('CIRCUIT_BREAKER_ENABLED', 'true').lower() == 'true'
+        self.failure_threshold = int(os.getenv('CIRCUIT_BREAKER_FAILURE_THRESHOLD', 5))
+        self.recovery_timeout = float(os.getenv('CIRCUIT_BREAKER_RECOVERY_TIMEOUT', 30.0))
+        self.half_open_max_calls = int(os.getenv('CIRCUIT_BREAKER_HALF_OPEN_CALLS', 1))
+        self.aimd_enabled = os.getenv('AIMD_ENABLED', 'true').lower() == 'true'
+        self.aimd_decrease_factor = float(os.getenv('AIMD_DECREASE_FACTOR', 0.5))
+        self._guards: Dict[str, UpstreamGuard] = {}
+
+    def get(self, name: str) -> UpstreamGuard:
+        guard = self._guards.get(name)
+        if guard is None:
+            # llm_qwen 等子上游未单独配置时沿用 llm 的舱壁配置
+            family = name.split('_')[0]
+            default_concurrent, default_wait = BULKHEAD_DEFAULTS.get(name, BULKHEAD_DEFAULTS.get(family, (10, 5.0)))
+            default_concurrent = int(os.getenv(f'BULKHEAD_{family.upper()}_MAX_CONCURRENT', default_concurrent))
+            default_wait = float(os.getenv(f'BULKHEAD_{family.upper()}_MAX_WAIT', default_wait))
+            prefix = f"BULKHEAD_{name.upper()}"
+            max_concurrent = int(os.getenv(f'{prefix}_MAX_CONCURRENT', default_concurrent))
+            guard = UpstreamGuard(
+                name,
+                CircuitBreaker(
+                    name,
+                    failure_threshold=self.failure_threshold,
+                    recovery_timeout=self.recovery_timeout,
+                    half_open_max_calls=self.half_open_max_calls,
+                    enabled=self.enabled
+                ),
+                Bulkhead(
+                    name,
+                    max_concurrent=max_concurrent,
+                    max_wait=float(os.getenv(f'{prefix}_MAX_WAIT', default_wait)),
+                    controller=self._create_controller(name, family, max_concurrent)
+                ),
+                quota=shared_quotas.get(name)
+            )
+            self._guards[name] = guard
+        return guard
+
+    def _create_controller(self, name: str, family: str, max_concurrent: int) -> Optional[AIMDController]:
+        """按 AIMD_<NAME>_* / AIMD_<FAMILY>_* 创建在途上限控制器，以舱壁上限为最大值"""
+        if not self.aimd_enabled:
+            return None
+
+        def setting(key: str, default: float) -> float:
+            value = os.getenv(f'AIMD_{name.upper()}_{key}') or os.getenv(f'AIMD_{family.upper()}_{key}')
+            return float(value) if value else default
+
+        return AIMDController(
+            name,
+            max_limit=max_concurrent,
+            min_limit=int(setting('MIN_CONCURRENT', 1)),
+            decrease_factor=self.aimd_decrease_factor,
+            latency_tolerance=setting('LATENCY_TOLERANCE', AIMD_LATENCY_TOLERANCE.get(family, 0.0))
+        )
+
+    def reset(self, name: Optional[str] = None):
+        """重置熔断器和舱壁（测试用）"""
+        for key in ([name] if name else list(self._guards)):
+            self._guards.pop(key, None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {name: guard.get_stats() for name, guard in self._guards.items()}
+
+def retry_while_available(upstream: str, exception_types: Tuple[Type[BaseException], ...]):
+    """tenacity 重试条件：指定异常且熔断器仍放行时才重试，熔断打开后不再等待重试"""
+    return retry_if_exception(
+        lambda e: isinstance(e, exception_types) and upstream_guards.get(upstream).is_available()
+    )
+
+# 创建全局实例
+upstream_guards = UpstreamGuards()
@@ -0,0 +1,199 @@
+"""多进程共享的上游请求配额
+
+uvicorn 以多个 worker 运行时，每个进程各自维护限流状态，高德、大模型和天气接口的实际 QPS
+会随进程数成倍增加。SharedQuota 把每个上游的令牌桶状态（GCRA 理论到达时间）保存在同一台
+机器上所有 worker 共用的 SQLite 文件中，在文件锁内以 BEGIN IMMEDIATE 事务读取并推进，
+保证所有进程合计不超过配置的速率。
+
+为避免每次调用都访问数据库，进程一次租借一小段时间内的若干个发送时刻（租约，默认 0.25 秒的量），
+在本进程内按先到先得依次使用；过期未用的时刻直接丢弃，不会在之后集中发出。
+
+发送时刻使用系统时间（time.time()），要求各 worker 在同一台机器上。
+"""
+
+import os
+import time
+import asyncio
+import logging
+import sqlite3
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterator, List, Optional
+from dotenv import load_dotenv
+
+try:
+    import fcntl  # POSIX 文件锁；不可用时只依赖 SQLite 自身的锁和忙等待
+except ImportError:
+    fcntl = None
+
+# 加载环境变量
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+class SharedQuota:
+    """单个上游跨进程共享的令牌桶"""
+
+    def __init__(self, name: str, rate: float, db_path: str, burst: int = 1, lease_seconds: float = 0.25,
+                 max_wait: float = 10.0):
+        self.name = name
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.db_path = db_path
+        self.lease_size = max(1, int(rate * lease_seconds))  # 每次租借的发送时刻数
+        self.max_wait = max_wait
+        self._slots: Deque[float] = deque()  # 本进程已租到、尚未使用的发送时刻
+        self._lock: Optional[asyncio.Lock] = None
+        self._conn: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self._waits: Deque[float] = deque(maxlen=200)
+        self.stats = {'requests': 0, 'leases': 0, 'expired_slots': 0, 'rejected': 0, 'errors': 0}
+
+    @property
+    def interval(self) -> float:
+        return 1.0 / self.rate
+
+    def _get_connection(self) -> sqlite3.Connection:
+        # 首次使用时连接，uvicorn 派生 worker 之后各进程使用自己的连接
+        if self._conn is None:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, timeout=30.0, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS shared_quota (name TEXT PRIMARY KEY, tat REAL NOT NULL)")
+        return self._conn
+
+    @contextmanager
+    def _file_lock(self) -> Iterator[None]:
+        """跨进程互斥：持有锁的进程独占读取和推进理论到达时间"""
+        if fcntl is None:
+            yield
+            return
+        with open(f"{self.db_path}.lock", 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _lease(self, count: int) -> List[float]:
+        """在共享的令牌桶中预约 count 个发送时刻"""
+        tolerance = (self.burst - 1) * self.interval
+        with self._db_lock, self._file_lock():
+            conn = self._get_connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT tat FROM shared_quota WHERE name = ?", (self.name,)).fetchone()
+                tat = row[0] if row else 0.0
+                now = time.time()
+                slots = []
+                for _ in range(count):
+                    start = max(now, tat - tolerance)
+                    slots.append(start)
+                    tat = max(tat, start) + self.interval
+                conn.execute(
+                    "INSERT INTO shared_quota (name, tat) VALUES (?, ?) "
+                    "ON CONFLICT(name) DO UPDATE SET tat = excluded.tat",
+                    (self.name, tat)
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return slots
+
+    async def acquire(self, max_wait: Optional[float] = None) -> Optional[float]:
+        """等到本进程的下一个发送时刻，返回等待的秒数；需要等待超过 max_wait 时不占用并返回 None
+
+        等待时间从调用时算起（包括排队取时刻的时间）。发送时刻晚于当前计划的截止时间时
+        抛出 DeadlineExceededError。共享存储不可用时不限流（返回 0），由各进程自己的限流兜底。
+        """
+        # deadline 依赖 resilience，resilience 依赖本模块，在调用时导入
+        from services.deadline import DeadlineExceededError, remaining_budget
+
+        arrived = time.time()
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        max_wait = self.max_wait if max_wait is None else max_wait
+        async with self._lock:  # 本进程内按先到先得分配租到的时刻，只在锁内预约，不在锁内等待
+            self.stats['requests'] += 1
+            # 错过的时刻不再使用（否则会和其他进程之后的时刻集中发出），允许半个间隔的调度误差
+            cutoff = time.time() - self.interval / 2
+            while self._slots and self._slots[0] < cutoff:
+                self._slots.popleft()
+                self.stats['expired_slots'] += 1
+            if not self._slots:
+                try:
+                    self._slots.extend(await asyncio.to_thread(self._lease, self.lease_size))
+                    self.stats['leases'] += 1
+                except (sqlite3.Error, OSError) as e:
+                    logger.warning(f"共享配额不可用，本次不限流: {self.name}: {str(e)}")
+                    self.stats['errors'] += 1
+                    return 0.0
+            slot = self._slots[0]
+            wait = slot - arrived
+            if wait > max_wait:
+                self.stats['rejected'] += 1
+                return None
+            remaining = remaining_budget()
+            if remaining is not None and slot - time.time() > remaining:
+                self.stats['rejected'] += 1
+                raise DeadlineExceededError(self.name, f"共享配额需等待 {wait:.1f}s，超过剩余预算 {remaining:.1f}s")
+            self._slots.popleft()
+        delay = slot - time.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        wait = max(wait, 0.0)
+        self._waits.append(wait)
+        return wait
+
+    def get_stats(self) -> Dict[str, Any]:
+        waits = sorted(self._waits)
+        return {
+            'rate': self.rate,
+            'burst': self.burst,
+            'lease_size': self.lease_size,
+            'leased_slots': len(self._slots),
+            'leases_per_request': round(self.stats['leases'] / self.stats['requests'], 3)
+            if self.stats['requests'] else 0.0,
+            'wait_avg': round(sum(waits) / len(waits), 3) if waits else 0.0,
+            'wait_p95': round(waits[min(len(waits) - 1, int(0.95 * len(waits)))], 3) if waits else 0.0,
+            **self.stats
+        }
+
+class SharedQuotas:
+    """各上游的共享配额注册表，未启用或未配置速率的上游返回 None"""
+
+    def __init__(self):
+        self.enabled = os.getenv('SHARED_QUOTA_ENABLED', 'false').lower() == 'true'
+        self.db_path = os.getenv('SHARED_QUOTA_DB_PATH', './data/shared_quota.db')
+        self.lease_seconds = float(os.getenv('SHARED_QUOTA_LEASE_SECONDS', 0.25))
+        self.max_wait = float(os.getenv('SHARED_QUOTA_MAX_WAIT', 10.0))
+        self._quotas: Dict[str, SharedQuota] = {}
+
+    def get(self, name: str) -> Optional[SharedQuota]:
+        """按 SHARED_QUOTA_<NAME>_QPS（llm_qwen 等未单独配置时用 SHARED_QUOTA_<FAMILY>_QPS）创建"""
+        if not self.enabled:
+            return None
+        quota = self._quotas.get(name)
+        if quota is None:
+            family = name.split('_')[0]
+
+            def setting(key: str) -> Optional[str]:
+                return os.getenv(f'SHARED_QUOTA_{name.upper()}_{key}') or os.getenv(f'SHARED_QUOTA_{family.upper()}_{key}')
+
+            rate = float(setting('QPS') or 0)
+            if rate <= 0:
+                return None
+            quota = SharedQuota(name, rate, self.db_path, burst=int(setting('BURST') or 1),
+                                lease_seconds=self.lease_seconds, max_wait=self.max_wait)
+            self._quotas[name] = quota
+        return quota
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {name: quota.get_stats() for name, quota in self._quotas.items()}
+
+# 创建全局实例
+shared_quotas = SharedQuotas()
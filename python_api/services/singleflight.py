@@ -0,0 +1,171 @@
+"""相同上游请求的合并（singleflight）和计划内记忆化
+
+很多用户同时规划同一目的地时，相同的 POI 搜索、地理编码、天气预报和大模型提示词
+会同时发出，而结果缓存要等请求完成后才会写入。SingleFlight 让并发的相同请求共享
+同一个进行中的任务：第一个调用方发起请求，其余调用方等待同一结果（包括异常）。
+
+在 plan_memo() 作用域内（每次生成计划），成功的结果按键记忆到计划结束，
+同一行程中重复的查询（如多天早餐都是“酒店餐厅”）只解析一次。
+
+共享的任务不继承第一个调用方的上下文：以等待者中最紧急的优先级执行（比进行中任务更紧急的
+调用方另起一个任务），截止时间取等待者中最宽松的一个，新的等待者加入时推迟；
+每个调用方按自己的剩余预算等待结果，预算耗尽时只有该调用方放弃，任务继续为其他调用方执行，
+所有等待者的预算都耗尽后任务的上游调用也不再重试。
+"""
+
+import os
+import time
+import asyncio
+import logging
+import contextvars
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterator, Optional, Tuple, TypeVar
+from dotenv import load_dotenv
+
+from services.deadline import Deadline, DeadlineExceededError, current_deadline, remaining_budget, use_deadline
+from services.token_scheduler import current_priority, priority_scope
+
+# 加载环境变量
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+# 当前计划的记忆化结果：{(分组, 键): 任务}
+_current_memo: ContextVar[Optional[Dict[Tuple[str, Hashable], asyncio.Future]]] = ContextVar('plan_memo', default=None)
+
+@contextmanager
+def plan_memo() -> Iterator[Dict[Tuple[str, Hashable], asyncio.Future]]:
+    """在当前上下文（及其创建的任务）中记忆化上游查询结果，退出后丢弃"""
+    memo: Dict[Tuple[str, Hashable], asyncio.Future] = {}
+    token = _current_memo.set(memo)
+    try:
+        yield memo
+    finally:
+        _current_memo.reset(token)
+
+class _Flight:
+    """一个进行中的共享任务及其执行时使用的优先级和截止时间"""
+
+    def __init__(self, priority: int, deadline: Optional[Deadline]):
+        self.priority = priority
+        self.deadline = deadline  # None 表示不限时
+        self.task: Optional[asyncio.Future] = None
+
+    def admit(self, remaining: Optional[float]):
+        """新的等待者加入：截止时间推迟到所有等待者中最晚的一个"""
+        if self.deadline is not None:
+            self.deadline.extend(float('inf') if remaining is None else time.monotonic() + remaining)
+
+    async def run(self, fn: Callable[[], Awaitable[T]]) -> T:
+        with priority_scope(self.priority), use_deadline(self.deadline):
+            return await fn()
+
+class SingleFlight:
+    """一组上游调用的进行中任务表，相同键的并发调用共享一个任务"""
+
+    def __init__(self, name: str, enabled: bool = True, memoize: bool = True):
+        self.name = name
+        self.enabled = enabled
+        self.memoize = memoize
+        self._inflight: Dict[Hashable, _Flight] = {}
+        self.stats = {'calls': 0, 'executed': 0, 'coalesced': 0, 'escalated': 0, 'memo_hits': 0}
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._inflight)
+
+    def _finished(self, key: Hashable, flight: _Flight, task: asyncio.Future):
+        if self._inflight.get(key) is flight:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # 所有调用方都已取消时，避免“异常未被获取”的警告
+
+    async def _wait(self, task: asyncio.Future) -> Any:
+        """按当前调用方的剩余预算等待共享任务，超时不取消任务"""
+        remaining = remaining_budget()
+        if remaining is None:
+            return await asyncio.shield(task)
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), remaining)
+        except asyncio.TimeoutError as e:
+            raise DeadlineExceededError(self.name, f"剩余预算 {remaining:.1f}s 内未等到合并的请求") from e
+
+    def _start(self, key: Hashable, fn: Callable[[], Awaitable[T]], priority: int) -> _Flight:
+        """以调用方的优先级和截止时间（可被之后的等待者推迟）在新任务中执行 fn"""
+        deadline = current_deadline()
+        if deadline is not None:
+            deadline = Deadline(deadline.remaining(), deadline.route)
+        flight = _Flight(priority, deadline)
+        # 空白的上下文：不继承发起者的截止时间对象和计划作用域
+        flight.task = asyncio.get_running_loop().create_task(flight.run(fn), context=contextvars.Context())
+        flight.task.add_done_callback(lambda t: self._finished(key, flight, t))
+        self._inflight[key] = flight
+        return flight
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]], memoize: bool = False) -> T:
+        """执行 fn，或等待相同键的进行中任务
+
+        请求在独立的任务中执行，某个调用方被取消或预算耗尽不会影响其他等待同一结果的调用方。
+
+        Args:
+            key: 请求的唯一键（如缓存键、函数参数）
+            fn: 发起请求的函数
+            memoize: 在 plan_memo() 作用域内是否记忆成功的结果
+        """
+        if not self.enabled:
+            return await fn()
+
+        self.stats['calls'] += 1
+        memo = _current_memo.get() if memoize and self.memoize else None
+        memo_key = (self.name, key)
+        if memo is not None and memo_key in memo:
+            self.stats['memo_hits'] += 1
+            return await self._wait(memo[memo_key])
+
+        priority = current_priority()
+        flight = self._inflight.get(key)
+        if flight is not None and priority < flight.priority:
+            # 进行中的任务可能排在低优先级队列里，更紧急的调用方另起一个任务，之后的调用方合并到新任务
+            self.stats['escalated'] += 1
+            flight = None
+        if flight is not None:
+            self.stats['coalesced'] += 1
+            flight.admit(remaining_budget())
+        else:
+            self.stats['executed'] += 1
+            flight = self._start(key, fn, priority)
+        task = flight.task
+
+        if memo is not None:
+            memo[memo_key] = task
+            task.add_done_callback(
+                lambda t: memo.pop(memo_key, None) if t.cancelled() or t.exception() else None
+            )  # 失败的结果不记忆
+        return await self._wait(task)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {'enabled': self.enabled, 'in_flight': self.in_flight, **self.stats}
+
+class FlightGroups:
+    """各上游（amap / weather / llm）的 SingleFlight 注册表"""
+
+    def __init__(self):
+        self.enabled = os.getenv('SINGLEFLIGHT_ENABLED', 'true').lower() == 'true'
+        self.memoize = os.getenv('PLAN_MEMO_ENABLED', 'true').lower() == 'true'
+        self._groups: Dict[str, SingleFlight] = {}
+
+    def get(self, name: str) -> SingleFlight:
+        group = self._groups.get(name)
+        if group is None:
+            group = SingleFlight(name, enabled=self.enabled, memoize=self.memoize)
+            self._groups[name] = group
+        return group
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {name: group.get_stats() for name, group in self._groups.items()}
+
+# 创建全局实例
+flight_groups = FlightGroups()
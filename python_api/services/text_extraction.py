@@ -0,0 +1,294 @@
+"""LLM文本输出的结构化提取
+
+模型没有返回可用的JSON时，从自由文本中提取行程。所有正则在模块加载时编译，
+每段文本只按行扫描一遍：识别时段标题（早餐、上午、午餐……），并把
+"地址：…"、"开放时间：…"、"门票价格：…"、"人均消费：…" 等键值字段归入当前时段。
+
+同时提供费用、时长和开放时间的解析函数，供智能体转换行程时复用。
+"""
+
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+# 时段关键词 -> 行程时段（同一行出现多个时按最先出现的计）
+PERIOD_KEYWORDS: Dict[str, str] = {
+    '早餐': 'breakfast', '早饭': 'breakfast', 'breakfast': 'breakfast',
+    '上午': 'morning', '早上': 'morning', 'morning': 'morning',
+    '午餐': 'lunch', '午饭': 'lunch', '中午': 'lunch', 'lunch': 'lunch',
+    '下午': 'afternoon', 'afternoon': 'afternoon',
+    '晚餐': 'dinner', '晚饭': 'dinner', 'dinner': 'dinner',
+    '晚上': 'evening', '傍晚': 'evening', '夜间': 'evening', 'evening': 'evening',
+}
+
+# 字段名 -> 行程结构中的字段
+FIELD_KEYWORDS: Dict[str, str] = {
+    '餐厅名称': 'name', '景点名称': 'name', '活动名称': 'name', '名称': 'name',
+    '活动内容': 'activity', '活动': 'activity',
+    '地址': 'address', '位置': 'address',
+    '开放时间': 'openTime', '营业时间': 'openTime',
+    '门票价格': 'ticketPrice', '门票': 'ticketPrice', '票价': 'ticketPrice',
+    '人均消费': 'cost', '人均': 'cost', '费用': 'cost', '花费': 'cost', '预算': 'cost',
+    '推荐菜品': 'specialties', '招牌菜': 'specialties', '特色菜': 'specialties',
+    '特色介绍': 'features', '游览重点': 'features', '亮点': 'features', '特色': 'features',
+    '注意事项': 'tips', '小贴士': 'tips', '贴士': 'tips', '提示': 'tips',
+    '建议时长': 'duration', '游览时长': 'duration', '时长': 'duration', '用时': 'duration',
+    '简介': 'description', '介绍': 'description', '描述': 'description',
+    '交通方式': 'transportation', '交通': 'transportation',
+}
+
+def _alternation(words) -> str:
+    # 长词优先，避免 "特色" 抢先匹配 "特色介绍"
+    return '|'.join(re.escape(word) for word in sorted(words, key=len, reverse=True))
+
+_FIELD_NAMES = _alternation(FIELD_KEYWORDS)
+_LEADING_MARKS = r'[\s#>*\-•·●\d.、)）]*'
+_TIME = r'\d{1,2}\s*[:：]\s*\d{2}'
+
+# 行首的时段标题，允许前面有列表符号、加粗标记和时间范围
+_PERIOD_PATTERN = re.compile(
+    rf'^{_LEADING_MARKS}(?:{_TIME}\s*(?:[-–—~至到]\s*{_TIME})?\s*)?(?:\*\*)?\s*'
+    rf'(?P<period>{_alternation(PERIOD_KEYWORDS)})(?:\*\*)?',
+    re.IGNORECASE
+)
+# 字段名及其后的冒号；字段值为到下一个字段名或行尾之间的文本
+# 先用字段名首字过滤，避免在每个位置都尝试整个候选列表
+_FIELD_PATTERN = re.compile(
+    rf'(?=[{"".join(sorted({word[0] for word in FIELD_KEYWORDS}))}])(?:^|(?<=[\s*，,；;|（(]))'
+    rf'(?P<key>{_FIELD_NAMES})(?:\*\*)?\s*[：:]\s*'
+)
+_PLACE_PATTERN = re.compile(
+    r'[\u4e00-\u9fa5A-Za-z0-9·]{2,}?(?:博物馆|博物院|公园|景区|风景区|寺|庙|塔|楼|阁|山|湖|河|桥|街|路|巷|'
+    r'广场|中心|古镇|大学|图书馆|剧院|商场|市场|夜市|餐厅|酒楼|酒店|饭店|茶楼|咖啡厅|小吃店|面馆|美食城)'
+)
+_HEADLINE_NOISE_PATTERN = re.compile(
+    rf'(?=[\d（(*])(?:{_TIME}\s*(?:[-–—~至到]\s*{_TIME})?|\d+(?:\.\d+)?\s*元|[（(][^）)]*[）)]|\*+)'
+)
+_HEADLINE_PREFIX_PATTERN = re.compile(r'^[\s：:\-–—|，,]+')
+_ACTION_PREFIX_PATTERN = re.compile(r'^(?:前往|游览|参观|打卡|漫步|观看|品尝|逛逛|逛|去|在|到)')
+_PRICE_PATTERN = re.compile(r'\d+(?:\.\d+)?\s*元')
+_SENTENCE_BREAK_PATTERN = re.compile(r'[，,。；;！!？?\s]')
+_MARKDOWN_PATTERN = re.compile(
+    r'\*\*(.*?)\*\*|\*(.*?)\*|^[ \t]*(?:[-*]|#+|\d+\.)[ \t]+', re.MULTILINE
+)
+_WHITESPACE_PATTERN = re.compile(r'\s+')
+
+_NUMBER_PATTERN = re.compile(r'\d+(?:\.\d+)?')
+_FREE_PATTERN = re.compile(r'免费|free', re.IGNORECASE)
+_DURATION_PATTERN = re.compile(
+    r'(?P<low>\d+(?:\.\d+)?)\s*(?:[-–~至到]\s*(?P<high>\d+(?:\.\d+)?))?\s*'
+    r'(?:个)?\s*(?P<unit>小时|分钟|h(?:ours?)?|min(?:utes?)?)'
+    r'(?:\s*(?P<minutes>\d+)\s*分(?:钟)?)?',
+    re.IGNORECASE
+)
+_HALF_DAY_PATTERN = re.compile(r'半天|半日')
+_FULL_DAY_PATTERN = re.compile(r'全天|一天|整天')
+_OPEN_RANGE_PATTERN = re.compile(
+    r'(?P<open_h>\d{1,2})\s*[:：点]\s*(?P<open_m>\d{2})?\s*[-–—~至到]+\s*'
+    r'(?P<next>次日)?\s*(?P<close_h>\d{1,2})\s*[:：点]\s*(?P<close_m>\d{2})?'
+)
+_ALL_DAY_PATTERN = re.compile(r'全天|24\s*小时|00:00\s*[-–~]\s*24:00')
+
+@dataclass
+class ExtractedSection:
+    """一个时段的提取结果"""
+    period: str
+    headline: str = ''
+    fields: Dict[str, str] = field(default_factory=dict)
+    lines: List[str] = field(default_factory=list)
+    notes: List[str] = field(default_factory=list)  # 标题之后不含字段的说明行
+
+def parse_cost(value: Any, default: float = 0.0) -> float:
+    """解析费用：数字原样返回，字符串取第一个数字（如 "人均80元" -> 80），"免费" 为 0"""
+    if isinstance(value, bool) or value is None:
+        return default
+    if isinstance(value, (int, float)):
+        return float(value)
+    if not isinstance(value, str):
+        return default
+    match = _NUMBER_PATTERN.search(value)
+    if match:
+        return float(match.group())
+    return 0.0 if _FREE_PATTERN.search(value) else default
+
+def parse_duration(value: Any) -> Optional[float]:
+    """解析时长为小时数：'1.5小时' -> 1.5，'2-3小时' -> 2.5，'1小时30分钟' -> 1.5，'半天' -> 4"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    if not isinstance(value, str) or not value:
+        return None
+    match = _DURATION_PATTERN.search(value)
+    if match:
+        low = float(match.group('low'))
+        high = float(match.group('high')) if match.group('high') else low
+        hours = (low + high) / 2
+        if match.group('unit').lower().startswith(('分', 'min')):
+            hours /= 60
+        if match.group('minutes'):
+            hours += int(match.group('minutes')) / 60
+        return round(hours, 2)
+    if _HALF_DAY_PATTERN.search(value):
+        return 4.0
+    if _FULL_DAY_PATTERN.search(value):
+        return 8.0
+    return None
+
+def format_duration(value: Any, default: str) -> str:
+    """校验时长文本：能解析出时长时保留原文（数字补上 '小时'），否则返回默认值"""
+    hours = parse_duration(value)
+    if hours is None or hours <= 0:
+        return default
+    return value.strip() if isinstance(value, str) else f"{hours:g}小时"
+
+def parse_opening_hours(value: Any) -> Optional[Tuple[str, str]]:
+    """解析开放时间为 (开门, 关门)：'8:30-17:00' -> ('08:30', '17:00')，'全天开放' -> ('00:00', '24:00')
+
+    跨夜营业（'18:00-次日2:00'）的关门时间按 24 小时以上表示，如 '26:00'。
+    """
+    if not isinstance(value, str) or not value:
+        return None
+    match = _OPEN_RANGE_PATTERN.search(value)
+    if match:
+        open_h, close_h = int(match.group('open_h')), int(match.group('close_h'))
+        if match.group('next') or close_h < open_h:
+            close_h += 24
+        return (f"{open_h:02d}:{match.group('open_m') or '00'}",
+                f"{close_h:02d}:{match.group('close_m') or '00'}")
+    if _ALL_DAY_PATTERN.search(value):
+        return ('00:00', '24:00')
+    return None
+
+def format_opening_hours(value: Any, default: str) -> str:
+    """开放时间统一为 'HH:MM-HH:MM'（跨夜为 '次日HH:MM'）或 '全天'，并保留闭馆日等附加说明；
+    无法解析时保留原文，为空时返回默认值"""
+    if not isinstance(value, str) or not value.strip():
+        return default
+    match = _OPEN_RANGE_PATTERN.search(value)
+    hours = parse_opening_hours(value)
+    if hours is None:
+        return value.strip()
+    if match is None:
+        return '全天'
+    close_h, close_m = hours[1].split(':')
+    close = f"次日{int(close_h) - 24:02d}:{close_m}" if int(close_h) > 24 else hours[1]
+    note = _HEADLINE_PREFIX_PATTERN.sub('', value[:match.start()] + value[match.end():]).strip()
+    return f"{hours[0]}-{close}" + (f" {note}" if note else '')
+
+def clean_markdown(text: str) -> str:
+    """清理Markdown格式标记（粗体、斜体、列表、标题、编号）并合并空白"""
+    text = _MARKDOWN_PATTERN.sub(lambda m: m.group(1) or m.group(2) or '', text)
+    return _WHITESPACE_PATTERN.sub(' ', text).strip()
+
+def tokenize_sections(content: str) -> Tuple[Dict[str, ExtractedSection], Dict[str, str]]:
+    """单遍扫描文本，按时段切分并提取键值字段
+
+    Returns:
+        (时段 -> 提取结果, 不属于任何时段的全局字段，如整天的交通方式)
+    """
+    sections: Dict[str, ExtractedSection] = {}
+    global_fields: Dict[str, str] = {}
+    current: Optional[ExtractedSection] = None
+
+    for raw_line in content.splitlines():
+        line = raw_line.strip()
+        if not line:
+            continue
+
+        rest = line
+        period_match = _PERIOD_PATTERN.match(line)
+        if period_match:
+            period = PERIOD_KEYWORDS[period_match.group('period').lower()]
+            # 同一时段重复出现时（如 "上午" 标题和 "上午活动：…"）继续写入同一段
+            current = sections.setdefault(period, ExtractedSection(period))
+            rest = line[period_match.end():]
+
+        fields = {}
+        first_field = None
+        if '：' in rest or ':' in rest:
+            matches = list(_FIELD_PATTERN.finditer(rest))
+            for i, match in enumerate(matches):
+                end = matches[i + 1].start() if i + 1 < len(matches) else len(rest)
+                value = rest[match.end():end].strip(' *，,；;|')
+                if value.endswith(('）', ')')) and not ('（' in value or '(' in value):
+                    # 字段写在括号里时（如 "西湖（地址：…）"）去掉收尾的括号
+                    value = value[:-1].rstrip()
+                if value:
+                    fields.setdefault(FIELD_KEYWORDS[match.group('key')], value)
+            if matches:
+                first_field = matches[0].start()
+
+        if current is None:
+            for key, value in fields.items():
+                global_fields.setdefault(key, value)
+            continue
+
+        current.lines.append(line)
+        if not period_match and first_field is None:
+            current.notes.append(line)
+        for key, value in fields.items():
+            current.fields.setdefault(key, value)
+        if not current.headline:
+            headline = (rest if first_field is None else rest[:first_field]).strip(' *：:')
+            if headline:
+                headline = _HEADLINE_PREFIX_PATTERN.sub('', _HEADLINE_NOISE_PATTERN.sub('', headline))
+                current.headline = headline.strip('，,。.：: （(')
+
+    return sections, global_fields
+
+def _extract_place(headline: str) -> str:
+    """从时段标题中取地点名：短标题本身即地点，否则匹配以景点/餐厅后缀结尾的词"""
+    if headline and len(headline) <= 12 and not _SENTENCE_BREAK_PATTERN.search(headline):
+        return _ACTION_PREFIX_PATTERN.sub('', headline) or headline
+    match = _PLACE_PATTERN.search(headline)
+    return _ACTION_PREFIX_PATTERN.sub('', match.group()) if match else ''
+
+def _default_location(activity: str) -> str:
+    """没有提取到地点时按活动类型给出默认地点"""
+    if '餐' in activity or '吃' in activity or '美食' in activity:
+        return '当地特色餐厅'
+    if '博物馆' in activity:
+        return '博物馆'
+    if '公园' in activity or '漫步' in activity:
+        return '城市公园'
+    if '购物' in activity or '商场' in activity:
+        return '购物中心'
+    return '市区景点'
+
+def extract_itinerary(content: str, day: int) -> Dict[str, Any]:
+    """从非JSON文本中提取单日行程，只包含提取到的时段和字段，缺失部分由调用方补全"""
+    sections, global_fields = tokenize_sections(content or '')
+    itinerary: Dict[str, Any] = {'day': day}
+
+    for period, section in sections.items():
+        values = dict(section.fields)
+        transportation = values.pop('transportation', None)
+        if transportation:
+            global_fields.setdefault('transportation', transportation)
+
+        headline = section.headline
+        place = values.get('name') or _extract_place(headline)
+        if place:
+            values.setdefault('name', place)
+        if headline:
+            values.setdefault('activity', headline)
+        elif place:
+            values.setdefault('activity', f"游览{place}" if period not in ('breakfast', 'lunch', 'dinner')
+                              else f"在{place}用餐")
+        values['location'] = place or values.get('address') or (
+            _default_location(values['activity']) if values.get('activity') else '')
+
+        if 'cost' not in values and 'ticketPrice' in values:
+            values['cost'] = values['ticketPrice']
+        if 'cost' not in values:
+            # 没有费用字段时取正文中第一个 "xx元"
+            price = next((m.group() for m in map(_PRICE_PATTERN.search, section.lines) if m), None)
+            if price:
+                values['cost'] = price
+        values['cost'] = parse_cost(values.get('cost'))
+        if not values.get('description') and section.notes:
+            values['description'] = clean_markdown(' '.join(section.notes))
+        itinerary[period] = values
+
+    if global_fields.get('transportation'):
+        itinerary['transportation'] = global_fields['transportation']
+    return itinerary
@@ -0,0 +1,77 @@
+"""按调用点统计提示词的token构成
+
+每次请求记录输入token（供应商返回的 usage，流式请求没有 usage 时按文本估算）、
+其中固定前缀（系统提示词）的token数、供应商上下文缓存命中的token数和输出token数，
+用于比较提示词格式的开销和确认跨天、跨用户相同的前缀是否命中供应商缓存。
+"""
+
+import logging
+from typing import Any, Dict, List, Optional
+
+from services.token_scheduler import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+def message_tokens(messages: List[Dict[str, str]]) -> int:
+    """估算消息列表的输入token数（每条消息另加约4个token的格式开销）"""
+    return sum(estimate_tokens(message.get('content', '')) + 4 for message in messages)
+
+def prefix_tokens(messages: List[Dict[str, str]]) -> int:
+    """估算开头连续的系统消息（跨天、跨用户不变的前缀）的token数"""
+    prefix = []
+    for message in messages:
+        if message.get('role') != 'system':
+            break
+        prefix.append(message)
+    return message_tokens(prefix)
+
+def cached_tokens(usage: Dict[str, Any]) -> int:
+    """供应商上下文缓存命中的输入token数（OpenAI 兼容接口的 prompt_tokens_details.cached_tokens）"""
+    return int((usage.get('prompt_tokens_details') or {}).get('cached_tokens') or 0)
+
+class TokenAccounting:
+    """各调用点的输入/输出token统计"""
+
+    def __init__(self):
+        self._sites: Dict[str, Dict[str, int]] = {}
+
+    def record(self, site: Optional[str], messages: List[Dict[str, str]],
+               usage: Optional[Dict[str, Any]] = None, completion_text: Optional[str] = None):
+        """记录一次请求；usage 为 None 时（流式请求）按文本估算"""
+        entry = self._sites.setdefault(site or '*', {
+            'calls': 0, 'reported': 0, 'prompt_tokens': 0, 'reported_prompt_tokens': 0, 'estimated_prompt_tokens': 0,
+            'prefix_tokens': 0, 'cached_tokens': 0, 'completion_tokens': 0
+        })
+        estimated = message_tokens(messages)
+        entry['calls'] += 1
+        entry['estimated_prompt_tokens'] += estimated
+        entry['prefix_tokens'] += prefix_tokens(messages)
+        if usage and usage.get('prompt_tokens'):
+            entry['reported'] += 1
+            entry['prompt_tokens'] += int(usage['prompt_tokens'])
+            entry['reported_prompt_tokens'] += int(usage['prompt_tokens'])
+            entry['cached_tokens'] += cached_tokens(usage)
+            entry['completion_tokens'] += int(usage.get('completion_tokens', 0))
+        else:
+            entry['prompt_tokens'] += estimated
+            entry['completion_tokens'] += estimate_tokens(completion_text or '')
+
+    def get_report(self) -> Dict[str, Any]:
+        """各调用点的平均输入/前缀/输出token数和供应商缓存命中率"""
+        report = {}
+        for site, entry in self._sites.items():
+            calls = entry['calls'] or 1
+            report[site] = {
+                'calls': entry['calls'],
+                'avg_prompt_tokens': round(entry['prompt_tokens'] / calls, 1),
+                'avg_estimated_prompt_tokens': round(entry['estimated_prompt_tokens'] / calls, 1),
+                'avg_prefix_tokens': round(entry['prefix_tokens'] / calls, 1),
+                'prefix_share': round(entry['prefix_tokens'] / entry['estimated_prompt_tokens'], 4)
+                if entry['estimated_prompt_tokens'] else 0.0,
+                'avg_completion_tokens': round(entry['completion_tokens'] / calls, 1),
+                'cached_tokens': entry['cached_tokens'],
+                'cache_hit_rate': round(entry['cached_tokens'] / entry['reported_prompt_tokens'], 4)
+                if entry['reported_prompt_tokens'] else 0.0,
+                'usage_reported': entry['reported']
+            }
+        return report
@@ -0,0 +1,264 @@
+"""大模型供应商的 TPM/RPM 调度
+
+供应商按每分钟 token 数（TPM）和请求数（RPM）限流，超出后才以 429 告知。
+调度器在发出请求前估算本次的输入和输出 token，按最近 60 秒内已发出请求的用量
+控制发出节奏，保持在配置的限额以内；响应返回后用实际用量（usage）修正记录，
+并据此校准后续的估算。
+
+等待发出的请求按优先级排队：交互式调用（同步等待结果的快速规划、计划优化）
+先于后台调用（异步生成的完整计划、目的地知识刷新）。
+"""
+
+import re
+import math
+import time
+import heapq
+import asyncio
+import itertools
+import logging
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Deque, Dict, Iterator, List, Optional
+from dotenv import load_dotenv
+
+from services.resilience import UpstreamUnavailableError
+from services.deadline import DeadlineExceededError, remaining_budget
+
+# 加载环境变量
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 请求优先级，数值越小越先发出
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: 'interactive', PRIORITY_BACKGROUND: 'background'}
+
+# 限额统计窗口（秒）
+WINDOW_SECONDS = 60.0
+
+_CJK_PATTERN = re.compile(r'[\u4e00-\u9fff\u3000-\u303f\uff00-\uffef]')
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算文本的token数：中文约每字0.8个token，其他字符约每3.5个字符1个token"""
+    cjk = len(_CJK_PATTERN.findall(text))
+    return math.ceil(cjk * 0.8 + (len(text) - cjk) / 3.5)
+
+class TokenBudgetExceededError(UpstreamUnavailableError):
+    """排队等待超过上限，调用方应切换供应商或使用备用数据"""
+
+_current_priority: ContextVar[int] = ContextVar('llm_priority', default=PRIORITY_INTERACTIVE)
+
+@contextmanager
+def priority_scope(priority: int) -> Iterator[None]:
+    """在当前上下文（及其创建的任务）中设置大模型请求的优先级"""
+    token = _current_priority.set(priority)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+def current_priority() -> int:
+    return _current_priority.get()
+
+class TokenReservation:
+    """一次请求在限额窗口中占用的 token，响应返回后按实际用量修正"""
+
+    def __init__(self, scheduler: 'TokenScheduler', entry: List[float], prompt_tokens: int,
+                 completion_tokens: int, site: Optional[str]):
+        self.scheduler = scheduler
+        self._entry = entry  # [发出时间, token数]
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.site = site
+        self.settled = False
+
+    @property
+    def tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def settle(self, usage: Optional[Dict[str, Any]] = None, completion_text: Optional[str] = None):
+        """按响应的 usage（或流式输出的文本）修正占用；请求失败时只保留输入部分"""
+        if self.settled:
+            return
+        self.settled = True
+        self._entry[1] = self.scheduler._actual_tokens(self, usage, completion_text)
+        self.scheduler._settle(self, usage, completion_text)
+
+class TokenScheduler:
+    """单个供应商的 TPM/RPM 调度器，tpm/rpm 为 0 表示不限制"""
+
+    def __init__(self, name: str, tpm: int = 0, rpm: int = 0, max_wait: float = 60.0,
+                 window: float = WINDOW_SECONDS):
+        self.name = name
+        self.tpm = tpm
+        self.rpm = rpm
+        self.max_wait = max_wait
+        self.window = window
+        self._window: Deque[List[float]] = deque()  # [发出时间, token数]
+        self._queue: List[List[Any]] = []  # 堆：[优先级, 序号, 估算token数]
+        self._seq = itertools.count()
+        self._changed = asyncio.Event()
+        self._prompt_ratio = 1.0  # 实际/估算输入token的滑动平均，校准估算
+        self._completion_avg: Dict[str, float] = {}  # 各调用点实际输出token的滑动平均
+        self._waits: Deque[float] = deque(maxlen=200)
+        self.stats = {'requests': 0, 'delayed': 0, 'rejected': 0, 'prompt_tokens': 0, 'completion_tokens': 0,
+                      'estimated_tokens': 0}
+
+    @property
+    def limited(self) -> bool:
+        return self.tpm > 0 or self.rpm > 0
+
+    def estimate(self, messages: List[Dict[str, str]], max_tokens: Optional[int],
+                 site: Optional[str] = None) -> Dict[str, int]:
+        """估算输入和输出token：输入按文本估算并校准，输出取该调用点的近期均值（不超过 max_tokens）"""
+        prompt = sum(estimate_tokens(message.get('content', '')) + 4 for message in messages)
+        prompt = math.ceil(prompt * self._prompt_ratio)
+        completion = self._completion_avg.get(site or '*')
+        if completion is None:
+            completion = max_tokens or 1000
+        elif max_tokens:
+            completion = min(completion, max_tokens)
+        return {'prompt_tokens': prompt, 'completion_tokens': math.ceil(completion)}
+
+    def _usage(self) -> Dict[str, float]:
+        cutoff = time.monotonic() - self.window
+        while self._window and self._window[0][0] < cutoff:
+            self._window.popleft()
+        return {'tokens': sum(tokens for _, tokens in self._window), 'requests': len(self._window)}
+
+    def _delay_for(self, tokens: int) -> float:
+        """按当前窗口用量，还需等待多久才能发出 tokens 个token的请求"""
+        usage = self._usage()
+        delay = 0.0
+        now = time.monotonic()
+        if self.rpm > 0 and usage['requests'] + 1 > self.rpm:
+            oldest = self._window[usage['requests'] - self.rpm][0]
+            delay = max(delay, oldest + self.window - now)
+        # 单次请求超过整个 TPM 时，等窗口清空后发出
+        tokens = min(tokens, self.tpm) if self.tpm > 0 else tokens
+        if self.tpm > 0 and usage['tokens'] + tokens > self.tpm:
+            excess = usage['tokens'] + tokens - self.tpm
+            for sent_at, used in self._window:
+                excess -= used
+                if excess <= 0:
+                    delay = max(delay, sent_at + self.window - now)
+                    break
+        return max(delay, 0.0)
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def _remove(self, entry: List[Any]):
+        if entry in self._queue:
+            self._queue.remove(entry)
+            heapq.heapify(self._queue)
+            self._notify()
+
+    async def acquire(self, estimate: Dict[str, int], site: Optional[str] = None,
+                      priority: Optional[int] = None) -> TokenReservation:
+        """等待限额允许后占用 token；等待超过 max_wait 或剩余预算时抛出异常"""
+        tokens = estimate['prompt_tokens'] + estimate['completion_tokens']
+        priority = current_priority() if priority is None else priority
+        self.stats['requests'] += 1
+        self.stats['estimated_tokens'] += tokens
+        start = time.monotonic()
+
+        if self.limited:
+            entry = [priority, next(self._seq), tokens]
+            heapq.heappush(self._queue, entry)
+            try:
+                while True:
+                    changed = self._changed
+                    delay = self._delay_for(tokens) if self._queue[0] is entry else None
+                    if delay == 0:
+                        heapq.heappop(self._queue)
+                        self._notify()  # 让下一个排队的请求检查限额
+                        break
+                    waited = time.monotonic() - start
+                    limit = self.max_wait - waited
+                    remaining = remaining_budget()
+                    if delay is not None and (delay > limit or (remaining is not None and delay > remaining)):
+                        self.stats['rejected'] += 1
+                        self._remove(entry)
+                        message = f"需等待 {delay:.1f}s 才能发出（已排队 {waited:.1f}s）"
+                        if remaining is not None and delay > remaining:
+                            raise DeadlineExceededError(self.name, message)
+                        raise TokenBudgetExceededError(self.name, message, retry_after=delay)
+                    try:
+                        await asyncio.wait_for(changed.wait(), timeout=min(delay, limit) if delay else limit)
+                    except asyncio.TimeoutError:
+                        if delay is None and time.monotonic() - start >= self.max_wait:
+                            self.stats['rejected'] += 1
+                            self._remove(entry)
+                            raise TokenBudgetExceededError(self.name, f"排队超过 {self.max_wait:.0f}s")
+            except asyncio.CancelledError:
+                self._remove(entry)
+                raise
+
+        wait = time.monotonic() - start
+        self._waits.append(wait)
+        if wait > 0.01:
+            self.stats['delayed'] += 1
+            logger.info(f"{self.name} 按 TPM/RPM 限额等待 {wait:.2f}s 后发出请求（{PRIORITY_NAMES.get(priority)}）")
+        entry = [time.monotonic(), tokens]
+        self._window.append(entry)
+        return TokenReservation(self, entry, estimate['prompt_tokens'], estimate['completion_tokens'], site)
+
+    @asynccontextmanager
+    async def reserve(self, messages: List[Dict[str, str]], max_tokens: Optional[int],
+                      site: Optional[str] = None) -> AsyncIterator[TokenReservation]:
+        """估算并等待限额，退出时未按实际用量修正的占用只保留输入部分"""
+        reservation = await self.acquire(self.estimate(messages, max_tokens, site), site)
+        try:
+            yield reservation
+        finally:
+            reservation.settle()
+
+    def _actual_tokens(self, reservation: TokenReservation, usage: Optional[Dict[str, Any]],
+                       completion_text: Optional[str]) -> int:
+        if usage and usage.get('total_tokens'):
+            return int(usage['total_tokens'])
+        if completion_text is not None:
+            return reservation.prompt_tokens + estimate_tokens(completion_text)
+        return reservation.prompt_tokens  # 请求失败，输出未生成
+
+    def _settle(self, reservation: TokenReservation, usage: Optional[Dict[str, Any]],
+                completion_text: Optional[str]):
+        """记录实际用量并校准估算（滑动平均）"""
+        if usage and usage.get('total_tokens'):
+            prompt = int(usage.get('prompt_tokens', 0))
+            completion = int(usage.get('completion_tokens', 0))
+            if prompt and reservation.prompt_tokens:
+                calibrated = self._prompt_ratio * prompt / reservation.prompt_tokens
+                self._prompt_ratio = 0.8 * self._prompt_ratio + 0.2 * calibrated
+        elif completion_text is not None:
+            prompt, completion = reservation.prompt_tokens, estimate_tokens(completion_text)
+        else:
+            return
+        self.stats['prompt_tokens'] += prompt
+        self.stats['completion_tokens'] += completion
+        key = reservation.site or '*'
+        previous = self._completion_avg.get(key)
+        self._completion_avg[key] = completion if previous is None else 0.8 * previous + 0.2 * completion
+        self._notify()  # 实际用量低于估算时，排队的请求可能可以提前发出
+
+    def get_stats(self) -> Dict[str, Any]:
+        usage = self._usage()
+        waits = sorted(self._waits)
+        depth = {name: sum(1 for entry in self._queue if entry[0] == priority)
+                 for priority, name in PRIORITY_NAMES.items()}
+        return {
+            'tpm': self.tpm,
+            'rpm': self.rpm,
+            'queue_depth': len(self._queue),
+            'queue_depth_by_priority': depth,
+            'window_tokens': int(usage['tokens']),
+            'window_requests': usage['requests'],
+            'wait_avg': round(sum(waits) / len(waits), 3) if waits else 0.0,
+            'wait_p95': round(waits[min(len(waits) - 1, int(0.95 * len(waits)))], 3) if waits else 0.0,
+            'prompt_ratio': round(self._prompt_ratio, 3),
+            **self.stats
+        }
@@ -2,12 +2,18 @@ import os
 import json
 import time
 import logging
+from functools import partial
 from typing import Dict, List, Optional, Any
 import httpx
 from datetime import datetime, timedelta
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
+from tenacity import retry, stop_after_attempt, wait_exponential
 from dotenv import load_dotenv
 
+from services.http_client import HTTPClientPool, http_client_pool
+from services.resilience import retry_while_available, upstream_guards
+from services.deadline import bounded_call, stop_before_deadline
+from services.singleflight import flight_groups
+
 # 加载环境变量
 load_dotenv()
 
@@ -16,18 +22,22 @@ logger = logging.getLogger(__name__)
 class WeatherService:
     """天气服务类"""
     
-    def __init__(self):
+    def __init__(self, http_pool: Optional[HTTPClientPool] = None):
         self.api_key = os.getenv('OPENWEATHER_API_KEY')
-        self.base_url = "https://api.openweathermap.org/data/2.5"
+        self.base_url = os.getenv('OPENWEATHER_BASE_URL', "https://api.openweathermap.org/data/2.5")
         self.geocoding_url = "https://api.openweathermap.org/geo/1.0"
+        self.http_pool = http_pool or http_client_pool  # 共享连接池
+        self.http_pool.register('weather', timeout=10.0)
+        self.guard = upstream_guards.get('weather')  # 熔断器 + 舱壁
+        self.flights = flight_groups.get('weather')  # 合并并发的相同查询，计划内记忆化
         
         if not self.api_key:
             logger.warning("OpenWeatherMap API密钥未配置，天气功能将使用模拟数据")
     
     @retry(
-        stop=stop_after_attempt(3),
+        stop=stop_after_attempt(3) | stop_before_deadline(2),
         wait=wait_exponential(multiplier=1, min=2, max=8),
-        retry=retry_if_exception_type((httpx.RequestError, httpx.HTTPStatusError))
+        retry=retry_while_available('weather', (httpx.RequestError, httpx.HTTPStatusError))
     )
     async def _make_request(self, url: str, params: Dict[str, Any]) -> Dict[str, Any]:
         """发送HTTP请求"""
@@ -42,9 +52,10 @@ class WeatherService:
         logger.info(f"[{request_id}] 开始调用天气API: {url}")
         logger.debug(f"[{request_id}] 请求参数: {params}")
         
-        async with httpx.AsyncClient(timeout=10.0) as client:
+        async with self.guard.protect(), bounded_call('weather', self.http_pool.get_timeout('weather')) as timeout, \
+                self.http_pool.session('weather') as client:
             try:
-                response = await client.get(url, params=params)
+                response = await client.get(url, params=params, timeout=timeout)
                 response.raise_for_status()
                 response_data = response.json()
                 
@@ -131,8 +142,15 @@ class WeatherService:
     
     async def get_forecast(self, city_name: str, days: int = 5) -> List[Dict[str, Any]]:
         """获取天气预报"""
+        return await self.flights.do(('forecast', city_name, days), partial(self._get_forecast, city_name, days),
+                                     memoize=True)
+    
+    async def _get_forecast(self, city_name: str, days: int = 5) -> List[Dict[str, Any]]:
         if not self.api_key:
             return self._get_fallback_forecast(city_name, days)
+        if not self.guard.is_available():
+            logger.warning(f"天气服务熔断中，使用备用预报: {city_name}")
+            return self._get_fallback_forecast(city_name, days)
         
         try:
             # 先获取坐标
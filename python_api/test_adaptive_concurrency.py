@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""测试 AIMD 自适应在途上限：限流时乘法减小、同一轮只减一次、按延迟判断拥塞、拥塞消失后自动恢复"""
+
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+sys.path.append(str(Path(__file__).parent))
+
+from services.adaptive_limit import AIMDController
+from services.resilience import Bulkhead, CircuitBreaker, UpstreamGuard, UpstreamGuards
+
+def test_controller():
+    """限流减半，同一轮的其他失败不再减小，成功后每轮加 1"""
+    print("\n1. 测试AIMD控制器")
+    controller = AIMDController("test", max_limit=10, min_limit=2)
+    started = time.monotonic()
+    controller.on_overload(started)
+    controller.on_overload(started)  # 同一轮发出的请求
+    assert controller.limit == 5 and controller.stats['decreases'] == 1
+    controller.on_overload(time.monotonic())
+    controller.on_overload(time.monotonic())
+    assert controller.limit == 2  # 不低于 min_limit
+
+    successes = 0
+    while controller.limit < 10:
+        controller.on_success(time.monotonic(), 0.01)
+        successes += 1
+    assert 30 < successes < 60, successes  # 约为 2+3+...+9
+    controller.on_success(time.monotonic(), 0.01)
+    assert controller.limit == 10
+    print(f"✅ 从 2 恢复到 10 用了 {successes} 次成功请求")
+
+def test_latency_signal():
+    """延迟超过基线的容忍倍数时减小；容忍倍数为 0 时不按延迟调整"""
+    print("\n2. 测试按延迟调整")
+    controller = AIMDController("amap", max_limit=8, latency_tolerance=3.0)
+    for _ in range(10):
+        controller.on_success(time.monotonic(), 0.02)
+    controller.on_success(time.monotonic(), 0.05)
+    assert controller.limit == 8
+    controller.on_success(time.monotonic(), 0.2)
+    assert controller.limit == 4 and controller.stats['latency_decreases'] == 1
+    assert controller.get_stats()['baseline_latency'] < 0.03
+
+    llm = AIMDController("llm", max_limit=8)
+    for latency in [0.5] * 10 + [20.0]:
+        llm.on_success(time.monotonic(), latency)
+    assert llm.limit == 8
+    print(f"✅ 延迟升高时上限 8 -> 4，大模型不按延迟调整: {controller.get_stats()}")
+
+async def test_bulkhead_follows_limit():
+    """舱壁按当前上限放行，上限增大后唤醒排队的请求"""
+    print("\n3. 测试舱壁跟随上限")
+    controller = AIMDController("test", max_limit=4)
+    bulkhead = Bulkhead("test", max_concurrent=4, max_wait=1.0, controller=controller)
+    controller.on_overload(time.monotonic())
+    assert bulkhead.limit == 2
+    order, peak = [], 0
+
+    async def call(index):
+        nonlocal peak
+        async with bulkhead.acquire():
+            peak = max(peak, bulkhead.in_flight)
+            order.append(index)
+            await asyncio.sleep(0.05)
+
+    tasks = [asyncio.create_task(call(i)) for i in range(6)]
+    await asyncio.sleep(0.01)
+    assert bulkhead.in_flight == 2 and len(bulkhead._waiters) == 4
+    controller._limit = 4.0  # 上限增大
+    bulkhead._wake()
+    assert bulkhead.in_flight == 4
+    await asyncio.gather(*tasks)
+    assert order == list(range(6)) and peak == 4 and bulkhead.in_flight == 0
+    print("✅ 上限 2 时只放行 2 个，增大到 4 后立即放行排队的请求，按到达顺序执行")
+
+async def test_spike_recovery():
+    """上游容量在突发期间下降：上限收敛到容量附近，限流减少；容量恢复后上限自动回到最大值"""
+    print("\n4. 测试突发后自动恢复")
+    controller = AIMDController("sim", max_limit=16)
+    guard = UpstreamGuard("sim", CircuitBreaker("sim", enabled=False),
+                          Bulkhead("sim", max_concurrent=16, max_wait=5.0, controller=controller))
+    upstream = {'active': 0, 'capacity': 4, 'throttled': 0}
+
+    async def call():
+        async with guard.protect() as outcome:
+            upstream['active'] += 1
+            try:
+                await asyncio.sleep(0.005)
+                if upstream['active'] > upstream['capacity']:
+                    upstream['throttled'] += 1
+                    outcome.throttled()
+            finally:
+                upstream['active'] -= 1
+
+    async def worker(calls):
+        for _ in range(calls):
+            await call()
+
+    await asyncio.gather(*(worker(10) for _ in range(16)))
+    first_half = upstream['throttled']
+    upstream['throttled'] = 0
+    await asyncio.gather(*(worker(10) for _ in range(16)))
+    assert controller.limit <= 8 and upstream['throttled'] < first_half, (controller.limit, first_half, upstream)
+    spike_limit = controller.limit
+
+    upstream['capacity'] = 100  # 突发结束
+    await asyncio.gather(*(worker(20) for _ in range(16)))
+    assert controller.limit == 16
+    stats = guard.get_stats()['bulkhead']
+    assert stats['limit'] == 16 and stats['adaptive']['decreases'] >= 2
+    print(f"✅ 限流 {first_half} -> {upstream['throttled']} 次，突发中上限 {spike_limit}，恢复后 {stats['limit']}")
+
+def test_registry_config():
+    """注册表按上游创建控制器：地图和天气按延迟调整，大模型只按限流调整；可整体关闭"""
+    print("\n5. 测试注册表配置")
+    os.environ.update({'AIMD_ENABLED': 'true', 'AIMD_AMAP_MIN_CONCURRENT': '2', 'BULKHEAD_AMAP_MAX_CONCURRENT': '6'})
+    guards = UpstreamGuards()
+    amap = guards.get('amap').bulkhead.controller
+    assert amap.min_limit == 2 and amap.max_limit == 6 and amap.latency_tolerance == 3.0
+    assert guards.get('llm_qwen').bulkhead.controller.latency_tolerance == 0.0
+    assert guards.get('weather').get_stats()['bulkhead']['limit'] == 10
+
+    os.environ['AIMD_ENABLED'] = 'false'
+    try:
+        bulkhead = UpstreamGuards().get('amap').bulkhead
+        assert bulkhead.controller is None and bulkhead.limit == 6
+    finally:
+        for key in ('AIMD_ENABLED', 'AIMD_AMAP_MIN_CONCURRENT', 'BULKHEAD_AMAP_MAX_CONCURRENT'):
+            del os.environ[key]
+    print("✅ 各上游的控制器配置正确")
+
+async def main():
+    print("=== 测试AIMD自适应并发 ===")
+    test_controller()
+    test_latency_signal()
+    await test_bulkhead_follows_limit()
+    await test_spike_recovery()
+    test_registry_config()
+    print("\n=== 测试完成 ===")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""测试共享智能体注册表及单例上的并发计划生成"""
+
+import asyncio
+import contextlib
+import io
+import os
+import sys
+from datetime import date, timedelta
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+sys.path.append(str(Path(__file__).parent))
+os.environ.setdefault('QWEN_API_KEY', 'test-key')
+os.environ.setdefault('ITINERARY_STREAMING', 'false')  # 下面替换的是非流式的 generate_daily_itinerary
+
+from agents.registry import get_travel_planner_agent, reset_agents
+from agents.models import TravelRequest
+from services.llm_service import llm_service
+
+def test_singleton():
+    """多次获取返回同一个已编译的工作流"""
+    print("\n1. 测试单例")
+    reset_agents()
+    first = get_travel_planner_agent()
+    second = get_travel_planner_agent()
+    assert first is second
+    assert first.graph is second.graph
+    print("✅ 注册表返回同一个智能体实例")
+
+async def test_concurrent_plans_on_singleton():
+    """同一用户（匿名）的并发计划互不干扰"""
+    print("\n2. 测试单例上的并发计划")
+
+    async def fake_analysis(destination, preferences):
+        await asyncio.sleep(0.05)
+        return f"{destination}分析"
+
+    async def fake_tips(destination, preferences):
+        await asyncio.sleep(0.05)
+        return [f"{destination}贴士"]
+
+    async def fake_daily(destination, day, total_days, preferences, budget_level):
+        await asyncio.sleep(0.05)
+        return {'day': day, 'morning': {'activity': f'游览{destination}', 'location': destination}}
+
+    llm_service.generate_destination_analysis = fake_analysis
+    llm_service.generate_travel_tips = fake_tips
+    llm_service.generate_daily_itinerary = fake_daily
+
+    agent = get_travel_planner_agent()
+    destinations = ["杭州", "成都", "西安", "南京", "广州"]
+    requests = [
+        TravelRequest(
+            destination=destination,
+            start_date=date.today(),
+            end_date=date.today() + timedelta(days=1),
+            budget_level="舒适型",
+            travel_style="文化探索"
+        )
+        for destination in destinations
+    ]
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = await asyncio.gather(*[agent.generate_travel_plan(request) for request in requests])
+
+    for destination, result in zip(destinations, results):
+        assert result["success"], result.get("message")
+        plan = result["plan"]
+        assert plan.destination == destination
+        assert plan.cultural_tips == [f"{destination}贴士"]
+        assert all(destination in item.activities[0].activity for item in plan.itinerary)
+    print(f"✅ {len(destinations)} 个并发计划结果互不串扰")
+
+async def main():
+    print("=== 测试智能体注册表 ===")
+    test_singleton()
+    await test_concurrent_plans_on_singleton()
+    print("\n=== 测试完成 ===")
+
+if __name__ == "__main__":
+    asyncio.run(main())
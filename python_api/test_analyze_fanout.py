@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""测试目的地分析阶段的并发执行、子任务超时和备用结果"""
+
+import asyncio
+import os
+import sys
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+sys.path.append(str(Path(__file__).parent))
+os.environ.setdefault('QWEN_API_KEY', 'test-key')
+
+import agents.travel_planner_agent as planner_module
+from agents.travel_planner_agent import TravelPlannerAgent
+from agents.models import AgentState, TravelRequest
+from services.llm_service import llm_service
+from services.map_service import map_service
+from services.destination_knowledge import destination_knowledge
+from services.weather_service import weather_service
+
+def _make_state() -> AgentState:
+    request = TravelRequest(
+        destination="杭州",
+        start_date=date.today(),
+        end_date=date.today() + timedelta(days=2),
+        budget_level="舒适型",
+        travel_style="文化探索"
+    )
+    # 每个用例都从空的目的地知识库开始，确保子任务真正执行
+    destination_knowledge.clear()
+    state = AgentState(request=request)
+    state.metadata.update({"destination_processed": "杭州", "travel_style": "文化探索"})
+    return state
+
+def _delayed(seconds: float, value):
+    async def _call(*args, **kwargs):
+        await asyncio.sleep(seconds)
+        return value
+    return _call
+
+async def test_parallel_fanout():
+    """七个子任务并发执行，总耗时接近最慢子任务"""
+    print("\n1. 测试并发执行")
+    llm_service.generate_destination_analysis = _delayed(0.3, "分析内容")
+    llm_service.generate_travel_tips = _delayed(0.3, ["贴士"])
+    map_service.geocode = _delayed(0.3, {'longitude': 120.15, 'latitude': 30.27, 'address': '杭州'})
+    weather_service.get_current_weather = _delayed(0.3, {'temperature': 20})
+    weather_service.get_forecast = _delayed(0.3, [])
+    weather_service.get_weather_for_travel = _delayed(0.3, {'city': '杭州'})
+    map_service.search_poi = _delayed(0.3, [{'name': '西湖', 'address': '西湖区'}])
+
+    agent = TravelPlannerAgent()
+    state = _make_state()
+    start = time.perf_counter()
+    state = await agent._analyze_destination(state)
+    elapsed = time.perf_counter() - start
+
+    timings = state.metadata["stage_timings"]["analyze_destination"]
+    assert elapsed < 0.6, f"阶段耗时 {elapsed:.2f}s，应接近 0.3s 而不是 2.1s"
+    assert set(timings) == {"destination_analysis", "travel_tips", "geocode", "top_pois",
+                            "current_weather", "forecast", "travel_weather"}
+    assert all(t["status"] == "ok" for t in timings.values())
+    assert state.weather_data["location"]["longitude"] == 120.15
+    print(f"✅ 阶段耗时 {elapsed:.2f}s，子任务耗时: {timings}")
+
+async def test_subtask_timeout_fallback():
+    """单个子任务超时只影响自身，使用备用结果"""
+    print("\n2. 测试子任务超时")
+    planner_module.ANALYZE_LLM_TIMEOUT = 0.2
+    llm_service.generate_destination_analysis = _delayed(5, "不会返回")
+    llm_service.generate_travel_tips = _delayed(0.05, ["贴士"])
+
+    agent = TravelPlannerAgent()
+    state = await agent._analyze_destination(_make_state())
+    timings = state.metadata["stage_timings"]["analyze_destination"]
+
+    assert timings["destination_analysis"]["status"] == "timeout"
+    assert timings["travel_tips"]["status"] == "ok"
+    assert "值得探索" in state.destination_info["analysis"]
+    assert state.cultural_info["tips"] == ["贴士"]
+    assert not state.errors
+    print(f"✅ 超时子任务已降级: {timings['destination_analysis']}")
+
+async def test_geocode_failure_fallback():
+    """地理编码失败时天气数据使用示例数据"""
+    print("\n3. 测试地理编码失败")
+    planner_module.ANALYZE_LLM_TIMEOUT = 1
+    llm_service.generate_destination_analysis = _delayed(0, "分析内容")
+
+    async def _failing_geocode(*args, **kwargs):
+        raise RuntimeError("geocode down")
+    map_service.geocode = _failing_geocode
+
+    agent = TravelPlannerAgent()
+    state = await agent._analyze_destination(_make_state())
+    timings = state.metadata["stage_timings"]["analyze_destination"]
+
+    assert timings["geocode"]["status"] == "error"
+    assert state.weather_data["note"] == "天气数据获取失败，显示为示例数据"
+    print("✅ 地理编码失败已降级为示例天气数据")
+
+async def main():
+    print("=== 测试目的地分析并发执行 ===")
+    await test_parallel_fanout()
+    await test_subtask_timeout_fallback()
+    await test_geocode_failure_fallback()
+    print("\n=== 测试完成 ===")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""测试有界检查点存储、SQLite后端和计划完成后的检查点释放"""
+
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import tempfile
+from datetime import date, timedelta
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+sys.path.append(str(Path(__file__).parent))
+os.environ.setdefault('QWEN_API_KEY', 'test-key')
+os.environ.setdefault('ITINERARY_STREAMING', 'false')  # 下面替换的是非流式的 generate_daily_itinerary
+
+import agents.travel_planner_agent as planner_module
+from agents.checkpointer import BoundedMemorySaver, SQLiteSaver
+from agents.travel_planner_agent import TravelPlannerAgent
+from agents.models import TravelRequest
+from services.llm_service import llm_service
+
+def _install_fake_llm():
+    async def fake_analysis(destination, preferences):
+        return f"{destination}分析"
+
+    async def fake_tips(destination, preferences):
+        return [f"{destination}贴士"]
+
+    async def fake_daily(destination, day, total_days, preferences, budget_level):
+        return {'day': day, 'morning': {'activity': f'游览{destination}', 'location': destination}}
+
+    llm_service.generate_destination_analysis = fake_analysis
+    llm_service.generate_travel_tips = fake_tips
+    llm_service.generate_daily_itinerary = fake_daily
+
+def _make_request(destination: str = "杭州") -> TravelRequest:
+    return TravelRequest(
+        destination=destination,
+        start_date=date.today(),
+        end_date=date.today() + timedelta(days=1),
+        budget_level="舒适型",
+        travel_style="文化探索"
+    )
+
+async def _run_plans(agent: TravelPlannerAgent, count: int):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return await asyncio.gather(*[agent.generate_travel_plan(_make_request()) for _ in range(count)])
+
+async def test_bounded_memory_eviction():
+    """保留检查点时线程数不超过上限"""
+    print("\n1. 测试内存存储容量上限")
+    planner_module.CHECKPOINT_RETENTION = "keep"
+    saver = BoundedMemorySaver(max_threads=5, ttl=0)
+    agent = TravelPlannerAgent(checkpointer=saver)
+
+    for _ in range(12):
+        results = await _run_plans(agent, 1)
+        assert results[0]["success"]
+    assert len(saver.storage) == 5
+    assert saver.get_stats()["evictions"] == 7
+    print(f"✅ 12 个计划后只保留 {len(saver.storage)} 个线程: {saver.get_stats()}")
+
+async def test_release_after_finalize():
+    """计划最终化后删除或压缩检查点"""
+    print("\n2. 测试计划完成后释放检查点")
+    saver = BoundedMemorySaver(max_threads=100, ttl=0)
+    agent = TravelPlannerAgent(checkpointer=saver)
+
+    planner_module.CHECKPOINT_RETENTION = "delete"
+    await _run_plans(agent, 3)
+    assert not saver.storage and not saver.writes and not saver.blobs
+    print("✅ delete: 检查点已全部删除")
+
+    planner_module.CHECKPOINT_RETENTION = "compact"
+    await _run_plans(agent, 3)
+    assert len(saver.storage) == 3
+    for namespaces in saver.storage.values():
+        assert all(len(checkpoints) == 1 for checkpoints in namespaces.values())
+    thread_id = next(iter(saver.storage))
+    latest = saver.get_tuple({"configurable": {"thread_id": thread_id}})
+    assert latest.checkpoint["channel_values"]["metadata"]["final_plan"].destination == "杭州"
+    print("✅ compact: 每个线程只保留最新检查点，最终状态可读取")
+
+async def test_sqlite_backend():
+    """SQLite后端可以完整运行工作流并在完成后清理"""
+    print("\n3. 测试SQLite后端")
+    with tempfile.TemporaryDirectory() as tmp:
+        saver = SQLiteSaver(os.path.join(tmp, "checkpoints.db"))
+        agent = TravelPlannerAgent(checkpointer=saver)
+
+        planner_module.CHECKPOINT_RETENTION = "compact"
+        results = await _run_plans(agent, 3)
+        assert all(result["success"] for result in results), results
+        assert saver.get_stats()["threads"] == 3
+        thread_id = saver._execute("SELECT thread_id FROM checkpoints LIMIT 1")[0][0]
+        assert len(list(saver.list({"configurable": {"thread_id": thread_id}}))) == 1
+        latest = saver.get_tuple({"configurable": {"thread_id": thread_id}})
+        assert latest.checkpoint["channel_values"]["metadata"]["final_plan"].destination == "杭州"
+
+        planner_module.CHECKPOINT_RETENTION = "delete"
+        await _run_plans(agent, 3)
+        assert saver.get_stats()["threads"] == 3
+        journal_mode = saver._execute("PRAGMA journal_mode")[0][0]
+        assert journal_mode == "wal"
+        saver.close()
+    print("✅ SQLite(WAL) 后端运行正常")
+
+async def main():
+    print("=== 测试检查点存储 ===")
+    _install_fake_llm()
+    await test_bounded_memory_eviction()
+    await test_release_after_finalize()
+    await test_sqlite_backend()
+    print("\n=== 测试完成 ===")
+
+if __name__ == "__main__":
+    asyncio.run(main())
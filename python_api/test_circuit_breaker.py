@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""测试上游熔断器和舱壁：状态切换、Retry-After、快速失败到备用数据"""
+
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+sys.path.append(str(Path(__file__).parent))
+os.environ.setdefault('CIRCUIT_BREAKER_FAILURE_THRESHOLD', '1')  # 一次失败即打开，避免测试等待重试间隔
+
+from benchmarks.stub_upstream import StubUpstream, _route
+from services.resilience import (
+    Bulkhead, BulkheadFullError, CircuitBreaker, CircuitOpenError, parse_retry_after
+)
+
+async def test_breaker_states():
+    """连续失败打开，冷却后半开，探测成功后关闭"""
+    print("\n1. 测试熔断器状态切换")
+    breaker = CircuitBreaker("test", failure_threshold=2, recovery_timeout=0.1)
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open"
+    try:
+        breaker.before_call()
+        assert False, "打开状态应拒绝请求"
+    except CircuitOpenError as e:
+        assert 0 < e.retry_after <= 0.1
+
+    await asyncio.sleep(0.12)
+    assert breaker.state == "half_open"
+    breaker.before_call()  # 唯一的探测名额
+    assert not breaker.allows_requests()
+    breaker.record_failure()  # 探测失败立即重新打开
+    assert breaker.state == "open"
+
+    await asyncio.sleep(0.12)
+    breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+    breaker.record_failure(retry_after=0.3)  # Retry-After 直接打开，按上游要求冷却
+    assert breaker.state == "open" and breaker.retry_after() > 0.2
+    assert parse_retry_after("7") == 7.0
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+    assert parse_retry_after("soon") is None
+    print(f"✅ 状态切换正确: {breaker.get_stats()}")
+
+async def test_bulkhead():
+    """在途请求达到上限后，等待超时的请求快速失败"""
+    print("\n2. 测试舱壁")
+    bulkhead = Bulkhead("test", max_concurrent=2, max_wait=0.05)
+
+    async def call():
+        async with bulkhead.acquire():
+            await asyncio.sleep(0.2)
+
+    results = await asyncio.gather(*[call() for _ in range(4)], return_exceptions=True)
+    rejected = [r for r in results if isinstance(r, BulkheadFullError)]
+    assert len(rejected) == 2
+    assert bulkhead.get_stats()["peak_in_flight"] == 2 and bulkhead.in_flight == 0
+    print(f"✅ 在途上限 2，拒绝 {len(rejected)} 个请求")
+
+async def test_fast_fail_to_fallbacks(stub: StubUpstream):
+    """上游 429/500 后熔断，后续调用不再请求上游，直接返回备用数据"""
+    print("\n3. 测试快速失败到备用数据")
+    from services.llm_service import llm_service
+    from services.map_service import map_service
+    from services.weather_service import weather_service
+
+    def handler(method, path, query, body):
+        if path.endswith('/chat/completions'):
+            return 429, {'error': 'rate limited'}, {'Retry-After': '30'}
+        if path.endswith('/place/text') or path.endswith('/forecast'):
+            return 500, {'error': 'upstream down'}
+        return _route(method, path, query, body)
+
+    stub.handler = handler
+    start = time.perf_counter()
+    itinerary = await llm_service.generate_daily_itinerary("杭州", 1, 2, {}, "舒适型")
+    assert itinerary["morning"]["activity"] == "杭州市区观光"  # _get_fallback_itinerary
+    pois = await map_service.search_poi("西湖", "杭州")
+    forecast = await weather_service.get_forecast("杭州", 3)
+    first_round = time.perf_counter() - start
+    assert llm_service.router.primary.guard.breaker.state == "open"
+    assert llm_service.router.primary.guard.breaker.retry_after() > 25  # 按 Retry-After 冷却
+    assert map_service.guard.breaker.state == "open"
+    assert weather_service.guard.breaker.state == "open"
+
+    stub.reset_counters()
+    start = time.perf_counter()
+    for day in range(2, 6):
+        await llm_service.generate_daily_itinerary("杭州", day, 5, {}, "舒适型")
+    assert (await map_service.search_poi("灵隐寺", "杭州"))[0]["name"]
+    assert len(await weather_service.get_forecast("杭州", 3)) == 3
+    elapsed = time.perf_counter() - start
+    assert stub.requests == 0, stub.requests
+    assert elapsed < 0.5, elapsed
+    assert pois and forecast
+    print(f"✅ 首轮 {first_round:.2f}s 后熔断，之后 6 次调用共 {elapsed * 1000:.1f}ms，未请求上游")
+
+async def test_agent_skips_queue():
+    """大模型熔断时，计划不排队等待并发名额，各天直接降级"""
+    print("\n4. 测试智能体快速降级")
+    os.environ['ITINERARY_STREAMING'] = 'false'
+    from agents.travel_planner_agent import TravelPlannerAgent
+    from agents.models import TravelRequest
+
+    request = TravelRequest(
+        destination="杭州",
+        start_date=date.today(),
+        end_date=date.today() + timedelta(days=4),
+        budget_level="舒适型",
+        travel_style="文化探索"
+    )
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = await TravelPlannerAgent(day_concurrency=1).generate_travel_plan(request)
+    elapsed = time.perf_counter() - start
+
+    assert result["success"]
+    assert len(result["plan"].itinerary) == 5
+    timings = result["plan"].metadata["stage_timings"]["plan_itinerary"] if "stage_timings" in result["plan"].metadata else None
+    if timings:
+        assert all(entry.get("status") == "circuit_open" for entry in timings.values())
+    assert elapsed < 3, elapsed
+    print(f"✅ 5 天计划在熔断状态下 {elapsed:.2f}s 完成")
+
+async def main():
+    print("=== 测试熔断器和舱壁 ===")
+    await test_breaker_states()
+    await test_bulkhead()
+
+    stub = StubUpstream()
+    await stub.start()
+    os.environ.update({
+        'QWEN_API_KEY': 'test-key',
+        'QWEN_BASE_URL': f"{stub.base_url}/v1",
+        'AMAP_API_KEY': 'test-key',
+        'AMAP_BASE_URL': f"{stub.base_url}/v3",
+        'AMAP_STORE_ENABLED': 'false',
+        'OPENWEATHER_API_KEY': 'test-key',
+        'OPENWEATHER_BASE_URL': f"{stub.base_url}/data/2.5",
+        'LLM_CACHE_ENABLED': 'false'
+    })
+    try:
+        await test_fast_fail_to_fallbacks(stub)
+        await test_agent_skips_queue()
+    finally:
+        await stub.stop()
+    print("\n=== 测试完成 ===")
+
+if __name__ == "__main__":
+    asyncio.run(main())
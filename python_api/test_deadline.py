@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""测试计划生成的截止时间传播：请求超时随剩余预算缩短，临近截止时剩余天数降级为规则行程"""
+
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+sys.path.append(str(Path(__file__).parent))
+os.environ.setdefault('DEADLINE_MIN_CALL_BUDGET', '0.1')
+os.environ.setdefault('DEADLINE_DAY_MIN_BUDGET', '1')
+os.environ.setdefault('DEADLINE_FINALIZE_RESERVE', '0.5')
+
+from benchmarks.stub_upstream import StubUpstream
+from services.deadline import (
+    DeadlineExceededError, call_timeout, deadline_scope, get_route_budget, remaining_budget
+)
+
+# 桩服务中大模型每次请求的延迟（秒）
+LLM_LATENCY = 1.0
+
+async def test_deadline_scope():
+    """截止时间只在作用域及其创建的任务内生效，预算不足时不再发起请求"""
+    print("\n1. 测试截止时间作用域")
+    assert remaining_budget() is None
+    assert call_timeout("llm", 120.0) == 120.0
+    assert get_route_budget("quick") < get_route_budget("full")
+
+    with deadline_scope(0.5, "quick") as deadline:
+        assert 0.4 < call_timeout("llm", 120.0) <= 0.5
+        assert call_timeout("amap", 0.1) == 0.1
+        # 子任务继承截止时间，后台任务可以解除
+        async def inherited():
+            return remaining_budget()
+        assert await asyncio.create_task(inherited()) is not None
+        with deadline_scope(None):
+            assert remaining_budget() is None
+        await asyncio.sleep(0.5)
+        assert deadline.expired()
+        try:
+            call_timeout("llm", 120.0)
+            assert False, "预算耗尽后应拒绝请求"
+        except DeadlineExceededError as e:
+            assert e.upstream == "llm"
+    assert remaining_budget() is None
+    print("✅ 作用域、继承和预算检查正确")
+
+async def test_bounded_upstream_call(stub: StubUpstream):
+    """请求超时被剩余预算截断，不重试、不触发熔断"""
+    print("\n2. 测试上游请求超时随预算缩短")
+    from services.llm_service import llm_service
+
+    stub.reset_counters()
+    start = time.perf_counter()
+    with deadline_scope(LLM_LATENCY / 2):
+        try:
+            await llm_service._make_request([{"role": "user", "content": "你好"}])
+            assert False, "应在预算内超时"
+        except DeadlineExceededError:
+            pass
+    elapsed = time.perf_counter() - start
+    assert elapsed < LLM_LATENCY, elapsed
+    assert stub.requests == 1, stub.requests
+    assert llm_service.router.primary.guard.breaker.state == "closed"
+    print(f"✅ {elapsed:.2f}s 后放弃请求，未重试，熔断器保持关闭")
+
+async def test_plan_degrades_remaining_days():
+    """预算只够生成部分天数时，其余天数使用规则生成的行程，计划按时完成"""
+    print("\n3. 测试临近截止时间时降级")
+    from agents.travel_planner_agent import TravelPlannerAgent
+    from agents.models import TravelRequest
+
+    request = TravelRequest(
+        destination="杭州",
+        start_date=date.today(),
+        end_date=date.today() + timedelta(days=5),
+        budget_level="舒适型",
+        travel_style="文化探索"
+    )
+    budget = 5.0
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = await TravelPlannerAgent(day_concurrency=1).generate_travel_plan(request, route="quick", budget=budget)
+    elapsed = time.perf_counter() - start
+
+    assert result["success"], result
+    plan = result["plan"]
+    assert len(plan.itinerary) == 6
+    assert elapsed < budget + 0.5, elapsed
+
+    degraded = plan.metadata["degraded"]
+    degraded_days = sorted(int(entry["part"].split("_")[1]) for entry in degraded
+                           if entry["stage"] == "plan_itinerary")
+    assert degraded_days and all(entry["reason"] == "deadline" for entry in degraded)
+    assert 1 not in degraded_days and 6 in degraded_days, degraded_days
+    # 降级的天使用规则生成的行程，其余天使用大模型行程
+    assert "西湖" in plan.itinerary[0].activities[1].activity
+    assert plan.itinerary[-1].activities[0].activity == "早餐"
+    assert plan.metadata["deadline"]["route"] == "quick"
+    assert plan.metadata["deadline"]["budget"] == budget
+    print(f"✅ {elapsed:.2f}s 完成 6 天计划，第{degraded_days}天降级为规则行程")
+
+async def main():
+    print("=== 测试截止时间传播 ===")
+    await test_deadline_scope()
+
+    def latency(path: str) -> float:
+        if path.endswith('/chat/completions'):
+            return LLM_LATENCY
+        return 0.0
+
+    stub = StubUpstream(latency=latency)
+    await stub.start()
+    os.environ.update({
+        'QWEN_API_KEY': 'test-key',
+        'QWEN_BASE_URL': f"{stub.base_url}/v1",
+        'AMAP_API_KEY': 'test-key',
+        'AMAP_BASE_URL': f"{stub.base_url}/v3",
+        'AMAP_STORE_ENABLED': 'false',
+        'OPENWEATHER_API_KEY': 'test-key',
+        'OPENWEATHER_BASE_URL': f"{stub.base_url}/data/2.5",
+        'LLM_CACHE_ENABLED': 'false',
+        'ITINERARY_STREAMING': 'false'
+    })
+    try:
+        await test_bounded_upstream_call(stub)
+        await test_plan_degrades_remaining_days()
+    finally:
+        await stub.stop()
+    print("\n=== 测试完成 ===")
+
+if __name__ == "__main__":
+    asyncio.run(main())
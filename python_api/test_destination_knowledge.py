@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""测试跨用户共享的目的地知识库：命中、分桶、备用数据不入库和后台刷新"""
+
+import asyncio
+import os
+import sys
+from datetime import date, timedelta
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+sys.path.append(str(Path(__file__).parent))
+os.environ.setdefault('QWEN_API_KEY', 'test-key')
+
+from agents.travel_planner_agent import TravelPlannerAgent
+from agents.models import AgentState, TravelRequest
+from services.destination_knowledge import destination_knowledge
+from services.llm_service import llm_service
+from services.map_service import map_service
+from services.weather_service import weather_service
+
+calls = {"analysis": 0, "tips": 0, "geocode": 0, "poi": 0}
+
+def _install_fakes():
+    async def fake_analysis(destination, preferences):
+        calls["analysis"] += 1
+        return f"{destination}分析v{calls['analysis']}"
+
+    async def fake_tips(destination, preferences):
+        calls["tips"] += 1
+        return [f"{destination}贴士"]
+
+    async def fake_geocode(address, city=None):
+        calls["geocode"] += 1
+        return {'longitude': 120.15, 'latitude': 30.27, 'address': address}
+
+    async def fake_poi(keyword, city=None, poi_type=None, page_size=20):
+        calls["poi"] += 1
+        return [{'name': '西湖', 'address': '西湖区', 'location': '120.1,30.2', 'type': '风景名胜', 'tel': ''}]
+
+    async def fake_weather(*args, **kwargs):
+        return {'temperature': 20}
+
+    llm_service.generate_destination_analysis = fake_analysis
+    llm_service.generate_travel_tips = fake_tips
+    map_service.geocode = fake_geocode
+    map_service.search_poi = fake_poi
+    weather_service.get_current_weather = fake_weather
+    weather_service.get_forecast = fake_weather
+    weather_service.get_weather_for_travel = fake_weather
+
+def _make_state(destination: str, travel_style: str = "文化探索", budget_level: str = "舒适型") -> AgentState:
+    request = TravelRequest(
+        destination=destination,
+        start_date=date.today(),
+        end_date=date.today() + timedelta(days=2),
+        budget_level=budget_level,
+        travel_style=travel_style
+    )
+    state = AgentState(request=request)
+    state.metadata.update({
+        "destination_processed": destination,
+        "travel_style": travel_style,
+        "budget_level": budget_level
+    })
+    return state
+
+async def test_hit_skips_llm_and_geocode(agent: TravelPlannerAgent):
+    """同一分桶的第二个计划不再调用LLM和地理编码"""
+    print("\n1. 测试知识库命中")
+    destination_knowledge.clear()
+    calls.update({key: 0 for key in calls})
+
+    first = await agent._analyze_destination(_make_state("杭州"))
+    second = await agent._analyze_destination(_make_state("杭州市 "))
+
+    assert calls == {"analysis": 1, "tips": 1, "geocode": 1, "poi": 1}, calls
+    assert second.destination_info["analysis"] == first.destination_info["analysis"]
+    assert second.destination_info["top_pois"][0]["name"] == "西湖"
+    assert second.weather_data["location"]["longitude"] == 120.15
+    assert second.metadata["stage_timings"]["analyze_destination"]["destination_knowledge"]["status"] == "cached"
+    print(f"✅ 第二个计划直接使用知识库: {destination_knowledge.get_stats()}")
+
+async def test_buckets(agent: TravelPlannerAgent):
+    """不同的 (旅行风格, 预算水平) 分桶互不共享"""
+    print("\n2. 测试偏好分桶")
+    calls.update({key: 0 for key in calls})
+    await agent._analyze_destination(_make_state("杭州", budget_level="豪华型"))
+    await agent._analyze_destination(_make_state("杭州", travel_style="美食之旅"))
+    assert calls["analysis"] == 2
+    print("✅ 不同分桶分别生成")
+
+async def test_fallback_not_stored(agent: TravelPlannerAgent):
+    """子任务降级时不把备用数据写入知识库"""
+    print("\n3. 测试备用数据不入库")
+    original = map_service.geocode
+
+    async def failing_geocode(address, city=None):
+        raise RuntimeError("geocode down")
+
+    map_service.geocode = failing_geocode
+    await agent._analyze_destination(_make_state("成都"))
+    map_service.geocode = original
+
+    key = destination_knowledge.make_key("成都", "文化探索", "舒适型")
+    assert key not in destination_knowledge._entries
+    print("✅ 地理编码失败的结果未写入知识库")
+
+async def test_stale_while_revalidate(agent: TravelPlannerAgent):
+    """陈旧条目立即返回，同时在后台刷新"""
+    print("\n4. 测试陈旧条目后台刷新")
+    destination_knowledge.clear()
+    calls.update({key: 0 for key in calls})
+    await agent._analyze_destination(_make_state("西安"))
+
+    destination_knowledge.fresh_ttl = 0
+    stale_state = await agent._analyze_destination(_make_state("西安"))
+    assert stale_state.destination_info["analysis"] == "西安分析v1"
+    assert stale_state.metadata["stage_timings"]["analyze_destination"]["destination_knowledge"]["status"] == "stale"
+
+    await destination_knowledge.wait_for_refreshes()
+    destination_knowledge.fresh_ttl = 3600
+    refreshed = await agent._analyze_destination(_make_state("西安"))
+    assert refreshed.destination_info["analysis"] == "西安分析v2"
+    assert destination_knowledge.stats["refreshes"] == 1
+    print("✅ 陈旧条目先返回，后台刷新后使用新内容")
+
+async def main():
+    print("=== 测试目的地知识库 ===")
+    _install_fakes()
+    agent = TravelPlannerAgent()
+    await test_hit_skips_llm_and_geocode(agent)
+    await test_buckets(agent)
+    await test_fallback_not_stored(agent)
+    await test_stale_while_revalidate(agent)
+    print("\n=== 测试完成 ===")
+
+if __name__ == "__main__":
+    asyncio.run(main())
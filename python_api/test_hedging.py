@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""测试对冲请求：超过延迟分位数后发出第二份请求、先返回的生效、预算上限、服务内的长尾请求"""
+
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+sys.path.append(str(Path(__file__).parent))
+os.environ.setdefault('HEDGE_ENABLED', 'true')
+os.environ.setdefault('HEDGE_MIN_SAMPLES', '5')
+os.environ.setdefault('HEDGE_BUDGET', '0.5')
+os.environ.setdefault('HEDGE_LLM_MIN_DELAY', '0.05')
+os.environ.setdefault('HEDGE_AMAP_MIN_DELAY', '0.05')
+
+from benchmarks.stub_upstream import StubUpstream
+from services.hedging import HedgePolicy
+
+# 桩服务中长尾请求的延迟（秒）
+SLOW_LATENCY = 2.0
+
+def make_call(latencies, cancelled=None, errors=()):
+    """按调用顺序返回不同延迟的请求函数；errors 中的序号抛出异常"""
+    attempts = []
+
+    async def call():
+        index = len(attempts)
+        attempts.append(index)
+        try:
+            await asyncio.sleep(latencies[index] if index < len(latencies) else 0.01)
+        except asyncio.CancelledError:
+            if cancelled is not None:
+                cancelled.append(index)
+            raise
+        if index in errors:
+            raise RuntimeError(f"attempt {index} failed")
+        return index
+
+    return call, attempts
+
+async def test_first_response_wins():
+    """主请求超过分位数后发出对冲请求，先返回的生效，另一份被取消"""
+    print("\n1. 测试对冲请求")
+    policy = HedgePolicy("test", enabled=True, budget=1.0, min_samples=5, min_delay=0.01)
+    call, _ = make_call([])
+    for _ in range(5):
+        assert await policy.run(call, key="tips") is not None
+    assert policy.stats['hedged'] == 0 and policy.hedge_delay("tips") < 0.05
+    assert policy.hedge_delay("itinerary") is None  # 按调用键分别统计，样本不足时不对冲
+
+    cancelled = []
+    call, attempts = make_call([1.0, 0.01], cancelled)
+    start = time.perf_counter()
+    assert await policy.run(call, key="tips") == 1
+    elapsed = time.perf_counter() - start
+    await asyncio.sleep(0)
+    assert elapsed < 0.3, elapsed
+    assert attempts == [0, 1] and cancelled == [0]
+    assert policy.stats['hedge_wins'] == 1 and policy.stats['cancelled'] == 1
+
+    # 对冲后主请求失败时等待对冲请求；两份都失败时抛出异常
+    call, _ = make_call([0.2, 0.3], errors={0})
+    assert await policy.run(call, key="tips") == 1
+    call, _ = make_call([0.2, 0.3], errors={0, 1})
+    try:
+        await policy.run(call, key="tips")
+        assert False, "两份请求都失败时应抛出异常"
+    except RuntimeError:
+        pass
+    print(f"✅ {elapsed * 1000:.0f}ms 返回对冲结果，主请求已取消: {policy.get_stats()}")
+
+async def test_budget_cap():
+    """对冲请求数不超过调用数的预算比例"""
+    print("\n2. 测试对冲预算")
+    class FixedDelayPolicy(HedgePolicy):
+        def hedge_delay(self, key=None):
+            return 0.01  # 每次调用都超过对冲等待时间
+
+    policy = FixedDelayPolicy("test", enabled=True, budget=0.1)
+    for _ in range(50):
+        call, _ = make_call([0.03, 0.03])
+        await policy.run(call)
+    stats = policy.get_stats()
+    assert stats['hedged'] == 5 and stats['budget_denied'] == 45, stats
+    assert stats['extra_load'] <= policy.budget
+    disabled = HedgePolicy("off")
+    call, attempts = make_call([0.05])
+    await disabled.run(call)
+    assert attempts == [0] and disabled.stats['calls'] == 0
+    print(f"✅ 50 次慢调用只对冲 {stats['hedged']} 次，额外负载 {stats['extra_load']:.0%}")
+
+async def test_service_tail_latency(stub: StubUpstream, slow: dict):
+    """大模型和地图调用遇到长尾时由对冲请求返回，熔断器不受影响"""
+    print("\n3. 测试服务内对冲")
+    from services.llm_service import llm_service
+    from services.map_service import map_service
+
+    messages = [{"role": "user", "content": "你好"}]
+    for i in range(5):
+        await llm_service._make_request(messages, site="travel_tips")
+        await map_service.search_poi(f"景点{i}", "杭州")
+
+    stub.reset_counters()
+    slow.update({'/v1/chat/completions': 1, '/v3/place/text': 1})
+    start = time.perf_counter()
+    response = await llm_service._make_request(messages, site="travel_tips")
+    llm_elapsed = time.perf_counter() - start
+    assert response["choices"][0]["message"]["content"]
+    start = time.perf_counter()
+    pois = await map_service.search_poi("长尾景点", "杭州")
+    map_elapsed = time.perf_counter() - start
+    assert pois
+
+    assert llm_elapsed < SLOW_LATENCY / 2 and map_elapsed < SLOW_LATENCY / 2, (llm_elapsed, map_elapsed)
+    assert stub.requests == 4, stub.requests
+    assert llm_service.hedging.stats['hedge_wins'] == 1
+    assert map_service.hedging.stats['hedge_wins'] == 1
+    assert llm_service.router.primary.guard.breaker.state == "closed"
+    assert map_service.guard.breaker.state == "closed"
+    print(f"✅ 长尾请求由对冲返回: 大模型 {llm_elapsed:.2f}s，地图 {map_elapsed:.2f}s（上游延迟 {SLOW_LATENCY}s）")
+
+async def main():
+    print("=== 测试对冲请求 ===")
+    await test_first_response_wins()
+    await test_budget_cap()
+
+    slow = {}  # 路径 -> 剩余的慢请求数
+
+    def latency(path: str) -> float:
+        if slow.get(path):
+            slow[path] -= 1
+            return SLOW_LATENCY
+        return 0.01
+
+    stub = StubUpstream(latency=latency)
+    await stub.start()
+    os.environ.update({
+        'QWEN_API_KEY': 'test-key',
+        'QWEN_BASE_URL': f"{stub.base_url}/v1",
+        'AMAP_API_KEY': 'test-key',
+        'AMAP_BASE_URL': f"{stub.base_url}/v3",
+        'AMAP_STORE_ENABLED': 'false',
+        'LLM_CACHE_ENABLED': 'false'
+    })
+    try:
+        await test_service_tail_latency(stub, slow)
+    finally:
+        await stub.stop()
+    print("\n=== 测试完成 ===")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""测试LLM响应缓存：两级命中、变体、调用点开关、持久化和淘汰"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+sys.path.append(str(Path(__file__).parent))
+os.environ.setdefault('QWEN_API_KEY', 'test-key')
+
+from services.llm_cache import LLMResponseCache
+from services.llm_service import QwenLLMService
+
+def _make_service(db_path: str) -> QwenLLMService:
+    """创建使用独立缓存的服务，_make_request 替换为计数的假实现"""
+    service = QwenLLMService(cache=LLMResponseCache(db_path=db_path))
+    service.api_calls = 0
+
+    async def fake_make_request(messages, **kwargs):
+        service.api_calls += 1
+        return {'choices': [{'message': {'content': f"- 贴士{service.api_calls}"}}]}
+
+    service._make_request = fake_make_request
+    return service
+
+async def test_hit_and_persistence(tmp: str):
+    """相同请求第二次命中内存，重启后命中SQLite"""
+    print("\n1. 测试命中与持久化")
+    db_path = os.path.join(tmp, "cache.db")
+    service = _make_service(db_path)
+    messages = [{"role": "user", "content": "杭州"}]
+
+    first = await service._cached_request(messages, cache_site='test', temperature=0)
+    second = await service._cached_request(messages, cache_site='test', temperature=0)
+    assert first == second and service.api_calls == 1
+    assert service.cache.stats['memory_hits'] == 1
+
+    restarted_at = time.time()
+    restarted = _make_service(db_path)
+    third = await restarted._cached_request(messages, cache_site='test', temperature=0)
+    assert third == first and restarted.api_calls == 0
+    assert restarted.cache.stats['disk_hits'] == 1
+    # 提升到内存的条目沿用SQLite中的写入时间，TTL不重新计算
+    created_at, _ = next(iter(restarted.cache._memory.values()))
+    assert created_at < restarted_at
+    print(f"✅ 命中统计: {restarted.cache.get_stats()}")
+
+async def test_variants(tmp: str):
+    """temperature > 0 时先补足变体，再从变体中随机返回"""
+    print("\n2. 测试多变体")
+    service = _make_service(os.path.join(tmp, "variants.db"))
+    messages = [{"role": "user", "content": "成都"}]
+
+    results = [await service._cached_request(messages, cache_site='test', cache_variants=3, temperature=0.8)
+               for _ in range(20)]
+    contents = {r['choices'][0]['message']['content'] for r in results}
+    assert service.api_calls == 3
+    assert contents == {"- 贴士1", "- 贴士2", "- 贴士3"}
+
+    # 请求期间内存条目被淘汰时，新变体按数据库中的编号追加，不覆盖已保存的变体
+    cache = service.cache
+    await cache.put("evicted", {"text": "变体0"}, variants=2)
+    cache._memory.clear()
+    await cache.put("evicted", {"text": "变体1"}, variants=2)
+    await cache.put("evicted", {"text": "变体2"}, variants=2)
+    _, stored = cache._disk_get("evicted")
+    assert stored == [{"text": "变体0"}, {"text": "变体1"}], stored
+    print(f"✅ 20 次调用只请求 {service.api_calls} 次，返回 {len(contents)} 个不同变体")
+
+async def test_site_opt_out(tmp: str):
+    """未指定调用点或调用点被禁用时不使用缓存"""
+    print("\n3. 测试调用点开关")
+    service = _make_service(os.path.join(tmp, "sites.db"))
+    service.cache.disabled_sites = {'travel_tips'}
+    messages = [{"role": "user", "content": "西安"}]
+
+    for _ in range(2):
+        await service._cached_request(messages, cache_site='travel_tips', temperature=0)
+        await service._cached_request(messages, temperature=0)
+    assert service.api_calls == 4
+    assert service.cache.get_stats()['misses'] == 0
+
+    tips = [await service.generate_travel_tips("西安", {}) for _ in range(2)]
+    assert tips[0] != tips[1]
+    print("✅ 禁用的调用点每次都请求API")
+
+async def test_eviction(tmp: str):
+    """TTL过期和容量上限淘汰"""
+    print("\n4. 测试淘汰")
+    service = _make_service(os.path.join(tmp, "evict.db"))
+    cache = service.cache
+    cache.max_memory_entries = 2
+    cache.max_disk_entries = 3
+
+    for city in ["北京", "上海", "广州", "深圳", "南京"]:
+        await service._cached_request([{"role": "user", "content": city}], cache_site='test', temperature=0)
+    assert len(cache._memory) == 2
+    assert cache._get_connection().execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0] == 3
+
+    cache.ttl = 0
+    service.api_calls = 0
+    await service._cached_request([{"role": "user", "content": "南京"}], cache_site='test', temperature=0)
+    assert service.api_calls == 1
+    print(f"✅ 内存 {len(cache._memory)} 条，淘汰 {cache.stats['evictions']} 次，过期条目重新请求")
+
+async def main():
+    print("=== 测试LLM响应缓存 ===")
+    with tempfile.TemporaryDirectory() as tmp:
+        await test_hit_and_persistence(tmp)
+        await test_variants(tmp)
+        await test_site_opt_out(tmp)
+        await test_eviction(tmp)
+    print("\n=== 测试完成 ===")
+
+if __name__ == "__main__":
+    asyncio.run(main())
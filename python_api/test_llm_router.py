@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""测试大模型多供应商路由：延迟/错误率统计、按健康度排序、计划中途切换供应商"""
+
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+sys.path.append(str(Path(__file__).parent))
+
+from benchmarks.stub_upstream import StubUpstream, _route
+from services.http_client import HTTPClientPool
+from services.llm_router import AnthropicProvider, LatencyTracker, LLMProvider, LLMRouter
+
+# 首选供应商在前几次大模型请求（目的地分析、贴士、前两天行程）后开始返回 500
+PRIMARY_HEALTHY_REQUESTS = 4
+
+async def test_tracker_and_ranking():
+    """分位数和错误率统计正确，错误率过高或明显偏慢的供应商排到后面"""
+    print("\n1. 测试延迟统计和供应商排序")
+    tracker = LatencyTracker(window=100)
+    for i in range(1, 21):
+        tracker.record(i / 10, ok=True)
+    tracker.record(5.0, ok=False)
+    assert tracker.percentile(0.5) == 1.1 and tracker.percentile(0.95) == 2.0
+    assert round(tracker.error_rate, 3) == round(1 / 21, 3)
+
+    pool = HTTPClientPool()
+    primary = LLMProvider("rank_a", "key", "http://a/v1", "model-a", 0, pool)
+    secondary = AnthropicProvider("rank_b", "key", "http://b/v1", "model-b", 1, pool)
+    router = LLMRouter([primary, secondary])
+    assert router.rank("tips") == [primary, secondary]  # 没有样本时按配置顺序
+
+    for _ in range(10):
+        router.record(primary, "tips", 1.2, True)
+        router.record(secondary, "tips", 1.0, True)
+    assert router.rank("tips")[0] is primary  # 在容忍范围内不因略慢而切换
+    for _ in range(10):
+        router.record(primary, "daily_itinerary", 9.0, True)
+        router.record(secondary, "daily_itinerary", 3.0, True)
+    assert router.rank("daily_itinerary")[0] is secondary  # 按调用点统计：行程调用偏慢
+    assert router.rank("tips")[0] is primary
+    for _ in range(20):
+        router.record(primary, "tips", 1.0, False)
+    assert router.rank("tips")[0] is secondary  # 错误率过高
+    stats = router.get_stats()["providers"][0]
+    assert stats["sites"]["daily_itinerary"]["p95"] == 9.0 and stats["error_rate"] > 0.4
+    print(f"✅ 排序正确: {stats['sites']}")
+
+async def test_anthropic_provider(secondary: StubUpstream):
+    """Anthropic 接口的请求和响应（含流式）与 OpenAI 格式互相转换"""
+    print("\n2. 测试 Anthropic 供应商")
+    pool = HTTPClientPool()
+    provider = AnthropicProvider("conv", "key", f"{secondary.base_url}/v1", "claude-test", 0, pool)
+    payload = provider.build_payload(
+        [{"role": "system", "content": "系统"}, {"role": "user", "content": "你好"}],
+        temperature=0.5, response_format={"type": "json_object"}
+    )
+    assert payload["system"] == "系统" and payload["messages"] == [{"role": "user", "content": "你好"}]
+    assert payload["max_tokens"] == 4096 and "response_format" not in payload
+
+    converted = provider.parse_response({
+        "content": [{"type": "text", "text": "你好"}], "stop_reason": "max_tokens",
+        "usage": {"input_tokens": 3, "output_tokens": 2}
+    })
+    assert converted["choices"][0]["message"]["content"] == "你好"
+    assert converted["choices"][0]["finish_reason"] == "length"
+    assert converted["usage"]["total_tokens"] == 5
+    assert provider.parse_stream_event(json.dumps(
+        {"type": "content_block_delta", "delta": {"type": "text_delta", "text": "段"}})) == ("段", False)
+    assert provider.parse_stream_event(json.dumps({"type": "message_stop"})) == (None, True)
+    await pool.aclose()
+    print("✅ 请求和响应格式转换正确")
+
+async def test_failover_mid_plan(primary: StubUpstream, secondary: StubUpstream):
+    """首选供应商在计划中途故障，后续天数切换到备用供应商，已完成的天保持不变"""
+    print("\n3. 测试计划中途切换供应商")
+    from services.llm_service import llm_service
+    from agents.travel_planner_agent import TravelPlannerAgent
+    from agents.models import TravelRequest
+
+    assert [p.name for p in llm_service.router.providers] == ["qwen", "anthropic"]
+    request = TravelRequest(
+        destination="杭州",
+        start_date=date.today(),
+        end_date=date.today() + timedelta(days=4),
+        budget_level="舒适型",
+        travel_style="文化探索"
+    )
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = await TravelPlannerAgent(day_concurrency=1).generate_travel_plan(request)
+    elapsed = time.perf_counter() - start
+
+    assert result["success"], result
+    plan = result["plan"]
+    mornings = [day.activities[1].activity for day in plan.itinerary]
+    assert all("西湖" in activity for activity in mornings[:2]), mornings
+    assert all("西溪湿地" in activity for activity in mornings[2:]), mornings
+    assert not plan.metadata["degraded"]
+
+    stats = llm_service.router.get_stats()
+    assert stats["failovers"] >= 1
+    assert stats["providers"][0]["error_rate"] > 0
+    assert stats["providers"][1]["sites"]["daily_itinerary"]["count"] == 3
+    print(f"✅ {elapsed:.2f}s 完成，第1-2天来自首选供应商，第3-5天切换到备用供应商，切换 {stats['failovers']} 次")
+
+    # 行程调用点上首选供应商错误率已超过阈值，后续请求（包括流式）直接路由到备用供应商
+    assert llm_service.router.rank("daily_itinerary")[0].name == "anthropic"
+    assert llm_service.router.rank("travel_tips")[0].name == "qwen"
+    sections = [section async for _, section in llm_service.stream_daily_itinerary("杭州", 6, 6, {}, "舒适型")]
+    assert len(sections) == 6 and sections[1]["name"] == "西溪湿地"
+    assert llm_service.router.get_stats()["failovers"] == stats["failovers"]
+    print("✅ 行程调用直接路由到备用供应商（流式），其他调用点仍使用首选供应商")
+
+async def main():
+    print("=== 测试大模型多供应商路由 ===")
+    await test_tracker_and_ranking()
+
+    chat_requests = 0
+
+    def primary_handler(method, path, query, body):
+        nonlocal chat_requests
+        if path.endswith('/chat/completions'):
+            chat_requests += 1
+            if chat_requests > PRIMARY_HEALTHY_REQUESTS:
+                return 500, {'error': 'upstream down'}
+        return _route(method, path, query, body)
+
+    def secondary_handler(method, path, query, body):
+        status, payload = _route(method, path, query, body)
+        if path.endswith('/messages') and isinstance(payload, dict):
+            payload['content'][0]['text'] = payload['content'][0]['text'].replace('西湖', '西溪湿地')
+        elif path.endswith('/messages'):
+            text = ''.join(payload.chunks).replace('西湖', '西溪湿地')
+            payload.chunks = [text[i:i + 8] for i in range(0, len(text), 8)]
+        return status, payload
+
+    primary = StubUpstream(handler=primary_handler)
+    secondary = StubUpstream(handler=secondary_handler)
+    await primary.start()
+    await secondary.start()
+    os.environ.update({
+        'LLM_PROVIDERS': 'qwen,anthropic',
+        'QWEN_API_KEY': 'test-key',
+        'QWEN_BASE_URL': f"{primary.base_url}/v1",
+        'ANTHROPIC_API_KEY': 'test-key',
+        'ANTHROPIC_BASE_URL': f"{secondary.base_url}/v1",
+        'ANTHROPIC_MODEL': 'claude-test',
+        'AMAP_API_KEY': 'test-key',
+        'AMAP_BASE_URL': f"{primary.base_url}/v3",
+        'AMAP_STORE_ENABLED': 'false',
+        'OPENWEATHER_API_KEY': 'test-key',
+        'OPENWEATHER_BASE_URL': f"{primary.base_url}/data/2.5",
+        'LLM_CACHE_ENABLED': 'false',
+        'ITINERARY_STREAMING': 'false'
+    })
+    try:
+        await test_anthropic_provider(secondary)
+        await test_failover_mid_plan(primary, secondary)
+    finally:
+        await primary.stop()
+        await secondary.stop()
+    print("\n=== 测试完成 ===")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""测试地图响应缓存：容量上限和LRU淘汰、按接口分组的有效期、过期条目的清理、响应裁剪和命中统计"""
+
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+sys.path.append(str(Path(__file__).parent))
+
+from benchmarks.stub_upstream import StubUpstream, _route
+from services.map_cache import MapResponseCache, trim_response
+
+ROUTE_RESPONSE = {
+    'status': '1', 'info': 'OK', 'count': '2',
+    'route': {'origin': '120.1,30.2', 'destination': '120.2,30.3', 'taxi_cost': '30', 'paths': [
+        {'distance': '5200', 'duration': '900', 'tolls': '0', 'toll_distance': '0', 'traffic_lights': '6',
+         'strategy': '速度最快', 'steps': [
+             {'instruction': '向东行驶', 'road': '龙井路', 'distance': '2000', 'duration': '300',
+              'action': '右转', 'assistant_action': '', 'polyline': '120.1,30.2;' * 200,
+              'tmcs': [{'status': '畅通', 'polyline': '120.1,30.2;' * 50}]},
+             {'instruction': '到达目的地', 'road': '湖滨路', 'distance': '3200', 'duration': '600',
+              'action': '', 'assistant_action': '到达目的地', 'polyline': '120.2,30.3;' * 200}
+         ]},
+        {'distance': '6100', 'duration': '1000', 'steps': []}
+    ]}
+}
+
+def test_lru_and_ttl():
+    """超出容量淘汰最久未访问的条目，各分组按自己的有效期过期"""
+    print("\n1. 测试LRU淘汰和分组有效期")
+    cache = MapResponseCache(max_entries=3, ttls={'geocode': 60, 'poi': 60, 'route': 0.05})
+    for key in ('a', 'b', 'c'):
+        cache.put('geocode/geo', key, {'status': '1', 'geocodes': []})
+    assert cache.get('geocode/geo', 'a') is not None  # a 变为最近访问
+    cache.put('place/text', 'd', {'status': '1', 'pois': []})
+    assert len(cache) == 3 and cache.stats['evictions'] == 1
+    assert cache.get('geocode/geo', 'b') is None and cache.get('geocode/geo', 'a') is not None
+
+    cache.put('direction/driving', 'route', ROUTE_RESPONSE)
+    assert cache.get('direction/driving', 'route') is not None
+    time.sleep(0.06)
+    assert cache.get('direction/driving', 'route') is None  # 路线的有效期最短
+    assert cache.get('place/text', 'd') is not None
+    stats = cache.get_stats()
+    assert stats['expired'] == 1 and stats['groups']['geocode'] == {'hits': 2, 'misses': 1}
+    print(f"✅ 命中 {stats['hits']} 次，未命中 {stats['misses']} 次，淘汰 {stats['evictions']} 次")
+
+def test_expired_entries_swept_on_write():
+    """写入时从最久未访问的一端移除已过期的条目，不需要读取也不扫描整个缓存"""
+    print("\n2. 测试过期条目清理")
+    cache = MapResponseCache(max_entries=1000, ttls={'route': 0.05, 'poi': 60})
+    for i in range(100):
+        cache.put('distance', f'route{i}', {'status': '1', 'results': []})
+    time.sleep(0.06)
+    cache.put('place/text', 'poi', {'status': '1', 'pois': []})
+    assert len(cache) == 1 and cache.stats['expired'] == 100 and cache.stats['evictions'] == 0
+
+    cache.ttls['poi'] = 0  # 有效期为 0 时不缓存
+    cache.put('place/text', 'other', {'status': '1', 'pois': []})
+    assert cache.get('place/text', 'other') is None
+    print("✅ 100 个过期的路线条目在下一次写入时清理")
+
+def test_trim():
+    """只保留解析用到的字段"""
+    print("\n3. 测试响应裁剪")
+    trimmed = trim_response('direction/driving', ROUTE_RESPONSE)
+    assert len(trimmed['route']['paths']) == 1
+    step = trimmed['route']['paths'][0]['steps'][0]
+    assert 'polyline' not in step and 'tmcs' not in step and step['road'] == '龙井路'
+    assert len(str(trimmed)) < len(str(ROUTE_RESPONSE)) / 5
+
+    pois = trim_response('place/text', {'status': '1', 'pois': [
+        {'name': '西湖', 'location': '120.1,30.2', 'photos': [{'url': 'x'}] * 5, 'biz_ext': {'rating': '4.8'}}
+    ]})['pois']
+    assert pois == [{'name': '西湖', 'location': '120.1,30.2'}]
+    assert trim_response('unknown', {'a': 1}) == {'a': 1}
+    print(f"✅ 路线响应从 {len(str(ROUTE_RESPONSE))} 字符裁剪到 {len(str(trimmed))} 字符")
+
+async def test_service_cache(paths):
+    """重复查询命中缓存，裁剪后的缓存数据解析结果与原始响应一致"""
+    print("\n4. 测试服务内缓存")
+    from services.map_service import map_service
+
+    map_service.rate_limiter.set_rate(0)
+    map_service.cache.clear()
+    paths.clear()
+    first = await map_service.get_route((120.1, 30.2), (120.2, 30.3))
+    second = await map_service.get_route((120.1, 30.2), (120.2, 30.3))
+    assert first == second and first['distance'] == 5200 and len(first['steps']) == 2
+    assert paths.count('/v3/direction/driving') == 1
+
+    pois = await map_service.search_poi("西湖", "杭州")
+    assert await map_service.search_poi("西湖", "杭州") == pois
+    assert await map_service.geocode("杭州") == await map_service.geocode("杭州")
+    assert paths.count('/v3/place/text') == 1 and paths.count('/v3/geocode/geo') == 1
+
+    stats = map_service.cache.get_stats()
+    assert stats['size'] == 3 and stats['hits'] == 3
+    assert stats['groups']['route'] == {'hits': 1, 'misses': 1}
+    print(f"✅ 服务缓存统计: 命中率 {stats['hit_rate']:.0%}，{stats['size']} 个条目")
+
+async def main():
+    print("=== 测试地图响应缓存 ===")
+    test_lru_and_ttl()
+    test_expired_entries_swept_on_write()
+    test_trim()
+
+    paths = []
+
+    def handler(method, path, query, body):
+        paths.append(path)
+        if path.endswith('/direction/driving'):
+            return 200, ROUTE_RESPONSE
+        return _route(method, path, query, body)
+
+    stub = StubUpstream(handler=handler)
+    await stub.start()
+    os.environ.update({
+        'QWEN_API_KEY': 'test-key',
+        'AMAP_API_KEY': 'test-key',
+        'AMAP_BASE_URL': f"{stub.base_url}/v3",
+        'AMAP_STORE_ENABLED': 'false'
+    })
+    try:
+        await test_service_cache(paths)
+    finally:
+        await stub.stop()
+    print("\n=== 测试完成 ===")
+
+if __name__ == "__main__":
+    asyncio.run(main())
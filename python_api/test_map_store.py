@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""测试地图结果持久化存储：查询规范化、有效期、空结果不保存、重启后从存储读取、预热和导出"""
+
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+sys.path.append(str(Path(__file__).parent))
+
+from benchmarks.stub_upstream import StubUpstream, _route
+from services.map_store import MapResultStore, normalize_query
+
+GEOCODE_RESPONSE = {'status': '1', 'info': 'OK', 'geocodes': [
+    {'formatted_address': '浙江省杭州市', 'location': '120.155070,30.274084', 'level': '市', 'adcode': '330100'}]}
+
+def test_normalize_query():
+    """城市的“市”后缀、大小写和多余空白不影响寻址"""
+    print("\n1. 测试查询规范化")
+    assert normalize_query('geocode/geo', {'address': ' 西湖  断桥 ', 'city': '杭州市'}) == \
+        normalize_query('geocode/geo', {'address': '西湖 断桥', 'city': '杭州'}) == ('geocode', '西湖 断桥', '杭州')
+    assert normalize_query('place/text', {'keywords': 'KFC', 'city': '杭州', 'offset': 20}) == \
+        ('poi', 'kfc||20', '杭州')
+    assert normalize_query('geocode/regeo', {'location': '120.1,30.2'})[1] == '120.100000,30.200000'
+    assert normalize_query('direction/driving', {'origin': '120.1,30.2'}) is None
+    print("✅ 等价的查询映射到同一个键，路线不持久化")
+
+async def test_roundtrip_and_ttl(db_path: str):
+    """写入后可读取，过期条目不再返回，没有结果的响应不保存"""
+    print("\n2. 测试读写和有效期")
+    store = MapResultStore(db_path)
+    params = {'address': '杭州', 'city': '杭州市'}
+    await store.put('geocode/geo', params, GEOCODE_RESPONSE)
+    stored = await store.get('geocode/geo', {'address': '杭州', 'city': '杭州'})
+    assert stored['geocodes'][0]['location'] == '120.155070,30.274084'
+    assert 'adcode' not in stored['geocodes'][0]  # 只保存解析用到的字段
+
+    await store.put('place/text', {'keywords': '不存在的景点', 'offset': 20}, {'status': '1', 'pois': []})
+    assert await store.get('place/text', {'keywords': '不存在的景点', 'offset': 20}) is None
+
+    store.ttls['geocode'] = 0.05
+    time.sleep(0.06)
+    assert await store.get('geocode/geo', params) is None
+    stats = store.get_stats()
+    assert stats['stores'] == 1 and stats['hits'] == 1 and stats['misses'] == 2
+    print(f"✅ 存储统计: {stats}")
+
+async def test_survives_restart(db_path: str, paths):
+    """新的服务实例（模拟重启）从持久化存储读取，不请求高德"""
+    print("\n3. 测试重启后读取")
+    from services.map_service import MapService
+
+    first = MapService()
+    first.rate_limiter.set_rate(0)
+    location = await first.geocode("杭州")
+    pois = await first.search_poi("西湖", "杭州市")
+    assert paths.count('/v3/geocode/geo') == 1 and paths.count('/v3/place/text') == 1
+    await first.geocode("北京")
+
+    paths.clear()
+    restarted = MapService()
+    restarted.rate_limiter.set_rate(0)
+    assert restarted.cache.get_stats()['size'] == 0
+    assert await restarted.geocode("杭州") == location
+    assert await restarted.search_poi("西湖", "杭州") == pois
+    assert paths == []
+    stats = restarted.store.get_stats()
+    assert stats['hits'] == 2 and restarted.cache.get_stats()['size'] == 2  # 命中后写入内存缓存
+
+    # 路线等不持久化的接口仍请求高德
+    await restarted.get_route((120.1, 30.2), (120.2, 30.3))
+    assert set(paths) == {'/v3/direction/driving'}
+    print(f"✅ 重启后地理编码和POI搜索 0 次上游请求，存储命中率 {stats['hit_rate']:.0%}")
+
+async def test_prewarm_and_dump(directory: str, db_path: str):
+    """从 JSON Lines 文件预热，已有条目不覆盖；导出文件可预热其他实例"""
+    print("\n4. 测试预热和导出")
+    prewarm_file = os.path.join(directory, 'prewarm.jsonl')
+    with open(prewarm_file, 'w', encoding='utf-8') as f:
+        f.write(json.dumps({'kind': 'geocode', 'query': '成都 ', 'city': '成都市', 'response': {
+            'status': '1', 'geocodes': [{'formatted_address': '四川省成都市', 'location': '104.066,30.572'}]}},
+            ensure_ascii=False) + '\n\n')
+        f.write(json.dumps({'kind': 'poi', 'query': '宽窄巷子||20', 'city': '成都', 'response': {
+            'status': '1', 'pois': [{'name': '宽窄巷子', 'location': '104.05,30.66'}]}}, ensure_ascii=False) + '\n')
+
+    os.environ['AMAP_STORE_PREWARM_FILE'] = prewarm_file
+    try:
+        store = MapResultStore(db_path)
+        stored = await store.get('geocode/geo', {'address': '成都', 'city': '成都'})
+        assert stored['geocodes'][0]['location'] == '104.066,30.572'
+        assert await store.get('place/text', {'keywords': '宽窄巷子', 'city': '成都市', 'offset': 20}) is not None
+        assert store.stats['prewarmed'] == 2 and store.load_file(prewarm_file) == 0
+    finally:
+        del os.environ['AMAP_STORE_PREWARM_FILE']
+
+    dump_file = os.path.join(directory, 'dump.jsonl')
+    count = store.dump_file(dump_file)
+    other = MapResultStore(os.path.join(directory, 'other.db'))
+    assert other.load_file(dump_file) == count >= 4
+    assert await other.get('geocode/geo', {'address': '杭州'}) is not None
+    print(f"✅ 预热 2 条，导出并导入 {count} 条")
+
+async def main():
+    print("=== 测试地图结果持久化存储 ===")
+    paths = []
+
+    def handler(method, path, query, body):
+        paths.append(path)
+        return _route(method, path, query, body)
+
+    stub = StubUpstream(handler=handler)
+    await stub.start()
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, 'map_store.db')
+        os.environ.update({
+            'QWEN_API_KEY': 'test-key',
+            'AMAP_API_KEY': 'test-key',
+            'AMAP_BASE_URL': f"{stub.base_url}/v3",
+            'AMAP_STORE_ENABLED': 'true',
+            'AMAP_STORE_DB_PATH': db_path
+        })
+        try:
+            test_normalize_query()
+            await test_roundtrip_and_ttl(os.path.join(directory, 'roundtrip.db'))
+            await test_survives_restart(db_path, paths)
+            await test_prewarm_and_dump(directory, db_path)
+        finally:
+            await stub.stop()
+    print("\n=== 测试完成 ===")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""测试按调用点分级的模型配置：各调用点的输出上限和超时、p95 超出目标时降级、计划中的档位报告"""
+
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+sys.path.append(str(Path(__file__).parent))
+os.environ.setdefault('LLM_TIER_MIN_SAMPLES', '3')
+os.environ.setdefault('LLM_SLO_TRAVEL_TIPS', '0.2')
+
+from benchmarks.stub_upstream import StubUpstream, _route
+from services.http_client import HTTPClientPool
+from services.llm_router import AnthropicProvider, LLMProvider, LLMRouter
+from services.model_tiering import ModelTiering, current_tier_report, tier_report
+
+# 桩服务中大模型请求的延迟（秒），测试过程中调整
+chat_latency = 0.0
+
+async def test_tier_selection():
+    """样本不足时使用第一档，p95 超过目标后降级，样本过期后恢复"""
+    print("\n1. 测试档位选择")
+    pool = HTTPClientPool()
+    primary = LLMProvider("tier_a", "key", "http://a/v1", "strong", 0, pool, fast_model="quick")
+    secondary = AnthropicProvider("tier_b", "key", "http://b/v1", "b-strong", 1, pool, fast_model="b-quick")
+    tiering = ModelTiering(LLMRouter([primary, secondary]))
+    tiering.horizon = 0.5
+
+    tier = tiering.select("travel_tips")
+    assert tier.model == "strong" and tier.max_tokens == 800 and tier.slo == 0.2
+    assert tiering.select("daily_itinerary").max_tokens == 1500
+    assert tiering.select(None).max_tokens is None
+    for _ in range(3):
+        tiering.record(tier, 0.5)
+    fast = tiering.select("travel_tips")
+    assert fast.index == 1 and fast.model == "quick"
+    assert fast.model_for(primary) == "quick" and fast.model_for(secondary) == "b-quick"
+    assert tier.model_for(secondary) == "b-strong"
+    assert tiering.select("daily_itinerary").index == 0  # 其他调用点不受影响
+
+    with tier_report() as report:
+        tiering.select("travel_tips")
+        async def in_task():
+            return tiering.select("travel_tips")
+        await asyncio.create_task(in_task())  # 子任务中的选择计入同一份报告
+    assert report == {"travel_tips": {"tier_a/quick": 2}}
+    assert current_tier_report() is None
+
+    await asyncio.sleep(0.6)
+    assert tiering.select("travel_tips").index == 0  # 样本过期后重新尝试较强档位
+    stats = tiering.get_stats()
+    assert stats["downgrades"] == 1 and stats["sites"]["travel_tips"]["active"] == "tier_a/strong"
+    print(f"✅ 档位选择正确: {stats['sites']['travel_tips']['tiers']}")
+
+async def test_downgrade_in_service(models):
+    """贴士调用变慢后改用更快的模型，请求体中的模型和 max_tokens 随档位变化"""
+    global chat_latency
+    print("\n2. 测试服务内降级")
+    from services.llm_service import llm_service
+
+    chat_latency = 0.3
+    for _ in range(3):
+        assert await llm_service.generate_travel_tips("杭州", {})
+    assert [m for m, _ in models] == ["qwen-plus"] * 3
+    assert all(max_tokens == 800 for _, max_tokens in models)
+
+    chat_latency = 0.0
+    models.clear()
+    await llm_service.generate_travel_tips("杭州", {})
+    await llm_service.generate_destination_analysis("杭州", {})
+    assert models == [("qwen-turbo", 800), ("qwen-plus", 2000)], models
+    print("✅ p95 超过 0.2s 后贴士改用 qwen-turbo，目的地分析仍使用 qwen-plus")
+
+async def test_plan_reports_tiers():
+    """计划元数据中记录各调用点实际使用的档位"""
+    print("\n3. 测试计划档位报告")
+    from agents.travel_planner_agent import TravelPlannerAgent
+    from agents.models import TravelRequest
+
+    request = TravelRequest(
+        destination="杭州",
+        start_date=date.today(),
+        end_date=date.today() + timedelta(days=1),
+        budget_level="舒适型",
+        travel_style="文化探索"
+    )
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = await TravelPlannerAgent().generate_travel_plan(request)
+
+    assert result["success"], result
+    tiers = result["plan"].metadata["model_tiers"]
+    assert tiers["travel_tips"] == {"qwen/qwen-turbo": 1}, tiers
+    assert tiers["daily_itinerary"] == {"qwen/qwen-plus": 2}, tiers
+    assert "qwen/qwen-plus" in tiers["destination_analysis"], tiers
+    print(f"✅ 计划档位: {tiers}")
+
+async def main():
+    print("=== 测试模型分级 ===")
+    await test_tier_selection()
+
+    models = []
+
+    def handler(method, path, query, body):
+        if path.endswith('/chat/completions'):
+            payload = json.loads(body)
+            models.append((payload['model'], payload.get('max_tokens')))
+        return _route(method, path, query, body)
+
+    stub = StubUpstream(latency=lambda path: chat_latency if path.endswith('/chat/completions') else 0.0,
+                        handler=handler)
+    await stub.start()
+    os.environ.update({
+        'QWEN_API_KEY': 'test-key',
+        'QWEN_BASE_URL': f"{stub.base_url}/v1",
+        'AMAP_API_KEY': 'test-key',
+        'AMAP_BASE_URL': f"{stub.base_url}/v3",
+        'AMAP_STORE_ENABLED': 'false',
+        'OPENWEATHER_API_KEY': 'test-key',
+        'OPENWEATHER_BASE_URL': f"{stub.base_url}/data/2.5",
+        'LLM_CACHE_ENABLED': 'false',
+        'ITINERARY_STREAMING': 'false'
+    })
+    try:
+        start = time.perf_counter()
+        await test_downgrade_in_service(models)
+        await test_plan_reports_tiers()
+        print(f"\n服务测试耗时 {time.perf_counter() - start:.2f}s")
+    finally:
+        await stub.stop()
+    print("\n=== 测试完成 ===")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""测试多日行程模式：分批、解析和缺失天补生成"""
+
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sys
+from datetime import date, timedelta
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+sys.path.append(str(Path(__file__).parent))
+os.environ.setdefault('QWEN_API_KEY', 'test-key')
+os.environ.setdefault('ITINERARY_STREAMING', 'false')  # 下面替换的是非流式的 generate_daily_itinerary
+
+import agents.travel_planner_agent as planner_module
+from agents.travel_planner_agent import TravelPlannerAgent
+from agents.models import TravelRequest
+from services.llm_service import llm_service
+
+def test_chunk_sizing():
+    """按token预算分批，短行程一次请求，各批天数均匀"""
+    print("\n1. 测试分批")
+    llm_service.max_output_tokens = 6000
+    llm_service.tokens_per_day = 1500
+    assert llm_service.plan_itinerary_chunks(3) == [[1, 2, 3]]
+    assert llm_service.plan_itinerary_chunks(4) == [[1, 2, 3, 4]]
+    assert [len(c) for c in llm_service.plan_itinerary_chunks(10)] == [4, 3, 3]
+
+    llm_service.tokens_per_day = 8000  # 单天超出预算时仍然每次一天
+    assert llm_service.plan_itinerary_chunks(2) == [[1], [2]]
+    print("✅ 分批结果符合预算")
+
+def test_parse_multi_day():
+    """解析 {"days": [...]}、直接数组和markdown包裹的输出"""
+    print("\n2. 测试多日解析")
+    day = {"breakfast": {"name": "知味观", "cost": "50元"}, "morning": {"name": "西湖"}}
+    wrapped = "```json\n" + json.dumps({"days": [{"day": 4, **day}, {"day": 5, **day}]}, ensure_ascii=False) + "\n```"
+    parsed = llm_service._parse_multi_day_itinerary(wrapped, [4, 5])
+    assert set(parsed) == {4, 5}
+    assert parsed[4]["breakfast"]["cost"] == 50.0
+    assert parsed[5]["evening"]["duration"] == "2小时"  # 缺失的时段补全为默认结构
+
+    # 没有day字段时按顺序对应；多余的天和非法条目被忽略
+    bare = json.dumps([day, "oops", day, day], ensure_ascii=False)
+    assert set(llm_service._parse_multi_day_itinerary(bare, [1, 2])) == {1}
+    assert llm_service._parse_multi_day_itinerary("不是JSON", [1, 2]) == {}
+    print("✅ 多日输出解析正确")
+
+async def test_missing_days_fallback():
+    """多日请求缺少的天逐天补生成，结果按天排序"""
+    print("\n3. 测试缺失天补生成")
+    calls = {"multi": [], "daily": []}
+
+    async def fake_multi(destination, days, total_days, preferences, budget_level, day_notes=None):
+        calls["multi"].append(days)
+        return {day: {"day": day, "morning": {"activity": f"多日{day}", "location": destination}}
+                for day in days if day % 2 == 1}
+
+    async def fake_daily(destination, day, total_days, preferences, budget_level):
+        calls["daily"].append(day)
+        return {"day": day, "morning": {"activity": f"单日{day}", "location": destination}}
+
+    async def fake_text(destination, preferences):
+        return ["贴士"]
+
+    llm_service.generate_multi_day_itinerary = fake_multi
+    llm_service.generate_daily_itinerary = fake_daily
+    llm_service.generate_destination_analysis = fake_text
+    llm_service.generate_travel_tips = fake_text
+    llm_service.tokens_per_day = 1500
+    planner_module.ITINERARY_MODE = "multi_day"
+
+    request = TravelRequest(
+        destination="杭州",
+        start_date=date.today(),
+        end_date=date.today() + timedelta(days=5),
+        budget_level="舒适型",
+        travel_style="文化探索"
+    )
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = await TravelPlannerAgent().generate_travel_plan(request)
+
+    itinerary = result["plan"].itinerary
+    assert calls["multi"] == [[1, 2, 3], [4, 5, 6]]
+    assert sorted(calls["daily"]) == [2, 4, 6]
+    assert [item.day for item in itinerary] == [1, 2, 3, 4, 5, 6]
+    assert itinerary[0].activities[0].activity == "多日1"
+    assert itinerary[1].activities[0].activity == "单日2"
+    print(f"✅ 2 次多日请求 + {len(calls['daily'])} 次补生成，顺序正确")
+
+async def main():
+    print("=== 测试多日行程模式 ===")
+    test_chunk_sizing()
+    test_parse_multi_day()
+    await test_missing_days_fallback()
+    print("\n=== 测试完成 ===")
+
+if __name__ == "__main__":
+    asyncio.run(main())
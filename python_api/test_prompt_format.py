@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""测试紧凑提示词格式：固定前缀逐字节相同、输入token减少、按调用点统计token和供应商缓存命中"""
+
+import asyncio
+import json
+import os
+import sys
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+sys.path.append(str(Path(__file__).parent))
+
+from benchmarks.stub_upstream import StubUpstream, _route
+from services.token_accounting import TokenAccounting, message_tokens
+
+PREFERENCES = {"travel_style": "文化探索", "interests": ["历史"], "budget_level": "舒适型"}
+
+def daily_messages(llm_service, destination, day, weather):
+    return llm_service._build_daily_itinerary_messages(
+        destination, day, 3, {**PREFERENCES, "weather_info": weather}, "舒适型")
+
+def test_stable_prefix():
+    """系统提示词跨天、跨用户逐字节相同，同一计划各天的用户提示词只有末尾不同"""
+    print("\n1. 测试固定前缀")
+    from services.llm_service import llm_service
+
+    first = daily_messages(llm_service, "杭州", 1, "晴")
+    second = daily_messages(llm_service, "杭州", 2, "小雨")
+    other = daily_messages(llm_service, "成都", 3, "多云")
+    assert first[0]["content"] == second[0]["content"] == other[0]["content"]
+    assert "杭州" not in first[0]["content"] and "第1天" not in first[0]["content"]
+    prefix = os.path.commonprefix([first[1]["content"], second[1]["content"]])
+    assert prefix.endswith('"interests":["历史"],"budget_level":"舒适型","weather_info":"'), prefix
+
+    assert llm_service._build_travel_tips_messages("杭州", PREFERENCES)[0]["content"] == \
+        llm_service._build_travel_tips_messages("成都", {})[0]["content"]
+    assert '"interests":["历史"]' in llm_service._build_destination_analysis_messages("杭州", PREFERENCES)[1]["content"]
+    print(f"✅ 系统提示词一致，同一计划各天共享 {len(prefix)} 个字符的用户提示词前缀")
+
+def test_compact_saves_tokens():
+    """紧凑格式的每日行程提示词明显更短，verbose 格式仍使用完整模板"""
+    print("\n2. 测试紧凑格式")
+    from services.llm_service import llm_service, DAILY_ITINERARY_TEMPLATE
+
+    compact = message_tokens(daily_messages(llm_service, "杭州", 1, "晴"))
+    llm_service.prompt_format = "verbose"
+    try:
+        verbose_messages = daily_messages(llm_service, "杭州", 1, "晴")
+        verbose = message_tokens(verbose_messages)
+    finally:
+        llm_service.prompt_format = "compact"
+    assert DAILY_ITINERARY_TEMPLATE in verbose_messages[0]["content"]
+    assert compact < verbose * 0.5, (compact, verbose)
+
+    patch = llm_service._build_patch_messages(daily_messages(llm_service, "杭州", 1, "晴"),
+                                              {"morning": {"name": "西湖"}}, ["dinner", "evening"])
+    assert '{"dinner":S,"evening":S}' in patch[0]["content"] and '"breakfast"' not in patch[0]["content"]
+    print(f"✅ 每日行程输入 {verbose} -> {compact} token")
+
+def test_accounting():
+    """按调用点汇总输入、前缀、缓存命中和输出token；流式请求按文本估算"""
+    print("\n3. 测试token统计")
+    accounting = TokenAccounting()
+    messages = [{"role": "system", "content": "固定的系统提示词" * 10}, {"role": "user", "content": "杭州"}]
+    accounting.record("daily_itinerary", messages, {"prompt_tokens": 200, "completion_tokens": 50,
+                                                    "prompt_tokens_details": {"cached_tokens": 150}})
+    accounting.record("daily_itinerary", messages, completion_text="输出" * 10)
+    report = accounting.get_report()["daily_itinerary"]
+    assert report["calls"] == 2 and report["usage_reported"] == 1
+    assert report["cached_tokens"] == 150 and report["cache_hit_rate"] == 0.75
+    assert report["avg_completion_tokens"] == (50 + 16) / 2
+    assert 0.5 < report["prefix_share"] < 1
+    print(f"✅ 统计报告: {report}")
+
+async def test_service_report(stub: StubUpstream):
+    """服务按调用点记录供应商返回的 usage，Anthropic 的缓存命中换算为 cached_tokens"""
+    print("\n4. 测试服务内统计")
+    from services.llm_service import llm_service
+    from services.llm_router import AnthropicProvider
+
+    await llm_service.generate_travel_tips("杭州", PREFERENCES)
+    await llm_service.generate_travel_tips("成都", PREFERENCES)
+    report = llm_service.accounting.get_report()["travel_tips"]
+    assert report["calls"] == 2 and report["avg_prompt_tokens"] == 600
+    assert report["cached_tokens"] == 400 and report["cache_hit_rate"] == round(400 / 1200, 4)
+
+    usage = AnthropicProvider.parse_response(llm_service.router.primary, {
+        "content": [{"type": "text", "text": "{}"}], "stop_reason": "end_turn",
+        "usage": {"input_tokens": 100, "cache_read_input_tokens": 500, "output_tokens": 20}
+    })["usage"]
+    assert usage["prompt_tokens"] == 600 and usage["prompt_tokens_details"]["cached_tokens"] == 500
+    print(f"✅ 贴士调用缓存命中率 {report['cache_hit_rate']:.0%}")
+
+async def main():
+    print("=== 测试紧凑提示词格式 ===")
+    calls = []
+
+    def handler(method, path, query, body):
+        status, data = _route(method, path, query, body)
+        if path.endswith("/chat/completions"):
+            # 第一次请求写入供应商缓存，之后的请求命中固定前缀
+            cached = 400 if calls else 0
+            calls.append(json.loads(body))
+            data["usage"]["prompt_tokens_details"] = {"cached_tokens": cached}
+        return status, data
+
+    stub = StubUpstream(handler=handler)
+    await stub.start()
+    os.environ.update({
+        'QWEN_API_KEY': 'test-key',
+        'QWEN_BASE_URL': f"{stub.base_url}/v1",
+        'LLM_CACHE_ENABLED': 'false',
+        'LLM_PROMPT_FORMAT': 'compact'
+    })
+    try:
+        test_stable_prefix()
+        test_compact_saves_tokens()
+        test_accounting()
+        await test_service_report(stub)
+    finally:
+        await stub.stop()
+    print("\n=== 测试完成 ===")
+
+if __name__ == "__main__":
+    asyncio.run(main())
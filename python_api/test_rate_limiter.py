@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""测试高德令牌桶限流：并发请求不越过速率、突发、FIFO顺序、分组配额、等待上限、超限降速和恢复、等待统计"""
+
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+sys.path.append(str(Path(__file__).parent))
+
+from benchmarks.stub_upstream import StubUpstream, _route
+from services.deadline import DeadlineExceededError, deadline_scope
+from services.rate_limiter import RateLimiter, RateLimitExceededError, TokenBucket
+
+GROUPS = {'geocode/geo': 'geocode', 'place/text': 'poi'}
+
+async def send_all(limiter: RateLimiter, endpoints):
+    """并发发出请求，返回 (序号, 接口, 发出时刻) 按发出顺序排列"""
+    sent = []
+    start = time.monotonic()
+
+    async def one(index, endpoint):
+        await limiter.acquire(endpoint)
+        sent.append((index, endpoint, time.monotonic() - start))
+
+    await asyncio.gather(*(one(index, endpoint) for index, endpoint in enumerate(endpoints)))
+    return sent
+
+async def test_concurrent_fifo():
+    """并发协程按到达顺序、以配置的间隔依次发出"""
+    print("\n1. 测试并发和FIFO")
+    limiter = RateLimiter('amap', rate=20, burst=1, groups=GROUPS)
+    sent = await send_all(limiter, ['geocode/geo'] * 10)
+    assert [index for index, _, _ in sent] == list(range(10))
+    gaps = [b[2] - a[2] for a, b in zip(sent, sent[1:])]
+    assert min(gaps) > 0.04 and 0.4 < sent[-1][2] < 0.6, gaps
+    stats = limiter.get_stats()
+    assert stats['delayed'] == 9 and stats['queue_depth'] == 0 and stats['peak_queue_depth'] == 9
+    assert stats['peak_demand_qps'] == 10 and stats['wait_max'] >= 0.44
+    print(f"✅ 10 个并发请求用时 {sent[-1][2]:.2f}s，最小间隔 {min(gaps) * 1000:.0f}ms")
+
+async def test_burst():
+    """突发以内的请求立即发出，之后匀速"""
+    print("\n2. 测试突发")
+    limiter = RateLimiter('amap', rate=10, burst=4, groups=GROUPS)
+    sent = await send_all(limiter, ['place/text'] * 6)
+    assert all(at < 0.02 for _, _, at in sent[:4]) and 0.08 < sent[4][2] < 0.15 and sent[5][2] > 0.18
+    print(f"✅ 前 4 个立即发出，第 5、6 个在 {sent[4][2]:.2f}s、{sent[5][2]:.2f}s 发出")
+
+async def test_group_quota():
+    """分组配额只限制本分组，其他分组只受全局速率约束"""
+    print("\n3. 测试分组配额")
+    limiter = RateLimiter('amap', rate=100, burst=1, groups=GROUPS,
+                          quotas={'poi': TokenBucket('amap/poi', rate=10)})
+    sent = await send_all(limiter, ['place/text'] * 4 + ['geocode/geo'] * 4)
+    poi = [at for _, endpoint, at in sent if endpoint == 'place/text']
+    geocode = [at for _, endpoint, at in sent if endpoint == 'geocode/geo']
+    assert max(geocode) < 0.1 and poi[-1] > 0.28
+    assert limiter.interval('place/text') == 0.1 and limiter.interval('geocode/geo') == 0.01
+    stats = limiter.get_stats()['groups']
+    assert stats['poi']['rate'] == 10 and stats['geocode']['rate'] is None
+    assert stats['poi']['wait_max'] > stats['geocode']['wait_max']
+    print(f"✅ 地理编码 {max(geocode):.2f}s 内发完，POI 按配额在 {poi[-1]:.2f}s 发完")
+
+async def test_limits_and_throttle():
+    """等待超过上限或剩余预算时拒绝，取消的预约退回，超限后降速、成功后恢复"""
+    print("\n4. 测试等待上限、降速和恢复")
+    limiter = RateLimiter('amap', rate=2, burst=1, groups=GROUPS, max_wait=0.6)
+    await limiter.acquire('geocode/geo')
+    waiter = asyncio.create_task(limiter.acquire('geocode/geo'))
+    await asyncio.sleep(0.01)
+    waiter.cancel()
+    await asyncio.gather(waiter, return_exceptions=True)
+    start = time.monotonic()
+    await limiter.acquire('geocode/geo')  # 取消的预约已退回，只等一个间隔
+    assert time.monotonic() - start < 0.55
+
+    queued = asyncio.create_task(limiter.acquire('geocode/geo'))
+    await asyncio.sleep(0)
+    try:
+        await limiter.acquire('geocode/geo')
+        assert False, "应拒绝等待 1s 的请求"
+    except RateLimitExceededError as e:
+        assert e.retry_after > 0.6
+    limiter.max_wait = 5
+    with deadline_scope(0.2):
+        try:
+            await limiter.acquire('geocode/geo')
+            assert False, "应因剩余预算不足拒绝"
+        except DeadlineExceededError:
+            pass
+    await queued
+
+    for _ in range(3):
+        limiter.throttled('geocode/geo')  # 同一秒内的多次超限只减半一次
+    stats = limiter.get_stats()
+    assert stats['rate'] == 1.0 and stats['rejected'] == 2 and stats['groups']['geocode']['throttled'] == 3
+    for _ in range(4):
+        limiter.succeeded('geocode/geo')
+    assert abs(limiter.bucket.rate - 1.4) < 1e-9
+    for _ in range(10):
+        limiter.succeeded('geocode/geo')
+    assert limiter.bucket.rate == limiter.bucket.max_rate == 2
+    print(f"✅ 拒绝 {stats['rejected']} 次，超限后速率降为 {stats['rate']} QPS，成功请求后恢复到 2 QPS")
+
+async def test_service_under_concurrency(arrivals):
+    """并发查询不会在同一时刻越过速率，上游不再返回频率超限"""
+    print("\n5. 测试服务内限流")
+    from services.map_service import map_service
+
+    map_service.rate_limiter.set_rate(20)
+    map_service.cache.clear()
+    await map_service.geocode("杭州")  # 先建立连接，避免首批请求因建连在上游处聚集
+    arrivals.clear()
+    results = await asyncio.gather(*(map_service.geocode(f"景点{i}", "杭州") for i in range(8)))
+    assert all(result for result in results) and len(arrivals) == 8
+    gaps = [b - a for a, b in zip(arrivals, arrivals[1:])]
+    assert min(gaps) > 0.035, gaps
+    stats = map_service.rate_limiter.get_stats()
+    assert stats['groups']['geocode']['requests'] == 9 and stats['throttled'] == 0
+    print(f"✅ 8 个并发地理编码请求最小间隔 {min(gaps) * 1000:.0f}ms，平均排队 {stats['wait_avg']:.2f}s")
+
+async def main():
+    print("=== 测试高德令牌桶限流 ===")
+    await test_concurrent_fifo()
+    await test_burst()
+    await test_group_quota()
+    await test_limits_and_throttle()
+
+    arrivals = []
+
+    def handler(method, path, query, body):
+        if path.endswith('/geocode/geo'):
+            # 间隔小于 40ms 视为超出 QPS
+            now = time.monotonic()
+            throttled = bool(arrivals) and now - arrivals[-1] < 0.04
+            arrivals.append(now)
+            if throttled:
+                return 200, {'status': '0', 'info': 'CUQPS_HAS_EXCEEDED_THE_LIMIT'}
+        return _route(method, path, query, body)
+
+    stub = StubUpstream(handler=handler)
+    await stub.start()
+    os.environ.update({
+        'QWEN_API_KEY': 'test-key',
+        'AMAP_API_KEY': 'test-key',
+        'AMAP_BASE_URL': f"{stub.base_url}/v3",
+        'AMAP_STORE_ENABLED': 'false'
+    })
+    try:
+        await test_service_under_concurrency(arrivals)
+    finally:
+        await stub.stop()
+    print("\n=== 测试完成 ===")
+
+if __name__ == "__main__":
+    asyncio.run(main())
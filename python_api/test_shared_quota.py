@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""测试多进程共享配额：多个 worker 合计不超过配置的 QPS、按租约批量预约、等待上限和剩余预算、存储不可用时放行"""
+
+import asyncio
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+sys.path.append(str(Path(__file__).parent))
+
+from services.adaptive_limit import AIMDController
+from services.deadline import DeadlineExceededError, deadline_scope
+from services.rate_limiter import RateLimiter
+from services.resilience import Bulkhead, CircuitBreaker, QuotaExceededError, UpstreamGuard
+from services.shared_quota import SharedQuota
+
+RATE = 20
+WORKERS = 4
+DURATION = 2.0
+
+async def _send_for(acquire, duration: float, concurrency: int = 3):
+    """以 concurrency 个协程持续请求 duration 秒，返回每次放行的时间"""
+    sent = []
+    deadline = time.time() + duration
+
+    async def loop():
+        while time.time() < deadline:
+            await acquire()
+            sent.append(time.time())
+
+    await asyncio.gather(*(loop() for _ in range(concurrency)))
+    return sent
+
+def worker(db_path, shared: bool, start_at: float, results):
+    """模拟一个 uvicorn worker：各自的进程内限流，可选地共享配额"""
+    time.sleep(max(0.0, start_at - time.time()))
+    local = RateLimiter('amap', rate=RATE)
+    quota = SharedQuota('amap', RATE, db_path)
+
+    async def acquire():
+        await local.acquire('geocode/geo')
+        if shared:
+            await quota.acquire()
+
+    sent = asyncio.run(_send_for(acquire, DURATION))
+    results.put((sent, quota.get_stats()))
+
+def run_workers(db_path: str, shared: bool):
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    start_at = time.time() + 1.5  # 等所有进程启动后同时开始
+    processes = [context.Process(target=worker, args=(db_path, shared, start_at, results)) for _ in range(WORKERS)]
+    for process in processes:
+        process.start()
+    outputs = [results.get(timeout=30) for _ in processes]
+    for process in processes:
+        process.join()
+    sent = sorted(at for output, _ in outputs for at in output)
+    return sent, [stats for _, stats in outputs]
+
+def max_per_second(sent):
+    """任意 1 秒滑动窗口内的最大请求数"""
+    peak, left = 0, 0
+    for right, at in enumerate(sent):
+        while sent[left] <= at - 1.0:
+            left += 1
+        peak = max(peak, right - left + 1)
+    return peak
+
+def test_multi_process(directory: str):
+    """各进程单独限流时合计 QPS 约为进程数倍；共享配额后合计不超过上限"""
+    print("\n1. 测试多进程合计QPS")
+    sent, _ = run_workers(os.path.join(directory, 'unused.db'), shared=False)
+    unshared_peak = max_per_second(sent)
+    assert unshared_peak > RATE * 2, unshared_peak
+
+    sent, stats = run_workers(os.path.join(directory, 'shared.db'), shared=True)
+    peak = max_per_second(sent)
+    throughput = len(sent) / (sent[-1] - sent[0])
+    assert peak <= RATE + 1, peak  # 间隔恰为 1/RATE 时，闭区间的 1 秒窗口两端各含一个请求
+    assert throughput > RATE * 0.75, throughput  # 租约浪费的时刻有限
+    requests = sum(item['requests'] for item in stats)
+    leases = sum(item['leases'] for item in stats)
+    assert leases / requests < 0.35, (leases, requests)
+    print(f"✅ {WORKERS} 个进程: 不共享时峰值 {unshared_peak} QPS，共享后峰值 {peak} QPS（上限 {RATE}），"
+          f"平均 {throughput:.1f} QPS，{requests} 次请求访问共享存储 {leases} 次")
+
+async def test_guard_integration(directory: str):
+    """受保护调用先等待共享配额；等待超过上限时快速失败，不计入熔断"""
+    print("\n2. 测试上游保护集成")
+    quota = SharedQuota('weather', rate=2, db_path=os.path.join(directory, 'guard.db'), max_wait=0.2)
+    guard = UpstreamGuard('weather', CircuitBreaker('weather', failure_threshold=1),
+                          Bulkhead('weather', 4, 1.0, controller=AIMDController('weather', max_limit=4)), quota=quota)
+    async with guard.protect():
+        pass
+    try:
+        async with guard.protect():
+            assert False, "下一个发送时刻在 0.5s 后，应快速失败"
+    except QuotaExceededError as e:
+        assert e.upstream == 'weather'
+    stats = guard.get_stats()
+    assert stats['breaker']['state'] == 'closed' and stats['breaker']['failures'] == 0
+    assert stats['shared_quota']['rejected'] == 1 and stats['bulkhead']['in_flight'] == 0
+    print(f"✅ 配额用满时快速失败: {stats['shared_quota']}")
+
+async def test_concurrent_waits(directory: str):
+    """并发调用方在锁外等待，等待时间从调用时算起；发送时刻晚于截止时间时抛出异常"""
+    print("\n3. 测试并发等待和剩余预算")
+    quota = SharedQuota('amap', rate=10, db_path=os.path.join(directory, 'waits.db'), max_wait=0.25)
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+
+    async def timed():
+        waited = await quota.acquire()
+        return waited, loop.time() - start
+
+    results = await asyncio.gather(*(timed() for _ in range(6)))
+    accepted = [at for waited, at in results if waited is not None]
+    rejected = [at for waited, at in results if waited is None]
+    assert len(accepted) == 3 and max(accepted) < 0.3, results  # 发送时刻 0、0.1、0.2s
+    assert len(rejected) == 3 and max(rejected) < 0.05, results  # 无需等前面的调用方发出即可拒绝
+
+    quota.max_wait = 10
+    with deadline_scope(0.05):
+        try:
+            await quota.acquire()
+            assert False, "发送时刻晚于截止时间，应抛出异常"
+        except DeadlineExceededError as e:
+            assert e.upstream == 'amap'
+    assert quota.stats['rejected'] == 4
+    assert await quota.acquire() is not None  # 超时的调用方没有占用发送时刻
+    print(f"✅ 6 个并发调用 3 个在 {max(accepted):.2f}s 内发出，3 个立即拒绝，超过剩余预算时抛出异常")
+
+async def test_fail_open(directory: str):
+    """共享存储不可用时不限流，由进程内限流兜底"""
+    print("\n4. 测试存储不可用")
+    blocker = os.path.join(directory, 'not_a_directory')
+    Path(blocker).write_text('')
+    quota = SharedQuota('amap', rate=5, db_path=os.path.join(blocker, 'quota.db'))
+    assert await quota.acquire() == 0.0 and quota.stats['errors'] == 1
+    print("✅ 存储不可用时放行并记录错误")
+
+async def main():
+    print("=== 测试多进程共享配额 ===")
+    with tempfile.TemporaryDirectory() as directory:
+        test_multi_process(directory)
+        await test_guard_integration(directory)
+        await test_concurrent_waits(directory)
+        await test_fail_open(directory)
+    print("\n=== 测试完成 ===")
+
+if __name__ == "__main__":
+    asyncio.run(main())
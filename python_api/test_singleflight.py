@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""测试相同上游请求的合并：并发请求共享一次调用、异常共享、调用方取消和预算互不影响、计划内记忆化"""
+
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import tempfile
+from collections import Counter
+from datetime import date, timedelta
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+sys.path.append(str(Path(__file__).parent))
+
+from benchmarks.stub_upstream import StubUpstream, _route
+from services.deadline import DeadlineExceededError, deadline_scope, remaining_budget
+from services.singleflight import SingleFlight, plan_memo
+from services.token_scheduler import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, current_priority, priority_scope
+
+# 桩服务中每次上游请求的延迟（秒），保证并发请求在第一次请求完成前到达
+UPSTREAM_LATENCY = 0.2
+
+def make_fetch(calls, delay=0.05, error=None):
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(delay)
+        if error:
+            raise error
+        return {"value": len(calls)}
+    return fetch
+
+async def test_coalescing():
+    """并发的相同请求只执行一次，结果和异常共享给所有调用方"""
+    print("\n1. 测试并发请求合并")
+    flight = SingleFlight("test")
+    calls = []
+    results = await asyncio.gather(*[flight.do("key", make_fetch(calls)) for _ in range(10)])
+    assert len(calls) == 1 and all(result is results[0] for result in results)
+    assert flight.stats["executed"] == 1 and flight.stats["coalesced"] == 9 and flight.in_flight == 0
+
+    calls = []
+    results = await asyncio.gather(*[flight.do("bad", make_fetch(calls, error=ValueError("上游错误")))
+                                     for _ in range(3)], return_exceptions=True)
+    assert len(calls) == 1 and all(isinstance(result, ValueError) for result in results)
+
+    # 第一个调用方取消后，其他调用方仍得到结果
+    calls = []
+    leader = asyncio.create_task(flight.do("key", make_fetch(calls, delay=0.1)))
+    await asyncio.sleep(0.01)
+    follower = asyncio.create_task(flight.do("key", make_fetch(calls, delay=0.1)))
+    await asyncio.sleep(0.01)
+    leader.cancel()
+    assert (await follower)["value"] == 1 and len(calls) == 1
+
+    # 串行调用不合并（结果缓存由各服务负责）
+    calls = []
+    await flight.do("key", make_fetch(calls))
+    await flight.do("key", make_fetch(calls))
+    assert len(calls) == 2
+    print(f"✅ 并发请求合并正确: {flight.get_stats()}")
+
+async def test_caller_budgets():
+    """共享任务以等待者的优先级执行，截止时间取等待者中最宽松的；各调用方按自己的预算等待"""
+    print("\n2. 测试调用方各自的预算和优先级")
+    flight = SingleFlight("test")
+    seen = []
+
+    async def fetch():
+        seen.append((remaining_budget(), current_priority()))
+        await asyncio.sleep(0.5)
+        seen.append((remaining_budget(), current_priority()))
+        return "ok"
+
+    async def call(budget, priority=PRIORITY_BACKGROUND):
+        with deadline_scope(budget), priority_scope(priority):
+            return await flight.do("key", fetch)
+
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    short = asyncio.create_task(call(1))  # 预算较短的调用方先发起请求
+    await asyncio.sleep(0.01)
+    results = await asyncio.gather(short, call(0.2), call(100), return_exceptions=True)
+    # 0.2s 预算的调用方超时放弃，其他调用方拿到结果
+    assert results[0] == results[2] == "ok" and isinstance(results[1], DeadlineExceededError), results
+    (started_budget, started_priority), (later_budget, later_priority) = seen
+    assert started_budget <= 1 and started_priority == later_priority == PRIORITY_BACKGROUND
+    assert later_budget > 99  # 100s 预算的调用方加入后截止时间推迟
+    assert flight.stats["coalesced"] == 2 and loop.time() - start > 0.45
+
+    # 不限时的调用方加入后，任务也不再限时
+    seen.clear()
+    bounded = asyncio.create_task(call(1))
+    await asyncio.sleep(0.01)
+    await asyncio.gather(bounded, call(None))
+    assert seen[0][0] <= 1 and seen[1][0] == float("inf"), seen
+
+    # 交互式调用方不等待后台任务，另起一个交互式任务
+    seen.clear()
+    background = asyncio.create_task(call(None))
+    await asyncio.sleep(0.01)
+    await asyncio.gather(background, call(None, PRIORITY_INTERACTIVE), call(None, PRIORITY_INTERACTIVE))
+    assert sorted(priority for _, priority in seen[:2]) == [PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND], seen
+    assert flight.stats["escalated"] == 1
+    print(f"✅ 任务以后台优先级执行，截止时间推迟到 {later_budget:.0f}s，交互式调用方另起任务: {flight.get_stats()}")
+
+async def test_plan_memo():
+    """计划作用域内成功的结果只解析一次，失败的结果不记忆，作用域外不记忆"""
+    print("\n3. 测试计划内记忆化")
+    flight = SingleFlight("test")
+    calls = []
+    with plan_memo():
+        for _ in range(3):
+            await flight.do("酒店餐厅", make_fetch(calls), memoize=True)
+        assert len(calls) == 1
+
+        async def other_day():
+            return await flight.do("酒店餐厅", make_fetch(calls), memoize=True)
+        await asyncio.create_task(other_day())  # 节点创建的任务共享同一份记忆
+        assert len(calls) == 1
+
+        failures = []
+        for _ in range(2):
+            with contextlib.suppress(ValueError):
+                await flight.do("失败", make_fetch(failures, error=ValueError()), memoize=True)
+        assert len(failures) == 2
+
+    with plan_memo():
+        await flight.do("酒店餐厅", make_fetch(calls), memoize=True)
+    await flight.do("酒店餐厅", make_fetch(calls), memoize=True)
+    assert len(calls) == 3
+    assert flight.stats["memo_hits"] == 3
+    print(f"✅ 记忆化正确: {flight.get_stats()}")
+
+async def test_concurrent_services(stub: StubUpstream, paths: Counter):
+    """多个用户同时查询同一目的地时，每种查询只请求一次上游"""
+    print("\n4. 测试服务内的并发合并")
+    from services.llm_service import llm_service
+    from services.map_service import map_service
+    from services.weather_service import weather_service
+
+    weather_service.geocoding_url = f"{stub.base_url}/geo/1.0"
+    paths.clear()
+    await asyncio.gather(*[
+        call
+        for _ in range(8)
+        for call in (
+            map_service.search_poi("西湖", "杭州"),
+            map_service.geocode("杭州"),
+            weather_service.get_forecast("杭州", 7),
+            llm_service.generate_travel_tips("杭州", {"interests": ["历史"]})
+        )
+    ])
+    assert paths["/v3/place/text"] == 1, paths
+    assert paths["/v3/geocode/geo"] == 1, paths
+    assert paths["/data/2.5/forecast"] == 1, paths
+    assert paths["/v1/chat/completions"] == 1, paths
+    print(f"✅ 8 个用户的 32 次查询只请求上游 {sum(paths.values())} 次: {dict(paths)}")
+
+async def test_plan_repeated_lookups(paths: Counter):
+    """同一计划中重复的地点查询只解析一次"""
+    print("\n5. 测试计划内重复查询")
+    from services.map_service import map_service
+    from agents.travel_planner_agent import TravelPlannerAgent
+    from agents.models import TravelRequest
+
+    map_service.cache.clear()
+    paths.clear()
+    memo_hits = map_service.flights.stats["memo_hits"]
+    request = TravelRequest(
+        destination="杭州",
+        start_date=date.today(),
+        end_date=date.today() + timedelta(days=2),
+        budget_level="舒适型",
+        travel_style="文化探索"
+    )
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = await TravelPlannerAgent(day_concurrency=3).generate_travel_plan(request)
+
+    assert result["success"], result
+    hits = map_service.flights.stats["memo_hits"] - memo_hits
+    # 桩服务每天返回相同的餐厅和景点，3 天共 18 个时段只查询 6 个地点
+    assert paths["/v3/place/text"] <= 7, paths
+    assert hits >= 12, hits
+    print(f"✅ 3 天行程地点查询 {paths['/v3/place/text']} 次，记忆命中 {hits} 次")
+
+async def main():
+    print("=== 测试相同上游请求合并 ===")
+    await test_coalescing()
+    await test_caller_budgets()
+    await test_plan_memo()
+
+    paths = Counter()
+
+    def handler(method, path, query, body):
+        paths[path] += 1
+        return _route(method, path, query, body)
+
+    stub = StubUpstream(latency=lambda path: UPSTREAM_LATENCY, handler=handler)
+    await stub.start()
+    os.environ.update({
+        'QWEN_API_KEY': 'test-key',
+        'QWEN_BASE_URL': f"{stub.base_url}/v1",
+        'AMAP_API_KEY': 'test-key',
+        'AMAP_BASE_URL': f"{stub.base_url}/v3",
+        'AMAP_STORE_ENABLED': 'false',
+        'OPENWEATHER_API_KEY': 'test-key',
+        'OPENWEATHER_BASE_URL': f"{stub.base_url}/data/2.5",
+        'LLM_CACHE_DB_PATH': os.path.join(tempfile.mkdtemp(), 'llm_cache.db'),
+        'ITINERARY_STREAMING': 'false'
+    })
+    try:
+        await test_concurrent_services(stub, paths)
+        await test_plan_repeated_lookups(paths)
+    finally:
+        await stub.stop()
+    print("\n=== 测试完成 ===")
+
+if __name__ == "__main__":
+    asyncio.run(main())
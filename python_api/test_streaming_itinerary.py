@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""测试流式行程生成：增量JSON解析、按时段提前返回和失败回退"""
+
+import asyncio
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+sys.path.append(str(Path(__file__).parent))
+
+from benchmarks.stub_upstream import DAILY_ITINERARY, StubUpstream, _route
+from services.json_stream import IncrementalJSONParser
+
+def test_incremental_parser():
+    """任意切分的输入都能在每个时段闭合时解析出来"""
+    print("\n1. 测试增量JSON解析")
+    data = {"day": 1, **DAILY_ITINERARY, "note": "含 \"引号\" 和 {括号}", "list": [{"a": 1}]}
+    text = "```json\n" + json.dumps(data, ensure_ascii=False, indent=2) + "\n```"
+
+    for size in (1, 3, 7, len(text)):
+        parser = IncrementalJSONParser()
+        sections = []
+        for i in range(0, len(text), size):
+            sections.extend(parser.feed(text[i:i + size]))
+        assert [key for key, _ in sections] == ["breakfast", "morning", "lunch", "afternoon", "dinner", "evening"]
+        assert dict(sections)["afternoon"] == DAILY_ITINERARY["afternoon"]
+    print("✅ 不同分块大小下均按时段依次解析")
+
+async def test_stream_emits_sections_early(stub: StubUpstream):
+    """首个时段在生成结束前就返回"""
+    print("\n2. 测试流式提前返回")
+    from services.llm_service import llm_service
+
+    start = time.perf_counter()
+    arrivals = []
+    async for period, section in llm_service.stream_daily_itinerary("杭州", 1, 3, {}, "舒适型"):
+        arrivals.append((period, time.perf_counter() - start))
+        assert section["name"] == DAILY_ITINERARY[period]["name"]
+    total = time.perf_counter() - start
+
+    assert [period for period, _ in arrivals] == ["breakfast", "morning", "lunch", "afternoon", "dinner", "evening"]
+    assert arrivals[0][1] < total / 2, arrivals
+    print(f"✅ 首个时段 {arrivals[0][1]:.2f}s 返回，生成共 {total:.2f}s")
+
+async def test_stream_failure_fallback(stub: StubUpstream):
+    """流式请求失败时回退到非流式生成"""
+    print("\n3. 测试流式失败回退")
+    from services.llm_service import llm_service
+
+    def handler(method, path, query, body):
+        if json.loads(body or b'{}').get('stream'):
+            return 400, {'error': 'stream not supported'}
+        return _route(method, path, query, body)
+
+    stub.handler = handler
+    periods = [period async for period, _ in llm_service.stream_daily_itinerary("杭州", 2, 3, {}, "舒适型")]
+    stub.handler = _route
+    assert periods == ["breakfast", "morning", "lunch", "afternoon", "dinner", "evening"]
+    print("✅ 回退到非流式生成，时段完整")
+
+async def main():
+    print("=== 测试流式行程生成 ===")
+    test_incremental_parser()
+
+    stub = StubUpstream(token_interval=0.005)
+    await stub.start()
+    os.environ.update({
+        'QWEN_API_KEY': 'test-key',
+        'QWEN_BASE_URL': f"{stub.base_url}/v1",
+        'LLM_CACHE_ENABLED': 'false'
+    })
+    try:
+        await test_stream_emits_sections_early(stub)
+        await test_stream_failure_fallback(stub)
+    finally:
+        await stub.stop()
+    print("\n=== 测试完成 ===")
+
+if __name__ == "__main__":
+    asyncio.run(main())
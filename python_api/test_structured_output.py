@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""测试结构化输出：本地JSON修复、结构校验、重新生成和解析失败率统计"""
+
+import asyncio
+import json
+import os
+import sys
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+sys.path.append(str(Path(__file__).parent))
+os.environ.setdefault('QWEN_API_KEY', 'test-key')
+os.environ['LLM_CACHE_ENABLED'] = 'false'
+
+from benchmarks.stub_upstream import DAILY_ITINERARY
+from services.json_repair import repair_json
+from services.llm_service import llm_service
+
+FULL_TEXT = json.dumps({"day": 1, **DAILY_ITINERARY}, ensure_ascii=False)
+
+def test_repair_json():
+    """截断、尾随逗号和说明文字都能修复为合法JSON"""
+    print("\n1. 测试本地JSON修复")
+    cases = {
+        '{"a": 1, "b": [1, 2,], }': {"a": 1, "b": [1, 2]},
+        '好的，行程如下：\n```json\n{"a": {"b": "c"}}\n```\n祝旅途愉快': {"a": {"b": "c"}},
+        '{"a": {"name": "西湖", "tips": "早点': {"a": {"name": "西湖", "tips": "早点"}},
+        '{"a": 1, "b": ': {"a": 1},
+        '{"a": 1, "b"': {"a": 1},
+        '{"a": "x\\': {"a": "x"},
+    }
+    for text, expected in cases.items():
+        assert json.loads(repair_json(text)) == expected, (text, repair_json(text))
+
+    # 任意位置截断完整行程后都能解析出对象
+    for cut in range(1, len(FULL_TEXT), 17):
+        assert isinstance(json.loads(repair_json(FULL_TEXT[:cut])), dict), FULL_TEXT[:cut]
+    print(f"✅ {len(cases)} 个用例和任意截断位置均修复成功")
+
+def test_schema_normalization():
+    """缺失时段补默认值，费用统一为数字，非法结构被拒绝"""
+    print("\n2. 测试结构校验")
+    itinerary, outcome = llm_service._parse_itinerary_json(
+        '{"breakfast": {"name": "知味观", "cost": "人均50元", "tips": ["排队", "早去"]}}', 3)
+    assert outcome == "strict"
+    assert itinerary["day"] == 3
+    assert itinerary["breakfast"]["cost"] == 50.0
+    assert itinerary["breakfast"]["tips"] == "排队、早去"
+    assert itinerary["evening"]["duration"] == "2小时"
+    assert itinerary["transportation"] == "公共交通/步行"
+
+    truncated = FULL_TEXT[:FULL_TEXT.index('"dinner"') + 20]
+    itinerary, outcome = llm_service._parse_itinerary_json(truncated, 1)
+    assert outcome == "repaired"
+    assert itinerary["afternoon"]["name"] == DAILY_ITINERARY["afternoon"]["name"]
+
+    assert llm_service._parse_itinerary_json('{"error": "busy"}', 1) == (None, None)
+    assert llm_service._parse_itinerary_json('{"breakfast": {"cost": {"a": 1}}, "day": "x"}', 1)[0] is not None
+    print("✅ 结构校验与默认值补全正确")
+
+async def test_regenerate_and_metrics():
+    """修复失败时重新生成一次，请求带 response_format，统计解析结果"""
+    print("\n3. 测试重新生成和解析统计")
+    responses = ["抱歉，我无法提供JSON。", FULL_TEXT, FULL_TEXT[:-40], "不是JSON", "仍然不是JSON"]
+    requests = []
+
+    async def fake_request(messages, **kwargs):
+        requests.append(kwargs)
+        return {"choices": [{"message": {"content": responses.pop(0)}}]}
+
+    llm_service._make_request = fake_request
+    llm_service.parse_stats = {key: 0 for key in llm_service.parse_stats}
+
+    first = await llm_service.generate_daily_itinerary("杭州", 1, 3, {}, "舒适型")
+    second = await llm_service.generate_daily_itinerary("杭州", 2, 3, {}, "舒适型")
+    third = await llm_service.generate_daily_itinerary("杭州", 3, 3, {}, "舒适型")
+
+    assert len(requests) == 5
+    assert all(kwargs["response_format"] == {"type": "json_object"} for kwargs in requests)
+    assert first["morning"]["name"] == DAILY_ITINERARY["morning"]["name"]
+    assert second["breakfast"]["name"] == DAILY_ITINERARY["breakfast"]["name"]
+    assert third["day"] == 3 and "evening" in third
+
+    stats = llm_service.get_parse_stats()
+    assert stats["total"] == 3
+    assert (stats["regenerated"], stats["repaired"], stats["fallback"]) == (1, 1, 1)
+    assert stats["failure_rate"] == round(2 / 3, 4)
+    print(f"✅ 解析统计: {stats}")
+
+async def main():
+    print("=== 测试结构化输出 ===")
+    test_repair_json()
+    test_schema_normalization()
+    await test_regenerate_and_metrics()
+    print("\n=== 测试完成 ===")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""测试文本提取：记录的模型输出语料、费用/时长/开放时间解析和备用解析接入"""
+
+import asyncio
+import json
+import os
+import sys
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+sys.path.append(str(Path(__file__).parent))
+os.environ.setdefault('QWEN_API_KEY', 'test-key')
+
+from services.text_extraction import (
+    clean_markdown, extract_itinerary, format_duration, format_opening_hours,
+    parse_cost, parse_duration, parse_opening_hours
+)
+
+CORPUS_PATH = Path(__file__).parent / "benchmarks" / "corpus" / "llm_itinerary_outputs.json"
+
+def test_corpus():
+    """语料中每段输出提取出的字段与记录的期望一致"""
+    print("\n1. 测试记录的模型输出")
+    corpus = json.loads(CORPUS_PATH.read_text(encoding='utf-8'))
+    for case in corpus:
+        itinerary = extract_itinerary(case['content'], 1)
+        for period, expected in case['expected'].items():
+            if not isinstance(expected, dict):
+                assert itinerary.get(period) == expected, (case['name'], period, itinerary.get(period))
+                continue
+            for key, value in expected.items():
+                actual = itinerary.get(period, {}).get(key)
+                assert actual == value, (case['name'], period, key, actual)
+    print(f"✅ {len(corpus)} 段输出提取结果符合预期")
+
+def test_value_parsers():
+    """费用、时长、开放时间和Markdown清理"""
+    print("\n2. 测试字段解析")
+    assert parse_cost("人均80元") == 80.0
+    assert parse_cost("免费") == 0.0
+    assert parse_cost(45) == 45.0
+    assert parse_cost(None, default=50) == 50.0
+    assert parse_cost("待定", default=50) == 50.0
+
+    assert parse_duration("1.5小时") == 1.5
+    assert parse_duration("2-3小时") == 2.5
+    assert parse_duration("1小时30分钟") == 1.5
+    assert parse_duration("45分钟") == 0.75
+    assert parse_duration("半天") == 4.0
+    assert parse_duration("待定") is None
+    assert format_duration("约2个小时", "1小时") == "约2个小时"
+    assert format_duration("", "1小时") == "1小时"
+    assert format_duration(3, "1小时") == "3小时"
+
+    assert parse_opening_hours("8:30-17:00") == ("08:30", "17:00")
+    assert parse_opening_hours("9点至17点") == ("09:00", "17:00")
+    assert parse_opening_hours("18:00-次日2:00") == ("18:00", "26:00")
+    assert parse_opening_hours("全天开放") == ("00:00", "24:00")
+    assert format_opening_hours("08:00—22:00（周一闭馆）", "全天") == "08:00-22:00 （周一闭馆）"
+    assert format_opening_hours("18:00-次日2:00", "夜间") == "18:00-次日02:00"
+    assert format_opening_hours("", "夜间") == "夜间"
+
+    assert clean_markdown("**西湖**是*著名*景点\n- 断桥\n## 苏堤") == "西湖是著名景点 断桥 苏堤"
+    print("✅ 字段解析正确")
+
+async def test_service_fallback():
+    """JSON无法解析时，服务的备用解析返回完整结构"""
+    print("\n3. 测试备用解析接入")
+    from services.llm_service import llm_service
+
+    corpus = json.loads(CORPUS_PATH.read_text(encoding='utf-8'))
+    itinerary = llm_service._parse_daily_itinerary(corpus[0]['content'], 2)
+    assert itinerary['day'] == 2
+    assert itinerary['morning']['name'] == "西湖风景区"
+    assert itinerary['afternoon']['cost'] == 45.0
+    assert itinerary['dinner']['duration'] == "1.5小时"  # 未提取到的字段补默认值
+    assert itinerary['transportation'] == "地铁1号线+公交+步行"
+    print("✅ 备用解析结果经过结构校验")
+
+async def main():
+    print("=== 测试文本提取 ===")
+    test_corpus()
+    test_value_parsers()
+    await test_service_fallback()
+    print("\n=== 测试完成 ===")
+
+if __name__ == "__main__":
+    asyncio.run(main())
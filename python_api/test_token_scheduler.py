@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""测试大模型 TPM/RPM 调度：按限额控制发出节奏、实际用量修正、优先级排队、等待上限和队列统计"""
+
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+sys.path.append(str(Path(__file__).parent))
+
+from benchmarks.stub_upstream import StubUpstream
+from services.deadline import DeadlineExceededError, deadline_scope
+from services.token_scheduler import (
+    PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, TokenBudgetExceededError, TokenScheduler, priority_scope
+)
+
+# 测试用的限额窗口（秒），代替真实的 60 秒
+WINDOW = 0.5
+
+def tokens(count: int):
+    return {'prompt_tokens': count, 'completion_tokens': 0}
+
+async def test_estimate_and_settle():
+    """估算输入输出token，按实际用量校准估算"""
+    print("\n1. 测试用量估算和校准")
+    scheduler = TokenScheduler("test")
+    messages = [{"role": "system", "content": "你是旅行顾问"}, {"role": "user", "content": "介绍杭州"}]
+    estimate = scheduler.estimate(messages, 800, "travel_tips")
+    assert estimate['completion_tokens'] == 800 and 0 < estimate['prompt_tokens'] < 30
+
+    async with scheduler.reserve(messages, 800, "travel_tips") as reservation:
+        reservation.settle({'prompt_tokens': estimate['prompt_tokens'] * 2, 'completion_tokens': 300,
+                            'total_tokens': estimate['prompt_tokens'] * 2 + 300})
+    calibrated = scheduler.estimate(messages, 800, "travel_tips")
+    assert calibrated['prompt_tokens'] > estimate['prompt_tokens']
+    assert calibrated['completion_tokens'] == 300  # 调用点的近期实际输出
+    assert scheduler.estimate(messages, 1500, "daily_itinerary")['completion_tokens'] == 1500
+
+    async with scheduler.reserve(messages, 800, "travel_tips"):
+        pass  # 请求失败：只保留输入部分
+    stats = scheduler.get_stats()
+    assert stats['window_tokens'] == estimate['prompt_tokens'] * 2 + 300 + calibrated['prompt_tokens']
+    assert stats['completion_tokens'] == 300
+    print(f"✅ 输入校准系数 {stats['prompt_ratio']}，贴士输出估算 {calibrated['completion_tokens']}")
+
+async def test_pacing_and_priority():
+    """超过 TPM 的请求等待窗口滑出，交互式请求先于先排队的后台请求发出"""
+    print("\n2. 测试限额节奏和优先级")
+    scheduler = TokenScheduler("test", tpm=3000, window=WINDOW)
+    start = time.perf_counter()
+    for _ in range(3):
+        await scheduler.acquire(tokens(1000))
+    assert time.perf_counter() - start < 0.05
+
+    order = []
+
+    async def request(name, priority):
+        reservation = await scheduler.acquire(tokens(1000), priority=priority)
+        order.append((name, time.perf_counter() - start))
+        return reservation
+
+    background = asyncio.create_task(request("background", PRIORITY_BACKGROUND))
+    await asyncio.sleep(0.05)
+    with priority_scope(PRIORITY_INTERACTIVE):
+        interactive = asyncio.create_task(request("interactive", None))
+    await asyncio.sleep(0.05)
+    stats = scheduler.get_stats()
+    assert stats['queue_depth'] == 2, stats
+    assert stats['queue_depth_by_priority'] == {'interactive': 1, 'background': 1}
+    await asyncio.gather(background, interactive)
+
+    assert [name for name, _ in order] == ["interactive", "background"], order
+    assert WINDOW * 0.9 < order[0][1] < WINDOW * 1.5, order
+    stats = scheduler.get_stats()
+    assert stats['delayed'] == 2 and stats['queue_depth'] == 0 and stats['wait_p95'] > 0
+    print(f"✅ 第4、5个请求在窗口滑出后依次发出: {[(name, round(t, 2)) for name, t in order]}")
+
+async def test_settle_releases_budget():
+    """实际用量低于估算时，排队的请求提前发出"""
+    print("\n3. 测试实际用量释放限额")
+    scheduler = TokenScheduler("test", tpm=2000, window=10.0)
+    reservation = await scheduler.acquire(tokens(2000))
+    waiter = asyncio.create_task(scheduler.acquire(tokens(1000)))
+    await asyncio.sleep(0.05)
+    assert not waiter.done()
+    start = time.perf_counter()
+    reservation.settle({'prompt_tokens': 500, 'completion_tokens': 300, 'total_tokens': 800})
+    await asyncio.wait_for(waiter, 1.0)
+    print(f"✅ 实际用量 800 token，排队请求在 {(time.perf_counter() - start) * 1000:.1f}ms 内发出")
+
+async def test_wait_limits():
+    """等待超过上限或剩余预算时不排队，取消的请求离开队列"""
+    print("\n4. 测试等待上限")
+    scheduler = TokenScheduler("test", rpm=1, max_wait=0.2, window=5.0)
+    await scheduler.acquire(tokens(10))
+    start = time.perf_counter()
+    try:
+        await scheduler.acquire(tokens(10))
+        assert False, "超过等待上限应抛出异常"
+    except TokenBudgetExceededError as e:
+        assert e.retry_after > 4
+    assert time.perf_counter() - start < 0.05
+
+    scheduler.max_wait = 60
+    with deadline_scope(1.0):
+        try:
+            await scheduler.acquire(tokens(10))
+            assert False, "超过剩余预算应抛出异常"
+        except DeadlineExceededError:
+            pass
+
+    waiter = asyncio.create_task(scheduler.acquire(tokens(10)))
+    await asyncio.sleep(0.05)
+    assert scheduler.get_stats()['queue_depth'] == 1
+    waiter.cancel()
+    await asyncio.gather(waiter, return_exceptions=True)
+    assert scheduler.get_stats()['queue_depth'] == 0
+    assert scheduler.get_stats()['rejected'] == 2
+    print("✅ 超过等待上限和剩余预算的请求立即失败，取消的请求已出队")
+
+async def test_service_pacing(stub: StubUpstream):
+    """服务按 RPM 限额控制发出节奏，按响应 usage 统计实际用量"""
+    print("\n5. 测试服务内调度")
+    from services.llm_service import llm_service
+
+    scheduler = llm_service.router.primary.scheduler
+    scheduler.window = WINDOW
+    assert scheduler.rpm == 2
+    stub.reset_counters()
+    start = time.perf_counter()
+    tips = await asyncio.gather(*[llm_service.generate_travel_tips(f"城市{i}", {}) for i in range(5)])
+    elapsed = time.perf_counter() - start
+    assert all(tips) and stub.requests == 5
+    assert WINDOW * 2 <= elapsed < WINDOW * 3, elapsed  # 每个窗口最多发出 2 个请求
+
+    stats = llm_service.router.get_stats()["providers"][0]["scheduler"]
+    assert stats['prompt_tokens'] == 600 * 5 and stats['completion_tokens'] == 900 * 5  # 桩服务的 usage
+    assert stats['delayed'] == 3
+    print(f"✅ 5 个请求按 RPM=2 在 {elapsed:.2f}s 内发完，实际用量 {stats['prompt_tokens'] + stats['completion_tokens']} token")
+
+async def main():
+    print("=== 测试 TPM/RPM 调度 ===")
+    await test_estimate_and_settle()
+    await test_pacing_and_priority()
+    await test_settle_releases_budget()
+    await test_wait_limits()
+
+    stub = StubUpstream()
+    await stub.start()
+    os.environ.update({
+        'QWEN_API_KEY': 'test-key',
+        'QWEN_BASE_URL': f"{stub.base_url}/v1",
+        'QWEN_RPM': '2',
+        'LLM_CACHE_ENABLED': 'false'
+    })
+    try:
+        await test_service_pacing(stub)
+    finally:
+        await stub.stop()
+    print("\n=== 测试完成 ===")
+
+if __name__ == "__main__":
+    asyncio.run(main())
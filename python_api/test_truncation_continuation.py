@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""测试行程输出截断的处理：截断检测、续写剩余文本、缺失时段单独补全和按时段计算 max_tokens"""
+
+import asyncio
+import json
+import os
+import sys
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+sys.path.append(str(Path(__file__).parent))
+
+from benchmarks.stub_upstream import DAILY_ITINERARY, SSEStream, StubUpstream, _route
+from services.json_repair import is_truncated
+
+FULL_TEXT = json.dumps(DAILY_ITINERARY, ensure_ascii=False)
+# 截断在晚餐时段中间
+CUT = FULL_TEXT.index('"dinner"') + 30
+# 补全请求返回的时段，名称与完整行程不同以便区分
+PATCHED = {
+    "dinner": {"name": "新丰小吃", "activity": "在新丰小吃用餐", "location": "新丰小吃", "cost": "人均40元"},
+    "evening": {"name": "宋城", "activity": "观看宋城千古情", "location": "宋城", "cost": 300},
+}
+
+class TruncatingUpstream:
+    """按请求类型返回截断的行程、续写的文本或补全的时段"""
+
+    def __init__(self):
+        self.mode = "truncate"
+        self.payloads = []
+
+    def kind(self, payload):
+        messages = payload["messages"]
+        if messages[-1]["content"].startswith("上一条回复因长度限制被截断"):
+            return "continuation"
+        if "缺少部分时段" in messages[0]["content"]:
+            return "patch"
+        return "daily" if "breakfast" in messages[0]["content"] else "other"
+
+    def handler(self, method, path, query, body):
+        if not path.endswith("/chat/completions"):
+            return _route(method, path, query, body)
+        payload = json.loads(body)
+        kind = self.kind(payload)
+        self.payloads.append((kind, payload))
+        finish_reason = "stop"
+        if kind == "daily" and self.mode == "truncate":
+            content, finish_reason = FULL_TEXT[:CUT], "length"
+        elif kind == "daily" and self.mode == "omit":
+            content = json.dumps({key: value for key, value in DAILY_ITINERARY.items()
+                                  if key not in ("dinner", "evening")}, ensure_ascii=False)
+        elif kind == "continuation":
+            # 模型重复了截断处之前的一小段
+            content = FULL_TEXT[CUT - 20:]
+        elif kind == "patch":
+            requested = [period for period in PATCHED if f'"{period}"' in payload["messages"][0]["content"]]
+            content = json.dumps({period: PATCHED[period] for period in requested}, ensure_ascii=False)
+        else:
+            return _route(method, path, query, body)
+        if payload.get("stream"):
+            return 200, SSEStream(content)
+        return 200, {
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                         "finish_reason": finish_reason}],
+            "usage": {"prompt_tokens": 600, "completion_tokens": 900, "total_tokens": 1500}
+        }
+
+def test_detection():
+    """括号未闭合或停在字符串中间视为截断，未完整生成的时段视为缺失"""
+    print("\n1. 测试截断检测")
+    from services.llm_service import llm_service
+
+    assert not is_truncated(FULL_TEXT) and not is_truncated("```json\n" + FULL_TEXT + "\n```")
+    assert is_truncated(FULL_TEXT[:CUT]) and is_truncated('{"a": "未完')
+    assert not is_truncated("抱歉，我无法提供JSON。")
+
+    assert llm_service._missing_periods(FULL_TEXT) == []
+    assert llm_service._missing_periods(FULL_TEXT[:CUT]) == ["dinner", "evening"]
+    assert llm_service._join_continuation(FULL_TEXT[:CUT], FULL_TEXT[CUT - 20:]) == FULL_TEXT
+    boundary = FULL_TEXT.rindex(', ', 0, CUT) + 2  # 重叠较短但结束在分隔符上
+    assert llm_service._join_continuation(FULL_TEXT[:boundary], FULL_TEXT[boundary - 3:]) == FULL_TEXT
+    assert llm_service._join_continuation(FULL_TEXT[:CUT], "```json\n" + FULL_TEXT[CUT:]) == FULL_TEXT
+    assert llm_service._join_continuation(FULL_TEXT[:CUT], FULL_TEXT) == FULL_TEXT  # 模型从头重新生成
+    # 截断在数字或叠字中间时，续写开头与结尾相同的字符不是重复输出
+    assert llm_service._join_continuation('{"lunch":{"cost":10', '0,"name":"x"}}') == '{"lunch":{"cost":100,"name":"x"}}'
+    assert llm_service._join_continuation('{"tips":"谢', '谢光临"}}') == '{"tips":"谢谢光临"}}'
+
+    per_section = llm_service.tokens_per_section
+    assert llm_service._sections_max_tokens(["dinner"]) == per_section + 100
+    assert llm_service._sections_max_tokens(["dinner"] * 100) == llm_service.max_output_tokens
+    print(f"✅ 截断检测正确，每个时段 {per_section} token")
+
+async def test_continuation(upstream: TruncatingUpstream):
+    """finish_reason 为 length 时只续写剩余文本，拼接后严格解析"""
+    print("\n2. 测试截断续写")
+    from services.llm_service import llm_service
+
+    upstream.mode = "truncate"
+    upstream.payloads.clear()
+    llm_service.parse_stats = {key: 0 for key in llm_service.parse_stats}
+    itinerary = await llm_service.generate_daily_itinerary("杭州", 2, 3, {}, "舒适型")
+
+    assert [kind for kind, _ in upstream.payloads] == ["daily", "continuation"]
+    daily, continuation = upstream.payloads[0][1], upstream.payloads[1][1]
+    assert daily["max_tokens"] == llm_service._sections_max_tokens(["breakfast", "morning", "lunch",
+                                                                    "afternoon", "dinner", "evening"])
+    assert continuation["max_tokens"] == llm_service._sections_max_tokens(["dinner", "evening"])
+    assert "response_format" not in continuation
+    assert continuation["messages"][-2] == {"role": "assistant", "content": FULL_TEXT[:CUT]}
+
+    assert itinerary["day"] == 2
+    assert itinerary["dinner"]["name"] == "外婆家" and itinerary["evening"]["name"] == "河坊街"
+    stats = llm_service.get_parse_stats()
+    assert stats["continued"] == 1 and stats["fallback"] == 0
+    print(f"✅ 续写 2 个时段（max_tokens={continuation['max_tokens']}）后完整解析")
+
+async def test_patch_missing_sections(upstream: TruncatingUpstream):
+    """缺少的时段单独补全，不重新生成整天；续写关闭时截断的输出也按时段补全"""
+    print("\n3. 测试缺失时段补全")
+    from services.llm_service import llm_service
+
+    upstream.mode = "omit"
+    upstream.payloads.clear()
+    llm_service.parse_stats = {key: 0 for key in llm_service.parse_stats}
+    itinerary = await llm_service.generate_daily_itinerary("杭州", 1, 3, {}, "舒适型")
+
+    assert [kind for kind, _ in upstream.payloads] == ["daily", "patch"]
+    patch = upstream.payloads[1][1]
+    assert patch["max_tokens"] == llm_service._sections_max_tokens(["dinner", "evening"])
+    assert '"breakfast"' not in patch["messages"][0]["content"]
+    assert "西湖" in patch["messages"][1]["content"]  # 已安排的时段作为上下文
+    assert itinerary["morning"]["name"] == "西湖"
+    assert itinerary["dinner"]["name"] == "新丰小吃" and itinerary["dinner"]["cost"] == 40.0
+    assert itinerary["evening"]["name"] == "宋城" and itinerary["evening"]["duration"] == "2小时"
+
+    upstream.mode = "truncate"
+    upstream.payloads.clear()
+    llm_service.max_continuations = 0
+    try:
+        itinerary = await llm_service.generate_daily_itinerary("杭州", 1, 3, {}, "舒适型")
+    finally:
+        llm_service.max_continuations = 1
+    assert [kind for kind, _ in upstream.payloads] == ["daily", "patch"]
+    assert itinerary["lunch"]["name"] == "楼外楼" and itinerary["dinner"]["name"] == "新丰小吃"
+
+    stats = llm_service.get_parse_stats()
+    assert stats["patched"] == 2 and stats["regenerated"] == 0 and stats["fallback"] == 0
+    print("✅ 缺失的晚餐和夜间时段单独补全，已生成的时段保留")
+
+async def test_stream_patch(upstream: TruncatingUpstream):
+    """流式输出被截断时，已返回的时段保留，只补全缺失的时段"""
+    print("\n4. 测试流式截断补全")
+    from services.llm_service import llm_service
+
+    upstream.mode = "truncate"
+    upstream.payloads.clear()
+    llm_service.parse_stats = {key: 0 for key in llm_service.parse_stats}
+    sections = [item async for item in llm_service.stream_daily_itinerary("杭州", 1, 3, {}, "舒适型")]
+
+    periods = [period for period, _ in sections]
+    assert periods == ["breakfast", "morning", "lunch", "afternoon", "dinner", "evening"], periods
+    assert dict(sections)["dinner"]["name"] == "新丰小吃"
+    assert [kind for kind, _ in upstream.payloads] == ["daily", "patch"]
+    assert llm_service.get_parse_stats()["patched"] == 1
+    print("✅ 流式截断后只补全了晚餐和夜间时段")
+
+async def main():
+    print("=== 测试行程截断续写 ===")
+    upstream = TruncatingUpstream()
+    stub = StubUpstream(handler=upstream.handler)
+    await stub.start()
+    os.environ.update({
+        'QWEN_API_KEY': 'test-key',
+        'QWEN_BASE_URL': f"{stub.base_url}/v1",
+        'LLM_CACHE_ENABLED': 'false'
+    })
+    try:
+        test_detection()
+        await test_continuation(upstream)
+        await test_patch_missing_sections(upstream)
+        await test_stream_patch(upstream)
+    finally:
+        await stub.stop()
+    print("\n=== 测试完成 ===")
+
+if __name__ == "__main__":
+    asyncio.run(main())